@@ -1,6 +1,60 @@
-from .spconv import SPConv
-from .linears import Linear, SPLinear
-from .nets import ParallelNN, ANN, JointComplex, KeepSignFunc
-from .visualize import viznn
-from . import functions, monitors, pfunctions, derivatives, core
-from . import lib
+'''
+Poor man's neural network, submodules and the classes below are \
+imported on first access, compiled extensions are imported \
+when the first layer using them is constructed.
+'''
+
+import sys
+import types
+import importlib
+
+__all__ = ['SPConv', 'Linear', 'SPLinear',
+           'ParallelNN', 'ANN', 'JointComplex', 'KeepSignFunc', 'viznn',
+           'set_num_threads', 'get_num_threads',
+           'functions', 'monitors', 'pfunctions', 'derivatives', 'core', 'lib']
+
+_LAZY_ATTRS = {
+    'SPConv': 'spconv',
+    'Linear': 'linears',
+    'SPLinear': 'linears',
+    'ParallelNN': 'nets',
+    'ANN': 'nets',
+    'JointComplex': 'nets',
+    'KeepSignFunc': 'nets',
+    'viznn': 'visualize',
+    'set_num_threads': 'threads',
+    'get_num_threads': 'threads',
+}
+'''Attributes of this package, and the submodules defining them.'''
+
+
+class _LazyPackage(types.ModuleType):
+    '''module type of this package, resolving attributes on first access.'''
+
+    def __getattr__(self, name):
+        if name in _LAZY_ATTRS:
+            value = getattr(importlib.import_module(
+                '.' + _LAZY_ATTRS[name], __name__), name)
+        elif name in __all__:
+            value = importlib.import_module('.' + name, __name__)
+        else:
+            raise AttributeError("module '%s' has no attribute '%s'" %
+                                 (__name__, name))
+        setattr(self, name, value)
+        return value
+
+    def __dir__(self):
+        return sorted(set(self.__dict__) | set(__all__))
+
+
+try:
+    sys.modules[__name__].__class__ = _LazyPackage
+except TypeError:
+    # module classes can not be assigned before python 3.5.
+    from .spconv import SPConv
+    from .linears import Linear, SPLinear
+    from .nets import ParallelNN, ANN, JointComplex, KeepSignFunc
+    from .visualize import viznn
+    from .threads import set_num_threads, get_num_threads
+    from . import functions, monitors, pfunctions, derivatives, core
+    from . import lib
@@ -0,0 +1,191 @@
+'''
+Autotuner of execution strategies, winners are kept in a persistent \
+tuning cache.
+
+The cache is a JSON file at :data:`TUNE_CACHE_FILE`, mapping a key of \
+layer geometry, data types, the 3M scheme, number of threads and CPU model \
+to the selected configuration and the timings of candidates.
+'''
+
+import os
+import json
+import time
+import platform
+import threading
+
+import numpy as np
+
+from .utils import typed_randn
+
+__all__ = ['TUNE_CACHE_FILE', 'cpu_model', 'spconv_candidates',
+           'tune_spconv', 'load_tune_cache', 'clear_tune_cache']
+
+TUNE_CACHE_FILE = os.environ.get('POORNN_TUNE_CACHE', os.path.join(
+    os.path.expanduser('~'), '.cache', 'poornn', 'tune_cache.json'))
+'''Path of the tuning cache, set by environment variable \
+`POORNN_TUNE_CACHE`.'''
+
+_CACHES = {}
+_LOCK = threading.Lock()
+
+
+def cpu_model():
+    '''
+    Model name of the CPU.
+
+    Returns:
+        str: the model name, the machine type if not found.
+    '''
+    try:
+        with open('/proc/cpuinfo') as f:
+            for line in f:
+                if line.startswith('model name'):
+                    return line.split(':', 1)[1].strip()
+    except IOError:
+        pass
+    return platform.processor() or platform.machine()
+
+
+def load_tune_cache(filename=None):
+    '''
+    Load the tuning cache, files are read once per process.
+
+    Args:
+        filename (str|None, default=None): path of the cache file, \
+:data:`TUNE_CACHE_FILE` if None.
+
+    Returns:
+        dict: the cache.
+    '''
+    filename = filename or TUNE_CACHE_FILE
+    with _LOCK:
+        if filename not in _CACHES:
+            _CACHES[filename] = _read_cache(filename)
+        return _CACHES[filename]
+
+
+def clear_tune_cache(filename=None):
+    '''
+    Clear the tuning cache, and remove its file.
+
+    Args:
+        filename (str|None, default=None): path of the cache file, \
+:data:`TUNE_CACHE_FILE` if None.
+    '''
+    filename = filename or TUNE_CACHE_FILE
+    with _LOCK:
+        _CACHES.pop(filename, None)
+        if os.path.isfile(filename):
+            os.remove(filename)
+
+
+def spconv_candidates(layer):
+    '''
+    Candidate configurations of an :class:`SPConv`.
+
+    Args:
+        layer (:class:`SPConv`): the layer.
+
+    Returns:
+        list<dict>: keyword arguments of :meth:`SPConv.set_strategy`.
+    '''
+    candidates = [dict(strategy='pixel', w_contiguous=True),
+                  dict(strategy='pixel', w_contiguous=False),
+                  dict(strategy='im2col', block_size=None),
+                  dict(strategy='im2col', block_size=16)]
+    if layer.boundary == 'P':
+        candidates.append(dict(strategy='fft'))
+    return candidates
+
+
+def tune_spconv(layer, num_batch, candidates=None, num_test=3,
+                filename=None, retune=False):
+    '''
+    Select the fastest configuration of an :class:`SPConv` for a batch \
+size, by timing forward and backward on random data. \
+Results are read from and saved to the tuning cache.
+
+    Args:
+        layer (:class:`SPConv`): the layer, its strategy is changed \
+during tuning and restored afterwards.
+        num_batch (int|None): batch size, None for single samples.
+        candidates (list<dict>|None, default=None): configurations, \
+:func:`spconv_candidates` if None.
+        num_test (int, default=3): number of timed runs of each candidate, \
+the best one counts.
+        filename (str|None, default=None): path of the cache file, \
+:data:`TUNE_CACHE_FILE` if None.
+        retune (bool, default=False): tune even if cached.
+
+    Returns:
+        dict: the fastest configuration, keyword arguments of \
+:meth:`SPConv.set_strategy`.
+    '''
+    from .threads import get_num_threads
+    input_shape = tuple(layer.input_shape[-layer.img_nd - 1:])
+    if num_batch is not None:
+        input_shape = (num_batch,) + input_shape
+    key = json.dumps(['SPConv', input_shape, layer.weight.shape,
+                      layer.strides, layer.boundary,
+                      [bool(m) for m in layer.var_mask],
+                      str(layer.itype), str(layer.dtype), bool(layer.gemm3m),
+                      get_num_threads(), cpu_model()])
+    cache = load_tune_cache(filename)
+    if key in cache and not retune:
+        return dict(cache[key]['config'])
+
+    if candidates is None:
+        candidates = spconv_candidates(layer)
+    x = np.asfortranarray(typed_randn(layer.itype, input_shape))
+    timings = []
+    # settings of the layer are restored, candidates may leave them out.
+    settings = dict(strategy=layer.strategy, w_contiguous=layer.w_contiguous,
+                    block_size=layer.block_size)
+    try:
+        for config in candidates:
+            layer.set_strategy(**config)
+            y = layer.forward(x)
+            dy = np.asfortranarray(typed_randn(y.dtype.name, y.shape))
+            layer.backward((x, y), dy)
+            elapse = []
+            for i in range(num_test):
+                t0 = time.time()
+                y = layer.forward(x)
+                layer.backward((x, y), dy)
+                elapse.append(time.time() - t0)
+            timings.append(min(elapse))
+    finally:
+        layer.set_strategy(**settings)
+    config = candidates[int(np.argmin(timings))]
+    _save_result(filename or TUNE_CACHE_FILE, key, {
+        'config': config,
+        'timings': [[c, t] for c, t in zip(candidates, timings)]})
+    return dict(config)
+
+
+def _read_cache(filename):
+    '''content of a cache file, empty if missing or broken.'''
+    try:
+        with open(filename) as f:
+            return json.load(f)
+    except (IOError, ValueError):
+        return {}
+
+
+def _save_result(filename, key, result):
+    '''add a result to the cache, and merge it into the file.'''
+    with _LOCK:
+        cache = _CACHES.setdefault(filename, {})
+        cache[key] = result
+        dirname = os.path.dirname(filename)
+        try:
+            if dirname and not os.path.isdir(dirname):
+                os.makedirs(dirname)
+            content = _read_cache(filename)
+            content.update(cache)
+            tmpfile = '%s.%d.tmp' % (filename, os.getpid())
+            with open(tmpfile, 'w') as f:
+                json.dump(content, f, indent=1, sort_keys=True)
+            getattr(os, 'replace', os.rename)(tmpfile, filename)
+        except (IOError, OSError):
+            pass  # read-only file system, keep the result in memory.
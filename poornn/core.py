@@ -83,6 +83,23 @@ refer :data:`poornn.core.TAG_LIST` for detail.
 and :attr:`itype`/:attr:`dtype`/:attr:`otype`, \
 attributes that will be displayed in print and graphviz.
     '''
+    __buffered__ = False
+    '''
+    True if :meth:`forward` and :meth:`backward` accept keyword `out`, \
+a preallocated array in 'F' order to store the output \
+(:math:`\\partial J/\\partial x` for :meth:`backward`).
+    '''
+    __elementwise__ = False
+    '''
+    True if each element of output (and :math:`\\partial J/\\partial x`) \
+only depends on the same element of input (and :math:`\\partial J/\\partial y`), \
+so that buffered :meth:`forward` and :meth:`backward` can write into their inputs.
+    '''
+    __backward_needs__ = 'xy'
+    '''
+    Contents of input ('x') and output ('y') read by :meth:`backward`, \
+tensors not read here can be overwritten once consumed.
+    '''
 
     def __init__(self, input_shape, output_shape,
                  itype, dtype=None, otype=None, tags=None):
@@ -213,6 +230,36 @@ are cost function and variables respectively.
         '''number of variables.'''
         pass
 
+    def bind_variables(self, variables, gradients):
+        '''
+        Make variables of this layer views of `variables`, \
+current values are copied into it.
+
+        Args:
+            variables (1darray): storage for variables.
+            gradients (1darray): storage for gradients, \
+:meth:`backward` may write gradients into it directly.
+        '''
+        if self.num_variables != 0:
+            raise NotImplementedError(
+                '%s does not support binding variables.' %
+                self.__class__.__name__)
+
+    def get_backends(self):
+        '''
+        Show backends of compute kernels used by this layer.
+
+        Returns:
+            dict: names of backends, indexed by attribute names of kernels.
+        '''
+        from .kernels import kernel_backend
+        backends = {}
+        for key, value in self.__dict__.items():
+            backend = kernel_backend(value) if callable(value) else None
+            if backend is not None:
+                backends[key] = backend
+        return backends
+
 
 class Function(Layer):
     '''Function layer with no variables.'''
@@ -280,6 +327,15 @@ a param is regarded as a constant if its mask is False.
     def set_variables(self, a):
         self.params[self.var_mask] = a
 
+    def bind_variables(self, variables, gradients):
+        if not self.var_mask.all():
+            raise ValueError('Can not bind params with constants.')
+        if variables.dtype != self.params.dtype:
+            raise TypeError('Can not bind params of type %s to %s.' % (
+                self.params.dtype, variables.dtype))
+        variables[:] = self.params
+        self.params = variables
+
     @property
     def num_variables(self):
         return self.var_mask.sum()
@@ -296,6 +352,9 @@ class Container(Layer):
     Attributes:
         layers (list<Layer>, default=[]): layers.
         labels (list<str>, default=[]): labels for layers, used for query.
+        flat_variables (1darray|None): storage for variables of all layers, \
+see :meth:`flatten_variables`.
+        flat_gradients (1darray|None): storage for gradients of all layers.
     '''
     __metaclass__ = ABCMeta
 
@@ -306,6 +365,8 @@ class Container(Layer):
             labels = []
         self.layers = layers
         self.__layer_dict__ = dict(zip(labels, layers))
+        self.flat_variables = None
+        self.flat_gradients = None
 
         # itype, dtype, otype, input_shape and
         # output_shape are defined as properties.
@@ -417,16 +478,21 @@ from :attr:`self.layers`.'''
             layer.set_runtime_vars(var_dict)
 
     def get_variables(self):
-        '''Dump values to an array.'''
+        '''Dump values to an array, a view of storage if flattened.'''
+        if self.flat_variables is not None:
+            return self.flat_variables
         return np.concatenate([layer.get_variables() for layer in self.layers])
 
     def set_variables(self, v):
         '''
-        Load data from an array.
+        Load data from an array, nothing to do if `v` is \
+:attr:`flat_variables` itself.
 
         Args:
             v (1darray): variables.
         '''
+        if v is self.flat_variables:
+            return
         start = 0
         for layer in self.layers:
             stop = start + layer.num_variables
@@ -438,6 +504,65 @@ from :attr:`self.layers`.'''
         '''int: number of variables.'''
         return np.sum([layer.num_variables for layer in self.layers])
 
+    def flatten_variables(self):
+        '''
+        Move variables of all layers into one contiguous array, \
+weights, biases and params of layers become its views. \
+Then :meth:`get_variables` returns this array without copy, \
+and :meth:`backward` writes gradients into :attr:`flat_gradients` \
+(overwritten in the next call) instead of concatenating them.
+
+        Note:
+            Updating :attr:`flat_variables` inplace bypasses \
+:meth:`set_variables`, so constraints like `is_unitary` are not kept.
+
+        Returns:
+            1darray: :attr:`flat_variables`.
+        '''
+        variables = self.get_variables()
+        self.bind_variables(variables, np.zeros_like(variables))
+        return variables
+
+    def bind_variables(self, variables, gradients):
+        bound = set()
+        start = 0
+        for layer in self.layers:
+            stop = start + layer.num_variables
+            if stop > start:
+                if id(layer) in bound:
+                    raise ValueError('Can not bind shared layer %s.' % layer)
+                bound.add(id(layer))
+            layer.bind_variables(variables[start:stop], gradients[start:stop])
+            start = stop
+        self.flat_variables = variables
+        self.flat_gradients = gradients
+
+    def _gather_gradients(self, dvs):
+        '''
+        Gather gradients of layers (in the order of :attr:`layers`), \
+into :attr:`flat_gradients` if flattened.
+        '''
+        if self.flat_gradients is None:
+            return dvs[0] if len(dvs) == 1 else np.concatenate(dvs)
+        start = 0
+        for layer, dv in zip(self.layers, dvs):
+            stop = start + layer.num_variables
+            slot = self.flat_gradients[start:stop]
+            # layers bound to slots have written gradients inplace.
+            if stop > start and not np.may_share_memory(dv, slot):
+                slot[:] = dv
+            start = stop
+        return self.flat_gradients
+
+    def get_backends(self):
+        '''
+        Show backends of compute kernels used by layers.
+
+        Returns:
+            list: backends of layers, in the order of :attr:`layers`.
+        '''
+        return [layer.get_backends() for layer in self.layers]
+
 
 class Monitor(Function):
     '''
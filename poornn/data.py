@@ -0,0 +1,188 @@
+'''
+Datasets, memory-mapped arrays and a prefetching minibatch pipeline.
+'''
+
+import gzip
+import struct
+import threading
+try:
+    from queue import Queue
+except ImportError:
+    from Queue import Queue
+
+import numpy as np
+
+__all__ = ['load_idx', 'load_array', 'MiniBatches']
+
+IDX_DTYPES = {0x08: '>u1', 0x09: '>i1', 0x0B: '>i2',
+              0x0C: '>i4', 0x0D: '>f4', 0x0E: '>f8'}
+'''Data types of IDX files, indexed by the type code in header.'''
+
+
+def load_idx(filename):
+    '''
+    Load an IDX file (the format of MNIST), memory-mapped unless gzipped.
+
+    Args:
+        filename (str): name of file, gzipped if ends with '.gz'.
+
+    Returns:
+        ndarray: data, with samples along axis 0.
+    '''
+    opener = gzip.open if filename.endswith('.gz') else open
+    with opener(filename, 'rb') as f:
+        zeros, code, ndim = struct.unpack('>HBB', f.read(4))
+        if zeros != 0 or code not in IDX_DTYPES:
+            raise ValueError('%s is not an IDX file!' % filename)
+        shape = struct.unpack('>' + 'I' * ndim, f.read(4 * ndim))
+        if opener is gzip.open:
+            return np.frombuffer(f.read(), dtype=IDX_DTYPES[code]).reshape(
+                shape)
+    return np.memmap(filename, dtype=IDX_DTYPES[code], mode='r',
+                     offset=4 + 4 * ndim, shape=shape)
+
+
+def load_array(filename):
+    '''
+    Load a '.npy' (memory-mapped) or an IDX file.
+
+    Args:
+        filename (str): name of file.
+
+    Returns:
+        ndarray: data, with samples along axis 0.
+    '''
+    if filename.endswith('.npy'):
+        return np.load(filename, mmap_mode='r')
+    return load_idx(filename)
+
+
+class MiniBatches(object):
+    '''
+    Minibatches of a dataset, gathered by a background thread into \
+a ring of preallocated buffers in 'F' order, so that loading overlaps \
+with computation. Iterating over it runs an epoch, yielding \
+`(x, var_dict)`, with `var_dict = {'y_true': y}` if labels are given.
+
+    Args:
+        x (ndarray): inputs with samples along axis 0, e.g. memory-mapped \
+by :func:`load_array`.
+        y (ndarray|None, default=None): labels with samples along axis 0.
+        batch_size (int, default=100): number of samples in a batch, \
+remaining samples in an epoch are dropped.
+        input_shape (tuple|None, default=None): shape of batches, \
+e.g. :attr:`ANN.input_shape`, -1 is replaced by `batch_size`, \
+None for `(batch_size,) + x.shape[1:]`.
+        dtype (str, default='float64'): data type of batches.
+        num_classes (int|None, default=None): number of classes, \
+integer labels are one-hot encoded if given.
+        scale (number|None, default=None): factor multiplied to inputs.
+        shuffle (bool, default=True): visit samples in a random order.
+        seed (int|None, default=None): seed of shuffling.
+        num_buffers (int, default=2): number of buffers in the ring, \
+at most `num_buffers - 1` batches are prepared in advance.
+
+    Attributes:
+        x (ndarray): inputs.
+        y (ndarray|None): labels.
+        batch_size (int): number of samples in a batch.
+        num_classes (int|None): number of classes.
+        scale (number|None): factor multiplied to inputs.
+        shuffle (bool): visit samples in a random order.
+
+    Note:
+        A yielded batch is overwritten after the next one is requested, \
+copy it if it is needed longer.
+    '''
+
+    def __init__(self, x, y=None, batch_size=100, input_shape=None,
+                 dtype='float64', num_classes=None, scale=None,
+                 shuffle=True, seed=None, num_buffers=2):
+        if y is not None and len(y) != len(x):
+            raise ValueError('Numbers of inputs (%d) and labels (%d) \
+mismatch!' % (len(x), len(y)))
+        if num_buffers < 2:
+            raise ValueError('At least 2 buffers are required!')
+        self.x = x
+        self.y = y
+        self.batch_size = batch_size
+        self.num_classes = num_classes
+        self.scale = scale
+        self.shuffle = shuffle
+        self._random = np.random.RandomState(seed)
+
+        if input_shape is None:
+            input_shape = (batch_size,) + x.shape[1:]
+        input_shape = tuple([batch_size if d == -1 else d
+                             for d in input_shape])
+        if input_shape[0] != batch_size or int(np.prod(input_shape[1:])) !=\
+                int(np.prod(x.shape[1:])):
+            raise ValueError('Can not fit samples of shape %s into \
+batches of shape %s!' % (x.shape[1:], input_shape))
+        self._sample_shape = input_shape[1:]
+        self._xs = [np.empty(input_shape, dtype=dtype, order='F')
+                    for i in range(num_buffers)]
+        self._ys = [None] * num_buffers
+        if y is not None:
+            y_shape = (batch_size, num_classes) if num_classes is not None\
+                else (batch_size,) + y.shape[1:]
+            self._ys = [np.empty(y_shape, dtype=dtype, order='F')
+                        for i in range(num_buffers)]
+
+    def __len__(self):
+        return len(self.x) // self.batch_size
+
+    def __iter__(self):
+        free, ready = Queue(), Queue()
+        for i in range(len(self._xs)):
+            free.put(i)
+        order = self._random.permutation(len(self.x)) if self.shuffle\
+            else np.arange(len(self.x))
+        worker = threading.Thread(target=self._produce,
+                                  args=(order, free, ready))
+        worker.daemon = True
+        worker.start()
+        last = None
+        try:
+            for k in range(len(self)):
+                if last is not None:
+                    free.put(last)
+                last = ready.get()
+                if isinstance(last, Exception):
+                    raise last
+                yield self._xs[last], {} if self.y is None else\
+                    {'y_true': self._ys[last]}
+        finally:
+            # stops the worker, even if the epoch is not finished.
+            free.put(None)
+            worker.join()
+
+    def _produce(self, order, free, ready):
+        '''gather batches into free buffers.'''
+        try:
+            for k in range(len(self)):
+                i = free.get()
+                if i is None:
+                    return
+                # sorted indices visit memory-mapped files in order.
+                indices = np.sort(order[k * self.batch_size:
+                                        (k + 1) * self.batch_size])
+                self._gather(indices, self._xs[i], self._ys[i])
+                ready.put(i)
+        except Exception as e:
+            ready.put(e)
+
+    def _gather(self, indices, x, y):
+        '''gather samples at `indices` into buffers `x` and `y`.'''
+        for k, index in enumerate(indices):
+            x[k] = self.x[index].reshape(self._sample_shape)
+        if self.scale is not None:
+            x *= self.scale
+        if y is None:
+            return
+        if self.num_classes is None:
+            for k, index in enumerate(indices):
+                y[k] = self.y[index]
+        else:
+            y[...] = 0
+            y[np.arange(len(indices)), self.y[indices]] = 1
@@ -0,0 +1,254 @@
+'''
+Data parallel training, worker processes share variables, \
+inputs and gradients through shared memory.
+'''
+
+import traceback
+import multiprocessing
+from multiprocessing.sharedctypes import RawArray
+try:
+    from queue import Empty
+except ImportError:
+    from Queue import Empty
+
+import numpy as np
+
+from .microbatch import accumulate_gradients, _batch_layers
+from .functions import Sum
+from .threads import set_num_threads
+
+__all__ = ['DataParallel']
+
+# seconds between liveness checks of workers while waiting for results.
+POLL_INTERVAL = 0.1
+
+
+class DataParallel(object):
+    '''
+    Data parallel gradient evaluation with forked worker processes, \
+each worker holds a replica of the network and evaluates gradients \
+on a shard of the batch (split along axis 0).
+    Variables of the network are moved into shared memory, \
+so updating :attr:`variables` inplace takes effect in all workers. \
+Inputs are copied into shared buffers and gradients are reduced \
+in shared memory, only small control messages are pickled per step.
+
+    Args:
+        net (:class:`ANN`): the network, its variables are flattened \
+into shared memory.
+        num_workers (int): number of worker processes.
+
+    Attributes:
+        net (:class:`ANN`): the network.
+        num_workers (int): number of worker processes.
+        variables (1darray): shared variables, \
+:attr:`flat_variables` of :attr:`net`.
+        gradients (1darray): reduced gradients, \
+:attr:`flat_gradients` of :attr:`net`.
+
+    Note:
+        Workers are forked (POSIX only) at the first call of \
+:meth:`compute_gradients`, and again if shapes of batch arrays change. \
+:class:`BatchNorm` layers over axis 0 take statistics of shards. \
+If a worker dies, :meth:`compute_gradients` stops all workers and \
+raises RuntimeError, the next call forks new ones. \
+Workers run kernels and BLAS on one thread, OpenMP (libgomp) is not \
+fork-safe once the parent has run a parallel region.
+    '''
+
+    def __init__(self, net, num_workers):
+        self.net = net
+        self.num_workers = num_workers
+        self._reduction = _batch_layers(net)[0]
+
+        variables = net.get_variables()
+        self.variables = _shared_array(variables.shape, variables.dtype)
+        self.variables[...] = variables
+        self.gradients = np.zeros_like(variables)
+        net.bind_variables(self.variables, self.gradients)
+
+        self._layout = None
+        self._workers = []
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
+
+    def compute_gradients(self, x, dy=np.array(1), var_dict=None):
+        '''
+        Forward and backward a batch, same as a run of :attr:`net` \
+on the whole batch.
+
+        Args:
+            x (ndarray): input, with samples along axis 0.
+            dy (ndarray, default=np.array(1)): gradient of output, \
+with samples along axis 0 if the last layer does not reduce axis 0.
+            var_dict (dict|None, default=None): runtime variables, \
+arrays with the batch size as the first dimension are split into shards.
+
+        Returns:
+            (ndarray, 1darray): output and :attr:`gradients` \
+(overwritten in the next call).
+        '''
+        if var_dict is None:
+            var_dict = {}
+        num_batch = x.shape[0]
+        arrays = {'x': x}
+        if self._reduction is None:
+            arrays['dy'] = dy
+        small = {}
+        for key, value in var_dict.items():
+            if isinstance(value, np.ndarray) and value.ndim > 0 and\
+                    value.shape[0] == num_batch:
+                arrays['var-' + key] = value
+            else:
+                small[key] = value
+        layout = sorted([(key, arr.shape, arr.dtype.name)
+                         for key, arr in arrays.items()])
+        if layout != self._layout:
+            self._start(arrays, layout)
+        for key, arr in arrays.items():
+            self._buffers[key][...] = arr
+
+        for commands in self._commands:
+            commands.put((small, None if self._reduction is None else dy))
+        ys = [None] * self.num_workers
+        errors = []
+        for i in range(self.num_workers):
+            rank, y, error = self._get_result()
+            ys[rank] = y
+            if error is not None:
+                errors.append(error)
+        if errors:
+            raise RuntimeError('Worker failed:\n%s' % errors[0])
+
+        np.sum(self._grads, axis=0, out=self.gradients)
+        if self._reduction is None:
+            y = self._buffers['y'].copy(order='F')
+        else:
+            y = sum(ys)
+        return y, self.gradients
+
+    def _get_result(self):
+        '''
+        wait for a result of workers, raise RuntimeError if a worker died \
+(e.g. killed by a signal) without posting it.
+        '''
+        while True:
+            try:
+                return self._results.get(timeout=POLL_INTERVAL)
+            except Empty:
+                dead = [(rank, worker.exitcode) for rank, worker in
+                        enumerate(self._workers) if not worker.is_alive()]
+                if dead:
+                    for worker in self._workers:
+                        if worker.is_alive():
+                            worker.terminate()
+                    self.close()
+                    raise RuntimeError('Worker %d died with exit code %s!' %
+                                       dead[0])
+
+    def close(self):
+        '''Stop worker processes.'''
+        for commands in self._commands if self._workers else []:
+            commands.put(None)
+        for worker in self._workers:
+            worker.join()
+        self._workers = []
+        self._layout = None
+
+    def _start(self, arrays, layout):
+        '''allocate shared buffers for batch arrays and fork workers.'''
+        self.close()
+        num_batch = arrays['x'].shape[0]
+        self._buffers = dict([(key, _shared_array(shape, dtype))
+                              for key, shape, dtype in layout])
+        if self._reduction is None:
+            from .nets import _output_shape
+            shape = _output_shape(self.net, arrays['x'])
+            if shape is None:
+                raise ValueError('Can not infer output shape of %s!' %
+                                 self.net)
+            self._buffers['y'] = _shared_array(shape, self.net.otype)
+        self._grads = _shared_array((self.num_workers,) +
+                                    self.variables.shape,
+                                    self.variables.dtype, order='C')
+        shards = [slice(num_batch * i // self.num_workers,
+                        num_batch * (i + 1) // self.num_workers)
+                  for i in range(self.num_workers)]
+
+        ctx = _fork_context()
+        self._commands = [ctx.Queue() for i in range(self.num_workers)]
+        self._results = ctx.Queue()
+        self._workers = []
+        for rank in range(self.num_workers):
+            worker = ctx.Process(
+                target=_worker, args=(self, rank, shards[rank], num_batch))
+            worker.daemon = True
+            worker.start()
+            self._workers.append(worker)
+        self._layout = layout
+
+
+def _worker(trainer, rank, shard, num_batch):
+    '''loop of a worker process, runs in a forked replica of `trainer`.'''
+    # before any parallel region, the OpenMP thread pool is not inherited.
+    set_num_threads(1)
+    net, buffers = trainer.net, trainer._buffers
+    grads = trainer._grads[rank]
+    net.bind_variables(trainer.variables, grads)
+    num = shard.stop - shard.start
+    weight = 1. if trainer._reduction in (None, Sum) else\
+        num / float(num_batch)
+    while True:
+        command = trainer._commands[rank].get()
+        if command is None:
+            break
+        small, dy = command
+        try:
+            y = 0
+            if num == 0:
+                grads[:] = 0
+            else:
+                var_dict = dict(small)
+                for key, buf in buffers.items():
+                    if key.startswith('var-'):
+                        var_dict[key[4:]] = buf[shard]
+                if dy is None:
+                    dy = buffers['dy'][shard]
+                y, dv, dx = accumulate_gradients(net, buffers['x'][shard],
+                                                 num, dy=dy,
+                                                 var_dict=var_dict)
+                if trainer._reduction is None:
+                    buffers['y'][shard] = y
+                    y = None
+                elif weight != 1:
+                    y = y * weight
+                    grads *= weight
+            trainer._results.put((rank, y, None))
+        except Exception:
+            trainer._results.put((rank, None, traceback.format_exc()))
+
+
+def _fork_context():
+    '''
+    multiprocessing context of forked processes, workers inherit \
+shared arrays of the parent instead of pickled copies.
+    '''
+    if not hasattr(multiprocessing, 'get_context'):
+        return multiprocessing  # python 2 forks on POSIX.
+    try:
+        return multiprocessing.get_context('fork')
+    except ValueError:
+        raise RuntimeError('DataParallel needs the fork start method, '
+                           'which is not available on this platform!')
+
+
+def _shared_array(shape, dtype, order='F'):
+    '''an array in shared memory, inherited by forked processes.'''
+    dtype = np.dtype(dtype)
+    size = int(np.prod(shape)) * dtype.itemsize
+    return np.ndarray(shape, dtype=dtype, buffer=RawArray('b', max(size, 1)),
+                      order=order)
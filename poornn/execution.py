@@ -0,0 +1,342 @@
+'''
+Static execution plans, run a network of fixed shapes as a flat list \
+of kernel calls.
+'''
+
+import numpy as np
+
+from .core import Monitor
+from .linears import Linear
+from .spconv import SPConv
+from .functions import ReLU, Pooling, Reshape
+from .memory import _flow_spec
+from .utils import tuple_prod
+
+__all__ = ['ExecutionPlan']
+
+
+class ExecutionPlan(object):
+    '''
+    Static execution plan of an :class:`ANN` for a fixed input shape \
+and data type. Shapes, Fortran entries and buffers are resolved once, \
+a run is a flat list of kernel calls.
+
+    Args:
+        net (:class:`ANN`): the network.
+        input_shape (tuple): concrete input shape.
+        itype (str): input data type.
+
+    Attributes:
+        net (:class:`ANN`): the network.
+        input_shape (tuple): concrete input shape.
+        itype (str): input data type.
+        shapes (list<tuple>): output shapes of layers.
+
+    Note:
+        Runtime variables should be set before compiling, \
+a dry run on `ones` is used to resolve shapes.
+        Outputs are served from an arena as in :attr:`ANN.plan_memory`, \
+they are overwritten by the next run.
+        Recompile if layers of the network are changed or rebound.
+    '''
+
+    def __init__(self, net, input_shape, itype):
+        self.net = net
+        self.input_shape = tuple(input_shape)
+        self.itype = itype
+
+        # dry run to resolve shapes.
+        x = np.ones(input_shape, dtype=itype, order='F')
+        specs, shapes = [], []
+        for layer in net.layers:
+            y = x if isinstance(layer, Monitor) else layer.forward(x)
+            if isinstance(y, list):
+                raise TypeError('Can not compile %s with list output.' % layer)
+            specs.append(_flow_spec(x, y))
+            shapes.append(np.shape(y))
+            x = y
+        self.shapes = shapes
+        self._fspecs = specs
+
+        buffers = net._build_memory_plan(specs).buffers
+        self._run_plan = buffers
+        self._run_steps = [_forward_step(layer, xs, ys, buf)
+                           for layer, xs, ys, buf in zip(
+                               net.layers, self._input_shapes, shapes,
+                               buffers)]
+        self._grad_plan = None
+        self._grad_steps = None
+
+    def __repr__(self):
+        return '<%s>: %s|%s -> %s' % (self.__class__.__name__,
+                                      self.input_shape, self.itype,
+                                      self.shapes[-1])
+
+    @property
+    def _input_shapes(self):
+        return [self.input_shape] + self.shapes[:-1]
+
+    def run(self, x):
+        '''
+        Forward run.
+
+        Args:
+            x (ndarray): input of shape :attr:`input_shape` in 'F' order.
+
+        Returns:
+            ndarray: output.
+        '''
+        for step in self._run_steps:
+            x = step(x)
+        return x
+
+    def grad(self, x, dy=np.array(1)):
+        '''
+        Forward run followed by back propagation.
+
+        Args:
+            x (ndarray): input of shape :attr:`input_shape` in 'F' order.
+            dy (ndarray): gradient of output defined as \
+:math:`\partial J/\partial y`.
+
+        Returns:
+            (1darray, ndarray): gradients for variables and input.
+        '''
+        if self._grad_steps is None:
+            return self._record(x, dy)
+        n = len(self._grad_steps)
+        xy = [x]
+        for fstep, bstep in self._grad_steps:
+            xy.append(fstep(xy[-1]))
+        dvs = []
+        for i in range(n - 1, -1, -1):
+            dv, dy = self._grad_steps[i][1](xy[i], xy[i + 1], dy)
+            dvs.append(dv)
+        return self.net._gather_gradients(dvs[::-1]), dy
+
+    def _record(self, x, dy):
+        '''
+        The first :meth:`grad`, go through layers to record \
+gradients and then build steps.
+        '''
+        net, cache = self.net, {}
+        xy = [x]
+        for layer in net.layers:
+            xy.append(layer.forward(xy[-1], data_cache=cache))
+        dvs, specs = [], []
+        for i in range(net.num_layers - 1, -1, -1):
+            dv, dx = net.layers[i].backward(
+                (xy[i], xy[i + 1]), dy, data_cache=cache)
+            specs.append(_flow_spec(dy, dx))
+            dvs.append(dv)
+            dy = dx
+
+        n = net.num_layers
+        buffers = net._build_memory_plan(self._fspecs, specs[::-1]).buffers
+        self._grad_plan = buffers
+        self._grad_steps = [
+            (_forward_step(layer, xs, ys, buffers[i], cache=cache),
+             _backward_step(layer, xs, ys, buffers[n + i], cache=cache))
+            for i, (layer, xs, ys) in enumerate(zip(
+                net.layers, self._input_shapes, self.shapes))]
+        return net._gather_gradients(dvs[::-1]), dy
+
+
+def _forward_step(layer, x_shape, y_shape, out, cache=None):
+    '''
+    Resolve forward of a layer as a function of input.
+
+    Args:
+        layer (Layer): the layer.
+        x_shape (tuple): concrete input shape.
+        y_shape (tuple): concrete output shape.
+        out (ndarray|None): buffer for output.
+        cache (dict|None, default=None): data cache for containers.
+
+    Returns:
+        func: step(x) -> y.
+    '''
+    # subclasses may change kernels, so only exact types are resolved.
+    if type(layer) in _STEP_BUILDERS:
+        return _STEP_BUILDERS[type(layer)][0](layer, x_shape, y_shape, out)
+    if out is not None and layer.__buffered__:
+        return lambda x: layer.forward(x, data_cache=cache, out=out)
+    return lambda x: layer.forward(x, data_cache=cache)
+
+
+def _backward_step(layer, x_shape, y_shape, out, cache=None):
+    '''
+    Resolve backward of a layer as a function of input, output and \
+gradient of output.
+
+    Args:
+        layer (Layer): the layer.
+        x_shape (tuple): concrete input shape.
+        y_shape (tuple): concrete output shape.
+        out (ndarray|None): buffer for gradient of input.
+        cache (dict|None, default=None): data cache for containers.
+
+    Returns:
+        func: step(x, y, dy) -> (dv, dx).
+    '''
+    # subclasses may change kernels, so only exact types are resolved.
+    if type(layer) in _STEP_BUILDERS:
+        return _STEP_BUILDERS[type(layer)][1](layer, x_shape, y_shape, out)
+    if out is not None and layer.__buffered__:
+        return lambda x, y, dy: layer.backward((x, y), dy, data_cache=cache,
+                                               out=out)
+    return lambda x, y, dy: layer.backward((x, y), dy, data_cache=cache)
+
+
+def _linear_forward(layer, x_shape, y_shape, out):
+    fforward = layer._fforward
+    x2 = (tuple_prod(x_shape[:-1]), x_shape[-1])
+    if out is not None:
+        out = out.reshape((x2[0], layer.weight.shape[0]), order='F')
+
+    def step(x):
+        return fforward(x.reshape(x2, order='F'), layer.weight, layer.bias,
+                        y=out).reshape(y_shape, order='F')
+    return step
+
+
+def _linear_backward(layer, x_shape, y_shape, out):
+    fbackward, mask = layer._fbackward, layer.var_mask
+    x2 = (tuple_prod(x_shape[:-1]), x_shape[-1])
+    y2 = (x2[0], layer.weight.shape[0])
+    if out is not None:
+        out = out.reshape(x2, order='F')
+
+    def step(x, y, dy):
+        dweight, dbias = layer._gradient_slots(layer.weight.shape)
+        dx, dweight, dbias = fbackward(dy.reshape(y2, order='F'),
+                                       x.reshape(x2, order='F'),
+                                       layer.weight, do_xgrad=True,
+                                       do_wgrad=mask[0], do_bgrad=mask[1],
+                                       dx=out, dweight=dweight, dbias=dbias)
+        return layer._pack_gradients(dweight, dbias),\
+            dx.reshape(x_shape, order='F')
+    return step
+
+
+def _spconv_forward(layer, x_shape, y_shape, out):
+    if layer.strategy != 'pixel':
+        return lambda x: layer.forward(x, out=out)
+    nbatch = len(x_shape) - layer.img_nd
+    fforward = layer._fforward1 if nbatch == 1 else layer._fforward
+    xf = x_shape[:nbatch] + (tuple_prod(x_shape[nbatch:]),)
+    if out is not None:
+        out = out.reshape(y_shape[:nbatch] + (-1,), order='F')
+    csc_indptr, csc_indices = layer.csc_indptr, layer.csc_indices
+
+    def step(x):
+        fltr = layer.weight.reshape(layer.weight.shape[:2] + (-1,),
+                                    order='F')
+        return fforward(x.reshape(xf, order='F'), csc_indptr=csc_indptr,
+                        csc_indices=csc_indices, fltr_data=fltr,
+                        bias=layer.bias, max_nnz_row=fltr.shape[-1],
+                        y=out).reshape(y_shape, order='F')
+    return step
+
+
+def _spconv_backward(layer, x_shape, y_shape, out):
+    if layer.strategy != 'pixel':
+        return lambda x, y, dy: layer.backward((x, y), dy, out=out)
+    nbatch = len(x_shape) - layer.img_nd
+    fbackward = layer._fbackward1 if nbatch == 1 else layer._fbackward
+    mask = layer.var_mask
+    xf = x_shape[:nbatch] + (tuple_prod(x_shape[nbatch:]),)
+    yf = y_shape[:nbatch] + (tuple_prod(y_shape[nbatch:]),)
+    if out is not None:
+        out = out.reshape(xf, order='F')
+    csc_indptr, csc_indices = layer.csc_indptr, layer.csc_indices
+
+    def step(x, y, dy):
+        fltr = layer.weight.reshape(layer.weight.shape[:2] + (-1,),
+                                    order='F')
+        dweight, dbias = layer._gradient_slots(fltr.shape)
+        dx, dweight, dbias = fbackward(dy.reshape(yf, order='F'),
+                                       x.reshape(xf, order='F'),
+                                       csc_indptr, csc_indices,
+                                       fltr_data=fltr, do_xgrad=True,
+                                       do_wgrad=mask[0], do_bgrad=mask[1],
+                                       max_nnz_row=fltr.shape[-1], dx=out,
+                                       dweight=dweight, dbias=dbias)
+        return layer._pack_gradients(dweight, dbias),\
+            dx.reshape(x_shape, order='F')
+    return step
+
+
+def _relu_forward(layer, x_shape, y_shape, out):
+    fforward, leak = layer._fforward, layer.leak
+    inplace = out is None and layer.tags['is_inplace']
+    if out is not None:
+        out = out.ravel(order='F')
+
+    def step(x):
+        x1 = x.ravel(order='F')
+        return fforward(x1, leak, y=x1 if inplace else out).reshape(
+            y_shape, order='F')
+    return step
+
+
+def _relu_backward(layer, x_shape, y_shape, out):
+    fbackward, leak = layer._fbackward, layer.leak
+    if out is not None:
+        out = out.ravel(order='F')
+
+    def step(x, y, dy):
+        return layer.get_variables(), fbackward(
+            x=x.ravel(order='F'), dy=dy.ravel(order='F'), leak=leak,
+            dx=out).reshape(x_shape, order='F')
+    return step
+
+
+def _pooling_forward(layer, x_shape, y_shape, out):
+    fforward, mode = layer._fforward, layer.mode_list.index(layer.mode)
+    img_in_shape, kernel_shape = x_shape[-layer.img_nd:], layer.kernel_shape
+    dim_out = tuple_prod(layer.img_out_shape)
+    x2 = (-1, tuple_prod(img_in_shape))
+    if out is not None:
+        out = out.reshape((-1, dim_out), order='F')
+
+    def step(x):
+        return fforward(x.reshape(x2, order='F'), img_in_shape=img_in_shape,
+                        kernel_shape=kernel_shape, dim_out=dim_out,
+                        mode=mode, y=out).reshape(y_shape, order='F')
+    return step
+
+
+def _pooling_backward(layer, x_shape, y_shape, out):
+    fbackward, mode = layer._fbackward, layer.mode_list.index(layer.mode)
+    img_in_shape, kernel_shape = x_shape[-layer.img_nd:], layer.kernel_shape
+    x2 = (-1, tuple_prod(img_in_shape))
+    y2 = (-1, tuple_prod(layer.img_out_shape))
+    if out is not None:
+        out = out.reshape(x2, order='F')
+
+    def step(x, y, dy):
+        return layer.get_variables(), fbackward(
+            dy.reshape(y2, order='F'), x.reshape(x2, order='F'),
+            img_in_shape=img_in_shape, kernel_shape=kernel_shape, mode=mode,
+            dx=out).reshape(x_shape, order='F')
+    return step
+
+
+def _reshape_forward(layer, x_shape, y_shape, out):
+    return lambda x: x.reshape(y_shape, order='F')
+
+
+def _reshape_backward(layer, x_shape, y_shape, out):
+    empty = layer.get_variables()
+    return lambda x, y, dy: (empty, dy.reshape(x_shape, order='F'))
+
+
+_STEP_BUILDERS = {
+    Linear: (_linear_forward, _linear_backward),
+    SPConv: (_spconv_forward, _spconv_backward),
+    ReLU: (_relu_forward, _relu_backward),
+    Pooling: (_pooling_forward, _pooling_backward),
+    Reshape: (_reshape_forward, _reshape_backward),
+}
+'''builders of forward and backward steps for known layers.'''
@@ -1,20 +1,17 @@
 import numpy as np
 import scipy
-from scipy import fftpack
 from numbers import Number
 import pdb
 
 from .core import Layer, Function, EXP_OVERFLOW, EMPTY_VAR
-from .lib.pooling import lib as fpooling
-from .lib.convprod import lib as fconvprod
-from .lib.relu import lib as frelu
+from .kernels import get_kernel
 from .utils import scan2csc, tuple_prod, dtype2token,\
     dtype_c2r, dtype_r2c, complex_backward, fsign
 
 __all__ = ['wrapfunc', 'Log2cosh', 'Logcosh', 'Sigmoid',
            'Cosh', 'Sinh', 'Tan', 'Tanh',
            'Sum', 'Mul', 'Mod', 'Mean', 'FFT', 'ReLU', 'ConvProd',
-           'Pooling', 'DropOut',
+           'Pooling', 'GlobalPooling', 'DropOut',
            'Sin', 'Cos', 'ArcTan', 'Exp', 'Log', 'SoftPlus', 'Power',
            'SoftMax', 'CrossEntropy', 'SoftMaxCrossEntropy', 'SquareLoss',
            'Reshape', 'Transpose', 'TypeCast',
@@ -194,6 +191,7 @@ class Sum(Function):
         axis (int): the axis along which to sum over.
     '''
     __display_attrs__ = ['axis']
+    __backward_needs__ = ''
 
     def __init__(self, input_shape, itype, axis, **kwargs):
         if axis > len(input_shape) - 1:
@@ -227,6 +225,7 @@ class Mean(Function):
         axis (int): the axis along which to operate.
     '''
     __display_attrs__ = ['axis']
+    __backward_needs__ = ''
 
     def __init__(self, input_shape, itype, axis, **kwargs):
         if axis > len(input_shape) - 1:
@@ -266,7 +265,9 @@ class FFT(Function):
     __display_attrs__ = ['kernel', 'axis']
 
     def __init__(self, input_shape, itype, axis, kernel='fft', **kwargs):
-        if not hasattr(fftpack, kernel):
+        try:
+            self._fforward = get_kernel('fft', kernel)
+        except NotImplementedError:
             raise ValueError(
                 'FFT Kernel %s not found in scipy.fftpack!' % kernel)
         dtype = (itype if itype[: 7] == 'complex' else dtype_r2c(itype))\
@@ -280,19 +281,17 @@ class FFT(Function):
         self.kernel = kernel
 
     def forward(self, x, **kwargs):
-        func = eval('fftpack.%s' % self.kernel)
         if hasattr(self.axis, '__iter__'):
-            return func(x, axes=self.axis)
+            return self._fforward(x, axes=self.axis)
         else:
-            return func(x, axis=self.axis)
+            return self._fforward(x, axis=self.axis)
 
     def backward(self, xy, dy, **kwargs):
         # note that dft matrix is hermitian
-        func = eval('fftpack.%s' % self.kernel)
         if hasattr(self.axis, '__iter__'):
-            dx = func(dy, axes=self.axis)
+            dx = self._fforward(dy, axes=self.axis)
         else:
-            dx = func(dy, axis=self.axis)
+            dx = self._fforward(dy, axis=self.axis)
         return EMPTY_VAR, dx
 
 
@@ -335,6 +334,9 @@ class ReLU(Function):
             relu or holomophic real (r) relu.
     '''
     __display_attrs__ = ['leak']
+    __buffered__ = True
+    __elementwise__ = True
+    __backward_needs__ = 'x'
 
     def __init__(self, input_shape, itype, leak=0.0, is_inplace=False,
                  mode=None, **kwargs):
@@ -352,17 +354,24 @@ class ReLU(Function):
             np.find_common_type((self.itype, self.dtype), ()))
 
         # use the correct function
-        self._fforward = eval('frelu.forward_%s%s' % (mode, dtype_token))
-        self._fbackward = eval('frelu.backward_%s%s' % (mode, dtype_token))
-
-    def forward(self, x, **kwargs):
-        y = self._fforward(x.ravel(order='F'), self.leak).reshape(
+        self._fforward = get_kernel('relu.forward', mode, dtype_token)
+        self._fbackward = get_kernel('relu.backward', mode, dtype_token)
+
+    def forward(self, x, out=None, **kwargs):
+        if out is None and self.tags['is_inplace']:
+            out = x
+        if out is not None:
+            out = out.ravel(order='F')
+        y = self._fforward(x.ravel(order='F'), self.leak, y=out).reshape(
             self.output_shape, order='F')
         return y
 
-    def backward(self, xy, dy, **kwargs):
+    def backward(self, xy, dy, out=None, **kwargs):
+        if out is not None:
+            out = out.ravel(order='F')
         dx = self._fbackward(x=xy[0].ravel(order='F'), dy=dy.ravel(
-            order='F'), leak=self.leak).reshape(self.input_shape, order='F')
+            order='F'), leak=self.leak, dx=out).reshape(self.input_shape,
+                                                        order='F')
         return EMPTY_VAR, dx
 
 
@@ -374,10 +383,14 @@ class Pooling(Function):
         kernel_shape (tuple): the shape of kernel.
         mode (str): the strategy used for pooling,
         refer `Pooling.mode_list` for available modes.
+        cache_argmax (bool, default=True): for max/min pooling, \
+let :meth:`forward` store selected positions in `data_cache`, \
+so that :meth:`backward` does not read the input.
 
     Attributes:
         kernel_shape (tuple): the shape of kernel.
         mode (str): the strategy used for pooling.
+        cache_argmax (bool): store selected positions in `data_cache`.
 
     Note:
         For input array x, axes are aranged as (num_batch, nfi, img_in_dims), \
@@ -385,19 +398,30 @@ stored in 'F' order.
         For output array y, axes are aranged as \
 (num_batch, nfo, img_out_dims), stored in 'F' order.
 
+        With :attr:`cache_argmax`, :meth:`forward` stores selected positions \
+(int32, one per output element) under key `'%d-argmax'%id(self)`, \
+:meth:`backward` scatters gradients to them, and falls back to \
+searching the input if they are not found.
+
         For complex numbers, what does max pooling looks like?
     '''
     __display_attrs__ = ['mode', 'kernel_shape']
+    __buffered__ = True
+    __backward_needs__ = 'x'
     mode_list = ['max', 'max-abs', 'min', 'min-abs', 'mean']
 
-    def __init__(self, input_shape, itype, kernel_shape, mode, **kwargs):
+    def __init__(self, input_shape, itype, kernel_shape, mode,
+                 cache_argmax=True, **kwargs):
         self.kernel_shape = kernel_shape
         self.mode = mode
         if mode not in self.mode_list:
             raise ValueError('mode %s not allowed!' % mode)
+        self.cache_argmax = cache_argmax
         img_in_shape = input_shape[-len(kernel_shape):]
-        self.csc_indptr, self.csc_indices, self.img_out_shape = scan2csc(
-            kernel_shape, img_in_shape, strides=kernel_shape, boundary='O')
+        if any([n % k != 0 for n, k in zip(img_in_shape, kernel_shape)]):
+            raise ValueError("Stride and Shape not match!")
+        self.img_out_shape = tuple(
+            n // k for n, k in zip(img_in_shape, kernel_shape))
         output_shape = input_shape[: -len(kernel_shape)] + self.img_out_shape
         super(Pooling, self).__init__(input_shape, output_shape, itype)
 
@@ -406,38 +430,86 @@ stored in 'F' order.
             np.find_common_type((self.itype, self.dtype), ()))
 
         # use the correct function
-        self._fforward = eval('fpooling.forward_%s' % dtype_token)
-        self._fbackward = eval('fpooling.backward_%s' % dtype_token)
+        self._fforward = get_kernel('pooling.forward_tiled', '', dtype_token)
+        self._fbackward = get_kernel('pooling.backward_tiled', '',
+                                     dtype_token)
+        if cache_argmax and mode != 'mean':
+            self._fforward_argmax = get_kernel('pooling.forward_tiled_argmax',
+                                               '', dtype_token)
+            self._fbackward_argmax = get_kernel('pooling.backward_argmax',
+                                                '', dtype_token)
+        # mean pooling reads the shape of input only.
+        if mode == 'mean' or cache_argmax:
+            self.__backward_needs__ = ''
 
     @property
     def img_nd(self):
         '''int: dimension of image.'''
         return len(self.kernel_shape)
 
-    def forward(self, x, **kwargs):
-        x_nd, img_nd = x.ndim, self.img_nd
-        img_dim = tuple_prod(self.input_shape[-img_nd:])
-
-        y = self._fforward(x.reshape([-1, img_dim], order='F'),
-                           csc_indptr=self.csc_indptr,
-                           csc_indices=self.csc_indices,
-                           mode=self.mode_list.index(self.mode)
-                           ).reshape(self.output_shape, order='F')
-        return y
+    def forward(self, x, out=None, data_cache=None, **kwargs):
+        img_nd = self.img_nd
+        img_in_shape = self.input_shape[-img_nd:]
+        dim_out = tuple_prod(self.img_out_shape)
+        if out is not None:
+            out = out.reshape([-1, dim_out], order='F')
+
+        x = x.reshape([-1, tuple_prod(img_in_shape)], order='F')
+        kwargs = dict(img_in_shape=img_in_shape,
+                      kernel_shape=self.kernel_shape, dim_out=dim_out,
+                      mode=self.mode_list.index(self.mode), y=out)
+        if data_cache is not None and self.cache_argmax and\
+                self.mode != 'mean':
+            y, argmax = self._fforward_argmax(x, **kwargs)
+            data_cache['%d-argmax' % id(self)] = argmax
+        else:
+            y = self._fforward(x, **kwargs)
+        return y.reshape(self.output_shape, order='F')
 
-    def backward(self, xy, dy, **kwargs):
+    def backward(self, xy, dy, out=None, data_cache=None, **kwargs):
         x, y = xy
-        x_nd, img_nd = x.ndim, self.img_nd
-        img_dim_in = tuple_prod(self.input_shape[-img_nd:])
-        img_dim_out = tuple_prod(self.output_shape[-img_nd:])
+        img_nd = self.img_nd
+        img_in_shape = self.input_shape[-img_nd:]
+        img_dim_in = tuple_prod(img_in_shape)
+        if out is not None:
+            out = out.reshape([-1, img_dim_in], order='F')
+
+        key = '%d-argmax' % id(self)
+        dy = dy.reshape([-1, tuple_prod(self.img_out_shape)], order='F')
+        if data_cache is not None and key in data_cache:
+            dx = self._fbackward_argmax(dy, data_cache[key],
+                                        dim_in=img_dim_in, dx=out)
+        else:
+            dx = self._fbackward(dy, x.reshape([-1, img_dim_in], order='F'),
+                                 img_in_shape=img_in_shape,
+                                 kernel_shape=self.kernel_shape,
+                                 mode=self.mode_list.index(self.mode), dx=out)
+        return EMPTY_VAR, dx.reshape(self.input_shape, order='F')
 
-        dx = self._fbackward(x=x.reshape([-1, img_dim_in], order='F'),
-                             dy=dy.reshape([-1, img_dim_out], order='F'),
-                             csc_indptr=self.csc_indptr,
-                             csc_indices=self.csc_indices,
-                             mode=self.mode_list.index(self.mode)
-                             ).reshape(self.input_shape, order='F')
-        return EMPTY_VAR, dx
+
+class GlobalPooling(Pooling):
+    '''
+    Pooling with the kernel covering the whole image, \
+image axes are removed from output.
+
+    Args:
+        mode (str): the strategy used for pooling,
+        refer `Pooling.mode_list` for available modes.
+        img_nd (int, default=2): dimension of image.
+
+    Note:
+        For input array x, axes are aranged as (num_batch, nfi, img_in_dims), \
+stored in 'F' order.
+        For output array y, axes are aranged as (num_batch, nfi), \
+stored in 'F' order.
+    '''
+    __display_attrs__ = ['mode']
+
+    def __init__(self, input_shape, itype, mode, img_nd=2, **kwargs):
+        super(GlobalPooling, self).__init__(
+            input_shape, itype, kernel_shape=tuple(input_shape[-img_nd:]),
+            mode=mode, **kwargs)
+        self.output_shape = input_shape[:-img_nd]
 
 
 class ConvProd(Function):
@@ -485,8 +557,8 @@ img_out_dims), stored in 'F' order.
             np.find_common_type((self.itype, self.dtype), ()))
 
         # use the correct function
-        self._fforward = eval('fconvprod.forward_%s' % dtype_token)
-        self._fbackward = eval('fconvprod.backward_%s' % dtype_token)
+        self._fforward = get_kernel('convprod.forward', '', dtype_token)
+        self._fbackward = get_kernel('convprod.backward', '', dtype_token)
 
     @property
     def img_nd(self):
@@ -539,6 +611,9 @@ class DropOut(Function):
          [  4.+0.j  10.+0.j   0.+0.j]]
     '''
     __display_attrs__ = ['axis', 'keep_rate']
+    __buffered__ = True
+    __elementwise__ = True
+    __backward_needs__ = ''
 
     def __init__(self, input_shape, itype, keep_rate, axis,
                  is_inplace=False, **kwargs):
@@ -559,21 +634,32 @@ class DropOut(Function):
         self.mask = np.random.random(
             self.input_shape[self.axis]) < self.keep_rate
 
-    def forward(self, x, **kwargs):
+    def forward(self, x, out=None, **kwargs):
         if self.seed is None:
             raise AttributeError('Please initialize variable\
                                  seed(use @set_runtime_vars)\
                                  before using a runtime layer % s!' % self)
-        y = x if self.tags['is_inplace'] else x.copy(order='F')
+        if out is None:
+            y = x if self.tags['is_inplace'] else x.copy(order='F')
+        else:
+            y = out
+            if y is not x:
+                y[...] = x
         y[(slice(None),) * self.axis + (self.mask,)] /= self.keep_rate
         y[(slice(None),) * self.axis + (~self.mask,)] = 0
         return y
 
-    def backward(self, xy, dy, **kwargs):
+    def backward(self, xy, dy, out=None, **kwargs):
         x, y = xy
-        dy[(slice(None),) * self.axis + (self.mask,)] /= self.keep_rate
-        dy[(slice(None),) * self.axis + (~self.mask,)] = 0
-        return EMPTY_VAR, dy
+        if out is None:
+            dx = dy if self.tags['is_inplace'] else dy.copy(order='F')
+        else:
+            dx = out
+            if dx is not dy:
+                dx[...] = dy
+        dx[(slice(None),) * self.axis + (self.mask,)] /= self.keep_rate
+        dx[(slice(None),) * self.axis + (~self.mask,)] = 0
+        return EMPTY_VAR, dx
 
 
 class SoftMax(Function):
@@ -732,6 +818,7 @@ class Reshape(Function):
     Note:
         output_shape is a mandatory parameter now.
     '''
+    __backward_needs__ = ''
 
     def forward(self, x, **kwargs):
         return x.reshape(self.output_shape, order='F')
@@ -0,0 +1,245 @@
+'''
+Fused layers, chains of layers evaluated by one kernel.
+'''
+
+import numpy as np
+
+from .kernels import get_kernel
+from .linears import Linear
+from .spconv import SPConv
+from .functions import ReLU, Pooling
+from .utils import scan2csc, tuple_prod, dtype2token
+
+__all__ = ['LinearReLU', 'SPConvReLUPooling', 'fuse_chain']
+
+
+class LinearReLU(Linear):
+    '''
+    :class:`Linear` followed by :class:`ReLU` of mode 'r', \
+the slope of relu in backward is infered from output.
+
+    Args:
+        leak (float, default=0.0): leakage of relu.
+
+    Attributes:
+        leak (float): leakage of relu.
+    '''
+    __display_attrs__ = ['var_mask', 'is_unitary', 'leak']
+    __backward_needs__ = 'xy'
+
+    def __init__(self, input_shape, itype, weight, bias, var_mask=(1, 1),
+                 leak=0.0, **kwargs):
+        if leak > 1 or leak < 0:
+            raise ValueError('leak parameter should be 0-1!')
+        super(LinearReLU, self).__init__(input_shape, itype=itype,
+                                         weight=weight, bias=bias,
+                                         var_mask=var_mask, **kwargs)
+        self.leak = leak
+
+        dtype_token = dtype2token(
+            np.find_common_type((self.itype, self.dtype), ()))
+        self._fforward = get_kernel('linear_relu.forward', '', dtype_token)
+        self._fbackward = get_kernel('linear_relu.backward', '', dtype_token)
+
+    def forward(self, x, out=None, **kwargs):
+        x = np.atleast_2d(x)
+        if out is not None:
+            out = out.reshape((x.shape[0], self.weight.shape[0]), order='F')
+        y = self._fforward(x, self.weight, self.bias, self.leak, y=out)
+        return y.reshape(self.output_shape, order='F')
+
+    def backward(self, xy, dy, out=None, **kwargs):
+        mask = self.var_mask
+        x, y = xy
+        x = np.atleast_2d(x)
+        y2 = (x.shape[0], self.weight.shape[0])
+        if out is not None:
+            out = out.reshape(x.shape, order='F')
+        dweight, dbias = self._gradient_slots(self.weight.shape)
+        dx, dweight, dbias = self._fbackward(dy.reshape(y2, order='F'), x,
+                                             y.reshape(y2, order='F'),
+                                             self.weight, self.leak,
+                                             do_xgrad=True,
+                                             do_wgrad=mask[0],
+                                             do_bgrad=mask[1], dx=out,
+                                             dweight=dweight, dbias=dbias)
+        return self._pack_gradients(dweight, dbias),\
+            dx.reshape(self.input_shape, order='F')
+
+
+class SPConvReLUPooling(SPConv):
+    '''
+    Contiguous :class:`SPConv` followed by :class:`ReLU` of mode 'r' \
+and :class:`Pooling`, outputs of convolution are pooled once computed, \
+and never stored.
+
+    Args:
+        pool_shape (tuple): kernel shape of pooling.
+        mode ('max'|'max-abs'|'min'|'min-abs', default='max'): \
+the strategy used for pooling.
+        leak (float, default=0.0): leakage of relu.
+
+    Attributes:
+        pool_shape (tuple): kernel shape of pooling.
+        mode (str): the strategy used for pooling.
+        leak (float): leakage of relu.
+
+    Note:
+        :meth:`forward` stores selected positions in `data_cache` \
+under key `'%d-argmax'%id(self)`, which is required by :meth:`backward`.
+    '''
+    __display_attrs__ = ['strides', 'boundary', 'kernel_shape', 'pool_shape',
+                         'mode', 'leak', 'is_unitary', 'var_mask']
+    mode_list = Pooling.mode_list[:4]
+
+    def __init__(self, input_shape, itype, weight, bias, pool_shape,
+                 mode='max', leak=0.0, strides=None, boundary='P',
+                 var_mask=(1, 1), **kwargs):
+        if mode not in self.mode_list:
+            raise ValueError('mode %s not allowed!' % mode)
+        if leak > 1 or leak < 0:
+            raise ValueError('leak parameter should be 0-1!')
+        super(SPConvReLUPooling, self).__init__(input_shape, itype=itype,
+                                                weight=weight, bias=bias,
+                                                strides=strides,
+                                                boundary=boundary,
+                                                var_mask=var_mask,
+                                                strategy='pixel', **kwargs)
+        self.pool_shape = tuple(pool_shape)
+        self.mode = mode
+        self.leak = leak
+        self.pool_indptr, self.pool_indices, self.img_pool_shape = scan2csc(
+            self.pool_shape, self.img_out_shape, strides=self.pool_shape,
+            boundary='O')
+        self.output_shape = self.output_shape[:-self.img_nd] + \
+            self.img_pool_shape
+
+        dtype_token = dtype2token(
+            np.find_common_type((self.itype, self.dtype), ()))
+        self._fforward = get_kernel('conv_relu_pool.forward', '',
+                                    dtype_token)
+        self._fbackward = get_kernel('conv_relu_pool.backward', '',
+                                     dtype_token)
+
+    def forward(self, x, out=None, data_cache=None, **kwargs):
+        '''
+        Args:
+            x (ndarray): (num_batch, nfi, img_in_dims), input in 'F' order.
+            out (ndarray|None, default=None): (num_batch, nfo, \
+img_pool_dims), preallocated output in 'F' order.
+            data_cache (dict|None, default=None): a dict to store \
+selected positions for :meth:`backward`.
+
+        Returns:
+            ndarray, (num_batch, nfo, img_pool_dims), output in 'F' order.
+        '''
+        x = x.reshape((-1, self.num_feature_in,
+                       tuple_prod(x.shape[-self.img_nd:])), order='F')
+        fltr = self.weight.reshape(self.weight.shape[:2] + (-1,), order='F')
+        if out is not None:
+            out = out.reshape((x.shape[0], self.num_feature_out, -1),
+                              order='F')
+        y, argmax = self._fforward(x, bias=self.bias,
+                                   csc_indptr=self.csc_indptr,
+                                   csc_indices=self.csc_indices,
+                                   fltr_data=fltr,
+                                   pool_indptr=self.pool_indptr,
+                                   pool_indices=self.pool_indices,
+                                   leak=self.leak,
+                                   mode=self.mode_list.index(self.mode),
+                                   max_nnz_row=fltr.shape[-1], y=out)
+        if data_cache is not None:
+            data_cache['%d-argmax' % id(self)] = argmax
+        return y.reshape(self.output_shape, order='F')
+
+    def backward(self, xy, dy, out=None, data_cache=None, **kwargs):
+        '''
+        Args:
+            xy ((ndarray, ndarray)):
+                * x -> (num_batch, nfi, img_in_dims), input in 'F' order.
+                * y -> (num_batch, nfo, img_pool_dims), output in 'F' order.
+            dy (ndarray): (num_batch, nfo, img_pool_dims),\
+                    gradient of output in 'F' order.
+            out (ndarray|None, default=None): (num_batch, nfi, \
+img_in_dims), preallocated gradient of input in 'F' order.
+            data_cache (dict): a dict with selected positions.
+
+        Returns:
+            tuple(1darray, ndarray): dw, dx
+        '''
+        key = '%d-argmax' % id(self)
+        if data_cache is None or key not in data_cache:
+            raise TypeError('Can not find cached argmax! get %s' % data_cache)
+        x, y = xy
+        mask = self.var_mask
+        x = x.reshape((-1, self.num_feature_in,
+                       tuple_prod(x.shape[-self.img_nd:])), order='F')
+        argmax = data_cache[key]
+        fltr = self.weight.reshape(self.weight.shape[:2] + (-1,), order='F')
+        if out is not None:
+            out = out.reshape(x.shape, order='F')
+        dweight, dbias = self._gradient_slots(fltr.shape)
+        dx, dweight, dbias = self._fbackward(dy.reshape(argmax.shape,
+                                                        order='F'),
+                                             x, argmax,
+                                             csc_indptr=self.csc_indptr,
+                                             csc_indices=self.csc_indices,
+                                             fltr_data=fltr,
+                                             pool_indptr=self.pool_indptr,
+                                             pool_indices=self.pool_indices,
+                                             leak=self.leak,
+                                             do_xgrad=True,
+                                             do_wgrad=mask[0],
+                                             do_bgrad=mask[1],
+                                             max_nnz_row=fltr.shape[-1],
+                                             dx=out, dweight=dweight,
+                                             dbias=dbias)
+        return self._pack_gradients(dweight, dbias),\
+            dx.reshape(self.input_shape, order='F')
+
+
+def fuse_chain(layers):
+    '''
+    Fuse the chain at the head of `layers`, the supported chains are
+
+        * :class:`Linear` -> :class:`ReLU`,
+        * :class:`SPConv` (contiguous, strategy 'pixel') -> :class:`ReLU` \
+-> :class:`Pooling`,
+
+    where :class:`ReLU` is of mode 'r', and :class:`Pooling` is not 'mean', \
+heads using the 3M scheme (`gemm3m`) are not fused. \
+The fused layer shares weight and bias with the head layer.
+
+    Args:
+        layers (list<Layer>): layers.
+
+    Returns:
+        (Layer, int)|None: fused layer and the number of layers it replaces, \
+None if no chain is found.
+    '''
+    if len(layers) < 2 or type(layers[1]) is not ReLU or\
+            layers[1].mode != 'r':
+        return None
+    head, relu = layers[:2]
+    if type(head) is Linear and not head.gemm3m:
+        fused = LinearReLU(head.input_shape, head.itype, head.weight,
+                           head.bias, var_mask=head.var_mask, leak=relu.leak)
+        num_fused = 2
+    elif type(head) is SPConv and not head.gemm3m and head.w_contiguous and\
+            head.strategy == 'pixel' and len(layers) > 2\
+            and type(layers[2]) is Pooling and\
+            layers[2].mode in SPConvReLUPooling.mode_list and\
+            layers[2].img_nd == head.img_nd:
+        pool = layers[2]
+        fused = SPConvReLUPooling(head.input_shape, head.itype, head.weight,
+                                  head.bias, pool.kernel_shape,
+                                  mode=pool.mode, leak=relu.leak,
+                                  strides=head.strides,
+                                  boundary=head.boundary,
+                                  var_mask=head.var_mask)
+        num_fused = 3
+    else:
+        return None
+    fused.is_unitary = head.is_unitary
+    fused._flat_gradients = head._flat_gradients
+    return fused, num_fused
@@ -0,0 +1,357 @@
+'''
+Registry of compute kernels, keyed by `(operation, variant, dtype)`.
+
+    * operation, e.g. 'linear.forward', 'spconv.backward1', 'fft'.
+    * variant, e.g. 'contiguous' or 'general' for :class:`SPConv`, \
+the mode for :class:`ReLU`, the kernel name for :class:`FFT`, \
+'' if there is only one.
+    * dtype, the token of data type returned by :func:`dtype2token`, \
+None for kernels accepting any data type.
+
+Kernels are provided by backends, which are tried in the order of \
+:data:`BACKENDS`. A backend either resolves kernels by a function \
+(:func:`register_backend`), or has kernels registered one by one \
+(:func:`register_kernel`). Layers resolve their kernels once, on construction.
+A Fortran extension that can not be imported is reported once \
+by a RuntimeWarning, its kernels are taken from other backends.
+'''
+
+import warnings
+from functools import partial
+
+import numpy as np
+
+from .lib import LazyLib
+
+__all__ = ['BACKENDS', 'FORTRAN_KERNELS', 'get_kernel', 'register_kernel',
+           'register_backend', 'set_backends', 'kernel_backend']
+
+BACKENDS = ['fortran', 'scipy', 'numpy']
+'''Names of backends, in the order of preference.'''
+
+FORTRAN_KERNELS = {
+    'linear.forward': ('linear', 'forward_{dtype}'),
+    'linear.backward': ('linear', 'backward_{dtype}'),
+    'splinear.forward': ('spsp', 'forward{dtype}'),
+    'splinear.backward': ('spsp', 'backward{dtype}'),
+    'spconv.forward': ('spconv', 'forward_{variant}{dtype}'),
+    'spconv.backward': ('spconv', 'backward_{variant}{dtype}'),
+    'spconv.forward1': ('spconv', 'forward1_{variant}{dtype}'),
+    'spconv.backward1': ('spconv', 'backward1_{variant}{dtype}'),
+    'spsp.forward': ('spsp', 'forward_conv{dtype}'),
+    'spsp.backward': ('spsp', 'backward_conv{dtype}'),
+    'relu.forward': ('relu', 'forward_{variant}{dtype}'),
+    'relu.backward': ('relu', 'backward_{variant}{dtype}'),
+    'pooling.forward_tiled': ('pooling', 'forward_tiled_{dtype}'),
+    'pooling.forward_tiled_argmax': ('pooling', 'forward_tiled_argmax_{dtype}'),
+    'pooling.backward_tiled': ('pooling', 'backward_tiled_{dtype}'),
+    'pooling.backward_argmax': ('pooling', 'backward_argmax_{dtype}'),
+    'convprod.forward': ('convprod', 'forward_{dtype}'),
+    'convprod.backward': ('convprod', 'backward_{dtype}'),
+    'linear_relu.forward': ('fused', 'linear_relu_forward_{dtype}'),
+    'linear_relu.backward': ('fused', 'linear_relu_backward_{dtype}'),
+    'conv_relu_pool.forward': ('fused', 'conv_relu_pool_forward_{dtype}'),
+    'conv_relu_pool.backward': ('fused', 'conv_relu_pool_backward_{dtype}'),
+    'sign': ('futils', 'fsign_{dtype}'),
+}
+'''Operations of the 'fortran' backend, mapped to \
+(extension in :mod:`poornn.lib`, pattern of routine names).'''
+
+_LIBS = {}
+_BROKEN_LIBS = set()
+_RESOLVERS = {}
+_KERNELS = {}
+_CACHE = {}
+_BACKEND_OF = {}
+
+
+def get_kernel(operation, variant='', dtype=None, backend=None):
+    '''
+    Resolve a kernel, from the first backend in :data:`BACKENDS` \
+providing it, results are cached.
+
+    Args:
+        operation (str): the operation, e.g. 'linear.forward'.
+        variant (str, default=''): the variant.
+        dtype (str|None, default=None): token of data type.
+        backend (str|None, default=None): use this backend only.
+
+    Returns:
+        func: the kernel.
+    '''
+    key = (operation, variant, dtype, backend)
+    if key not in _CACHE:
+        for name in BACKENDS if backend is None else [backend]:
+            func = _resolve(name, operation, variant, dtype)
+            if func is None:
+                func = _resolve(name, operation, variant, None)
+            if func is not None:
+                _BACKEND_OF[id(func)] = (func, name)
+                _CACHE[key] = func
+                break
+        else:
+            raise NotImplementedError(
+                'No kernel for %s (variant = %r, dtype = %s) in backends %s!'
+                % (operation, variant, dtype,
+                   BACKENDS if backend is None else [backend]))
+    return _CACHE[key]
+
+
+def register_kernel(operation, variant, dtype, func, backend='numpy'):
+    '''
+    Register a kernel, with the calling convention of the \
+kernel it replaces.
+
+    Args:
+        operation (str): the operation.
+        variant (str): the variant.
+        dtype (str|None): token of data type, None for any data type.
+        func (func): the kernel.
+        backend (str, default='numpy'): name of backend, \
+appended to :data:`BACKENDS` if new.
+    '''
+    _KERNELS.setdefault(backend, {})[(operation, variant, dtype)] = func
+    if backend not in BACKENDS:
+        BACKENDS.append(backend)
+    _CACHE.clear()
+
+
+def register_backend(name, resolver, priority=None):
+    '''
+    Register a backend resolving kernels by a function, \
+e.g. a different build of Fortran extensions.
+
+    Args:
+        name (str): name of backend.
+        resolver (func): `resolver(operation, variant, dtype)` returns \
+the kernel, or None if not provided.
+        priority (int|None, default=None): position in :data:`BACKENDS`, \
+if None, the last or the current position if listed.
+    '''
+    _RESOLVERS[name] = resolver
+    if priority is not None and name in BACKENDS:
+        BACKENDS.remove(name)
+    if name not in BACKENDS:
+        BACKENDS.insert(len(BACKENDS) if priority is None else priority,
+                        name)
+    _CACHE.clear()
+
+
+def set_backends(backends):
+    '''
+    Set the order of preference of backends, \
+layers constructed afterwards use it.
+
+    Args:
+        backends (list<str>): names of backends.
+
+    Returns:
+        list<str>: the previous order.
+    '''
+    previous = list(BACKENDS)
+    BACKENDS[:] = backends
+    _CACHE.clear()
+    return previous
+
+
+def kernel_backend(func):
+    '''
+    Name of the backend providing a kernel.
+
+    Args:
+        func (func): a kernel returned by :func:`get_kernel`, \
+or a `functools.partial` of it.
+
+    Returns:
+        str|None: name of backend, None if `func` is not a kernel.
+    '''
+    while isinstance(func, partial):
+        func = func.func
+    return _BACKEND_OF.get(id(func), (None, None))[1]
+
+
+def _resolve(backend, operation, variant, dtype):
+    '''a kernel of one backend, None if not provided.'''
+    func = _KERNELS.get(backend, {}).get((operation, variant, dtype))
+    if func is None and backend in _RESOLVERS:
+        func = _RESOLVERS[backend](operation, variant, dtype)
+    return func
+
+
+def _fortran_kernel(operation, variant, dtype):
+    '''resolver of the 'fortran' backend.'''
+    if operation not in FORTRAN_KERNELS or dtype is None:
+        return None
+    extension, pattern = FORTRAN_KERNELS[operation]
+    if variant and '{variant}' not in pattern:
+        return None
+    if extension in _BROKEN_LIBS:
+        return None
+    if extension not in _LIBS:
+        _LIBS[extension] = LazyLib(extension)
+    try:
+        return getattr(_LIBS[extension],
+                       pattern.format(variant=variant, dtype=dtype))
+    except AttributeError:
+        return None
+    except ImportError as err:
+        # a missing or broken build, warned once and skipped.
+        _BROKEN_LIBS.add(extension)
+        warnings.warn('Fortran extension poornn.lib.%s can not be imported '
+                      '(%s), its kernels are taken from other backends.' %
+                      (extension, err), RuntimeWarning)
+        return None
+
+
+def _scipy_kernel(operation, variant, dtype):
+    '''resolver of the 'scipy' backend.'''
+    if operation != 'fft':
+        return None
+    from scipy import fftpack
+    return getattr(fftpack, variant, None)
+
+
+register_backend('fortran', _fortran_kernel)
+register_backend('scipy', _scipy_kernel)
+
+
+# pure NumPy kernels, fallbacks when Fortran extensions are not built.
+
+def _dot3m(a, b):
+    '''
+    matrix product of complex arrays with 3 real products (3M scheme) \
+on planar real and imaginary parts.
+    '''
+    ar, ai, br, bi = a.real, a.imag, b.real, b.imag
+    t1, t2 = np.dot(ar, br), np.dot(ai, bi)
+    res = np.empty(t1.shape, dtype=np.result_type(a, b))
+    res.real = t1 - t2
+    res.imag = np.dot(ar + ai, br + bi) - t1 - t2
+    return res
+
+
+def _dot(a, b, gemm3m=False):
+    if gemm3m and np.iscomplexobj(a) and np.iscomplexobj(b):
+        return _dot3m(a, b)
+    return np.dot(a, b)
+
+
+def _linear_forward(x, weight, bias, y=None, gemm3m=False):
+    if y is None:
+        y = np.empty((x.shape[0], weight.shape[0]),
+                     dtype=np.result_type(x, weight), order='F')
+    y[...] = _dot(x, weight.T, gemm3m)
+    y += bias
+    return y
+
+
+def _linear_backward(dy, x, weight, do_xgrad=True, do_wgrad=True,
+                     do_bgrad=True, dx=None, dweight=None, dbias=None,
+                     gemm3m=False):
+    dtype = np.result_type(dy, x, weight)
+    if dx is None:
+        dx = np.empty(x.shape, dtype=dtype, order='F')
+    if dweight is None:
+        dweight = np.empty(weight.shape, dtype=dtype, order='F')
+    if dbias is None:
+        dbias = np.empty(weight.shape[0], dtype=dtype)
+    if do_wgrad:
+        dweight[...] = _dot(dy.T, x, gemm3m)
+    if do_xgrad:
+        dx[...] = _dot(dy, weight, gemm3m)
+    if do_bgrad:
+        dbias[...] = dy.sum(axis=0)
+    return dx, dweight, dbias
+
+
+def _relu_factor(x, leak):
+    rtype = x.real.dtype.type
+    return np.where(x.real < 0, rtype(leak), rtype(1))
+
+
+def _relu_forward(x, leak, y=None):
+    return np.multiply(x, _relu_factor(x, leak), out=y)
+
+
+def _relu_backward(dy, x, leak, dx=None):
+    return np.multiply(dy, _relu_factor(x, leak), out=dx)
+
+
+def _pooling_tiles(x, img_in_shape, kernel_shape, inverse=False):
+    '''
+    x (rows, img_in_dims) as a (rows, outputs, kernel) array, \
+outputs and kernel offsets in 'F' order, or the inverse.
+    '''
+    nd = len(kernel_shape)
+    shape, perm = (-1,), (0,) + tuple(range(2, 2 * nd + 1, 2)) +\
+        tuple(range(1, 2 * nd, 2))
+    for n, k in zip(img_in_shape, kernel_shape):
+        shape += (k, n // k)
+    if inverse:
+        x = x.reshape(tuple(shape[i] for i in perm), order='F')
+        x = x.transpose(np.argsort(perm))
+        return x.reshape((x.shape[0], -1), order='F')
+    xt = x.reshape(shape, order='F').transpose(perm)
+    return xt.reshape((x.shape[0], -1, int(np.prod(kernel_shape))),
+                      order='F')
+
+
+def _pooling_select(xt, mode):
+    '''selected kernel offsets of max/min pooling (mode = 0-3).'''
+    key = abs(xt) if mode in (1, 3) else xt.real
+    return key.argmax(axis=-1) if mode < 2 else key.argmin(axis=-1)
+
+
+def _pooling_forward_tiled(x, img_in_shape, kernel_shape, dim_out, mode,
+                           y=None, with_argmax=False):
+    xt = _pooling_tiles(x, img_in_shape, kernel_shape)
+    if mode == 4:
+        res = xt.mean(axis=-1)
+    else:
+        offset = _pooling_select(xt, mode)
+        res = np.take_along_axis(xt, offset[..., None], axis=-1)[..., 0]
+    if y is None:
+        y = np.empty(res.shape, dtype=x.dtype, order='F')
+    y[...] = res
+    if not with_argmax:
+        return y
+    # selected columns of x, start from 1 as in fortran.
+    index = _pooling_tiles(np.arange(1, x.shape[1] + 1, dtype='int32')[None],
+                           img_in_shape, kernel_shape)[0]
+    return y, np.asfortranarray(index[np.arange(dim_out), offset])
+
+
+def _pooling_backward_tiled(dy, x, img_in_shape, kernel_shape, mode,
+                            dx=None):
+    xt = _pooling_tiles(x, img_in_shape, kernel_shape)
+    if mode == 4:
+        dxt = np.repeat(dy[..., None] / xt.shape[-1], xt.shape[-1], axis=-1)
+    else:
+        dxt = np.zeros(xt.shape, dtype=dy.dtype)
+        np.put_along_axis(dxt, _pooling_select(xt, mode)[..., None],
+                          dy[..., None], axis=-1)
+    if dx is None:
+        dx = np.empty(x.shape, dtype=dy.dtype, order='F')
+    dx[...] = _pooling_tiles(dxt, img_in_shape, kernel_shape, inverse=True)
+    return dx
+
+
+def _pooling_backward_argmax(dy, argmax, dim_in, dx=None):
+    if dx is None:
+        dx = np.empty((dy.shape[0], dim_in), dtype=dy.dtype, order='F')
+    dx[...] = 0
+    dx[np.arange(dy.shape[0])[:, None], argmax - 1] = dy
+    return dx
+
+
+register_kernel('linear.forward', '', None, _linear_forward)
+register_kernel('linear.backward', '', None, _linear_backward)
+register_kernel('relu.forward', 'r', None, _relu_forward)
+register_kernel('relu.backward', 'r', None, _relu_backward)
+register_kernel('pooling.forward_tiled', '', None, _pooling_forward_tiled)
+register_kernel('pooling.forward_tiled_argmax', '', None,
+                partial(_pooling_forward_tiled, with_argmax=True))
+register_kernel('pooling.backward_tiled', '', None, _pooling_backward_tiled)
+register_kernel('pooling.backward_argmax', '', None, _pooling_backward_argmax)
+for _name in ['fftn', 'ifftn', 'rfftn', 'irfftn']:
+    register_kernel('fft', _name, None, getattr(np.fft, _name))
@@ -0,0 +1,35 @@
+'''
+Compiled Fortran extensions, imported on first use.
+'''
+
+import importlib
+
+__all__ = ['LazyLib']
+
+
+class LazyLib(object):
+    '''
+    Proxy of a compiled extension in :mod:`poornn.lib`, \
+the extension is imported at the first attribute access, \
+e.g. when the first layer using it is constructed.
+
+    Args:
+        name (str): name of extension, e.g. 'spconv'.
+    '''
+
+    def __init__(self, name):
+        self._name = name
+        self._lib = None
+
+    def __repr__(self):
+        return '<LazyLib %s%s>' % (
+            self._name, '' if self._lib is None else ' (loaded)')
+
+    def __getattr__(self, name):
+        if name.startswith('_'):
+            raise AttributeError(name)
+        if self._lib is None:
+            module = importlib.import_module('.' + self._name, __name__)
+            # routines of Fortran modules are wrapped in `lib`.
+            self._lib = getattr(module, 'lib', module)
+        return getattr(self._lib, name)
@@ -1,5 +1,6 @@
 !This is an f90 file automatically generated.
 module lib
+    !$ use omp_lib
     contains
     subroutine forward_z(x, y, csc_indptr, csc_indices, nnz, dim_in, dim_out, nfi, powers, nd)
         implicit none
@@ -13,6 +14,7 @@ module lib
         integer :: start_, end_, col, irow
 
         y=1
+        !$omp parallel do schedule(static) private(start_, end_, irow)
         do col=1, dim_out
             start_=csc_indptr(col)
             end_=csc_indptr(col+1)
@@ -20,6 +22,7 @@ module lib
                 y(:,col)=y(:,col)*x(:,csc_indices(start_+irow-1))**powers(irow)
             enddo
         enddo
+        !$omp end parallel do
     end subroutine forward_z
 
     subroutine backward_z(dy,x,y,dx,csc_indptr,csc_indices, nnz,dim_in,dim_out,nfi,powers,nd)
@@ -32,19 +35,26 @@ module lib
         integer,intent(in) :: csc_indptr(dim_out+1)
         complex*16,intent(out) :: dx(nfi, dim_in)
 
-        integer :: start_, end_, col, ib
+        integer :: start_, end_, col, ib, i0, i1
         integer,pointer :: rows(:)
 
         dx=0
+        !rows i0:i1 of x are taken by this thread.
+        !$omp parallel private(start_, end_, col, ib, i0, i1, rows)
+        i0=1
+        i1=nfi
+        !$ i0=omp_get_thread_num()*nfi/omp_get_num_threads()+1
+        !$ i1=(omp_get_thread_num()+1)*nfi/omp_get_num_threads()
         do col=1,dim_out
             start_=csc_indptr(col)
             end_=csc_indptr(col+1)
 
             rows=>csc_indices(start_:end_-1)
-            do ib=1,nfi
+            do ib=i0,i1
                 dx(ib,rows) = dx(ib,rows)+dy(ib,col)*y(ib,col)*powers/x(ib,rows)
             enddo
         enddo
+        !$omp end parallel
     end subroutine backward_z
     subroutine forward_c(x, y, csc_indptr, csc_indices, nnz, dim_in, dim_out, nfi, powers, nd)
         implicit none
@@ -58,6 +68,7 @@ module lib
         integer :: start_, end_, col, irow
 
         y=1
+        !$omp parallel do schedule(static) private(start_, end_, irow)
         do col=1, dim_out
             start_=csc_indptr(col)
             end_=csc_indptr(col+1)
@@ -65,6 +76,7 @@ module lib
                 y(:,col)=y(:,col)*x(:,csc_indices(start_+irow-1))**powers(irow)
             enddo
         enddo
+        !$omp end parallel do
     end subroutine forward_c
 
     subroutine backward_c(dy,x,y,dx,csc_indptr,csc_indices, nnz,dim_in,dim_out,nfi,powers,nd)
@@ -77,19 +89,26 @@ module lib
         integer,intent(in) :: csc_indptr(dim_out+1)
         complex*8,intent(out) :: dx(nfi, dim_in)
 
-        integer :: start_, end_, col, ib
+        integer :: start_, end_, col, ib, i0, i1
         integer,pointer :: rows(:)
 
         dx=0
+        !rows i0:i1 of x are taken by this thread.
+        !$omp parallel private(start_, end_, col, ib, i0, i1, rows)
+        i0=1
+        i1=nfi
+        !$ i0=omp_get_thread_num()*nfi/omp_get_num_threads()+1
+        !$ i1=(omp_get_thread_num()+1)*nfi/omp_get_num_threads()
         do col=1,dim_out
             start_=csc_indptr(col)
             end_=csc_indptr(col+1)
 
             rows=>csc_indices(start_:end_-1)
-            do ib=1,nfi
+            do ib=i0,i1
                 dx(ib,rows) = dx(ib,rows)+dy(ib,col)*y(ib,col)*powers/x(ib,rows)
             enddo
         enddo
+        !$omp end parallel
     end subroutine backward_c
     subroutine forward_d(x, y, csc_indptr, csc_indices, nnz, dim_in, dim_out, nfi, powers, nd)
         implicit none
@@ -103,6 +122,7 @@ module lib
         integer :: start_, end_, col, irow
 
         y=1
+        !$omp parallel do schedule(static) private(start_, end_, irow)
         do col=1, dim_out
             start_=csc_indptr(col)
             end_=csc_indptr(col+1)
@@ -110,6 +130,7 @@ module lib
                 y(:,col)=y(:,col)*x(:,csc_indices(start_+irow-1))**powers(irow)
             enddo
         enddo
+        !$omp end parallel do
     end subroutine forward_d
 
     subroutine backward_d(dy,x,y,dx,csc_indptr,csc_indices, nnz,dim_in,dim_out,nfi,powers,nd)
@@ -122,19 +143,26 @@ module lib
         integer,intent(in) :: csc_indptr(dim_out+1)
         real*8,intent(out) :: dx(nfi, dim_in)
 
-        integer :: start_, end_, col, ib
+        integer :: start_, end_, col, ib, i0, i1
         integer,pointer :: rows(:)
 
         dx=0
+        !rows i0:i1 of x are taken by this thread.
+        !$omp parallel private(start_, end_, col, ib, i0, i1, rows)
+        i0=1
+        i1=nfi
+        !$ i0=omp_get_thread_num()*nfi/omp_get_num_threads()+1
+        !$ i1=(omp_get_thread_num()+1)*nfi/omp_get_num_threads()
         do col=1,dim_out
             start_=csc_indptr(col)
             end_=csc_indptr(col+1)
 
             rows=>csc_indices(start_:end_-1)
-            do ib=1,nfi
+            do ib=i0,i1
                 dx(ib,rows) = dx(ib,rows)+dy(ib,col)*y(ib,col)*powers/x(ib,rows)
             enddo
         enddo
+        !$omp end parallel
     end subroutine backward_d
     subroutine forward_s(x, y, csc_indptr, csc_indices, nnz, dim_in, dim_out, nfi, powers, nd)
         implicit none
@@ -148,6 +176,7 @@ module lib
         integer :: start_, end_, col, irow
 
         y=1
+        !$omp parallel do schedule(static) private(start_, end_, irow)
         do col=1, dim_out
             start_=csc_indptr(col)
             end_=csc_indptr(col+1)
@@ -155,6 +184,7 @@ module lib
                 y(:,col)=y(:,col)*x(:,csc_indices(start_+irow-1))**powers(irow)
             enddo
         enddo
+        !$omp end parallel do
     end subroutine forward_s
 
     subroutine backward_s(dy,x,y,dx,csc_indptr,csc_indices, nnz,dim_in,dim_out,nfi,powers,nd)
@@ -167,18 +197,25 @@ module lib
         integer,intent(in) :: csc_indptr(dim_out+1)
         real*4,intent(out) :: dx(nfi, dim_in)
 
-        integer :: start_, end_, col, ib
+        integer :: start_, end_, col, ib, i0, i1
         integer,pointer :: rows(:)
 
         dx=0
+        !rows i0:i1 of x are taken by this thread.
+        !$omp parallel private(start_, end_, col, ib, i0, i1, rows)
+        i0=1
+        i1=nfi
+        !$ i0=omp_get_thread_num()*nfi/omp_get_num_threads()+1
+        !$ i1=(omp_get_thread_num()+1)*nfi/omp_get_num_threads()
         do col=1,dim_out
             start_=csc_indptr(col)
             end_=csc_indptr(col+1)
 
             rows=>csc_indices(start_:end_-1)
-            do ib=1,nfi
+            do ib=i0,i1
                 dx(ib,rows) = dx(ib,rows)+dy(ib,col)*y(ib,col)*powers/x(ib,rows)
             enddo
         enddo
+        !$omp end parallel
     end subroutine backward_s
     end module lib
\ No newline at end of file
@@ -0,0 +1,874 @@
+!This is an f90 file automatically generated.
+!orders: batch_dim, feature_dim_out/in, conv_dim_out/in
+!fused kernels, relu is the holomophic real (r) version.
+module lib
+    contains
+    !linear followed by relu, computed in blocks of batch.
+    subroutine linear_relu_forward_z(x, y, weight, bias, leak, num_batch, nfi, nfo)
+        implicit none
+        !f2py threadsafe
+        integer,intent(in) :: num_batch, nfi, nfo
+        real*8,intent(in) :: leak
+        complex*16,intent(in) :: x(num_batch, nfi), weight(nfo, nfi), bias(nfo)
+        complex*16,intent(inout) :: y(num_batch, nfo)
+        complex*16,parameter :: one=dcmplx(1D0,0D0)
+        integer,parameter :: block_size=64
+        integer :: i, j, i0, nb
+        !f2py complex*16 optional,intent(in,out),depend(num_batch,nfo) :: y(num_batch,nfo)
+
+        do i0=1,num_batch,block_size
+            nb=min(block_size,num_batch-i0+1)
+            do i=1,nfo
+                y(i0:i0+nb-1,i)=bias(i)
+            enddo
+            call zgemm('N', 'T', nb, nfo, nfi, one, x(i0,1), num_batch,&
+                weight, nfo, one, y(i0,1), num_batch)
+            do j=1,nfo
+                do i=i0,i0+nb-1
+                    if(real(y(i,j))<0) y(i,j)=leak*y(i,j)
+                enddo
+            enddo
+        enddo
+    end subroutine linear_relu_forward_z
+
+    !the slope of relu is infered from output y.
+    subroutine linear_relu_backward_z(dy, x, y, weight, leak, dx, dweight, dbias,&
+            nfi, nfo, num_batch, do_xgrad, do_wgrad, do_bgrad)
+        implicit none
+        !f2py threadsafe
+        integer,intent(in) :: num_batch, nfi, nfo
+        logical,intent(in) :: do_xgrad, do_wgrad, do_bgrad
+        real*8,intent(in) :: leak
+        complex*16,intent(in) :: x(num_batch, nfi), y(num_batch, nfo), dy(num_batch, nfo), weight(nfo, nfi)
+        complex*16,intent(inout) :: dweight(nfo, nfi), dbias(nfo), dx(num_batch, nfi)
+
+        complex*16,allocatable :: dz(:,:)
+        complex*16,parameter :: one=dcmplx(1D0,0D0)
+        complex*16,parameter :: zero=dcmplx(0D0,0D0)
+        integer :: i, j
+
+        !f2py complex*16 optional,intent(in,out),depend(num_batch,nfi) :: dx(num_batch,nfi)
+        !f2py complex*16 optional,intent(in,out),depend(nfo,nfi) :: dweight(nfo,nfi)
+        !f2py complex*16 optional,intent(in,out),depend(nfo) :: dbias(nfo)
+
+        allocate(dz(num_batch, nfo))
+        do j=1,nfo
+            do i=1,num_batch
+                if(real(y(i,j))<0 .or. (leak==0 .and. y(i,j)==zero)) then
+                    dz(i,j)=leak*dy(i,j)
+                else
+                    dz(i,j)=dy(i,j)
+                endif
+            enddo
+        enddo
+        if(do_wgrad) then
+            call zgemm('T', 'N', nfo, nfi, num_batch, one, dz, num_batch,&
+                x, num_batch, zero, dweight, nfo)
+        endif
+        if(do_xgrad) then
+            call zgemm('N', 'N', num_batch, nfi, nfo, one, dz, num_batch,&
+                weight, nfo, zero, dx, num_batch)
+        endif
+        if(do_bgrad) then
+            dbias=sum(dz,1)
+        endif
+        deallocate(dz)
+    end subroutine linear_relu_backward_z
+
+    !contiguous convolution followed by relu and pooling,
+    !convolution outputs are computed column by column and pooled at once.
+    !mode = 0: max real, 1: max abs, 2: min real, 3: min abs.
+    !argmax stores the selected column of convolution output,
+    !negative if relu takes the leak branch.
+    subroutine conv_relu_pool_forward_z(x, y, argmax, bias, num_batch, csc_indptr, csc_indices, fltr_data,&
+            pool_indptr, pool_indices, leak, mode, nnz, dim_in, dim_out, pool_nnz, dim_pool, nfi, nfo, nd, max_nnz_row)
+        implicit none
+        !f2py threadsafe
+        integer,intent(in) :: num_batch, nnz, dim_in, dim_out, pool_nnz, dim_pool, nfi, nfo, max_nnz_row, nd, mode
+        real*8,intent(in) :: leak
+        complex*16,intent(in) :: x(num_batch, nfi, dim_in), bias(nfo)
+        complex*16,intent(in) :: fltr_data(nfo, nfi, nd)
+        integer,intent(in) :: csc_indices(nnz), csc_indptr(dim_out+1)
+        integer,intent(in) :: pool_indices(pool_nnz), pool_indptr(dim_pool+1)
+        complex*16,intent(inout) :: y(num_batch, nfo, dim_pool)
+        integer,intent(out) :: argmax(num_batch, nfo, dim_pool)
+
+        complex*16 :: x_work(num_batch, nfi, max_nnz_row), z_work(num_batch, nfo), zi
+        real*8 :: key, best(num_batch, nfo)
+        integer :: start_, end_, col, pcol, jj, ii, ib, k, nnz_row, sgn
+        complex*16,parameter :: one=dcmplx(1D0,0D0)
+        !f2py intent(in) x, csc_indices, csc_indptr, fltr_data, bias, pool_indices, pool_indptr
+        !f2py intent(in) nfi, nfo, num_batch, max_nnz_row, nnz, dim_out, nd, dim_in, pool_nnz, dim_pool
+        !f2py complex*16 optional,intent(in,out),depend(num_batch,nfo,dim_pool) :: y(num_batch,nfo,dim_pool)
+        !f2py intent(out) argmax
+
+        do pcol=1,dim_pool
+            do jj=pool_indptr(pcol),pool_indptr(pcol+1)-1
+                col=pool_indices(jj)
+                start_=csc_indptr(col)
+                end_=csc_indptr(col+1)
+                nnz_row=end_-start_
+                k=nfi*nnz_row
+
+                !convolution output of this column.
+                do ii=1,nnz_row
+                    x_work(:,:,ii)=x(:,:,csc_indices(start_+ii-1))
+                enddo
+                do ii=1,nfo
+                    z_work(:,ii)=bias(ii)
+                enddo
+                call zgemm('N', 'T', num_batch, nfo, k, one, x_work, num_batch,&
+                    fltr_data, nfo, one, z_work, num_batch)
+
+                !relu and pooling.
+                do ii=1,nfo
+                    do ib=1,num_batch
+                        zi=z_work(ib,ii)
+                        sgn=1
+                        if(real(zi)<0) then
+                            zi=leak*zi
+                            sgn=-1
+                        endif
+                        select case (mode)
+                        case (0,2)
+                            key=real(zi)
+                        case (1,3)
+                            key=abs(zi)
+                        case default
+                            print*,'Error: Pooling mode not supported!'
+                            stop 1
+                        endselect
+                        if(mode>=2) key=-key
+                        !the first one is taken among equals.
+                        if(jj==pool_indptr(pcol) .or. key>best(ib,ii)) then
+                            best(ib,ii)=key
+                            y(ib,ii,pcol)=zi
+                            argmax(ib,ii,pcol)=sgn*col
+                        endif
+                    enddo
+                enddo
+            enddo
+        enddo
+    end subroutine conv_relu_pool_forward_z
+
+    subroutine conv_relu_pool_backward_z(dy, x, argmax, dx, dweight, dbias, num_batch, csc_indptr, csc_indices,&
+            fltr_data, pool_indptr, pool_indices, leak, nnz, dim_in, dim_out, pool_nnz, dim_pool, nfi, nfo, nd,&
+            do_xgrad, do_wgrad, do_bgrad, max_nnz_row)
+        implicit none
+        !f2py threadsafe
+        integer,intent(in) :: num_batch, nnz, dim_in, dim_out, pool_nnz, dim_pool, nfi, nfo, nd, max_nnz_row
+        logical,intent(in) :: do_xgrad, do_wgrad, do_bgrad
+        real*8,intent(in) :: leak
+        complex*16,intent(in) :: x(num_batch, nfi, dim_in), dy(num_batch, nfo, dim_pool), fltr_data(nfo, nfi, nd)
+        integer,intent(in) :: argmax(num_batch, nfo, dim_pool)
+        integer,intent(in) :: csc_indices(nnz), csc_indptr(dim_out+1)
+        integer,intent(in) :: pool_indices(pool_nnz), pool_indptr(dim_pool+1)
+        complex*16,intent(inout) :: dweight(nfo, nfi, nd), dbias(nfo), dx(num_batch, nfi, dim_in)
+
+        complex*16 :: x_work(num_batch, nfi, max_nnz_row), dz(num_batch, nfo)
+        integer :: start_, end_, col, pcol, jj, ii, ib, k, nnz_row, row
+        complex*16,parameter :: one=dcmplx(1D0,0D0)
+        complex*16,parameter :: zero=dcmplx(0D0,0D0)
+
+        !f2py intent(in) x, dy, argmax, csc_indices, csc_indptr, fltr_data, pool_indices, pool_indptr
+        !f2py intent(in) do_xgrad, do_wgrad, do_bgrad
+        !f2py intent(in) nfi, nfo, num_batch, nd, max_nnz_row, dim_in, dim_out, nnz, pool_nnz, dim_pool
+        !f2py complex*16 optional,intent(in,out),depend(num_batch,nfi,dim_in) :: dx(num_batch,nfi,dim_in)
+        !f2py complex*16 optional,intent(in,out),depend(nfo,nfi,nd) :: dweight(nfo,nfi,nd)
+        !f2py complex*16 optional,intent(in,out),depend(nfo) :: dbias(nfo)
+
+        if(do_xgrad) dx=zero
+        if(do_wgrad) dweight=zero
+        if(do_bgrad) dbias=zero
+        do pcol=1,dim_pool
+            do jj=pool_indptr(pcol),pool_indptr(pcol+1)-1
+                col=pool_indices(jj)
+                start_=csc_indptr(col)
+                end_=csc_indptr(col+1)
+                nnz_row=end_-start_
+                k=nfi*nnz_row
+
+                !gradient on convolution output of this column.
+                do ii=1,nfo
+                    do ib=1,num_batch
+                        if(argmax(ib,ii,pcol)==col) then
+                            dz(ib,ii)=dy(ib,ii,pcol)
+                        else if(argmax(ib,ii,pcol)==-col) then
+                            dz(ib,ii)=leak*dy(ib,ii,pcol)
+                        else
+                            dz(ib,ii)=zero
+                        endif
+                    enddo
+                enddo
+
+                if(do_wgrad) then
+                    do ii=1,nnz_row
+                        x_work(:,:,ii)=x(:,:,csc_indices(start_+ii-1))
+                    enddo
+                    call zgemm('T', 'N', nfo, k, num_batch, one,&
+                        dz, num_batch, x_work, num_batch, one, dweight, nfo)
+                endif
+                if(do_xgrad) then
+                    call zgemm('N', 'N', num_batch, k, nfo, one, dz, num_batch,&
+                        fltr_data, nfo, zero, x_work, num_batch)
+                    do ii=1,nnz_row
+                        row=csc_indices(start_+ii-1)
+                        dx(:,:,row)=dx(:,:,row)+x_work(:,:,ii)
+                    enddo
+                endif
+                if(do_bgrad) dbias=dbias+sum(dz,1)
+            enddo
+        enddo
+    end subroutine conv_relu_pool_backward_z
+    !linear followed by relu, computed in blocks of batch.
+    subroutine linear_relu_forward_c(x, y, weight, bias, leak, num_batch, nfi, nfo)
+        implicit none
+        !f2py threadsafe
+        integer,intent(in) :: num_batch, nfi, nfo
+        real*4,intent(in) :: leak
+        complex*8,intent(in) :: x(num_batch, nfi), weight(nfo, nfi), bias(nfo)
+        complex*8,intent(inout) :: y(num_batch, nfo)
+        complex*8,parameter :: one=cmplx(1.0,0.0)
+        integer,parameter :: block_size=64
+        integer :: i, j, i0, nb
+        !f2py complex*8 optional,intent(in,out),depend(num_batch,nfo) :: y(num_batch,nfo)
+
+        do i0=1,num_batch,block_size
+            nb=min(block_size,num_batch-i0+1)
+            do i=1,nfo
+                y(i0:i0+nb-1,i)=bias(i)
+            enddo
+            call cgemm('N', 'T', nb, nfo, nfi, one, x(i0,1), num_batch,&
+                weight, nfo, one, y(i0,1), num_batch)
+            do j=1,nfo
+                do i=i0,i0+nb-1
+                    if(real(y(i,j))<0) y(i,j)=leak*y(i,j)
+                enddo
+            enddo
+        enddo
+    end subroutine linear_relu_forward_c
+
+    !the slope of relu is infered from output y.
+    subroutine linear_relu_backward_c(dy, x, y, weight, leak, dx, dweight, dbias,&
+            nfi, nfo, num_batch, do_xgrad, do_wgrad, do_bgrad)
+        implicit none
+        !f2py threadsafe
+        integer,intent(in) :: num_batch, nfi, nfo
+        logical,intent(in) :: do_xgrad, do_wgrad, do_bgrad
+        real*4,intent(in) :: leak
+        complex*8,intent(in) :: x(num_batch, nfi), y(num_batch, nfo), dy(num_batch, nfo), weight(nfo, nfi)
+        complex*8,intent(inout) :: dweight(nfo, nfi), dbias(nfo), dx(num_batch, nfi)
+
+        complex*8,allocatable :: dz(:,:)
+        complex*8,parameter :: one=cmplx(1.0,0.0)
+        complex*8,parameter :: zero=cmplx(0.0,0.0)
+        integer :: i, j
+
+        !f2py complex*8 optional,intent(in,out),depend(num_batch,nfi) :: dx(num_batch,nfi)
+        !f2py complex*8 optional,intent(in,out),depend(nfo,nfi) :: dweight(nfo,nfi)
+        !f2py complex*8 optional,intent(in,out),depend(nfo) :: dbias(nfo)
+
+        allocate(dz(num_batch, nfo))
+        do j=1,nfo
+            do i=1,num_batch
+                if(real(y(i,j))<0 .or. (leak==0 .and. y(i,j)==zero)) then
+                    dz(i,j)=leak*dy(i,j)
+                else
+                    dz(i,j)=dy(i,j)
+                endif
+            enddo
+        enddo
+        if(do_wgrad) then
+            call cgemm('T', 'N', nfo, nfi, num_batch, one, dz, num_batch,&
+                x, num_batch, zero, dweight, nfo)
+        endif
+        if(do_xgrad) then
+            call cgemm('N', 'N', num_batch, nfi, nfo, one, dz, num_batch,&
+                weight, nfo, zero, dx, num_batch)
+        endif
+        if(do_bgrad) then
+            dbias=sum(dz,1)
+        endif
+        deallocate(dz)
+    end subroutine linear_relu_backward_c
+
+    !contiguous convolution followed by relu and pooling,
+    !convolution outputs are computed column by column and pooled at once.
+    !mode = 0: max real, 1: max abs, 2: min real, 3: min abs.
+    !argmax stores the selected column of convolution output,
+    !negative if relu takes the leak branch.
+    subroutine conv_relu_pool_forward_c(x, y, argmax, bias, num_batch, csc_indptr, csc_indices, fltr_data,&
+            pool_indptr, pool_indices, leak, mode, nnz, dim_in, dim_out, pool_nnz, dim_pool, nfi, nfo, nd, max_nnz_row)
+        implicit none
+        !f2py threadsafe
+        integer,intent(in) :: num_batch, nnz, dim_in, dim_out, pool_nnz, dim_pool, nfi, nfo, max_nnz_row, nd, mode
+        real*4,intent(in) :: leak
+        complex*8,intent(in) :: x(num_batch, nfi, dim_in), bias(nfo)
+        complex*8,intent(in) :: fltr_data(nfo, nfi, nd)
+        integer,intent(in) :: csc_indices(nnz), csc_indptr(dim_out+1)
+        integer,intent(in) :: pool_indices(pool_nnz), pool_indptr(dim_pool+1)
+        complex*8,intent(inout) :: y(num_batch, nfo, dim_pool)
+        integer,intent(out) :: argmax(num_batch, nfo, dim_pool)
+
+        complex*8 :: x_work(num_batch, nfi, max_nnz_row), z_work(num_batch, nfo), zi
+        real*4 :: key, best(num_batch, nfo)
+        integer :: start_, end_, col, pcol, jj, ii, ib, k, nnz_row, sgn
+        complex*8,parameter :: one=cmplx(1.0,0.0)
+        !f2py intent(in) x, csc_indices, csc_indptr, fltr_data, bias, pool_indices, pool_indptr
+        !f2py intent(in) nfi, nfo, num_batch, max_nnz_row, nnz, dim_out, nd, dim_in, pool_nnz, dim_pool
+        !f2py complex*8 optional,intent(in,out),depend(num_batch,nfo,dim_pool) :: y(num_batch,nfo,dim_pool)
+        !f2py intent(out) argmax
+
+        do pcol=1,dim_pool
+            do jj=pool_indptr(pcol),pool_indptr(pcol+1)-1
+                col=pool_indices(jj)
+                start_=csc_indptr(col)
+                end_=csc_indptr(col+1)
+                nnz_row=end_-start_
+                k=nfi*nnz_row
+
+                !convolution output of this column.
+                do ii=1,nnz_row
+                    x_work(:,:,ii)=x(:,:,csc_indices(start_+ii-1))
+                enddo
+                do ii=1,nfo
+                    z_work(:,ii)=bias(ii)
+                enddo
+                call cgemm('N', 'T', num_batch, nfo, k, one, x_work, num_batch,&
+                    fltr_data, nfo, one, z_work, num_batch)
+
+                !relu and pooling.
+                do ii=1,nfo
+                    do ib=1,num_batch
+                        zi=z_work(ib,ii)
+                        sgn=1
+                        if(real(zi)<0) then
+                            zi=leak*zi
+                            sgn=-1
+                        endif
+                        select case (mode)
+                        case (0,2)
+                            key=real(zi)
+                        case (1,3)
+                            key=abs(zi)
+                        case default
+                            print*,'Error: Pooling mode not supported!'
+                            stop 1
+                        endselect
+                        if(mode>=2) key=-key
+                        !the first one is taken among equals.
+                        if(jj==pool_indptr(pcol) .or. key>best(ib,ii)) then
+                            best(ib,ii)=key
+                            y(ib,ii,pcol)=zi
+                            argmax(ib,ii,pcol)=sgn*col
+                        endif
+                    enddo
+                enddo
+            enddo
+        enddo
+    end subroutine conv_relu_pool_forward_c
+
+    subroutine conv_relu_pool_backward_c(dy, x, argmax, dx, dweight, dbias, num_batch, csc_indptr, csc_indices,&
+            fltr_data, pool_indptr, pool_indices, leak, nnz, dim_in, dim_out, pool_nnz, dim_pool, nfi, nfo, nd,&
+            do_xgrad, do_wgrad, do_bgrad, max_nnz_row)
+        implicit none
+        !f2py threadsafe
+        integer,intent(in) :: num_batch, nnz, dim_in, dim_out, pool_nnz, dim_pool, nfi, nfo, nd, max_nnz_row
+        logical,intent(in) :: do_xgrad, do_wgrad, do_bgrad
+        real*4,intent(in) :: leak
+        complex*8,intent(in) :: x(num_batch, nfi, dim_in), dy(num_batch, nfo, dim_pool), fltr_data(nfo, nfi, nd)
+        integer,intent(in) :: argmax(num_batch, nfo, dim_pool)
+        integer,intent(in) :: csc_indices(nnz), csc_indptr(dim_out+1)
+        integer,intent(in) :: pool_indices(pool_nnz), pool_indptr(dim_pool+1)
+        complex*8,intent(inout) :: dweight(nfo, nfi, nd), dbias(nfo), dx(num_batch, nfi, dim_in)
+
+        complex*8 :: x_work(num_batch, nfi, max_nnz_row), dz(num_batch, nfo)
+        integer :: start_, end_, col, pcol, jj, ii, ib, k, nnz_row, row
+        complex*8,parameter :: one=cmplx(1.0,0.0)
+        complex*8,parameter :: zero=cmplx(0.0,0.0)
+
+        !f2py intent(in) x, dy, argmax, csc_indices, csc_indptr, fltr_data, pool_indices, pool_indptr
+        !f2py intent(in) do_xgrad, do_wgrad, do_bgrad
+        !f2py intent(in) nfi, nfo, num_batch, nd, max_nnz_row, dim_in, dim_out, nnz, pool_nnz, dim_pool
+        !f2py complex*8 optional,intent(in,out),depend(num_batch,nfi,dim_in) :: dx(num_batch,nfi,dim_in)
+        !f2py complex*8 optional,intent(in,out),depend(nfo,nfi,nd) :: dweight(nfo,nfi,nd)
+        !f2py complex*8 optional,intent(in,out),depend(nfo) :: dbias(nfo)
+
+        if(do_xgrad) dx=zero
+        if(do_wgrad) dweight=zero
+        if(do_bgrad) dbias=zero
+        do pcol=1,dim_pool
+            do jj=pool_indptr(pcol),pool_indptr(pcol+1)-1
+                col=pool_indices(jj)
+                start_=csc_indptr(col)
+                end_=csc_indptr(col+1)
+                nnz_row=end_-start_
+                k=nfi*nnz_row
+
+                !gradient on convolution output of this column.
+                do ii=1,nfo
+                    do ib=1,num_batch
+                        if(argmax(ib,ii,pcol)==col) then
+                            dz(ib,ii)=dy(ib,ii,pcol)
+                        else if(argmax(ib,ii,pcol)==-col) then
+                            dz(ib,ii)=leak*dy(ib,ii,pcol)
+                        else
+                            dz(ib,ii)=zero
+                        endif
+                    enddo
+                enddo
+
+                if(do_wgrad) then
+                    do ii=1,nnz_row
+                        x_work(:,:,ii)=x(:,:,csc_indices(start_+ii-1))
+                    enddo
+                    call cgemm('T', 'N', nfo, k, num_batch, one,&
+                        dz, num_batch, x_work, num_batch, one, dweight, nfo)
+                endif
+                if(do_xgrad) then
+                    call cgemm('N', 'N', num_batch, k, nfo, one, dz, num_batch,&
+                        fltr_data, nfo, zero, x_work, num_batch)
+                    do ii=1,nnz_row
+                        row=csc_indices(start_+ii-1)
+                        dx(:,:,row)=dx(:,:,row)+x_work(:,:,ii)
+                    enddo
+                endif
+                if(do_bgrad) dbias=dbias+sum(dz,1)
+            enddo
+        enddo
+    end subroutine conv_relu_pool_backward_c
+    !linear followed by relu, computed in blocks of batch.
+    subroutine linear_relu_forward_d(x, y, weight, bias, leak, num_batch, nfi, nfo)
+        implicit none
+        !f2py threadsafe
+        integer,intent(in) :: num_batch, nfi, nfo
+        real*8,intent(in) :: leak
+        real*8,intent(in) :: x(num_batch, nfi), weight(nfo, nfi), bias(nfo)
+        real*8,intent(inout) :: y(num_batch, nfo)
+        real*8,parameter :: one=1D0
+        integer,parameter :: block_size=64
+        integer :: i, j, i0, nb
+        !f2py real*8 optional,intent(in,out),depend(num_batch,nfo) :: y(num_batch,nfo)
+
+        do i0=1,num_batch,block_size
+            nb=min(block_size,num_batch-i0+1)
+            do i=1,nfo
+                y(i0:i0+nb-1,i)=bias(i)
+            enddo
+            call dgemm('N', 'T', nb, nfo, nfi, one, x(i0,1), num_batch,&
+                weight, nfo, one, y(i0,1), num_batch)
+            do j=1,nfo
+                do i=i0,i0+nb-1
+                    if((y(i,j))<0) y(i,j)=leak*y(i,j)
+                enddo
+            enddo
+        enddo
+    end subroutine linear_relu_forward_d
+
+    !the slope of relu is infered from output y.
+    subroutine linear_relu_backward_d(dy, x, y, weight, leak, dx, dweight, dbias,&
+            nfi, nfo, num_batch, do_xgrad, do_wgrad, do_bgrad)
+        implicit none
+        !f2py threadsafe
+        integer,intent(in) :: num_batch, nfi, nfo
+        logical,intent(in) :: do_xgrad, do_wgrad, do_bgrad
+        real*8,intent(in) :: leak
+        real*8,intent(in) :: x(num_batch, nfi), y(num_batch, nfo), dy(num_batch, nfo), weight(nfo, nfi)
+        real*8,intent(inout) :: dweight(nfo, nfi), dbias(nfo), dx(num_batch, nfi)
+
+        real*8,allocatable :: dz(:,:)
+        real*8,parameter :: one=1D0
+        real*8,parameter :: zero=0D0
+        integer :: i, j
+
+        !f2py real*8 optional,intent(in,out),depend(num_batch,nfi) :: dx(num_batch,nfi)
+        !f2py real*8 optional,intent(in,out),depend(nfo,nfi) :: dweight(nfo,nfi)
+        !f2py real*8 optional,intent(in,out),depend(nfo) :: dbias(nfo)
+
+        allocate(dz(num_batch, nfo))
+        do j=1,nfo
+            do i=1,num_batch
+                if((y(i,j))<0 .or. (leak==0 .and. y(i,j)==zero)) then
+                    dz(i,j)=leak*dy(i,j)
+                else
+                    dz(i,j)=dy(i,j)
+                endif
+            enddo
+        enddo
+        if(do_wgrad) then
+            call dgemm('T', 'N', nfo, nfi, num_batch, one, dz, num_batch,&
+                x, num_batch, zero, dweight, nfo)
+        endif
+        if(do_xgrad) then
+            call dgemm('N', 'N', num_batch, nfi, nfo, one, dz, num_batch,&
+                weight, nfo, zero, dx, num_batch)
+        endif
+        if(do_bgrad) then
+            dbias=sum(dz,1)
+        endif
+        deallocate(dz)
+    end subroutine linear_relu_backward_d
+
+    !contiguous convolution followed by relu and pooling,
+    !convolution outputs are computed column by column and pooled at once.
+    !mode = 0: max real, 1: max abs, 2: min real, 3: min abs.
+    !argmax stores the selected column of convolution output,
+    !negative if relu takes the leak branch.
+    subroutine conv_relu_pool_forward_d(x, y, argmax, bias, num_batch, csc_indptr, csc_indices, fltr_data,&
+            pool_indptr, pool_indices, leak, mode, nnz, dim_in, dim_out, pool_nnz, dim_pool, nfi, nfo, nd, max_nnz_row)
+        implicit none
+        !f2py threadsafe
+        integer,intent(in) :: num_batch, nnz, dim_in, dim_out, pool_nnz, dim_pool, nfi, nfo, max_nnz_row, nd, mode
+        real*8,intent(in) :: leak
+        real*8,intent(in) :: x(num_batch, nfi, dim_in), bias(nfo)
+        real*8,intent(in) :: fltr_data(nfo, nfi, nd)
+        integer,intent(in) :: csc_indices(nnz), csc_indptr(dim_out+1)
+        integer,intent(in) :: pool_indices(pool_nnz), pool_indptr(dim_pool+1)
+        real*8,intent(inout) :: y(num_batch, nfo, dim_pool)
+        integer,intent(out) :: argmax(num_batch, nfo, dim_pool)
+
+        real*8 :: x_work(num_batch, nfi, max_nnz_row), z_work(num_batch, nfo), zi
+        real*8 :: key, best(num_batch, nfo)
+        integer :: start_, end_, col, pcol, jj, ii, ib, k, nnz_row, sgn
+        real*8,parameter :: one=1D0
+        !f2py intent(in) x, csc_indices, csc_indptr, fltr_data, bias, pool_indices, pool_indptr
+        !f2py intent(in) nfi, nfo, num_batch, max_nnz_row, nnz, dim_out, nd, dim_in, pool_nnz, dim_pool
+        !f2py real*8 optional,intent(in,out),depend(num_batch,nfo,dim_pool) :: y(num_batch,nfo,dim_pool)
+        !f2py intent(out) argmax
+
+        do pcol=1,dim_pool
+            do jj=pool_indptr(pcol),pool_indptr(pcol+1)-1
+                col=pool_indices(jj)
+                start_=csc_indptr(col)
+                end_=csc_indptr(col+1)
+                nnz_row=end_-start_
+                k=nfi*nnz_row
+
+                !convolution output of this column.
+                do ii=1,nnz_row
+                    x_work(:,:,ii)=x(:,:,csc_indices(start_+ii-1))
+                enddo
+                do ii=1,nfo
+                    z_work(:,ii)=bias(ii)
+                enddo
+                call dgemm('N', 'T', num_batch, nfo, k, one, x_work, num_batch,&
+                    fltr_data, nfo, one, z_work, num_batch)
+
+                !relu and pooling.
+                do ii=1,nfo
+                    do ib=1,num_batch
+                        zi=z_work(ib,ii)
+                        sgn=1
+                        if((zi)<0) then
+                            zi=leak*zi
+                            sgn=-1
+                        endif
+                        select case (mode)
+                        case (0,2)
+                            key=(zi)
+                        case (1,3)
+                            key=abs(zi)
+                        case default
+                            print*,'Error: Pooling mode not supported!'
+                            stop 1
+                        endselect
+                        if(mode>=2) key=-key
+                        !the first one is taken among equals.
+                        if(jj==pool_indptr(pcol) .or. key>best(ib,ii)) then
+                            best(ib,ii)=key
+                            y(ib,ii,pcol)=zi
+                            argmax(ib,ii,pcol)=sgn*col
+                        endif
+                    enddo
+                enddo
+            enddo
+        enddo
+    end subroutine conv_relu_pool_forward_d
+
+    subroutine conv_relu_pool_backward_d(dy, x, argmax, dx, dweight, dbias, num_batch, csc_indptr, csc_indices,&
+            fltr_data, pool_indptr, pool_indices, leak, nnz, dim_in, dim_out, pool_nnz, dim_pool, nfi, nfo, nd,&
+            do_xgrad, do_wgrad, do_bgrad, max_nnz_row)
+        implicit none
+        !f2py threadsafe
+        integer,intent(in) :: num_batch, nnz, dim_in, dim_out, pool_nnz, dim_pool, nfi, nfo, nd, max_nnz_row
+        logical,intent(in) :: do_xgrad, do_wgrad, do_bgrad
+        real*8,intent(in) :: leak
+        real*8,intent(in) :: x(num_batch, nfi, dim_in), dy(num_batch, nfo, dim_pool), fltr_data(nfo, nfi, nd)
+        integer,intent(in) :: argmax(num_batch, nfo, dim_pool)
+        integer,intent(in) :: csc_indices(nnz), csc_indptr(dim_out+1)
+        integer,intent(in) :: pool_indices(pool_nnz), pool_indptr(dim_pool+1)
+        real*8,intent(inout) :: dweight(nfo, nfi, nd), dbias(nfo), dx(num_batch, nfi, dim_in)
+
+        real*8 :: x_work(num_batch, nfi, max_nnz_row), dz(num_batch, nfo)
+        integer :: start_, end_, col, pcol, jj, ii, ib, k, nnz_row, row
+        real*8,parameter :: one=1D0
+        real*8,parameter :: zero=0D0
+
+        !f2py intent(in) x, dy, argmax, csc_indices, csc_indptr, fltr_data, pool_indices, pool_indptr
+        !f2py intent(in) do_xgrad, do_wgrad, do_bgrad
+        !f2py intent(in) nfi, nfo, num_batch, nd, max_nnz_row, dim_in, dim_out, nnz, pool_nnz, dim_pool
+        !f2py real*8 optional,intent(in,out),depend(num_batch,nfi,dim_in) :: dx(num_batch,nfi,dim_in)
+        !f2py real*8 optional,intent(in,out),depend(nfo,nfi,nd) :: dweight(nfo,nfi,nd)
+        !f2py real*8 optional,intent(in,out),depend(nfo) :: dbias(nfo)
+
+        if(do_xgrad) dx=zero
+        if(do_wgrad) dweight=zero
+        if(do_bgrad) dbias=zero
+        do pcol=1,dim_pool
+            do jj=pool_indptr(pcol),pool_indptr(pcol+1)-1
+                col=pool_indices(jj)
+                start_=csc_indptr(col)
+                end_=csc_indptr(col+1)
+                nnz_row=end_-start_
+                k=nfi*nnz_row
+
+                !gradient on convolution output of this column.
+                do ii=1,nfo
+                    do ib=1,num_batch
+                        if(argmax(ib,ii,pcol)==col) then
+                            dz(ib,ii)=dy(ib,ii,pcol)
+                        else if(argmax(ib,ii,pcol)==-col) then
+                            dz(ib,ii)=leak*dy(ib,ii,pcol)
+                        else
+                            dz(ib,ii)=zero
+                        endif
+                    enddo
+                enddo
+
+                if(do_wgrad) then
+                    do ii=1,nnz_row
+                        x_work(:,:,ii)=x(:,:,csc_indices(start_+ii-1))
+                    enddo
+                    call dgemm('T', 'N', nfo, k, num_batch, one,&
+                        dz, num_batch, x_work, num_batch, one, dweight, nfo)
+                endif
+                if(do_xgrad) then
+                    call dgemm('N', 'N', num_batch, k, nfo, one, dz, num_batch,&
+                        fltr_data, nfo, zero, x_work, num_batch)
+                    do ii=1,nnz_row
+                        row=csc_indices(start_+ii-1)
+                        dx(:,:,row)=dx(:,:,row)+x_work(:,:,ii)
+                    enddo
+                endif
+                if(do_bgrad) dbias=dbias+sum(dz,1)
+            enddo
+        enddo
+    end subroutine conv_relu_pool_backward_d
+    !linear followed by relu, computed in blocks of batch.
+    subroutine linear_relu_forward_s(x, y, weight, bias, leak, num_batch, nfi, nfo)
+        implicit none
+        !f2py threadsafe
+        integer,intent(in) :: num_batch, nfi, nfo
+        real*4,intent(in) :: leak
+        real*4,intent(in) :: x(num_batch, nfi), weight(nfo, nfi), bias(nfo)
+        real*4,intent(inout) :: y(num_batch, nfo)
+        real*4,parameter :: one=1.0
+        integer,parameter :: block_size=64
+        integer :: i, j, i0, nb
+        !f2py real*4 optional,intent(in,out),depend(num_batch,nfo) :: y(num_batch,nfo)
+
+        do i0=1,num_batch,block_size
+            nb=min(block_size,num_batch-i0+1)
+            do i=1,nfo
+                y(i0:i0+nb-1,i)=bias(i)
+            enddo
+            call sgemm('N', 'T', nb, nfo, nfi, one, x(i0,1), num_batch,&
+                weight, nfo, one, y(i0,1), num_batch)
+            do j=1,nfo
+                do i=i0,i0+nb-1
+                    if((y(i,j))<0) y(i,j)=leak*y(i,j)
+                enddo
+            enddo
+        enddo
+    end subroutine linear_relu_forward_s
+
+    !the slope of relu is infered from output y.
+    subroutine linear_relu_backward_s(dy, x, y, weight, leak, dx, dweight, dbias,&
+            nfi, nfo, num_batch, do_xgrad, do_wgrad, do_bgrad)
+        implicit none
+        !f2py threadsafe
+        integer,intent(in) :: num_batch, nfi, nfo
+        logical,intent(in) :: do_xgrad, do_wgrad, do_bgrad
+        real*4,intent(in) :: leak
+        real*4,intent(in) :: x(num_batch, nfi), y(num_batch, nfo), dy(num_batch, nfo), weight(nfo, nfi)
+        real*4,intent(inout) :: dweight(nfo, nfi), dbias(nfo), dx(num_batch, nfi)
+
+        real*4,allocatable :: dz(:,:)
+        real*4,parameter :: one=1.0
+        real*4,parameter :: zero=0.0
+        integer :: i, j
+
+        !f2py real*4 optional,intent(in,out),depend(num_batch,nfi) :: dx(num_batch,nfi)
+        !f2py real*4 optional,intent(in,out),depend(nfo,nfi) :: dweight(nfo,nfi)
+        !f2py real*4 optional,intent(in,out),depend(nfo) :: dbias(nfo)
+
+        allocate(dz(num_batch, nfo))
+        do j=1,nfo
+            do i=1,num_batch
+                if((y(i,j))<0 .or. (leak==0 .and. y(i,j)==zero)) then
+                    dz(i,j)=leak*dy(i,j)
+                else
+                    dz(i,j)=dy(i,j)
+                endif
+            enddo
+        enddo
+        if(do_wgrad) then
+            call sgemm('T', 'N', nfo, nfi, num_batch, one, dz, num_batch,&
+                x, num_batch, zero, dweight, nfo)
+        endif
+        if(do_xgrad) then
+            call sgemm('N', 'N', num_batch, nfi, nfo, one, dz, num_batch,&
+                weight, nfo, zero, dx, num_batch)
+        endif
+        if(do_bgrad) then
+            dbias=sum(dz,1)
+        endif
+        deallocate(dz)
+    end subroutine linear_relu_backward_s
+
+    !contiguous convolution followed by relu and pooling,
+    !convolution outputs are computed column by column and pooled at once.
+    !mode = 0: max real, 1: max abs, 2: min real, 3: min abs.
+    !argmax stores the selected column of convolution output,
+    !negative if relu takes the leak branch.
+    subroutine conv_relu_pool_forward_s(x, y, argmax, bias, num_batch, csc_indptr, csc_indices, fltr_data,&
+            pool_indptr, pool_indices, leak, mode, nnz, dim_in, dim_out, pool_nnz, dim_pool, nfi, nfo, nd, max_nnz_row)
+        implicit none
+        !f2py threadsafe
+        integer,intent(in) :: num_batch, nnz, dim_in, dim_out, pool_nnz, dim_pool, nfi, nfo, max_nnz_row, nd, mode
+        real*4,intent(in) :: leak
+        real*4,intent(in) :: x(num_batch, nfi, dim_in), bias(nfo)
+        real*4,intent(in) :: fltr_data(nfo, nfi, nd)
+        integer,intent(in) :: csc_indices(nnz), csc_indptr(dim_out+1)
+        integer,intent(in) :: pool_indices(pool_nnz), pool_indptr(dim_pool+1)
+        real*4,intent(inout) :: y(num_batch, nfo, dim_pool)
+        integer,intent(out) :: argmax(num_batch, nfo, dim_pool)
+
+        real*4 :: x_work(num_batch, nfi, max_nnz_row), z_work(num_batch, nfo), zi
+        real*4 :: key, best(num_batch, nfo)
+        integer :: start_, end_, col, pcol, jj, ii, ib, k, nnz_row, sgn
+        real*4,parameter :: one=1.0
+        !f2py intent(in) x, csc_indices, csc_indptr, fltr_data, bias, pool_indices, pool_indptr
+        !f2py intent(in) nfi, nfo, num_batch, max_nnz_row, nnz, dim_out, nd, dim_in, pool_nnz, dim_pool
+        !f2py real*4 optional,intent(in,out),depend(num_batch,nfo,dim_pool) :: y(num_batch,nfo,dim_pool)
+        !f2py intent(out) argmax
+
+        do pcol=1,dim_pool
+            do jj=pool_indptr(pcol),pool_indptr(pcol+1)-1
+                col=pool_indices(jj)
+                start_=csc_indptr(col)
+                end_=csc_indptr(col+1)
+                nnz_row=end_-start_
+                k=nfi*nnz_row
+
+                !convolution output of this column.
+                do ii=1,nnz_row
+                    x_work(:,:,ii)=x(:,:,csc_indices(start_+ii-1))
+                enddo
+                do ii=1,nfo
+                    z_work(:,ii)=bias(ii)
+                enddo
+                call sgemm('N', 'T', num_batch, nfo, k, one, x_work, num_batch,&
+                    fltr_data, nfo, one, z_work, num_batch)
+
+                !relu and pooling.
+                do ii=1,nfo
+                    do ib=1,num_batch
+                        zi=z_work(ib,ii)
+                        sgn=1
+                        if((zi)<0) then
+                            zi=leak*zi
+                            sgn=-1
+                        endif
+                        select case (mode)
+                        case (0,2)
+                            key=(zi)
+                        case (1,3)
+                            key=abs(zi)
+                        case default
+                            print*,'Error: Pooling mode not supported!'
+                            stop 1
+                        endselect
+                        if(mode>=2) key=-key
+                        !the first one is taken among equals.
+                        if(jj==pool_indptr(pcol) .or. key>best(ib,ii)) then
+                            best(ib,ii)=key
+                            y(ib,ii,pcol)=zi
+                            argmax(ib,ii,pcol)=sgn*col
+                        endif
+                    enddo
+                enddo
+            enddo
+        enddo
+    end subroutine conv_relu_pool_forward_s
+
+    subroutine conv_relu_pool_backward_s(dy, x, argmax, dx, dweight, dbias, num_batch, csc_indptr, csc_indices,&
+            fltr_data, pool_indptr, pool_indices, leak, nnz, dim_in, dim_out, pool_nnz, dim_pool, nfi, nfo, nd,&
+            do_xgrad, do_wgrad, do_bgrad, max_nnz_row)
+        implicit none
+        !f2py threadsafe
+        integer,intent(in) :: num_batch, nnz, dim_in, dim_out, pool_nnz, dim_pool, nfi, nfo, nd, max_nnz_row
+        logical,intent(in) :: do_xgrad, do_wgrad, do_bgrad
+        real*4,intent(in) :: leak
+        real*4,intent(in) :: x(num_batch, nfi, dim_in), dy(num_batch, nfo, dim_pool), fltr_data(nfo, nfi, nd)
+        integer,intent(in) :: argmax(num_batch, nfo, dim_pool)
+        integer,intent(in) :: csc_indices(nnz), csc_indptr(dim_out+1)
+        integer,intent(in) :: pool_indices(pool_nnz), pool_indptr(dim_pool+1)
+        real*4,intent(inout) :: dweight(nfo, nfi, nd), dbias(nfo), dx(num_batch, nfi, dim_in)
+
+        real*4 :: x_work(num_batch, nfi, max_nnz_row), dz(num_batch, nfo)
+        integer :: start_, end_, col, pcol, jj, ii, ib, k, nnz_row, row
+        real*4,parameter :: one=1.0
+        real*4,parameter :: zero=0.0
+
+        !f2py intent(in) x, dy, argmax, csc_indices, csc_indptr, fltr_data, pool_indices, pool_indptr
+        !f2py intent(in) do_xgrad, do_wgrad, do_bgrad
+        !f2py intent(in) nfi, nfo, num_batch, nd, max_nnz_row, dim_in, dim_out, nnz, pool_nnz, dim_pool
+        !f2py real*4 optional,intent(in,out),depend(num_batch,nfi,dim_in) :: dx(num_batch,nfi,dim_in)
+        !f2py real*4 optional,intent(in,out),depend(nfo,nfi,nd) :: dweight(nfo,nfi,nd)
+        !f2py real*4 optional,intent(in,out),depend(nfo) :: dbias(nfo)
+
+        if(do_xgrad) dx=zero
+        if(do_wgrad) dweight=zero
+        if(do_bgrad) dbias=zero
+        do pcol=1,dim_pool
+            do jj=pool_indptr(pcol),pool_indptr(pcol+1)-1
+                col=pool_indices(jj)
+                start_=csc_indptr(col)
+                end_=csc_indptr(col+1)
+                nnz_row=end_-start_
+                k=nfi*nnz_row
+
+                !gradient on convolution output of this column.
+                do ii=1,nfo
+                    do ib=1,num_batch
+                        if(argmax(ib,ii,pcol)==col) then
+                            dz(ib,ii)=dy(ib,ii,pcol)
+                        else if(argmax(ib,ii,pcol)==-col) then
+                            dz(ib,ii)=leak*dy(ib,ii,pcol)
+                        else
+                            dz(ib,ii)=zero
+                        endif
+                    enddo
+                enddo
+
+                if(do_wgrad) then
+                    do ii=1,nnz_row
+                        x_work(:,:,ii)=x(:,:,csc_indices(start_+ii-1))
+                    enddo
+                    call sgemm('T', 'N', nfo, k, num_batch, one,&
+                        dz, num_batch, x_work, num_batch, one, dweight, nfo)
+                endif
+                if(do_xgrad) then
+                    call sgemm('N', 'N', num_batch, k, nfo, one, dz, num_batch,&
+                        fltr_data, nfo, zero, x_work, num_batch)
+                    do ii=1,nnz_row
+                        row=csc_indices(start_+ii-1)
+                        dx(:,:,row)=dx(:,:,row)+x_work(:,:,ii)
+                    enddo
+                endif
+                if(do_bgrad) dbias=dbias+sum(dz,1)
+            enddo
+        enddo
+    end subroutine conv_relu_pool_backward_s
+    end module lib
\ No newline at end of file
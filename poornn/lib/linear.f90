@@ -2,47 +2,138 @@
 !orders: batch_dim, feature_dim_out/in
 module lib
     contains
-    subroutine forward_z(x, y, weight, bias, num_batch, nfi, nfo)
+    !complex matrix product c=alpha*op(a)*op(b)+beta*c, op is 'N' or 'T'.
+    !if gemm3m, it uses the 3M (Gauss) scheme, three real gemms on planar
+    !real and imaginary parts instead of four real multiplies per element,
+    !  re = ar*br - ai*bi, im = (ar+ai)*(br+bi) - ar*br - ai*bi.
+    !it saves 25% of flops, the error of the real part is the same as zgemm,
+    !the error of the imaginary part is bounded by (|ar|+|ai|)*(|br|+|bi|)
+    !instead of |a|*|b|, larger if it cancels out.
+    subroutine gemm_z(gemm3m, transa, transb, m, n, k, alpha, a, lda, b, ldb, beta, c, ldc)
         implicit none
+        logical,intent(in) :: gemm3m
+        character,intent(in) :: transa, transb
+        integer,intent(in) :: m, n, k, lda, ldb, ldc
+        complex*16,intent(in) :: alpha, beta, a(lda,*), b(ldb,*)
+        complex*16,intent(inout) :: c(ldc,*)
+
+        real*8,allocatable :: ar(:,:), ai(:,:), br(:,:), bi(:,:), t1(:,:), t2(:,:)
+        real*8 :: p1, p2
+        integer :: ma, na, mb, nb, i, j
+        real*8,parameter :: rone=1D0, rzero=0D0
+
+        if(.not. gemm3m) then
+            call zgemm(transa, transb, m, n, k, alpha, a, lda, b, ldb, beta, c, ldc)
+            return
+        endif
+        if(m==0 .or. n==0) return
+        if(transa=='N') then
+            ma=m
+            na=k
+        else
+            ma=k
+            na=m
+        endif
+        if(transb=='N') then
+            mb=k
+            nb=n
+        else
+            mb=n
+            nb=k
+        endif
+        allocate(ar(ma,na), ai(ma,na), br(mb,nb), bi(mb,nb), t1(m,n), t2(m,n))
+        do j=1,na
+            do i=1,ma
+                ar(i,j)=real(a(i,j))
+                ai(i,j)=aimag(a(i,j))
+            enddo
+        enddo
+        do j=1,nb
+            do i=1,mb
+                br(i,j)=real(b(i,j))
+                bi(i,j)=aimag(b(i,j))
+            enddo
+        enddo
+        call dgemm(transa, transb, m, n, k, rone, ar, max(ma,1), br, max(mb,1), rzero, t1, m)
+        call dgemm(transa, transb, m, n, k, rone, ai, max(ma,1), bi, max(mb,1), rzero, t2, m)
+
+        !t1 <- real part, t2 <- -(ar*br+ai*bi), the imaginary part is accumulated on t2.
+        do j=1,n
+            do i=1,m
+                p1=t1(i,j)
+                p2=t2(i,j)
+                t1(i,j)=p1-p2
+                t2(i,j)=-p1-p2
+            enddo
+        enddo
+        ar=ar+ai
+        br=br+bi
+        call dgemm(transa, transb, m, n, k, rone, ar, max(ma,1), br, max(mb,1), rone, t2, m)
+
+        do j=1,n
+            if(beta==0) then
+                do i=1,m
+                    c(i,j)=alpha*cmplx(t1(i,j), t2(i,j), kind=8)
+                enddo
+            else
+                do i=1,m
+                    c(i,j)=alpha*cmplx(t1(i,j), t2(i,j), kind=8)+beta*c(i,j)
+                enddo
+            endif
+        enddo
+        deallocate(ar, ai, br, bi, t1, t2)
+    end subroutine gemm_z
+
+    subroutine forward_z(x, y, weight, bias, num_batch, nfi, nfo, gemm3m)
+        implicit none
+        !f2py threadsafe
         integer,intent(in) :: num_batch, nfi, nfo
+        logical,intent(in) :: gemm3m
+        !f2py logical optional,intent(in) :: gemm3m=0
         complex*16,intent(in) :: x(num_batch, nfi), weight(nfo, nfi), bias(nfo)
         
-        complex*16,intent(out) :: y(num_batch, nfo)
+        complex*16,intent(inout) :: y(num_batch, nfo)
         complex*16,parameter :: one=dcmplx(1D0,0D0)
         integer :: i
+        !f2py complex*16 optional,intent(in,out),depend(num_batch,nfo) :: y(num_batch,nfo)
 
         do i=1,nfo
             y(:,i)=bias(i)
         enddo
 
-        call zgemm('N', 'T', num_batch, nfo, nfi, one, x, num_batch,&
+        call gemm_z(gemm3m, 'N', 'T', num_batch, nfo, nfi, one, x, num_batch,&
             weight, nfo, one, y, num_batch)
     end subroutine forward_z
 
     subroutine backward_z(dy,x, weight, dx, dweight,dbias,&
-            nfi,nfo, num_batch, do_xgrad, do_wgrad, do_bgrad)
+            nfi,nfo, num_batch, do_xgrad, do_wgrad, do_bgrad, gemm3m)
         implicit none
+        !f2py threadsafe
         integer,intent(in) :: num_batch,nfi,nfo
+        logical,intent(in) :: gemm3m
+        !f2py logical optional,intent(in) :: gemm3m=0
         logical,intent(in) :: do_xgrad, do_wgrad, do_bgrad
         complex*16,intent(in) :: x(num_batch, nfi), dy(num_batch, nfo), weight(nfo, nfi)
         
-        complex*16,intent(out) :: dweight(nfo, nfi), dbias(nfo), dx(num_batch, nfi)
+        complex*16,intent(inout) :: dweight(nfo, nfi), dbias(nfo), dx(num_batch, nfi)
 
         complex*16,parameter :: one=dcmplx(1D0,0D0)
         complex*16,parameter :: zero=dcmplx(0D0,0D0)
 
-        !f2py intent(out) dx, dweight, dbias
+        !f2py complex*16 optional,intent(in,out),depend(num_batch,nfi) :: dx(num_batch,nfi)
+        !f2py complex*16 optional,intent(in,out),depend(nfo,nfi) :: dweight(nfo,nfi)
+        !f2py complex*16 optional,intent(in,out),depend(nfo) :: dbias(nfo)
 
         if(do_wgrad) then
             !call zgemm('T', 'N', nfo, nfi, num_batch, one, dy, num_batch,&
             !    conjg(x), num_batch, zero, dweight, nfo)
-            call zgemm('T', 'N', nfo, nfi, num_batch, one, dy, num_batch,&
+            call gemm_z(gemm3m, 'T', 'N', nfo, nfi, num_batch, one, dy, num_batch,&
                 x, num_batch, zero, dweight, nfo)
         endif
         if(do_xgrad) then
             !call zgemm('N', 'N', num_batch, nfi, nfo, one, dy, num_batch,&
             !    conjg(weight), nfo, zero, dx, num_batch)
-            call zgemm('N', 'N', num_batch, nfi, nfo, one, dy, num_batch,&
+            call gemm_z(gemm3m, 'N', 'N', num_batch, nfi, nfo, one, dy, num_batch,&
                 weight, nfo, zero, dx, num_batch)
         endif
         if(do_bgrad) then
@@ -50,47 +141,138 @@ module lib
             dbias=sum(dy,1)
         endif
     end subroutine backward_z
-    subroutine forward_c(x, y, weight, bias, num_batch, nfi, nfo)
+    !complex matrix product c=alpha*op(a)*op(b)+beta*c, op is 'N' or 'T'.
+    !if gemm3m, it uses the 3M (Gauss) scheme, three real gemms on planar
+    !real and imaginary parts instead of four real multiplies per element,
+    !  re = ar*br - ai*bi, im = (ar+ai)*(br+bi) - ar*br - ai*bi.
+    !it saves 25% of flops, the error of the real part is the same as zgemm,
+    !the error of the imaginary part is bounded by (|ar|+|ai|)*(|br|+|bi|)
+    !instead of |a|*|b|, larger if it cancels out.
+    subroutine gemm_c(gemm3m, transa, transb, m, n, k, alpha, a, lda, b, ldb, beta, c, ldc)
+        implicit none
+        logical,intent(in) :: gemm3m
+        character,intent(in) :: transa, transb
+        integer,intent(in) :: m, n, k, lda, ldb, ldc
+        complex*8,intent(in) :: alpha, beta, a(lda,*), b(ldb,*)
+        complex*8,intent(inout) :: c(ldc,*)
+
+        real*4,allocatable :: ar(:,:), ai(:,:), br(:,:), bi(:,:), t1(:,:), t2(:,:)
+        real*4 :: p1, p2
+        integer :: ma, na, mb, nb, i, j
+        real*4,parameter :: rone=1.0, rzero=0.0
+
+        if(.not. gemm3m) then
+            call cgemm(transa, transb, m, n, k, alpha, a, lda, b, ldb, beta, c, ldc)
+            return
+        endif
+        if(m==0 .or. n==0) return
+        if(transa=='N') then
+            ma=m
+            na=k
+        else
+            ma=k
+            na=m
+        endif
+        if(transb=='N') then
+            mb=k
+            nb=n
+        else
+            mb=n
+            nb=k
+        endif
+        allocate(ar(ma,na), ai(ma,na), br(mb,nb), bi(mb,nb), t1(m,n), t2(m,n))
+        do j=1,na
+            do i=1,ma
+                ar(i,j)=real(a(i,j))
+                ai(i,j)=aimag(a(i,j))
+            enddo
+        enddo
+        do j=1,nb
+            do i=1,mb
+                br(i,j)=real(b(i,j))
+                bi(i,j)=aimag(b(i,j))
+            enddo
+        enddo
+        call sgemm(transa, transb, m, n, k, rone, ar, max(ma,1), br, max(mb,1), rzero, t1, m)
+        call sgemm(transa, transb, m, n, k, rone, ai, max(ma,1), bi, max(mb,1), rzero, t2, m)
+
+        !t1 <- real part, t2 <- -(ar*br+ai*bi), the imaginary part is accumulated on t2.
+        do j=1,n
+            do i=1,m
+                p1=t1(i,j)
+                p2=t2(i,j)
+                t1(i,j)=p1-p2
+                t2(i,j)=-p1-p2
+            enddo
+        enddo
+        ar=ar+ai
+        br=br+bi
+        call sgemm(transa, transb, m, n, k, rone, ar, max(ma,1), br, max(mb,1), rone, t2, m)
+
+        do j=1,n
+            if(beta==0) then
+                do i=1,m
+                    c(i,j)=alpha*cmplx(t1(i,j), t2(i,j), kind=4)
+                enddo
+            else
+                do i=1,m
+                    c(i,j)=alpha*cmplx(t1(i,j), t2(i,j), kind=4)+beta*c(i,j)
+                enddo
+            endif
+        enddo
+        deallocate(ar, ai, br, bi, t1, t2)
+    end subroutine gemm_c
+
+    subroutine forward_c(x, y, weight, bias, num_batch, nfi, nfo, gemm3m)
         implicit none
+        !f2py threadsafe
         integer,intent(in) :: num_batch, nfi, nfo
+        logical,intent(in) :: gemm3m
+        !f2py logical optional,intent(in) :: gemm3m=0
         complex*8,intent(in) :: x(num_batch, nfi), weight(nfo, nfi), bias(nfo)
         
-        complex*8,intent(out) :: y(num_batch, nfo)
+        complex*8,intent(inout) :: y(num_batch, nfo)
         complex*8,parameter :: one=cmplx(1.0,0.0)
         integer :: i
+        !f2py complex*8 optional,intent(in,out),depend(num_batch,nfo) :: y(num_batch,nfo)
 
         do i=1,nfo
             y(:,i)=bias(i)
         enddo
 
-        call cgemm('N', 'T', num_batch, nfo, nfi, one, x, num_batch,&
+        call gemm_c(gemm3m, 'N', 'T', num_batch, nfo, nfi, one, x, num_batch,&
             weight, nfo, one, y, num_batch)
     end subroutine forward_c
 
     subroutine backward_c(dy,x, weight, dx, dweight,dbias,&
-            nfi,nfo, num_batch, do_xgrad, do_wgrad, do_bgrad)
+            nfi,nfo, num_batch, do_xgrad, do_wgrad, do_bgrad, gemm3m)
         implicit none
+        !f2py threadsafe
         integer,intent(in) :: num_batch,nfi,nfo
+        logical,intent(in) :: gemm3m
+        !f2py logical optional,intent(in) :: gemm3m=0
         logical,intent(in) :: do_xgrad, do_wgrad, do_bgrad
         complex*8,intent(in) :: x(num_batch, nfi), dy(num_batch, nfo), weight(nfo, nfi)
         
-        complex*8,intent(out) :: dweight(nfo, nfi), dbias(nfo), dx(num_batch, nfi)
+        complex*8,intent(inout) :: dweight(nfo, nfi), dbias(nfo), dx(num_batch, nfi)
 
         complex*8,parameter :: one=cmplx(1.0,0.0)
         complex*8,parameter :: zero=cmplx(0.0,0.0)
 
-        !f2py intent(out) dx, dweight, dbias
+        !f2py complex*8 optional,intent(in,out),depend(num_batch,nfi) :: dx(num_batch,nfi)
+        !f2py complex*8 optional,intent(in,out),depend(nfo,nfi) :: dweight(nfo,nfi)
+        !f2py complex*8 optional,intent(in,out),depend(nfo) :: dbias(nfo)
 
         if(do_wgrad) then
             !call cgemm('T', 'N', nfo, nfi, num_batch, one, dy, num_batch,&
             !    conjg(x), num_batch, zero, dweight, nfo)
-            call cgemm('T', 'N', nfo, nfi, num_batch, one, dy, num_batch,&
+            call gemm_c(gemm3m, 'T', 'N', nfo, nfi, num_batch, one, dy, num_batch,&
                 x, num_batch, zero, dweight, nfo)
         endif
         if(do_xgrad) then
             !call cgemm('N', 'N', num_batch, nfi, nfo, one, dy, num_batch,&
             !    conjg(weight), nfo, zero, dx, num_batch)
-            call cgemm('N', 'N', num_batch, nfi, nfo, one, dy, num_batch,&
+            call gemm_c(gemm3m, 'N', 'N', num_batch, nfi, nfo, one, dy, num_batch,&
                 weight, nfo, zero, dx, num_batch)
         endif
         if(do_bgrad) then
@@ -100,12 +282,15 @@ module lib
     end subroutine backward_c
     subroutine forward_d(x, y, weight, bias, num_batch, nfi, nfo)
         implicit none
+        !f2py threadsafe
         integer,intent(in) :: num_batch, nfi, nfo
+        
         real*8,intent(in) :: x(num_batch, nfi), weight(nfo, nfi), bias(nfo)
         
-        real*8,intent(out) :: y(num_batch, nfo)
+        real*8,intent(inout) :: y(num_batch, nfo)
         real*8,parameter :: one=1D0
         integer :: i
+        !f2py real*8 optional,intent(in,out),depend(num_batch,nfo) :: y(num_batch,nfo)
 
         do i=1,nfo
             y(:,i)=bias(i)
@@ -118,16 +303,20 @@ module lib
     subroutine backward_d(dy,x, weight, dx, dweight,dbias,&
             nfi,nfo, num_batch, do_xgrad, do_wgrad, do_bgrad)
         implicit none
+        !f2py threadsafe
         integer,intent(in) :: num_batch,nfi,nfo
+        
         logical,intent(in) :: do_xgrad, do_wgrad, do_bgrad
         real*8,intent(in) :: x(num_batch, nfi), dy(num_batch, nfo), weight(nfo, nfi)
         
-        real*8,intent(out) :: dweight(nfo, nfi), dbias(nfo), dx(num_batch, nfi)
+        real*8,intent(inout) :: dweight(nfo, nfi), dbias(nfo), dx(num_batch, nfi)
 
         real*8,parameter :: one=1D0
         real*8,parameter :: zero=0D0
 
-        !f2py intent(out) dx, dweight, dbias
+        !f2py real*8 optional,intent(in,out),depend(num_batch,nfi) :: dx(num_batch,nfi)
+        !f2py real*8 optional,intent(in,out),depend(nfo,nfi) :: dweight(nfo,nfi)
+        !f2py real*8 optional,intent(in,out),depend(nfo) :: dbias(nfo)
 
         if(do_wgrad) then
             !call dgemm('T', 'N', nfo, nfi, num_batch, one, dy, num_batch,&
@@ -148,12 +337,15 @@ module lib
     end subroutine backward_d
     subroutine forward_s(x, y, weight, bias, num_batch, nfi, nfo)
         implicit none
+        !f2py threadsafe
         integer,intent(in) :: num_batch, nfi, nfo
+        
         real*4,intent(in) :: x(num_batch, nfi), weight(nfo, nfi), bias(nfo)
         
-        real*4,intent(out) :: y(num_batch, nfo)
+        real*4,intent(inout) :: y(num_batch, nfo)
         real*4,parameter :: one=1.0
         integer :: i
+        !f2py real*4 optional,intent(in,out),depend(num_batch,nfo) :: y(num_batch,nfo)
 
         do i=1,nfo
             y(:,i)=bias(i)
@@ -166,16 +358,20 @@ module lib
     subroutine backward_s(dy,x, weight, dx, dweight,dbias,&
             nfi,nfo, num_batch, do_xgrad, do_wgrad, do_bgrad)
         implicit none
+        !f2py threadsafe
         integer,intent(in) :: num_batch,nfi,nfo
+        
         logical,intent(in) :: do_xgrad, do_wgrad, do_bgrad
         real*4,intent(in) :: x(num_batch, nfi), dy(num_batch, nfo), weight(nfo, nfi)
         
-        real*4,intent(out) :: dweight(nfo, nfi), dbias(nfo), dx(num_batch, nfi)
+        real*4,intent(inout) :: dweight(nfo, nfi), dbias(nfo), dx(num_batch, nfi)
 
         real*4,parameter :: one=1.0
         real*4,parameter :: zero=0.0
 
-        !f2py intent(out) dx, dweight, dbias
+        !f2py real*4 optional,intent(in,out),depend(num_batch,nfi) :: dx(num_batch,nfi)
+        !f2py real*4 optional,intent(in,out),depend(nfo,nfi) :: dweight(nfo,nfi)
+        !f2py real*4 optional,intent(in,out),depend(nfo) :: dbias(nfo)
 
         if(do_wgrad) then
             !call sgemm('T', 'N', nfo, nfi, num_batch, one, dy, num_batch,&
@@ -1,469 +1,2298 @@
 !This is an f90 file automatically generated.
 !orders: conv_dim_out/in, feature_dim_out/in, batch_dim
 module lib
+    !$ use omp_lib
     contains
+    !pixels of a regular tiling (strides equal to kernel_shape, open boundary),
+    !the input column of window iw at output column col is starts(col)+offsets(iw).
+    subroutine tile_offsets(img_in_shape, kernel_shape, nd, offsets, nk, starts, dim_out)
+        implicit none
+        integer,intent(in) :: nd, nk, dim_out
+        integer,intent(in) :: img_in_shape(nd), kernel_shape(nd)
+        integer,intent(out) :: offsets(nk), starts(dim_out)
+
+        integer :: i, iw, col, r, stride(nd)
+
+        stride(1)=1
+        do i=2,nd
+            stride(i)=stride(i-1)*img_in_shape(i-1)
+        enddo
+        do iw=1,nk
+            r=iw-1
+            offsets(iw)=1
+            do i=1,nd
+                offsets(iw)=offsets(iw)+mod(r,kernel_shape(i))*stride(i)
+                r=r/kernel_shape(i)
+            enddo
+        enddo
+        do col=1,dim_out
+            r=col-1
+            starts(col)=0
+            do i=1,nd
+                starts(col)=starts(col)+mod(r,img_in_shape(i)/kernel_shape(i))*kernel_shape(i)*stride(i)
+                r=r/(img_in_shape(i)/kernel_shape(i))
+            enddo
+        enddo
+    end subroutine tile_offsets
+
     !mode = 0: max real.
     !mode = 1: max abs.
     !mode = 2: min real.
     !mode = 3: min abs.
     !mode = 4: mean pooling.
-    subroutine forward_z(x, y, csc_indptr, csc_indices, nnz, dim_in, dim_out, nfi, mode)
+    !pooling over a regular tiling, without index arrays,
+    !rows (batch and feature) of x are contiguous, and split among threads.
+    !forward_tiled_argmax also returns the selected columns of x in argmax.
+    subroutine forward_tiled_z(x, y, img_in_shape, kernel_shape, nfi, dim_in, dim_out, nd, mode)
         implicit none
-        integer,intent(in) :: nnz, dim_in, dim_out, nfi,mode
+        !f2py threadsafe
+        integer,intent(in) :: nfi, dim_in, dim_out, nd, mode
+        integer,intent(in) :: img_in_shape(nd), kernel_shape(nd)
         complex*16,intent(in) :: x(nfi, dim_in)
-        integer,intent(in),target :: csc_indices(nnz)
-        integer,intent(in) :: csc_indptr(dim_out+1)
-        complex*16,intent(out) :: y(nfi, dim_out)
+        complex*16,intent(inout) :: y(nfi, dim_out)
+        
 
-        integer,pointer :: rows(:)
-        integer :: start_, end_, col, ib, irow
-        !f2py intent(in) x, csc_indices, csc_indptr
-        !f2py intent(in) nfi, nnz, dim_out, dim_in
-        !f2py intent(out) y
+        integer :: col, iw, ib, j, jb, start_, i0, i1, nk
+        integer,allocatable :: offsets(:), starts(:)
+        real*8 :: key, best
+        integer,allocatable :: jbest(:)
+        real*8,allocatable :: best_rows(:)
+        !windows larger than this are scanned by columns, keeping x contiguous.
+        integer,parameter :: max_nk_inner=16
+        !f2py intent(in) x, img_in_shape, kernel_shape, dim_out
+        !f2py intent(in) nfi, dim_in, nd, mode
+        !f2py complex*16 optional,intent(in,out),depend(nfi,dim_out) :: y(nfi,dim_out)
+        
 
-        do col=1, dim_out
-            start_=csc_indptr(col)
-            end_=csc_indptr(col+1)
+        if(mode<0 .or. mode>4) then
+            print*,'Error: Pooling mode not exist!'
+            stop 1
+        endif
+        nk=product(kernel_shape)
+        allocate(offsets(nk), starts(dim_out))
+        call tile_offsets(img_in_shape, kernel_shape, nd, offsets, nk, starts, dim_out)
 
-            !prepair work space by taking rows in x.
+        !$omp parallel private(col, iw, ib, j, jb, start_, i0, i1, key, best, jbest, best_rows)
+        i0=1
+        i1=nfi
+        !$ i0=omp_get_thread_num()*nfi/omp_get_num_threads()+1
+        !$ i1=(omp_get_thread_num()+1)*nfi/omp_get_num_threads()
+        if(nk>max_nk_inner) allocate(jbest(i0:i1), best_rows(i0:i1))
+        do col=1,dim_out
+            start_=starts(col)
             select case (mode)
             case (0)
-                rows=>csc_indices(start_:end_-1)
-                do ib=1,nfi
-                    irow=maxloc(real(x(ib,rows)),1)
-                    y(ib,col)=x(ib,rows(irow))
-                enddo
-                case (1)
-                rows=>csc_indices(start_:end_-1)
-                do ib=1,nfi
-                    irow=maxloc(abs(x(ib,rows)),1)
-                    y(ib,col)=x(ib,rows(irow))
-                enddo
+                if(nk<=max_nk_inner) then
+                    do ib=i0,i1
+                        jb=start_+offsets(1)
+                        best=real(x(ib,jb))
+                        do iw=2,nk
+                            j=start_+offsets(iw)
+                            key=real(x(ib,j))
+                            if(key>best) then
+                                best=key
+                                jb=j
+                            endif
+                        enddo
+                        y(ib,col)=x(ib,jb)
+                    enddo
+                else
+                    jbest=start_+offsets(1)
+                    best_rows=real(x(i0:i1,start_+offsets(1)))
+                    do iw=2,nk
+                        j=start_+offsets(iw)
+                        do ib=i0,i1
+                            key=real(x(ib,j))
+                            if(key>best_rows(ib)) then
+                                best_rows(ib)=key
+                                jbest(ib)=j
+                            endif
+                        enddo
+                    enddo
+                    do ib=i0,i1
+                        jb=jbest(ib)
+                        y(ib,col)=x(ib,jb)
+                    enddo
+                endif
+            case (1)
+                if(nk<=max_nk_inner) then
+                    do ib=i0,i1
+                        jb=start_+offsets(1)
+                        best=abs(x(ib,jb))
+                        do iw=2,nk
+                            j=start_+offsets(iw)
+                            key=abs(x(ib,j))
+                            if(key>best) then
+                                best=key
+                                jb=j
+                            endif
+                        enddo
+                        y(ib,col)=x(ib,jb)
+                    enddo
+                else
+                    jbest=start_+offsets(1)
+                    best_rows=abs(x(i0:i1,start_+offsets(1)))
+                    do iw=2,nk
+                        j=start_+offsets(iw)
+                        do ib=i0,i1
+                            key=abs(x(ib,j))
+                            if(key>best_rows(ib)) then
+                                best_rows(ib)=key
+                                jbest(ib)=j
+                            endif
+                        enddo
+                    enddo
+                    do ib=i0,i1
+                        jb=jbest(ib)
+                        y(ib,col)=x(ib,jb)
+                    enddo
+                endif
             case (2)
-                rows=>csc_indices(start_:end_-1)
-                do ib=1,nfi
-                    irow=minloc(real(x(ib,rows)),1)
-                    y(ib,col)=x(ib,rows(irow))
-                enddo
-                case (3)
-                rows=>csc_indices(start_:end_-1)
-                do ib=1,nfi
-                    irow=minloc(abs(x(ib,rows)),1)
-                    y(ib,col)=x(ib,rows(irow))
+                if(nk<=max_nk_inner) then
+                    do ib=i0,i1
+                        jb=start_+offsets(1)
+                        best=real(x(ib,jb))
+                        do iw=2,nk
+                            j=start_+offsets(iw)
+                            key=real(x(ib,j))
+                            if(key<best) then
+                                best=key
+                                jb=j
+                            endif
+                        enddo
+                        y(ib,col)=x(ib,jb)
+                    enddo
+                else
+                    jbest=start_+offsets(1)
+                    best_rows=real(x(i0:i1,start_+offsets(1)))
+                    do iw=2,nk
+                        j=start_+offsets(iw)
+                        do ib=i0,i1
+                            key=real(x(ib,j))
+                            if(key<best_rows(ib)) then
+                                best_rows(ib)=key
+                                jbest(ib)=j
+                            endif
+                        enddo
+                    enddo
+                    do ib=i0,i1
+                        jb=jbest(ib)
+                        y(ib,col)=x(ib,jb)
+                    enddo
+                endif
+            case (3)
+                if(nk<=max_nk_inner) then
+                    do ib=i0,i1
+                        jb=start_+offsets(1)
+                        best=abs(x(ib,jb))
+                        do iw=2,nk
+                            j=start_+offsets(iw)
+                            key=abs(x(ib,j))
+                            if(key<best) then
+                                best=key
+                                jb=j
+                            endif
+                        enddo
+                        y(ib,col)=x(ib,jb)
+                    enddo
+                else
+                    jbest=start_+offsets(1)
+                    best_rows=abs(x(i0:i1,start_+offsets(1)))
+                    do iw=2,nk
+                        j=start_+offsets(iw)
+                        do ib=i0,i1
+                            key=abs(x(ib,j))
+                            if(key<best_rows(ib)) then
+                                best_rows(ib)=key
+                                jbest(ib)=j
+                            endif
+                        enddo
+                    enddo
+                    do ib=i0,i1
+                        jb=jbest(ib)
+                        y(ib,col)=x(ib,jb)
+                    enddo
+                endif
+            case (4)
+                y(i0:i1,col)=x(i0:i1,start_+offsets(1))
+                do iw=2,nk
+                    y(i0:i1,col)=y(i0:i1,col)+x(i0:i1,start_+offsets(iw))
                 enddo
+                y(i0:i1,col)=y(i0:i1,col)/nk
+            endselect
+        enddo
+        if(nk>max_nk_inner) deallocate(jbest, best_rows)
+        !$omp end parallel
+        deallocate(offsets, starts)
+    end subroutine forward_tiled_z
+
+    subroutine forward_tiled_argmax_z(x, y, argmax, img_in_shape, kernel_shape, nfi, dim_in, dim_out, nd, mode)
+        implicit none
+        !f2py threadsafe
+        integer,intent(in) :: nfi, dim_in, dim_out, nd, mode
+        integer,intent(in) :: img_in_shape(nd), kernel_shape(nd)
+        complex*16,intent(in) :: x(nfi, dim_in)
+        complex*16,intent(inout) :: y(nfi, dim_out)
+        integer,intent(out) :: argmax(nfi, dim_out)
+
+        integer :: col, iw, ib, j, jb, start_, i0, i1, nk
+        integer,allocatable :: offsets(:), starts(:)
+        real*8 :: key, best
+        integer,allocatable :: jbest(:)
+        real*8,allocatable :: best_rows(:)
+        !windows larger than this are scanned by columns, keeping x contiguous.
+        integer,parameter :: max_nk_inner=16
+        !f2py intent(in) x, img_in_shape, kernel_shape, dim_out
+        !f2py intent(in) nfi, dim_in, nd, mode
+        !f2py complex*16 optional,intent(in,out),depend(nfi,dim_out) :: y(nfi,dim_out)
+        !f2py intent(out) argmax
+
+        if(mode<0 .or. mode>4) then
+            print*,'Error: Pooling mode not exist!'
+            stop 1
+        endif
+        nk=product(kernel_shape)
+        allocate(offsets(nk), starts(dim_out))
+        call tile_offsets(img_in_shape, kernel_shape, nd, offsets, nk, starts, dim_out)
+
+        !$omp parallel private(col, iw, ib, j, jb, start_, i0, i1, key, best, jbest, best_rows)
+        i0=1
+        i1=nfi
+        !$ i0=omp_get_thread_num()*nfi/omp_get_num_threads()+1
+        !$ i1=(omp_get_thread_num()+1)*nfi/omp_get_num_threads()
+        if(nk>max_nk_inner) allocate(jbest(i0:i1), best_rows(i0:i1))
+        do col=1,dim_out
+            start_=starts(col)
+            select case (mode)
+            case (0)
+                if(nk<=max_nk_inner) then
+                    do ib=i0,i1
+                        jb=start_+offsets(1)
+                        best=real(x(ib,jb))
+                        do iw=2,nk
+                            j=start_+offsets(iw)
+                            key=real(x(ib,j))
+                            if(key>best) then
+                                best=key
+                                jb=j
+                            endif
+                        enddo
+                        y(ib,col)=x(ib,jb)
+                        argmax(ib,col)=jb
+                    enddo
+                else
+                    jbest=start_+offsets(1)
+                    best_rows=real(x(i0:i1,start_+offsets(1)))
+                    do iw=2,nk
+                        j=start_+offsets(iw)
+                        do ib=i0,i1
+                            key=real(x(ib,j))
+                            if(key>best_rows(ib)) then
+                                best_rows(ib)=key
+                                jbest(ib)=j
+                            endif
+                        enddo
+                    enddo
+                    do ib=i0,i1
+                        jb=jbest(ib)
+                        y(ib,col)=x(ib,jb)
+                        argmax(ib,col)=jb
+                    enddo
+                endif
+            case (1)
+                if(nk<=max_nk_inner) then
+                    do ib=i0,i1
+                        jb=start_+offsets(1)
+                        best=abs(x(ib,jb))
+                        do iw=2,nk
+                            j=start_+offsets(iw)
+                            key=abs(x(ib,j))
+                            if(key>best) then
+                                best=key
+                                jb=j
+                            endif
+                        enddo
+                        y(ib,col)=x(ib,jb)
+                        argmax(ib,col)=jb
+                    enddo
+                else
+                    jbest=start_+offsets(1)
+                    best_rows=abs(x(i0:i1,start_+offsets(1)))
+                    do iw=2,nk
+                        j=start_+offsets(iw)
+                        do ib=i0,i1
+                            key=abs(x(ib,j))
+                            if(key>best_rows(ib)) then
+                                best_rows(ib)=key
+                                jbest(ib)=j
+                            endif
+                        enddo
+                    enddo
+                    do ib=i0,i1
+                        jb=jbest(ib)
+                        y(ib,col)=x(ib,jb)
+                        argmax(ib,col)=jb
+                    enddo
+                endif
+            case (2)
+                if(nk<=max_nk_inner) then
+                    do ib=i0,i1
+                        jb=start_+offsets(1)
+                        best=real(x(ib,jb))
+                        do iw=2,nk
+                            j=start_+offsets(iw)
+                            key=real(x(ib,j))
+                            if(key<best) then
+                                best=key
+                                jb=j
+                            endif
+                        enddo
+                        y(ib,col)=x(ib,jb)
+                        argmax(ib,col)=jb
+                    enddo
+                else
+                    jbest=start_+offsets(1)
+                    best_rows=real(x(i0:i1,start_+offsets(1)))
+                    do iw=2,nk
+                        j=start_+offsets(iw)
+                        do ib=i0,i1
+                            key=real(x(ib,j))
+                            if(key<best_rows(ib)) then
+                                best_rows(ib)=key
+                                jbest(ib)=j
+                            endif
+                        enddo
+                    enddo
+                    do ib=i0,i1
+                        jb=jbest(ib)
+                        y(ib,col)=x(ib,jb)
+                        argmax(ib,col)=jb
+                    enddo
+                endif
+            case (3)
+                if(nk<=max_nk_inner) then
+                    do ib=i0,i1
+                        jb=start_+offsets(1)
+                        best=abs(x(ib,jb))
+                        do iw=2,nk
+                            j=start_+offsets(iw)
+                            key=abs(x(ib,j))
+                            if(key<best) then
+                                best=key
+                                jb=j
+                            endif
+                        enddo
+                        y(ib,col)=x(ib,jb)
+                        argmax(ib,col)=jb
+                    enddo
+                else
+                    jbest=start_+offsets(1)
+                    best_rows=abs(x(i0:i1,start_+offsets(1)))
+                    do iw=2,nk
+                        j=start_+offsets(iw)
+                        do ib=i0,i1
+                            key=abs(x(ib,j))
+                            if(key<best_rows(ib)) then
+                                best_rows(ib)=key
+                                jbest(ib)=j
+                            endif
+                        enddo
+                    enddo
+                    do ib=i0,i1
+                        jb=jbest(ib)
+                        y(ib,col)=x(ib,jb)
+                        argmax(ib,col)=jb
+                    enddo
+                endif
             case (4)
-                y(:,col)=sum(x(:,csc_indices(start_:end_-1)),2)/(end_-start_)
-            case default
-                print*,'Error: Pooling mode not exist!'
-                stop 1
+                y(i0:i1,col)=x(i0:i1,start_+offsets(1))
+                do iw=2,nk
+                    y(i0:i1,col)=y(i0:i1,col)+x(i0:i1,start_+offsets(iw))
+                enddo
+                y(i0:i1,col)=y(i0:i1,col)/nk
             endselect
         enddo
-    end subroutine forward_z
+        if(nk>max_nk_inner) deallocate(jbest, best_rows)
+        !$omp end parallel
+        deallocate(offsets, starts)
+    end subroutine forward_tiled_argmax_z
 
-    subroutine backward_z(dy,x,dx,csc_indptr,csc_indices, nnz,dim_in,dim_out,nfi,mode)
+    subroutine backward_tiled_z(dy, x, dx, img_in_shape, kernel_shape, nfi, dim_in, dim_out, nd, mode)
         implicit none
-        integer,intent(in) :: nnz,dim_in,dim_out,nfi,mode
+        !f2py threadsafe
+        integer,intent(in) :: nfi, dim_in, dim_out, nd, mode
+        integer,intent(in) :: img_in_shape(nd), kernel_shape(nd)
         complex*16,intent(in) :: x(nfi, dim_in)
         complex*16,intent(in) :: dy(nfi, dim_out)
-        integer,intent(in),target :: csc_indices(nnz)
-        integer,intent(in) :: csc_indptr(dim_out+1)
-        complex*16,intent(out) :: dx(nfi, dim_in)
-
-        integer :: start_, end_, col, irow, ib
-        integer,pointer :: rows(:)
-        complex*16 :: y_work(nfi)
-        complex*16,parameter :: one=dcmplx(1D0,0D0)
-        complex*16,parameter :: zero=dcmplx(0D0,0D0)
+        complex*16,intent(inout) :: dx(nfi, dim_in)
 
-        !f2py intent(in) x, dy, csc_indices, csc_indptr
-        !f2py intent(in) nfi, dim_in, dim_out, nnz
-        !f2py intent(out) dx
+        integer :: col, iw, ib, j, jb, start_, i0, i1, nk
+        integer,allocatable :: offsets(:), starts(:)
+        real*8 :: key, best
+        integer,allocatable :: jbest(:)
+        real*8,allocatable :: best_rows(:)
+        integer,parameter :: max_nk_inner=16
+        complex*16,parameter :: zero=dcmplx(0D0,0D0)
+        !f2py intent(in) x, dy, img_in_shape, kernel_shape
+        !f2py intent(in) nfi, dim_in, dim_out, nd, mode
+        !f2py complex*16 optional,intent(in,out),depend(nfi,dim_in) :: dx(nfi,dim_in)
 
-        if(mode==0) dx=0
+        if(mode<0 .or. mode>4) then
+            print*,'Error: Pooling mode not exist!'
+            stop 1
+        endif
+        nk=product(kernel_shape)
+        allocate(offsets(nk), starts(dim_out))
+        call tile_offsets(img_in_shape, kernel_shape, nd, offsets, nk, starts, dim_out)
+        dx=zero
 
+        !$omp parallel private(col, iw, ib, j, jb, start_, i0, i1, key, best, jbest, best_rows)
+        i0=1
+        i1=nfi
+        !$ i0=omp_get_thread_num()*nfi/omp_get_num_threads()+1
+        !$ i1=(omp_get_thread_num()+1)*nfi/omp_get_num_threads()
+        if(nk>max_nk_inner) allocate(jbest(i0:i1), best_rows(i0:i1))
         do col=1,dim_out
-            start_=csc_indptr(col)
-            end_=csc_indptr(col+1)
-
+            start_=starts(col)
             select case (mode)
             case (0)
-                !prepair work space by taking rows in x.
-                rows=>csc_indices(start_:end_-1)
-                do ib=1,nfi
-                    irow=maxloc(real(x(ib,rows)),1)
-                    dx(ib,rows(irow))=dy(ib,col)
-                enddo
+                if(nk<=max_nk_inner) then
+                    do ib=i0,i1
+                        jb=start_+offsets(1)
+                        best=real(x(ib,jb))
+                        do iw=2,nk
+                            j=start_+offsets(iw)
+                            key=real(x(ib,j))
+                            if(key>best) then
+                                best=key
+                                jb=j
+                            endif
+                        enddo
+                        dx(ib,jb)=dy(ib,col)
+                    enddo
+                else
+                    jbest=start_+offsets(1)
+                    best_rows=real(x(i0:i1,start_+offsets(1)))
+                    do iw=2,nk
+                        j=start_+offsets(iw)
+                        do ib=i0,i1
+                            key=real(x(ib,j))
+                            if(key>best_rows(ib)) then
+                                best_rows(ib)=key
+                                jbest(ib)=j
+                            endif
+                        enddo
+                    enddo
+                    do ib=i0,i1
+                        jb=jbest(ib)
+                        dx(ib,jb)=dy(ib,col)
+                    enddo
+                endif
             case (1)
-                rows=>csc_indices(start_:end_-1)
-                do ib=1,nfi
-                    irow=maxloc(abs(x(ib,rows)),1)
-                    dx(ib,rows(irow))=dy(ib,col)
-                enddo
+                if(nk<=max_nk_inner) then
+                    do ib=i0,i1
+                        jb=start_+offsets(1)
+                        best=abs(x(ib,jb))
+                        do iw=2,nk
+                            j=start_+offsets(iw)
+                            key=abs(x(ib,j))
+                            if(key>best) then
+                                best=key
+                                jb=j
+                            endif
+                        enddo
+                        dx(ib,jb)=dy(ib,col)
+                    enddo
+                else
+                    jbest=start_+offsets(1)
+                    best_rows=abs(x(i0:i1,start_+offsets(1)))
+                    do iw=2,nk
+                        j=start_+offsets(iw)
+                        do ib=i0,i1
+                            key=abs(x(ib,j))
+                            if(key>best_rows(ib)) then
+                                best_rows(ib)=key
+                                jbest(ib)=j
+                            endif
+                        enddo
+                    enddo
+                    do ib=i0,i1
+                        jb=jbest(ib)
+                        dx(ib,jb)=dy(ib,col)
+                    enddo
+                endif
             case (2)
-                rows=>csc_indices(start_:end_-1)
-                do ib=1,nfi
-                    irow=minloc(real(x(ib,rows)),1)
-                    dx(ib,rows(irow))=dy(ib,col)
-                enddo
+                if(nk<=max_nk_inner) then
+                    do ib=i0,i1
+                        jb=start_+offsets(1)
+                        best=real(x(ib,jb))
+                        do iw=2,nk
+                            j=start_+offsets(iw)
+                            key=real(x(ib,j))
+                            if(key<best) then
+                                best=key
+                                jb=j
+                            endif
+                        enddo
+                        dx(ib,jb)=dy(ib,col)
+                    enddo
+                else
+                    jbest=start_+offsets(1)
+                    best_rows=real(x(i0:i1,start_+offsets(1)))
+                    do iw=2,nk
+                        j=start_+offsets(iw)
+                        do ib=i0,i1
+                            key=real(x(ib,j))
+                            if(key<best_rows(ib)) then
+                                best_rows(ib)=key
+                                jbest(ib)=j
+                            endif
+                        enddo
+                    enddo
+                    do ib=i0,i1
+                        jb=jbest(ib)
+                        dx(ib,jb)=dy(ib,col)
+                    enddo
+                endif
             case (3)
-                rows=>csc_indices(start_:end_-1)
-                do ib=1,nfi
-                    irow=minloc(abs(x(ib,rows)),1)
-                    dx(ib,rows(irow))=dy(ib,col)
-                enddo
+                if(nk<=max_nk_inner) then
+                    do ib=i0,i1
+                        jb=start_+offsets(1)
+                        best=abs(x(ib,jb))
+                        do iw=2,nk
+                            j=start_+offsets(iw)
+                            key=abs(x(ib,j))
+                            if(key<best) then
+                                best=key
+                                jb=j
+                            endif
+                        enddo
+                        dx(ib,jb)=dy(ib,col)
+                    enddo
+                else
+                    jbest=start_+offsets(1)
+                    best_rows=abs(x(i0:i1,start_+offsets(1)))
+                    do iw=2,nk
+                        j=start_+offsets(iw)
+                        do ib=i0,i1
+                            key=abs(x(ib,j))
+                            if(key<best_rows(ib)) then
+                                best_rows(ib)=key
+                                jbest(ib)=j
+                            endif
+                        enddo
+                    enddo
+                    do ib=i0,i1
+                        jb=jbest(ib)
+                        dx(ib,jb)=dy(ib,col)
+                    enddo
+                endif
             case (4)
-                y_work=dy(:,col)/(end_-start_)
-                do irow=start_,end_-1
-                    dx(:,csc_indices(irow))=y_work
+                do iw=1,nk
+                    dx(i0:i1,start_+offsets(iw))=dy(i0:i1,col)/nk
                 enddo
-            case default
-                print*,'Error: Pooling mode not exist!'
-                stop 1
             endselect
         enddo
-    end subroutine backward_z
+        if(nk>max_nk_inner) deallocate(jbest, best_rows)
+        !$omp end parallel
+        deallocate(offsets, starts)
+    end subroutine backward_tiled_z
+
+    subroutine backward_argmax_z(dy, argmax, dx, dim_in, dim_out, nfi)
+        implicit none
+        !f2py threadsafe
+        integer,intent(in) :: dim_in, dim_out, nfi
+        complex*16,intent(in) :: dy(nfi, dim_out)
+        integer,intent(in) :: argmax(nfi, dim_out)
+        complex*16,intent(inout) :: dx(nfi, dim_in)
+
+        integer :: col, ib, i0, i1
+        complex*16,parameter :: zero=dcmplx(0D0,0D0)
+
+        !f2py intent(in) dy, argmax, dim_in
+        !f2py intent(in) nfi, dim_out
+        !f2py complex*16 optional,intent(in,out),depend(nfi,dim_in) :: dx(nfi,dim_in)
+
+        dx=zero
+
+        !rows i0:i1 of dx are written by this thread.
+        !$omp parallel private(col, ib, i0, i1)
+        i0=1
+        i1=nfi
+        !$ i0=omp_get_thread_num()*nfi/omp_get_num_threads()+1
+        !$ i1=(omp_get_thread_num()+1)*nfi/omp_get_num_threads()
+        do col=1,dim_out
+            do ib=i0,i1
+                dx(ib,argmax(ib,col))=dy(ib,col)
+            enddo
+        enddo
+        !$omp end parallel
+    end subroutine backward_argmax_z
     !mode = 0: max real.
     !mode = 1: max abs.
     !mode = 2: min real.
     !mode = 3: min abs.
     !mode = 4: mean pooling.
-    subroutine forward_c(x, y, csc_indptr, csc_indices, nnz, dim_in, dim_out, nfi, mode)
+    !pooling over a regular tiling, without index arrays,
+    !rows (batch and feature) of x are contiguous, and split among threads.
+    !forward_tiled_argmax also returns the selected columns of x in argmax.
+    subroutine forward_tiled_c(x, y, img_in_shape, kernel_shape, nfi, dim_in, dim_out, nd, mode)
         implicit none
-        integer,intent(in) :: nnz, dim_in, dim_out, nfi,mode
+        !f2py threadsafe
+        integer,intent(in) :: nfi, dim_in, dim_out, nd, mode
+        integer,intent(in) :: img_in_shape(nd), kernel_shape(nd)
         complex*8,intent(in) :: x(nfi, dim_in)
-        integer,intent(in),target :: csc_indices(nnz)
-        integer,intent(in) :: csc_indptr(dim_out+1)
-        complex*8,intent(out) :: y(nfi, dim_out)
+        complex*8,intent(inout) :: y(nfi, dim_out)
+        
 
-        integer,pointer :: rows(:)
-        integer :: start_, end_, col, ib, irow
-        !f2py intent(in) x, csc_indices, csc_indptr
-        !f2py intent(in) nfi, nnz, dim_out, dim_in
-        !f2py intent(out) y
+        integer :: col, iw, ib, j, jb, start_, i0, i1, nk
+        integer,allocatable :: offsets(:), starts(:)
+        real*4 :: key, best
+        integer,allocatable :: jbest(:)
+        real*4,allocatable :: best_rows(:)
+        !windows larger than this are scanned by columns, keeping x contiguous.
+        integer,parameter :: max_nk_inner=16
+        !f2py intent(in) x, img_in_shape, kernel_shape, dim_out
+        !f2py intent(in) nfi, dim_in, nd, mode
+        !f2py complex*8 optional,intent(in,out),depend(nfi,dim_out) :: y(nfi,dim_out)
+        
 
-        do col=1, dim_out
-            start_=csc_indptr(col)
-            end_=csc_indptr(col+1)
+        if(mode<0 .or. mode>4) then
+            print*,'Error: Pooling mode not exist!'
+            stop 1
+        endif
+        nk=product(kernel_shape)
+        allocate(offsets(nk), starts(dim_out))
+        call tile_offsets(img_in_shape, kernel_shape, nd, offsets, nk, starts, dim_out)
 
-            !prepair work space by taking rows in x.
+        !$omp parallel private(col, iw, ib, j, jb, start_, i0, i1, key, best, jbest, best_rows)
+        i0=1
+        i1=nfi
+        !$ i0=omp_get_thread_num()*nfi/omp_get_num_threads()+1
+        !$ i1=(omp_get_thread_num()+1)*nfi/omp_get_num_threads()
+        if(nk>max_nk_inner) allocate(jbest(i0:i1), best_rows(i0:i1))
+        do col=1,dim_out
+            start_=starts(col)
             select case (mode)
             case (0)
-                rows=>csc_indices(start_:end_-1)
-                do ib=1,nfi
-                    irow=maxloc(real(x(ib,rows)),1)
-                    y(ib,col)=x(ib,rows(irow))
-                enddo
-                case (1)
-                rows=>csc_indices(start_:end_-1)
-                do ib=1,nfi
-                    irow=maxloc(abs(x(ib,rows)),1)
-                    y(ib,col)=x(ib,rows(irow))
-                enddo
+                if(nk<=max_nk_inner) then
+                    do ib=i0,i1
+                        jb=start_+offsets(1)
+                        best=real(x(ib,jb))
+                        do iw=2,nk
+                            j=start_+offsets(iw)
+                            key=real(x(ib,j))
+                            if(key>best) then
+                                best=key
+                                jb=j
+                            endif
+                        enddo
+                        y(ib,col)=x(ib,jb)
+                    enddo
+                else
+                    jbest=start_+offsets(1)
+                    best_rows=real(x(i0:i1,start_+offsets(1)))
+                    do iw=2,nk
+                        j=start_+offsets(iw)
+                        do ib=i0,i1
+                            key=real(x(ib,j))
+                            if(key>best_rows(ib)) then
+                                best_rows(ib)=key
+                                jbest(ib)=j
+                            endif
+                        enddo
+                    enddo
+                    do ib=i0,i1
+                        jb=jbest(ib)
+                        y(ib,col)=x(ib,jb)
+                    enddo
+                endif
+            case (1)
+                if(nk<=max_nk_inner) then
+                    do ib=i0,i1
+                        jb=start_+offsets(1)
+                        best=abs(x(ib,jb))
+                        do iw=2,nk
+                            j=start_+offsets(iw)
+                            key=abs(x(ib,j))
+                            if(key>best) then
+                                best=key
+                                jb=j
+                            endif
+                        enddo
+                        y(ib,col)=x(ib,jb)
+                    enddo
+                else
+                    jbest=start_+offsets(1)
+                    best_rows=abs(x(i0:i1,start_+offsets(1)))
+                    do iw=2,nk
+                        j=start_+offsets(iw)
+                        do ib=i0,i1
+                            key=abs(x(ib,j))
+                            if(key>best_rows(ib)) then
+                                best_rows(ib)=key
+                                jbest(ib)=j
+                            endif
+                        enddo
+                    enddo
+                    do ib=i0,i1
+                        jb=jbest(ib)
+                        y(ib,col)=x(ib,jb)
+                    enddo
+                endif
             case (2)
-                rows=>csc_indices(start_:end_-1)
-                do ib=1,nfi
-                    irow=minloc(real(x(ib,rows)),1)
-                    y(ib,col)=x(ib,rows(irow))
-                enddo
-                case (3)
-                rows=>csc_indices(start_:end_-1)
-                do ib=1,nfi
-                    irow=minloc(abs(x(ib,rows)),1)
-                    y(ib,col)=x(ib,rows(irow))
+                if(nk<=max_nk_inner) then
+                    do ib=i0,i1
+                        jb=start_+offsets(1)
+                        best=real(x(ib,jb))
+                        do iw=2,nk
+                            j=start_+offsets(iw)
+                            key=real(x(ib,j))
+                            if(key<best) then
+                                best=key
+                                jb=j
+                            endif
+                        enddo
+                        y(ib,col)=x(ib,jb)
+                    enddo
+                else
+                    jbest=start_+offsets(1)
+                    best_rows=real(x(i0:i1,start_+offsets(1)))
+                    do iw=2,nk
+                        j=start_+offsets(iw)
+                        do ib=i0,i1
+                            key=real(x(ib,j))
+                            if(key<best_rows(ib)) then
+                                best_rows(ib)=key
+                                jbest(ib)=j
+                            endif
+                        enddo
+                    enddo
+                    do ib=i0,i1
+                        jb=jbest(ib)
+                        y(ib,col)=x(ib,jb)
+                    enddo
+                endif
+            case (3)
+                if(nk<=max_nk_inner) then
+                    do ib=i0,i1
+                        jb=start_+offsets(1)
+                        best=abs(x(ib,jb))
+                        do iw=2,nk
+                            j=start_+offsets(iw)
+                            key=abs(x(ib,j))
+                            if(key<best) then
+                                best=key
+                                jb=j
+                            endif
+                        enddo
+                        y(ib,col)=x(ib,jb)
+                    enddo
+                else
+                    jbest=start_+offsets(1)
+                    best_rows=abs(x(i0:i1,start_+offsets(1)))
+                    do iw=2,nk
+                        j=start_+offsets(iw)
+                        do ib=i0,i1
+                            key=abs(x(ib,j))
+                            if(key<best_rows(ib)) then
+                                best_rows(ib)=key
+                                jbest(ib)=j
+                            endif
+                        enddo
+                    enddo
+                    do ib=i0,i1
+                        jb=jbest(ib)
+                        y(ib,col)=x(ib,jb)
+                    enddo
+                endif
+            case (4)
+                y(i0:i1,col)=x(i0:i1,start_+offsets(1))
+                do iw=2,nk
+                    y(i0:i1,col)=y(i0:i1,col)+x(i0:i1,start_+offsets(iw))
                 enddo
+                y(i0:i1,col)=y(i0:i1,col)/nk
+            endselect
+        enddo
+        if(nk>max_nk_inner) deallocate(jbest, best_rows)
+        !$omp end parallel
+        deallocate(offsets, starts)
+    end subroutine forward_tiled_c
+
+    subroutine forward_tiled_argmax_c(x, y, argmax, img_in_shape, kernel_shape, nfi, dim_in, dim_out, nd, mode)
+        implicit none
+        !f2py threadsafe
+        integer,intent(in) :: nfi, dim_in, dim_out, nd, mode
+        integer,intent(in) :: img_in_shape(nd), kernel_shape(nd)
+        complex*8,intent(in) :: x(nfi, dim_in)
+        complex*8,intent(inout) :: y(nfi, dim_out)
+        integer,intent(out) :: argmax(nfi, dim_out)
+
+        integer :: col, iw, ib, j, jb, start_, i0, i1, nk
+        integer,allocatable :: offsets(:), starts(:)
+        real*4 :: key, best
+        integer,allocatable :: jbest(:)
+        real*4,allocatable :: best_rows(:)
+        !windows larger than this are scanned by columns, keeping x contiguous.
+        integer,parameter :: max_nk_inner=16
+        !f2py intent(in) x, img_in_shape, kernel_shape, dim_out
+        !f2py intent(in) nfi, dim_in, nd, mode
+        !f2py complex*8 optional,intent(in,out),depend(nfi,dim_out) :: y(nfi,dim_out)
+        !f2py intent(out) argmax
+
+        if(mode<0 .or. mode>4) then
+            print*,'Error: Pooling mode not exist!'
+            stop 1
+        endif
+        nk=product(kernel_shape)
+        allocate(offsets(nk), starts(dim_out))
+        call tile_offsets(img_in_shape, kernel_shape, nd, offsets, nk, starts, dim_out)
+
+        !$omp parallel private(col, iw, ib, j, jb, start_, i0, i1, key, best, jbest, best_rows)
+        i0=1
+        i1=nfi
+        !$ i0=omp_get_thread_num()*nfi/omp_get_num_threads()+1
+        !$ i1=(omp_get_thread_num()+1)*nfi/omp_get_num_threads()
+        if(nk>max_nk_inner) allocate(jbest(i0:i1), best_rows(i0:i1))
+        do col=1,dim_out
+            start_=starts(col)
+            select case (mode)
+            case (0)
+                if(nk<=max_nk_inner) then
+                    do ib=i0,i1
+                        jb=start_+offsets(1)
+                        best=real(x(ib,jb))
+                        do iw=2,nk
+                            j=start_+offsets(iw)
+                            key=real(x(ib,j))
+                            if(key>best) then
+                                best=key
+                                jb=j
+                            endif
+                        enddo
+                        y(ib,col)=x(ib,jb)
+                        argmax(ib,col)=jb
+                    enddo
+                else
+                    jbest=start_+offsets(1)
+                    best_rows=real(x(i0:i1,start_+offsets(1)))
+                    do iw=2,nk
+                        j=start_+offsets(iw)
+                        do ib=i0,i1
+                            key=real(x(ib,j))
+                            if(key>best_rows(ib)) then
+                                best_rows(ib)=key
+                                jbest(ib)=j
+                            endif
+                        enddo
+                    enddo
+                    do ib=i0,i1
+                        jb=jbest(ib)
+                        y(ib,col)=x(ib,jb)
+                        argmax(ib,col)=jb
+                    enddo
+                endif
+            case (1)
+                if(nk<=max_nk_inner) then
+                    do ib=i0,i1
+                        jb=start_+offsets(1)
+                        best=abs(x(ib,jb))
+                        do iw=2,nk
+                            j=start_+offsets(iw)
+                            key=abs(x(ib,j))
+                            if(key>best) then
+                                best=key
+                                jb=j
+                            endif
+                        enddo
+                        y(ib,col)=x(ib,jb)
+                        argmax(ib,col)=jb
+                    enddo
+                else
+                    jbest=start_+offsets(1)
+                    best_rows=abs(x(i0:i1,start_+offsets(1)))
+                    do iw=2,nk
+                        j=start_+offsets(iw)
+                        do ib=i0,i1
+                            key=abs(x(ib,j))
+                            if(key>best_rows(ib)) then
+                                best_rows(ib)=key
+                                jbest(ib)=j
+                            endif
+                        enddo
+                    enddo
+                    do ib=i0,i1
+                        jb=jbest(ib)
+                        y(ib,col)=x(ib,jb)
+                        argmax(ib,col)=jb
+                    enddo
+                endif
+            case (2)
+                if(nk<=max_nk_inner) then
+                    do ib=i0,i1
+                        jb=start_+offsets(1)
+                        best=real(x(ib,jb))
+                        do iw=2,nk
+                            j=start_+offsets(iw)
+                            key=real(x(ib,j))
+                            if(key<best) then
+                                best=key
+                                jb=j
+                            endif
+                        enddo
+                        y(ib,col)=x(ib,jb)
+                        argmax(ib,col)=jb
+                    enddo
+                else
+                    jbest=start_+offsets(1)
+                    best_rows=real(x(i0:i1,start_+offsets(1)))
+                    do iw=2,nk
+                        j=start_+offsets(iw)
+                        do ib=i0,i1
+                            key=real(x(ib,j))
+                            if(key<best_rows(ib)) then
+                                best_rows(ib)=key
+                                jbest(ib)=j
+                            endif
+                        enddo
+                    enddo
+                    do ib=i0,i1
+                        jb=jbest(ib)
+                        y(ib,col)=x(ib,jb)
+                        argmax(ib,col)=jb
+                    enddo
+                endif
+            case (3)
+                if(nk<=max_nk_inner) then
+                    do ib=i0,i1
+                        jb=start_+offsets(1)
+                        best=abs(x(ib,jb))
+                        do iw=2,nk
+                            j=start_+offsets(iw)
+                            key=abs(x(ib,j))
+                            if(key<best) then
+                                best=key
+                                jb=j
+                            endif
+                        enddo
+                        y(ib,col)=x(ib,jb)
+                        argmax(ib,col)=jb
+                    enddo
+                else
+                    jbest=start_+offsets(1)
+                    best_rows=abs(x(i0:i1,start_+offsets(1)))
+                    do iw=2,nk
+                        j=start_+offsets(iw)
+                        do ib=i0,i1
+                            key=abs(x(ib,j))
+                            if(key<best_rows(ib)) then
+                                best_rows(ib)=key
+                                jbest(ib)=j
+                            endif
+                        enddo
+                    enddo
+                    do ib=i0,i1
+                        jb=jbest(ib)
+                        y(ib,col)=x(ib,jb)
+                        argmax(ib,col)=jb
+                    enddo
+                endif
             case (4)
-                y(:,col)=sum(x(:,csc_indices(start_:end_-1)),2)/(end_-start_)
-            case default
-                print*,'Error: Pooling mode not exist!'
-                stop 1
+                y(i0:i1,col)=x(i0:i1,start_+offsets(1))
+                do iw=2,nk
+                    y(i0:i1,col)=y(i0:i1,col)+x(i0:i1,start_+offsets(iw))
+                enddo
+                y(i0:i1,col)=y(i0:i1,col)/nk
             endselect
         enddo
-    end subroutine forward_c
+        if(nk>max_nk_inner) deallocate(jbest, best_rows)
+        !$omp end parallel
+        deallocate(offsets, starts)
+    end subroutine forward_tiled_argmax_c
 
-    subroutine backward_c(dy,x,dx,csc_indptr,csc_indices, nnz,dim_in,dim_out,nfi,mode)
+    subroutine backward_tiled_c(dy, x, dx, img_in_shape, kernel_shape, nfi, dim_in, dim_out, nd, mode)
         implicit none
-        integer,intent(in) :: nnz,dim_in,dim_out,nfi,mode
+        !f2py threadsafe
+        integer,intent(in) :: nfi, dim_in, dim_out, nd, mode
+        integer,intent(in) :: img_in_shape(nd), kernel_shape(nd)
         complex*8,intent(in) :: x(nfi, dim_in)
         complex*8,intent(in) :: dy(nfi, dim_out)
-        integer,intent(in),target :: csc_indices(nnz)
-        integer,intent(in) :: csc_indptr(dim_out+1)
-        complex*8,intent(out) :: dx(nfi, dim_in)
-
-        integer :: start_, end_, col, irow, ib
-        integer,pointer :: rows(:)
-        complex*8 :: y_work(nfi)
-        complex*8,parameter :: one=cmplx(1.0,0.0)
-        complex*8,parameter :: zero=cmplx(0.0,0.0)
+        complex*8,intent(inout) :: dx(nfi, dim_in)
 
-        !f2py intent(in) x, dy, csc_indices, csc_indptr
-        !f2py intent(in) nfi, dim_in, dim_out, nnz
-        !f2py intent(out) dx
+        integer :: col, iw, ib, j, jb, start_, i0, i1, nk
+        integer,allocatable :: offsets(:), starts(:)
+        real*4 :: key, best
+        integer,allocatable :: jbest(:)
+        real*4,allocatable :: best_rows(:)
+        integer,parameter :: max_nk_inner=16
+        complex*8,parameter :: zero=cmplx(0.0,0.0)
+        !f2py intent(in) x, dy, img_in_shape, kernel_shape
+        !f2py intent(in) nfi, dim_in, dim_out, nd, mode
+        !f2py complex*8 optional,intent(in,out),depend(nfi,dim_in) :: dx(nfi,dim_in)
 
-        if(mode==0) dx=0
+        if(mode<0 .or. mode>4) then
+            print*,'Error: Pooling mode not exist!'
+            stop 1
+        endif
+        nk=product(kernel_shape)
+        allocate(offsets(nk), starts(dim_out))
+        call tile_offsets(img_in_shape, kernel_shape, nd, offsets, nk, starts, dim_out)
+        dx=zero
 
+        !$omp parallel private(col, iw, ib, j, jb, start_, i0, i1, key, best, jbest, best_rows)
+        i0=1
+        i1=nfi
+        !$ i0=omp_get_thread_num()*nfi/omp_get_num_threads()+1
+        !$ i1=(omp_get_thread_num()+1)*nfi/omp_get_num_threads()
+        if(nk>max_nk_inner) allocate(jbest(i0:i1), best_rows(i0:i1))
         do col=1,dim_out
-            start_=csc_indptr(col)
-            end_=csc_indptr(col+1)
-
+            start_=starts(col)
             select case (mode)
             case (0)
-                !prepair work space by taking rows in x.
-                rows=>csc_indices(start_:end_-1)
-                do ib=1,nfi
-                    irow=maxloc(real(x(ib,rows)),1)
-                    dx(ib,rows(irow))=dy(ib,col)
-                enddo
+                if(nk<=max_nk_inner) then
+                    do ib=i0,i1
+                        jb=start_+offsets(1)
+                        best=real(x(ib,jb))
+                        do iw=2,nk
+                            j=start_+offsets(iw)
+                            key=real(x(ib,j))
+                            if(key>best) then
+                                best=key
+                                jb=j
+                            endif
+                        enddo
+                        dx(ib,jb)=dy(ib,col)
+                    enddo
+                else
+                    jbest=start_+offsets(1)
+                    best_rows=real(x(i0:i1,start_+offsets(1)))
+                    do iw=2,nk
+                        j=start_+offsets(iw)
+                        do ib=i0,i1
+                            key=real(x(ib,j))
+                            if(key>best_rows(ib)) then
+                                best_rows(ib)=key
+                                jbest(ib)=j
+                            endif
+                        enddo
+                    enddo
+                    do ib=i0,i1
+                        jb=jbest(ib)
+                        dx(ib,jb)=dy(ib,col)
+                    enddo
+                endif
             case (1)
-                rows=>csc_indices(start_:end_-1)
-                do ib=1,nfi
-                    irow=maxloc(abs(x(ib,rows)),1)
-                    dx(ib,rows(irow))=dy(ib,col)
-                enddo
+                if(nk<=max_nk_inner) then
+                    do ib=i0,i1
+                        jb=start_+offsets(1)
+                        best=abs(x(ib,jb))
+                        do iw=2,nk
+                            j=start_+offsets(iw)
+                            key=abs(x(ib,j))
+                            if(key>best) then
+                                best=key
+                                jb=j
+                            endif
+                        enddo
+                        dx(ib,jb)=dy(ib,col)
+                    enddo
+                else
+                    jbest=start_+offsets(1)
+                    best_rows=abs(x(i0:i1,start_+offsets(1)))
+                    do iw=2,nk
+                        j=start_+offsets(iw)
+                        do ib=i0,i1
+                            key=abs(x(ib,j))
+                            if(key>best_rows(ib)) then
+                                best_rows(ib)=key
+                                jbest(ib)=j
+                            endif
+                        enddo
+                    enddo
+                    do ib=i0,i1
+                        jb=jbest(ib)
+                        dx(ib,jb)=dy(ib,col)
+                    enddo
+                endif
             case (2)
-                rows=>csc_indices(start_:end_-1)
-                do ib=1,nfi
-                    irow=minloc(real(x(ib,rows)),1)
-                    dx(ib,rows(irow))=dy(ib,col)
-                enddo
+                if(nk<=max_nk_inner) then
+                    do ib=i0,i1
+                        jb=start_+offsets(1)
+                        best=real(x(ib,jb))
+                        do iw=2,nk
+                            j=start_+offsets(iw)
+                            key=real(x(ib,j))
+                            if(key<best) then
+                                best=key
+                                jb=j
+                            endif
+                        enddo
+                        dx(ib,jb)=dy(ib,col)
+                    enddo
+                else
+                    jbest=start_+offsets(1)
+                    best_rows=real(x(i0:i1,start_+offsets(1)))
+                    do iw=2,nk
+                        j=start_+offsets(iw)
+                        do ib=i0,i1
+                            key=real(x(ib,j))
+                            if(key<best_rows(ib)) then
+                                best_rows(ib)=key
+                                jbest(ib)=j
+                            endif
+                        enddo
+                    enddo
+                    do ib=i0,i1
+                        jb=jbest(ib)
+                        dx(ib,jb)=dy(ib,col)
+                    enddo
+                endif
             case (3)
-                rows=>csc_indices(start_:end_-1)
-                do ib=1,nfi
-                    irow=minloc(abs(x(ib,rows)),1)
-                    dx(ib,rows(irow))=dy(ib,col)
-                enddo
+                if(nk<=max_nk_inner) then
+                    do ib=i0,i1
+                        jb=start_+offsets(1)
+                        best=abs(x(ib,jb))
+                        do iw=2,nk
+                            j=start_+offsets(iw)
+                            key=abs(x(ib,j))
+                            if(key<best) then
+                                best=key
+                                jb=j
+                            endif
+                        enddo
+                        dx(ib,jb)=dy(ib,col)
+                    enddo
+                else
+                    jbest=start_+offsets(1)
+                    best_rows=abs(x(i0:i1,start_+offsets(1)))
+                    do iw=2,nk
+                        j=start_+offsets(iw)
+                        do ib=i0,i1
+                            key=abs(x(ib,j))
+                            if(key<best_rows(ib)) then
+                                best_rows(ib)=key
+                                jbest(ib)=j
+                            endif
+                        enddo
+                    enddo
+                    do ib=i0,i1
+                        jb=jbest(ib)
+                        dx(ib,jb)=dy(ib,col)
+                    enddo
+                endif
             case (4)
-                y_work=dy(:,col)/(end_-start_)
-                do irow=start_,end_-1
-                    dx(:,csc_indices(irow))=y_work
+                do iw=1,nk
+                    dx(i0:i1,start_+offsets(iw))=dy(i0:i1,col)/nk
                 enddo
-            case default
-                print*,'Error: Pooling mode not exist!'
-                stop 1
             endselect
         enddo
-    end subroutine backward_c
+        if(nk>max_nk_inner) deallocate(jbest, best_rows)
+        !$omp end parallel
+        deallocate(offsets, starts)
+    end subroutine backward_tiled_c
+
+    subroutine backward_argmax_c(dy, argmax, dx, dim_in, dim_out, nfi)
+        implicit none
+        !f2py threadsafe
+        integer,intent(in) :: dim_in, dim_out, nfi
+        complex*8,intent(in) :: dy(nfi, dim_out)
+        integer,intent(in) :: argmax(nfi, dim_out)
+        complex*8,intent(inout) :: dx(nfi, dim_in)
+
+        integer :: col, ib, i0, i1
+        complex*8,parameter :: zero=cmplx(0.0,0.0)
+
+        !f2py intent(in) dy, argmax, dim_in
+        !f2py intent(in) nfi, dim_out
+        !f2py complex*8 optional,intent(in,out),depend(nfi,dim_in) :: dx(nfi,dim_in)
+
+        dx=zero
+
+        !rows i0:i1 of dx are written by this thread.
+        !$omp parallel private(col, ib, i0, i1)
+        i0=1
+        i1=nfi
+        !$ i0=omp_get_thread_num()*nfi/omp_get_num_threads()+1
+        !$ i1=(omp_get_thread_num()+1)*nfi/omp_get_num_threads()
+        do col=1,dim_out
+            do ib=i0,i1
+                dx(ib,argmax(ib,col))=dy(ib,col)
+            enddo
+        enddo
+        !$omp end parallel
+    end subroutine backward_argmax_c
     !mode = 0: max real.
     !mode = 1: max abs.
     !mode = 2: min real.
     !mode = 3: min abs.
     !mode = 4: mean pooling.
-    subroutine forward_d(x, y, csc_indptr, csc_indices, nnz, dim_in, dim_out, nfi, mode)
+    !pooling over a regular tiling, without index arrays,
+    !rows (batch and feature) of x are contiguous, and split among threads.
+    !forward_tiled_argmax also returns the selected columns of x in argmax.
+    subroutine forward_tiled_d(x, y, img_in_shape, kernel_shape, nfi, dim_in, dim_out, nd, mode)
         implicit none
-        integer,intent(in) :: nnz, dim_in, dim_out, nfi,mode
+        !f2py threadsafe
+        integer,intent(in) :: nfi, dim_in, dim_out, nd, mode
+        integer,intent(in) :: img_in_shape(nd), kernel_shape(nd)
         real*8,intent(in) :: x(nfi, dim_in)
-        integer,intent(in),target :: csc_indices(nnz)
-        integer,intent(in) :: csc_indptr(dim_out+1)
-        real*8,intent(out) :: y(nfi, dim_out)
+        real*8,intent(inout) :: y(nfi, dim_out)
+        
 
-        integer,pointer :: rows(:)
-        integer :: start_, end_, col, ib, irow
-        !f2py intent(in) x, csc_indices, csc_indptr
-        !f2py intent(in) nfi, nnz, dim_out, dim_in
-        !f2py intent(out) y
+        integer :: col, iw, ib, j, jb, start_, i0, i1, nk
+        integer,allocatable :: offsets(:), starts(:)
+        real*8 :: key, best
+        integer,allocatable :: jbest(:)
+        real*8,allocatable :: best_rows(:)
+        !windows larger than this are scanned by columns, keeping x contiguous.
+        integer,parameter :: max_nk_inner=16
+        !f2py intent(in) x, img_in_shape, kernel_shape, dim_out
+        !f2py intent(in) nfi, dim_in, nd, mode
+        !f2py real*8 optional,intent(in,out),depend(nfi,dim_out) :: y(nfi,dim_out)
+        
 
-        do col=1, dim_out
-            start_=csc_indptr(col)
-            end_=csc_indptr(col+1)
+        if(mode<0 .or. mode>4) then
+            print*,'Error: Pooling mode not exist!'
+            stop 1
+        endif
+        nk=product(kernel_shape)
+        allocate(offsets(nk), starts(dim_out))
+        call tile_offsets(img_in_shape, kernel_shape, nd, offsets, nk, starts, dim_out)
 
-            !prepair work space by taking rows in x.
+        !$omp parallel private(col, iw, ib, j, jb, start_, i0, i1, key, best, jbest, best_rows)
+        i0=1
+        i1=nfi
+        !$ i0=omp_get_thread_num()*nfi/omp_get_num_threads()+1
+        !$ i1=(omp_get_thread_num()+1)*nfi/omp_get_num_threads()
+        if(nk>max_nk_inner) allocate(jbest(i0:i1), best_rows(i0:i1))
+        do col=1,dim_out
+            start_=starts(col)
             select case (mode)
             case (0)
-                y(:,col)=maxval(x(:,csc_indices(start_:end_-1)),2)
-                case (1)
-                rows=>csc_indices(start_:end_-1)
-                do ib=1,nfi
-                    irow=maxloc(abs(x(ib,rows)),1)
-                    y(ib,col)=x(ib,rows(irow))
+                y(i0:i1,col)=x(i0:i1,start_+offsets(1))
+                do iw=2,nk
+                    y(i0:i1,col)=max(y(i0:i1,col),x(i0:i1,start_+offsets(iw)))
                 enddo
+            case (1)
+                if(nk<=max_nk_inner) then
+                    do ib=i0,i1
+                        jb=start_+offsets(1)
+                        best=abs(x(ib,jb))
+                        do iw=2,nk
+                            j=start_+offsets(iw)
+                            key=abs(x(ib,j))
+                            if(key>best) then
+                                best=key
+                                jb=j
+                            endif
+                        enddo
+                        y(ib,col)=x(ib,jb)
+                    enddo
+                else
+                    jbest=start_+offsets(1)
+                    best_rows=abs(x(i0:i1,start_+offsets(1)))
+                    do iw=2,nk
+                        j=start_+offsets(iw)
+                        do ib=i0,i1
+                            key=abs(x(ib,j))
+                            if(key>best_rows(ib)) then
+                                best_rows(ib)=key
+                                jbest(ib)=j
+                            endif
+                        enddo
+                    enddo
+                    do ib=i0,i1
+                        jb=jbest(ib)
+                        y(ib,col)=x(ib,jb)
+                    enddo
+                endif
             case (2)
-                y(:,col)=minval(x(:,csc_indices(start_:end_-1)),2)
-                case (3)
-                rows=>csc_indices(start_:end_-1)
-                do ib=1,nfi
-                    irow=minloc(abs(x(ib,rows)),1)
-                    y(ib,col)=x(ib,rows(irow))
+                y(i0:i1,col)=x(i0:i1,start_+offsets(1))
+                do iw=2,nk
+                    y(i0:i1,col)=min(y(i0:i1,col),x(i0:i1,start_+offsets(iw)))
                 enddo
+            case (3)
+                if(nk<=max_nk_inner) then
+                    do ib=i0,i1
+                        jb=start_+offsets(1)
+                        best=abs(x(ib,jb))
+                        do iw=2,nk
+                            j=start_+offsets(iw)
+                            key=abs(x(ib,j))
+                            if(key<best) then
+                                best=key
+                                jb=j
+                            endif
+                        enddo
+                        y(ib,col)=x(ib,jb)
+                    enddo
+                else
+                    jbest=start_+offsets(1)
+                    best_rows=abs(x(i0:i1,start_+offsets(1)))
+                    do iw=2,nk
+                        j=start_+offsets(iw)
+                        do ib=i0,i1
+                            key=abs(x(ib,j))
+                            if(key<best_rows(ib)) then
+                                best_rows(ib)=key
+                                jbest(ib)=j
+                            endif
+                        enddo
+                    enddo
+                    do ib=i0,i1
+                        jb=jbest(ib)
+                        y(ib,col)=x(ib,jb)
+                    enddo
+                endif
             case (4)
-                y(:,col)=sum(x(:,csc_indices(start_:end_-1)),2)/(end_-start_)
-            case default
-                print*,'Error: Pooling mode not exist!'
-                stop 1
+                y(i0:i1,col)=x(i0:i1,start_+offsets(1))
+                do iw=2,nk
+                    y(i0:i1,col)=y(i0:i1,col)+x(i0:i1,start_+offsets(iw))
+                enddo
+                y(i0:i1,col)=y(i0:i1,col)/nk
             endselect
         enddo
-    end subroutine forward_d
+        if(nk>max_nk_inner) deallocate(jbest, best_rows)
+        !$omp end parallel
+        deallocate(offsets, starts)
+    end subroutine forward_tiled_d
 
-    subroutine backward_d(dy,x,dx,csc_indptr,csc_indices, nnz,dim_in,dim_out,nfi,mode)
+    subroutine forward_tiled_argmax_d(x, y, argmax, img_in_shape, kernel_shape, nfi, dim_in, dim_out, nd, mode)
         implicit none
-        integer,intent(in) :: nnz,dim_in,dim_out,nfi,mode
+        !f2py threadsafe
+        integer,intent(in) :: nfi, dim_in, dim_out, nd, mode
+        integer,intent(in) :: img_in_shape(nd), kernel_shape(nd)
         real*8,intent(in) :: x(nfi, dim_in)
-        real*8,intent(in) :: dy(nfi, dim_out)
-        integer,intent(in),target :: csc_indices(nnz)
-        integer,intent(in) :: csc_indptr(dim_out+1)
-        real*8,intent(out) :: dx(nfi, dim_in)
-
-        integer :: start_, end_, col, irow, ib
-        integer,pointer :: rows(:)
-        real*8 :: y_work(nfi)
-        real*8,parameter :: one=1D0
-        real*8,parameter :: zero=0D0
+        real*8,intent(inout) :: y(nfi, dim_out)
+        integer,intent(out) :: argmax(nfi, dim_out)
 
-        !f2py intent(in) x, dy, csc_indices, csc_indptr
-        !f2py intent(in) nfi, dim_in, dim_out, nnz
-        !f2py intent(out) dx
+        integer :: col, iw, ib, j, jb, start_, i0, i1, nk
+        integer,allocatable :: offsets(:), starts(:)
+        real*8 :: key, best
+        integer,allocatable :: jbest(:)
+        real*8,allocatable :: best_rows(:)
+        !windows larger than this are scanned by columns, keeping x contiguous.
+        integer,parameter :: max_nk_inner=16
+        !f2py intent(in) x, img_in_shape, kernel_shape, dim_out
+        !f2py intent(in) nfi, dim_in, nd, mode
+        !f2py real*8 optional,intent(in,out),depend(nfi,dim_out) :: y(nfi,dim_out)
+        !f2py intent(out) argmax
 
-        if(mode==0) dx=0
+        if(mode<0 .or. mode>4) then
+            print*,'Error: Pooling mode not exist!'
+            stop 1
+        endif
+        nk=product(kernel_shape)
+        allocate(offsets(nk), starts(dim_out))
+        call tile_offsets(img_in_shape, kernel_shape, nd, offsets, nk, starts, dim_out)
 
+        !$omp parallel private(col, iw, ib, j, jb, start_, i0, i1, key, best, jbest, best_rows)
+        i0=1
+        i1=nfi
+        !$ i0=omp_get_thread_num()*nfi/omp_get_num_threads()+1
+        !$ i1=(omp_get_thread_num()+1)*nfi/omp_get_num_threads()
+        if(nk>max_nk_inner) allocate(jbest(i0:i1), best_rows(i0:i1))
         do col=1,dim_out
-            start_=csc_indptr(col)
-            end_=csc_indptr(col+1)
-
+            start_=starts(col)
             select case (mode)
             case (0)
-                !prepair work space by taking rows in x.
-                rows=>csc_indices(start_:end_-1)
-                do ib=1,nfi
-                    irow=maxloc((x(ib,rows)),1)
-                    dx(ib,rows(irow))=dy(ib,col)
-                enddo
+                if(nk<=max_nk_inner) then
+                    do ib=i0,i1
+                        jb=start_+offsets(1)
+                        best=(x(ib,jb))
+                        do iw=2,nk
+                            j=start_+offsets(iw)
+                            key=(x(ib,j))
+                            if(key>best) then
+                                best=key
+                                jb=j
+                            endif
+                        enddo
+                        y(ib,col)=x(ib,jb)
+                        argmax(ib,col)=jb
+                    enddo
+                else
+                    jbest=start_+offsets(1)
+                    best_rows=(x(i0:i1,start_+offsets(1)))
+                    do iw=2,nk
+                        j=start_+offsets(iw)
+                        do ib=i0,i1
+                            key=(x(ib,j))
+                            if(key>best_rows(ib)) then
+                                best_rows(ib)=key
+                                jbest(ib)=j
+                            endif
+                        enddo
+                    enddo
+                    do ib=i0,i1
+                        jb=jbest(ib)
+                        y(ib,col)=x(ib,jb)
+                        argmax(ib,col)=jb
+                    enddo
+                endif
             case (1)
-                rows=>csc_indices(start_:end_-1)
-                do ib=1,nfi
-                    irow=maxloc(abs(x(ib,rows)),1)
-                    dx(ib,rows(irow))=dy(ib,col)
-                enddo
+                if(nk<=max_nk_inner) then
+                    do ib=i0,i1
+                        jb=start_+offsets(1)
+                        best=abs(x(ib,jb))
+                        do iw=2,nk
+                            j=start_+offsets(iw)
+                            key=abs(x(ib,j))
+                            if(key>best) then
+                                best=key
+                                jb=j
+                            endif
+                        enddo
+                        y(ib,col)=x(ib,jb)
+                        argmax(ib,col)=jb
+                    enddo
+                else
+                    jbest=start_+offsets(1)
+                    best_rows=abs(x(i0:i1,start_+offsets(1)))
+                    do iw=2,nk
+                        j=start_+offsets(iw)
+                        do ib=i0,i1
+                            key=abs(x(ib,j))
+                            if(key>best_rows(ib)) then
+                                best_rows(ib)=key
+                                jbest(ib)=j
+                            endif
+                        enddo
+                    enddo
+                    do ib=i0,i1
+                        jb=jbest(ib)
+                        y(ib,col)=x(ib,jb)
+                        argmax(ib,col)=jb
+                    enddo
+                endif
             case (2)
-                rows=>csc_indices(start_:end_-1)
-                do ib=1,nfi
-                    irow=minloc((x(ib,rows)),1)
-                    dx(ib,rows(irow))=dy(ib,col)
-                enddo
+                if(nk<=max_nk_inner) then
+                    do ib=i0,i1
+                        jb=start_+offsets(1)
+                        best=(x(ib,jb))
+                        do iw=2,nk
+                            j=start_+offsets(iw)
+                            key=(x(ib,j))
+                            if(key<best) then
+                                best=key
+                                jb=j
+                            endif
+                        enddo
+                        y(ib,col)=x(ib,jb)
+                        argmax(ib,col)=jb
+                    enddo
+                else
+                    jbest=start_+offsets(1)
+                    best_rows=(x(i0:i1,start_+offsets(1)))
+                    do iw=2,nk
+                        j=start_+offsets(iw)
+                        do ib=i0,i1
+                            key=(x(ib,j))
+                            if(key<best_rows(ib)) then
+                                best_rows(ib)=key
+                                jbest(ib)=j
+                            endif
+                        enddo
+                    enddo
+                    do ib=i0,i1
+                        jb=jbest(ib)
+                        y(ib,col)=x(ib,jb)
+                        argmax(ib,col)=jb
+                    enddo
+                endif
             case (3)
-                rows=>csc_indices(start_:end_-1)
-                do ib=1,nfi
-                    irow=minloc(abs(x(ib,rows)),1)
-                    dx(ib,rows(irow))=dy(ib,col)
+                if(nk<=max_nk_inner) then
+                    do ib=i0,i1
+                        jb=start_+offsets(1)
+                        best=abs(x(ib,jb))
+                        do iw=2,nk
+                            j=start_+offsets(iw)
+                            key=abs(x(ib,j))
+                            if(key<best) then
+                                best=key
+                                jb=j
+                            endif
+                        enddo
+                        y(ib,col)=x(ib,jb)
+                        argmax(ib,col)=jb
+                    enddo
+                else
+                    jbest=start_+offsets(1)
+                    best_rows=abs(x(i0:i1,start_+offsets(1)))
+                    do iw=2,nk
+                        j=start_+offsets(iw)
+                        do ib=i0,i1
+                            key=abs(x(ib,j))
+                            if(key<best_rows(ib)) then
+                                best_rows(ib)=key
+                                jbest(ib)=j
+                            endif
+                        enddo
+                    enddo
+                    do ib=i0,i1
+                        jb=jbest(ib)
+                        y(ib,col)=x(ib,jb)
+                        argmax(ib,col)=jb
+                    enddo
+                endif
+            case (4)
+                y(i0:i1,col)=x(i0:i1,start_+offsets(1))
+                do iw=2,nk
+                    y(i0:i1,col)=y(i0:i1,col)+x(i0:i1,start_+offsets(iw))
                 enddo
+                y(i0:i1,col)=y(i0:i1,col)/nk
+            endselect
+        enddo
+        if(nk>max_nk_inner) deallocate(jbest, best_rows)
+        !$omp end parallel
+        deallocate(offsets, starts)
+    end subroutine forward_tiled_argmax_d
+
+    subroutine backward_tiled_d(dy, x, dx, img_in_shape, kernel_shape, nfi, dim_in, dim_out, nd, mode)
+        implicit none
+        !f2py threadsafe
+        integer,intent(in) :: nfi, dim_in, dim_out, nd, mode
+        integer,intent(in) :: img_in_shape(nd), kernel_shape(nd)
+        real*8,intent(in) :: x(nfi, dim_in)
+        real*8,intent(in) :: dy(nfi, dim_out)
+        real*8,intent(inout) :: dx(nfi, dim_in)
+
+        integer :: col, iw, ib, j, jb, start_, i0, i1, nk
+        integer,allocatable :: offsets(:), starts(:)
+        real*8 :: key, best
+        integer,allocatable :: jbest(:)
+        real*8,allocatable :: best_rows(:)
+        integer,parameter :: max_nk_inner=16
+        real*8,parameter :: zero=0D0
+        !f2py intent(in) x, dy, img_in_shape, kernel_shape
+        !f2py intent(in) nfi, dim_in, dim_out, nd, mode
+        !f2py real*8 optional,intent(in,out),depend(nfi,dim_in) :: dx(nfi,dim_in)
+
+        if(mode<0 .or. mode>4) then
+            print*,'Error: Pooling mode not exist!'
+            stop 1
+        endif
+        nk=product(kernel_shape)
+        allocate(offsets(nk), starts(dim_out))
+        call tile_offsets(img_in_shape, kernel_shape, nd, offsets, nk, starts, dim_out)
+        dx=zero
+
+        !$omp parallel private(col, iw, ib, j, jb, start_, i0, i1, key, best, jbest, best_rows)
+        i0=1
+        i1=nfi
+        !$ i0=omp_get_thread_num()*nfi/omp_get_num_threads()+1
+        !$ i1=(omp_get_thread_num()+1)*nfi/omp_get_num_threads()
+        if(nk>max_nk_inner) allocate(jbest(i0:i1), best_rows(i0:i1))
+        do col=1,dim_out
+            start_=starts(col)
+            select case (mode)
+            case (0)
+                if(nk<=max_nk_inner) then
+                    do ib=i0,i1
+                        jb=start_+offsets(1)
+                        best=(x(ib,jb))
+                        do iw=2,nk
+                            j=start_+offsets(iw)
+                            key=(x(ib,j))
+                            if(key>best) then
+                                best=key
+                                jb=j
+                            endif
+                        enddo
+                        dx(ib,jb)=dy(ib,col)
+                    enddo
+                else
+                    jbest=start_+offsets(1)
+                    best_rows=(x(i0:i1,start_+offsets(1)))
+                    do iw=2,nk
+                        j=start_+offsets(iw)
+                        do ib=i0,i1
+                            key=(x(ib,j))
+                            if(key>best_rows(ib)) then
+                                best_rows(ib)=key
+                                jbest(ib)=j
+                            endif
+                        enddo
+                    enddo
+                    do ib=i0,i1
+                        jb=jbest(ib)
+                        dx(ib,jb)=dy(ib,col)
+                    enddo
+                endif
+            case (1)
+                if(nk<=max_nk_inner) then
+                    do ib=i0,i1
+                        jb=start_+offsets(1)
+                        best=abs(x(ib,jb))
+                        do iw=2,nk
+                            j=start_+offsets(iw)
+                            key=abs(x(ib,j))
+                            if(key>best) then
+                                best=key
+                                jb=j
+                            endif
+                        enddo
+                        dx(ib,jb)=dy(ib,col)
+                    enddo
+                else
+                    jbest=start_+offsets(1)
+                    best_rows=abs(x(i0:i1,start_+offsets(1)))
+                    do iw=2,nk
+                        j=start_+offsets(iw)
+                        do ib=i0,i1
+                            key=abs(x(ib,j))
+                            if(key>best_rows(ib)) then
+                                best_rows(ib)=key
+                                jbest(ib)=j
+                            endif
+                        enddo
+                    enddo
+                    do ib=i0,i1
+                        jb=jbest(ib)
+                        dx(ib,jb)=dy(ib,col)
+                    enddo
+                endif
+            case (2)
+                if(nk<=max_nk_inner) then
+                    do ib=i0,i1
+                        jb=start_+offsets(1)
+                        best=(x(ib,jb))
+                        do iw=2,nk
+                            j=start_+offsets(iw)
+                            key=(x(ib,j))
+                            if(key<best) then
+                                best=key
+                                jb=j
+                            endif
+                        enddo
+                        dx(ib,jb)=dy(ib,col)
+                    enddo
+                else
+                    jbest=start_+offsets(1)
+                    best_rows=(x(i0:i1,start_+offsets(1)))
+                    do iw=2,nk
+                        j=start_+offsets(iw)
+                        do ib=i0,i1
+                            key=(x(ib,j))
+                            if(key<best_rows(ib)) then
+                                best_rows(ib)=key
+                                jbest(ib)=j
+                            endif
+                        enddo
+                    enddo
+                    do ib=i0,i1
+                        jb=jbest(ib)
+                        dx(ib,jb)=dy(ib,col)
+                    enddo
+                endif
+            case (3)
+                if(nk<=max_nk_inner) then
+                    do ib=i0,i1
+                        jb=start_+offsets(1)
+                        best=abs(x(ib,jb))
+                        do iw=2,nk
+                            j=start_+offsets(iw)
+                            key=abs(x(ib,j))
+                            if(key<best) then
+                                best=key
+                                jb=j
+                            endif
+                        enddo
+                        dx(ib,jb)=dy(ib,col)
+                    enddo
+                else
+                    jbest=start_+offsets(1)
+                    best_rows=abs(x(i0:i1,start_+offsets(1)))
+                    do iw=2,nk
+                        j=start_+offsets(iw)
+                        do ib=i0,i1
+                            key=abs(x(ib,j))
+                            if(key<best_rows(ib)) then
+                                best_rows(ib)=key
+                                jbest(ib)=j
+                            endif
+                        enddo
+                    enddo
+                    do ib=i0,i1
+                        jb=jbest(ib)
+                        dx(ib,jb)=dy(ib,col)
+                    enddo
+                endif
             case (4)
-                y_work=dy(:,col)/(end_-start_)
-                do irow=start_,end_-1
-                    dx(:,csc_indices(irow))=y_work
+                do iw=1,nk
+                    dx(i0:i1,start_+offsets(iw))=dy(i0:i1,col)/nk
                 enddo
-            case default
-                print*,'Error: Pooling mode not exist!'
-                stop 1
             endselect
         enddo
-    end subroutine backward_d
+        if(nk>max_nk_inner) deallocate(jbest, best_rows)
+        !$omp end parallel
+        deallocate(offsets, starts)
+    end subroutine backward_tiled_d
+
+    subroutine backward_argmax_d(dy, argmax, dx, dim_in, dim_out, nfi)
+        implicit none
+        !f2py threadsafe
+        integer,intent(in) :: dim_in, dim_out, nfi
+        real*8,intent(in) :: dy(nfi, dim_out)
+        integer,intent(in) :: argmax(nfi, dim_out)
+        real*8,intent(inout) :: dx(nfi, dim_in)
+
+        integer :: col, ib, i0, i1
+        real*8,parameter :: zero=0D0
+
+        !f2py intent(in) dy, argmax, dim_in
+        !f2py intent(in) nfi, dim_out
+        !f2py real*8 optional,intent(in,out),depend(nfi,dim_in) :: dx(nfi,dim_in)
+
+        dx=zero
+
+        !rows i0:i1 of dx are written by this thread.
+        !$omp parallel private(col, ib, i0, i1)
+        i0=1
+        i1=nfi
+        !$ i0=omp_get_thread_num()*nfi/omp_get_num_threads()+1
+        !$ i1=(omp_get_thread_num()+1)*nfi/omp_get_num_threads()
+        do col=1,dim_out
+            do ib=i0,i1
+                dx(ib,argmax(ib,col))=dy(ib,col)
+            enddo
+        enddo
+        !$omp end parallel
+    end subroutine backward_argmax_d
     !mode = 0: max real.
     !mode = 1: max abs.
     !mode = 2: min real.
     !mode = 3: min abs.
     !mode = 4: mean pooling.
-    subroutine forward_s(x, y, csc_indptr, csc_indices, nnz, dim_in, dim_out, nfi, mode)
+    !pooling over a regular tiling, without index arrays,
+    !rows (batch and feature) of x are contiguous, and split among threads.
+    !forward_tiled_argmax also returns the selected columns of x in argmax.
+    subroutine forward_tiled_s(x, y, img_in_shape, kernel_shape, nfi, dim_in, dim_out, nd, mode)
         implicit none
-        integer,intent(in) :: nnz, dim_in, dim_out, nfi,mode
+        !f2py threadsafe
+        integer,intent(in) :: nfi, dim_in, dim_out, nd, mode
+        integer,intent(in) :: img_in_shape(nd), kernel_shape(nd)
         real*4,intent(in) :: x(nfi, dim_in)
-        integer,intent(in),target :: csc_indices(nnz)
-        integer,intent(in) :: csc_indptr(dim_out+1)
-        real*4,intent(out) :: y(nfi, dim_out)
+        real*4,intent(inout) :: y(nfi, dim_out)
+        
 
-        integer,pointer :: rows(:)
-        integer :: start_, end_, col, ib, irow
-        !f2py intent(in) x, csc_indices, csc_indptr
-        !f2py intent(in) nfi, nnz, dim_out, dim_in
-        !f2py intent(out) y
+        integer :: col, iw, ib, j, jb, start_, i0, i1, nk
+        integer,allocatable :: offsets(:), starts(:)
+        real*4 :: key, best
+        integer,allocatable :: jbest(:)
+        real*4,allocatable :: best_rows(:)
+        !windows larger than this are scanned by columns, keeping x contiguous.
+        integer,parameter :: max_nk_inner=16
+        !f2py intent(in) x, img_in_shape, kernel_shape, dim_out
+        !f2py intent(in) nfi, dim_in, nd, mode
+        !f2py real*4 optional,intent(in,out),depend(nfi,dim_out) :: y(nfi,dim_out)
+        
 
-        do col=1, dim_out
-            start_=csc_indptr(col)
-            end_=csc_indptr(col+1)
+        if(mode<0 .or. mode>4) then
+            print*,'Error: Pooling mode not exist!'
+            stop 1
+        endif
+        nk=product(kernel_shape)
+        allocate(offsets(nk), starts(dim_out))
+        call tile_offsets(img_in_shape, kernel_shape, nd, offsets, nk, starts, dim_out)
 
-            !prepair work space by taking rows in x.
+        !$omp parallel private(col, iw, ib, j, jb, start_, i0, i1, key, best, jbest, best_rows)
+        i0=1
+        i1=nfi
+        !$ i0=omp_get_thread_num()*nfi/omp_get_num_threads()+1
+        !$ i1=(omp_get_thread_num()+1)*nfi/omp_get_num_threads()
+        if(nk>max_nk_inner) allocate(jbest(i0:i1), best_rows(i0:i1))
+        do col=1,dim_out
+            start_=starts(col)
             select case (mode)
             case (0)
-                y(:,col)=maxval(x(:,csc_indices(start_:end_-1)),2)
-                case (1)
-                rows=>csc_indices(start_:end_-1)
-                do ib=1,nfi
-                    irow=maxloc(abs(x(ib,rows)),1)
-                    y(ib,col)=x(ib,rows(irow))
+                y(i0:i1,col)=x(i0:i1,start_+offsets(1))
+                do iw=2,nk
+                    y(i0:i1,col)=max(y(i0:i1,col),x(i0:i1,start_+offsets(iw)))
                 enddo
+            case (1)
+                if(nk<=max_nk_inner) then
+                    do ib=i0,i1
+                        jb=start_+offsets(1)
+                        best=abs(x(ib,jb))
+                        do iw=2,nk
+                            j=start_+offsets(iw)
+                            key=abs(x(ib,j))
+                            if(key>best) then
+                                best=key
+                                jb=j
+                            endif
+                        enddo
+                        y(ib,col)=x(ib,jb)
+                    enddo
+                else
+                    jbest=start_+offsets(1)
+                    best_rows=abs(x(i0:i1,start_+offsets(1)))
+                    do iw=2,nk
+                        j=start_+offsets(iw)
+                        do ib=i0,i1
+                            key=abs(x(ib,j))
+                            if(key>best_rows(ib)) then
+                                best_rows(ib)=key
+                                jbest(ib)=j
+                            endif
+                        enddo
+                    enddo
+                    do ib=i0,i1
+                        jb=jbest(ib)
+                        y(ib,col)=x(ib,jb)
+                    enddo
+                endif
             case (2)
-                y(:,col)=minval(x(:,csc_indices(start_:end_-1)),2)
-                case (3)
-                rows=>csc_indices(start_:end_-1)
-                do ib=1,nfi
-                    irow=minloc(abs(x(ib,rows)),1)
-                    y(ib,col)=x(ib,rows(irow))
+                y(i0:i1,col)=x(i0:i1,start_+offsets(1))
+                do iw=2,nk
+                    y(i0:i1,col)=min(y(i0:i1,col),x(i0:i1,start_+offsets(iw)))
                 enddo
+            case (3)
+                if(nk<=max_nk_inner) then
+                    do ib=i0,i1
+                        jb=start_+offsets(1)
+                        best=abs(x(ib,jb))
+                        do iw=2,nk
+                            j=start_+offsets(iw)
+                            key=abs(x(ib,j))
+                            if(key<best) then
+                                best=key
+                                jb=j
+                            endif
+                        enddo
+                        y(ib,col)=x(ib,jb)
+                    enddo
+                else
+                    jbest=start_+offsets(1)
+                    best_rows=abs(x(i0:i1,start_+offsets(1)))
+                    do iw=2,nk
+                        j=start_+offsets(iw)
+                        do ib=i0,i1
+                            key=abs(x(ib,j))
+                            if(key<best_rows(ib)) then
+                                best_rows(ib)=key
+                                jbest(ib)=j
+                            endif
+                        enddo
+                    enddo
+                    do ib=i0,i1
+                        jb=jbest(ib)
+                        y(ib,col)=x(ib,jb)
+                    enddo
+                endif
             case (4)
-                y(:,col)=sum(x(:,csc_indices(start_:end_-1)),2)/(end_-start_)
-            case default
-                print*,'Error: Pooling mode not exist!'
-                stop 1
+                y(i0:i1,col)=x(i0:i1,start_+offsets(1))
+                do iw=2,nk
+                    y(i0:i1,col)=y(i0:i1,col)+x(i0:i1,start_+offsets(iw))
+                enddo
+                y(i0:i1,col)=y(i0:i1,col)/nk
             endselect
         enddo
-    end subroutine forward_s
+        if(nk>max_nk_inner) deallocate(jbest, best_rows)
+        !$omp end parallel
+        deallocate(offsets, starts)
+    end subroutine forward_tiled_s
 
-    subroutine backward_s(dy,x,dx,csc_indptr,csc_indices, nnz,dim_in,dim_out,nfi,mode)
+    subroutine forward_tiled_argmax_s(x, y, argmax, img_in_shape, kernel_shape, nfi, dim_in, dim_out, nd, mode)
         implicit none
-        integer,intent(in) :: nnz,dim_in,dim_out,nfi,mode
+        !f2py threadsafe
+        integer,intent(in) :: nfi, dim_in, dim_out, nd, mode
+        integer,intent(in) :: img_in_shape(nd), kernel_shape(nd)
         real*4,intent(in) :: x(nfi, dim_in)
-        real*4,intent(in) :: dy(nfi, dim_out)
-        integer,intent(in),target :: csc_indices(nnz)
-        integer,intent(in) :: csc_indptr(dim_out+1)
-        real*4,intent(out) :: dx(nfi, dim_in)
-
-        integer :: start_, end_, col, irow, ib
-        integer,pointer :: rows(:)
-        real*4 :: y_work(nfi)
-        real*4,parameter :: one=1.0
-        real*4,parameter :: zero=0.0
+        real*4,intent(inout) :: y(nfi, dim_out)
+        integer,intent(out) :: argmax(nfi, dim_out)
 
-        !f2py intent(in) x, dy, csc_indices, csc_indptr
-        !f2py intent(in) nfi, dim_in, dim_out, nnz
-        !f2py intent(out) dx
+        integer :: col, iw, ib, j, jb, start_, i0, i1, nk
+        integer,allocatable :: offsets(:), starts(:)
+        real*4 :: key, best
+        integer,allocatable :: jbest(:)
+        real*4,allocatable :: best_rows(:)
+        !windows larger than this are scanned by columns, keeping x contiguous.
+        integer,parameter :: max_nk_inner=16
+        !f2py intent(in) x, img_in_shape, kernel_shape, dim_out
+        !f2py intent(in) nfi, dim_in, nd, mode
+        !f2py real*4 optional,intent(in,out),depend(nfi,dim_out) :: y(nfi,dim_out)
+        !f2py intent(out) argmax
 
-        if(mode==0) dx=0
+        if(mode<0 .or. mode>4) then
+            print*,'Error: Pooling mode not exist!'
+            stop 1
+        endif
+        nk=product(kernel_shape)
+        allocate(offsets(nk), starts(dim_out))
+        call tile_offsets(img_in_shape, kernel_shape, nd, offsets, nk, starts, dim_out)
 
+        !$omp parallel private(col, iw, ib, j, jb, start_, i0, i1, key, best, jbest, best_rows)
+        i0=1
+        i1=nfi
+        !$ i0=omp_get_thread_num()*nfi/omp_get_num_threads()+1
+        !$ i1=(omp_get_thread_num()+1)*nfi/omp_get_num_threads()
+        if(nk>max_nk_inner) allocate(jbest(i0:i1), best_rows(i0:i1))
         do col=1,dim_out
-            start_=csc_indptr(col)
-            end_=csc_indptr(col+1)
-
+            start_=starts(col)
             select case (mode)
             case (0)
-                !prepair work space by taking rows in x.
-                rows=>csc_indices(start_:end_-1)
-                do ib=1,nfi
-                    irow=maxloc((x(ib,rows)),1)
-                    dx(ib,rows(irow))=dy(ib,col)
-                enddo
+                if(nk<=max_nk_inner) then
+                    do ib=i0,i1
+                        jb=start_+offsets(1)
+                        best=(x(ib,jb))
+                        do iw=2,nk
+                            j=start_+offsets(iw)
+                            key=(x(ib,j))
+                            if(key>best) then
+                                best=key
+                                jb=j
+                            endif
+                        enddo
+                        y(ib,col)=x(ib,jb)
+                        argmax(ib,col)=jb
+                    enddo
+                else
+                    jbest=start_+offsets(1)
+                    best_rows=(x(i0:i1,start_+offsets(1)))
+                    do iw=2,nk
+                        j=start_+offsets(iw)
+                        do ib=i0,i1
+                            key=(x(ib,j))
+                            if(key>best_rows(ib)) then
+                                best_rows(ib)=key
+                                jbest(ib)=j
+                            endif
+                        enddo
+                    enddo
+                    do ib=i0,i1
+                        jb=jbest(ib)
+                        y(ib,col)=x(ib,jb)
+                        argmax(ib,col)=jb
+                    enddo
+                endif
             case (1)
-                rows=>csc_indices(start_:end_-1)
-                do ib=1,nfi
-                    irow=maxloc(abs(x(ib,rows)),1)
-                    dx(ib,rows(irow))=dy(ib,col)
-                enddo
+                if(nk<=max_nk_inner) then
+                    do ib=i0,i1
+                        jb=start_+offsets(1)
+                        best=abs(x(ib,jb))
+                        do iw=2,nk
+                            j=start_+offsets(iw)
+                            key=abs(x(ib,j))
+                            if(key>best) then
+                                best=key
+                                jb=j
+                            endif
+                        enddo
+                        y(ib,col)=x(ib,jb)
+                        argmax(ib,col)=jb
+                    enddo
+                else
+                    jbest=start_+offsets(1)
+                    best_rows=abs(x(i0:i1,start_+offsets(1)))
+                    do iw=2,nk
+                        j=start_+offsets(iw)
+                        do ib=i0,i1
+                            key=abs(x(ib,j))
+                            if(key>best_rows(ib)) then
+                                best_rows(ib)=key
+                                jbest(ib)=j
+                            endif
+                        enddo
+                    enddo
+                    do ib=i0,i1
+                        jb=jbest(ib)
+                        y(ib,col)=x(ib,jb)
+                        argmax(ib,col)=jb
+                    enddo
+                endif
             case (2)
-                rows=>csc_indices(start_:end_-1)
-                do ib=1,nfi
-                    irow=minloc((x(ib,rows)),1)
-                    dx(ib,rows(irow))=dy(ib,col)
-                enddo
+                if(nk<=max_nk_inner) then
+                    do ib=i0,i1
+                        jb=start_+offsets(1)
+                        best=(x(ib,jb))
+                        do iw=2,nk
+                            j=start_+offsets(iw)
+                            key=(x(ib,j))
+                            if(key<best) then
+                                best=key
+                                jb=j
+                            endif
+                        enddo
+                        y(ib,col)=x(ib,jb)
+                        argmax(ib,col)=jb
+                    enddo
+                else
+                    jbest=start_+offsets(1)
+                    best_rows=(x(i0:i1,start_+offsets(1)))
+                    do iw=2,nk
+                        j=start_+offsets(iw)
+                        do ib=i0,i1
+                            key=(x(ib,j))
+                            if(key<best_rows(ib)) then
+                                best_rows(ib)=key
+                                jbest(ib)=j
+                            endif
+                        enddo
+                    enddo
+                    do ib=i0,i1
+                        jb=jbest(ib)
+                        y(ib,col)=x(ib,jb)
+                        argmax(ib,col)=jb
+                    enddo
+                endif
             case (3)
-                rows=>csc_indices(start_:end_-1)
-                do ib=1,nfi
-                    irow=minloc(abs(x(ib,rows)),1)
-                    dx(ib,rows(irow))=dy(ib,col)
+                if(nk<=max_nk_inner) then
+                    do ib=i0,i1
+                        jb=start_+offsets(1)
+                        best=abs(x(ib,jb))
+                        do iw=2,nk
+                            j=start_+offsets(iw)
+                            key=abs(x(ib,j))
+                            if(key<best) then
+                                best=key
+                                jb=j
+                            endif
+                        enddo
+                        y(ib,col)=x(ib,jb)
+                        argmax(ib,col)=jb
+                    enddo
+                else
+                    jbest=start_+offsets(1)
+                    best_rows=abs(x(i0:i1,start_+offsets(1)))
+                    do iw=2,nk
+                        j=start_+offsets(iw)
+                        do ib=i0,i1
+                            key=abs(x(ib,j))
+                            if(key<best_rows(ib)) then
+                                best_rows(ib)=key
+                                jbest(ib)=j
+                            endif
+                        enddo
+                    enddo
+                    do ib=i0,i1
+                        jb=jbest(ib)
+                        y(ib,col)=x(ib,jb)
+                        argmax(ib,col)=jb
+                    enddo
+                endif
+            case (4)
+                y(i0:i1,col)=x(i0:i1,start_+offsets(1))
+                do iw=2,nk
+                    y(i0:i1,col)=y(i0:i1,col)+x(i0:i1,start_+offsets(iw))
                 enddo
+                y(i0:i1,col)=y(i0:i1,col)/nk
+            endselect
+        enddo
+        if(nk>max_nk_inner) deallocate(jbest, best_rows)
+        !$omp end parallel
+        deallocate(offsets, starts)
+    end subroutine forward_tiled_argmax_s
+
+    subroutine backward_tiled_s(dy, x, dx, img_in_shape, kernel_shape, nfi, dim_in, dim_out, nd, mode)
+        implicit none
+        !f2py threadsafe
+        integer,intent(in) :: nfi, dim_in, dim_out, nd, mode
+        integer,intent(in) :: img_in_shape(nd), kernel_shape(nd)
+        real*4,intent(in) :: x(nfi, dim_in)
+        real*4,intent(in) :: dy(nfi, dim_out)
+        real*4,intent(inout) :: dx(nfi, dim_in)
+
+        integer :: col, iw, ib, j, jb, start_, i0, i1, nk
+        integer,allocatable :: offsets(:), starts(:)
+        real*4 :: key, best
+        integer,allocatable :: jbest(:)
+        real*4,allocatable :: best_rows(:)
+        integer,parameter :: max_nk_inner=16
+        real*4,parameter :: zero=0.0
+        !f2py intent(in) x, dy, img_in_shape, kernel_shape
+        !f2py intent(in) nfi, dim_in, dim_out, nd, mode
+        !f2py real*4 optional,intent(in,out),depend(nfi,dim_in) :: dx(nfi,dim_in)
+
+        if(mode<0 .or. mode>4) then
+            print*,'Error: Pooling mode not exist!'
+            stop 1
+        endif
+        nk=product(kernel_shape)
+        allocate(offsets(nk), starts(dim_out))
+        call tile_offsets(img_in_shape, kernel_shape, nd, offsets, nk, starts, dim_out)
+        dx=zero
+
+        !$omp parallel private(col, iw, ib, j, jb, start_, i0, i1, key, best, jbest, best_rows)
+        i0=1
+        i1=nfi
+        !$ i0=omp_get_thread_num()*nfi/omp_get_num_threads()+1
+        !$ i1=(omp_get_thread_num()+1)*nfi/omp_get_num_threads()
+        if(nk>max_nk_inner) allocate(jbest(i0:i1), best_rows(i0:i1))
+        do col=1,dim_out
+            start_=starts(col)
+            select case (mode)
+            case (0)
+                if(nk<=max_nk_inner) then
+                    do ib=i0,i1
+                        jb=start_+offsets(1)
+                        best=(x(ib,jb))
+                        do iw=2,nk
+                            j=start_+offsets(iw)
+                            key=(x(ib,j))
+                            if(key>best) then
+                                best=key
+                                jb=j
+                            endif
+                        enddo
+                        dx(ib,jb)=dy(ib,col)
+                    enddo
+                else
+                    jbest=start_+offsets(1)
+                    best_rows=(x(i0:i1,start_+offsets(1)))
+                    do iw=2,nk
+                        j=start_+offsets(iw)
+                        do ib=i0,i1
+                            key=(x(ib,j))
+                            if(key>best_rows(ib)) then
+                                best_rows(ib)=key
+                                jbest(ib)=j
+                            endif
+                        enddo
+                    enddo
+                    do ib=i0,i1
+                        jb=jbest(ib)
+                        dx(ib,jb)=dy(ib,col)
+                    enddo
+                endif
+            case (1)
+                if(nk<=max_nk_inner) then
+                    do ib=i0,i1
+                        jb=start_+offsets(1)
+                        best=abs(x(ib,jb))
+                        do iw=2,nk
+                            j=start_+offsets(iw)
+                            key=abs(x(ib,j))
+                            if(key>best) then
+                                best=key
+                                jb=j
+                            endif
+                        enddo
+                        dx(ib,jb)=dy(ib,col)
+                    enddo
+                else
+                    jbest=start_+offsets(1)
+                    best_rows=abs(x(i0:i1,start_+offsets(1)))
+                    do iw=2,nk
+                        j=start_+offsets(iw)
+                        do ib=i0,i1
+                            key=abs(x(ib,j))
+                            if(key>best_rows(ib)) then
+                                best_rows(ib)=key
+                                jbest(ib)=j
+                            endif
+                        enddo
+                    enddo
+                    do ib=i0,i1
+                        jb=jbest(ib)
+                        dx(ib,jb)=dy(ib,col)
+                    enddo
+                endif
+            case (2)
+                if(nk<=max_nk_inner) then
+                    do ib=i0,i1
+                        jb=start_+offsets(1)
+                        best=(x(ib,jb))
+                        do iw=2,nk
+                            j=start_+offsets(iw)
+                            key=(x(ib,j))
+                            if(key<best) then
+                                best=key
+                                jb=j
+                            endif
+                        enddo
+                        dx(ib,jb)=dy(ib,col)
+                    enddo
+                else
+                    jbest=start_+offsets(1)
+                    best_rows=(x(i0:i1,start_+offsets(1)))
+                    do iw=2,nk
+                        j=start_+offsets(iw)
+                        do ib=i0,i1
+                            key=(x(ib,j))
+                            if(key<best_rows(ib)) then
+                                best_rows(ib)=key
+                                jbest(ib)=j
+                            endif
+                        enddo
+                    enddo
+                    do ib=i0,i1
+                        jb=jbest(ib)
+                        dx(ib,jb)=dy(ib,col)
+                    enddo
+                endif
+            case (3)
+                if(nk<=max_nk_inner) then
+                    do ib=i0,i1
+                        jb=start_+offsets(1)
+                        best=abs(x(ib,jb))
+                        do iw=2,nk
+                            j=start_+offsets(iw)
+                            key=abs(x(ib,j))
+                            if(key<best) then
+                                best=key
+                                jb=j
+                            endif
+                        enddo
+                        dx(ib,jb)=dy(ib,col)
+                    enddo
+                else
+                    jbest=start_+offsets(1)
+                    best_rows=abs(x(i0:i1,start_+offsets(1)))
+                    do iw=2,nk
+                        j=start_+offsets(iw)
+                        do ib=i0,i1
+                            key=abs(x(ib,j))
+                            if(key<best_rows(ib)) then
+                                best_rows(ib)=key
+                                jbest(ib)=j
+                            endif
+                        enddo
+                    enddo
+                    do ib=i0,i1
+                        jb=jbest(ib)
+                        dx(ib,jb)=dy(ib,col)
+                    enddo
+                endif
             case (4)
-                y_work=dy(:,col)/(end_-start_)
-                do irow=start_,end_-1
-                    dx(:,csc_indices(irow))=y_work
+                do iw=1,nk
+                    dx(i0:i1,start_+offsets(iw))=dy(i0:i1,col)/nk
                 enddo
-            case default
-                print*,'Error: Pooling mode not exist!'
-                stop 1
             endselect
         enddo
-    end subroutine backward_s
+        if(nk>max_nk_inner) deallocate(jbest, best_rows)
+        !$omp end parallel
+        deallocate(offsets, starts)
+    end subroutine backward_tiled_s
+
+    subroutine backward_argmax_s(dy, argmax, dx, dim_in, dim_out, nfi)
+        implicit none
+        !f2py threadsafe
+        integer,intent(in) :: dim_in, dim_out, nfi
+        real*4,intent(in) :: dy(nfi, dim_out)
+        integer,intent(in) :: argmax(nfi, dim_out)
+        real*4,intent(inout) :: dx(nfi, dim_in)
+
+        integer :: col, ib, i0, i1
+        real*4,parameter :: zero=0.0
+
+        !f2py intent(in) dy, argmax, dim_in
+        !f2py intent(in) nfi, dim_out
+        !f2py real*4 optional,intent(in,out),depend(nfi,dim_in) :: dx(nfi,dim_in)
+
+        dx=zero
+
+        !rows i0:i1 of dx are written by this thread.
+        !$omp parallel private(col, ib, i0, i1)
+        i0=1
+        i1=nfi
+        !$ i0=omp_get_thread_num()*nfi/omp_get_num_threads()+1
+        !$ i1=(omp_get_thread_num()+1)*nfi/omp_get_num_threads()
+        do col=1,dim_out
+            do ib=i0,i1
+                dx(ib,argmax(ib,col))=dy(ib,col)
+            enddo
+        enddo
+        !$omp end parallel
+    end subroutine backward_argmax_s
     end module lib
\ No newline at end of file
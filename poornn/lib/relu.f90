@@ -1,16 +1,20 @@
 !This is an f90 file automatically generated.
 !orders: conv_dim_out/in, feature_dim_out/in, batch_dim
 !version: 1 -> real-imagine seperate, otherwise real only
+!loops run in parallel if compiled with OpenMP and longer than 32768.
 module lib
     contains
     subroutine forward_rz(x, y, dim_in, leak)
         implicit none
+        !f2py threadsafe
         integer,intent(in) :: dim_in
         real*8,intent(in) :: leak
         complex*16,intent(in) :: x(dim_in)
-        complex*16,intent(out) :: y(dim_in)
+        complex*16,intent(inout) :: y(dim_in)
         integer :: i
+        !f2py complex*16 optional,intent(in,out),depend(dim_in) :: y(dim_in)
         complex*16 :: xi
+        !$omp parallel do schedule(static) private(xi) if(dim_in>32768)
         do i=1,dim_in
             xi=x(i)
             if(real(xi)<0) then
@@ -20,19 +24,23 @@ module lib
             endif
             
         enddo
+        !$omp end parallel do
     end subroutine forward_rz
 
     subroutine backward_rz(dy,x,dx,dim_in,leak)
         implicit none
+        !f2py threadsafe
         integer,intent(in) :: dim_in
         real*8,intent(in) :: leak
         complex*16,intent(in) :: x(dim_in)
         complex*16,intent(in) :: dy(dim_in)
-        complex*16,intent(out) :: dx(dim_in)
+        complex*16,intent(inout) :: dx(dim_in)
         complex*16 :: xi
+        !f2py complex*16 optional,intent(in,out),depend(dim_in) :: dx(dim_in)
 
         integer :: i
 
+        !$omp parallel do schedule(static) private(xi) if(dim_in>32768)
         do i=1,dim_in
             xi=x(i)
             if(real(xi)<0) then
@@ -42,15 +50,19 @@ module lib
             endif
             
         enddo
+        !$omp end parallel do
     end subroutine backward_rz
     subroutine forward_riz(x, y, dim_in, leak)
         implicit none
+        !f2py threadsafe
         integer,intent(in) :: dim_in
         real*8,intent(in) :: leak
         complex*16,intent(in) :: x(dim_in)
-        complex*16,intent(out) :: y(dim_in)
+        complex*16,intent(inout) :: y(dim_in)
         integer :: i
+        !f2py complex*16 optional,intent(in,out),depend(dim_in) :: y(dim_in)
         complex*16 :: xi
+        !$omp parallel do schedule(static) private(xi) if(dim_in>32768)
         do i=1,dim_in
             xi=x(i)
             if(aimag(xi)>0 .and. real(xi)>0) then
@@ -63,19 +75,23 @@ module lib
                 y(i)=dcmplx(real(xi),leak*aimag(xi))
             endif
         enddo
+        !$omp end parallel do
     end subroutine forward_riz
 
     subroutine backward_riz(dy,x,dx,dim_in,leak)
         implicit none
+        !f2py threadsafe
         integer,intent(in) :: dim_in
         real*8,intent(in) :: leak
         complex*16,intent(in) :: x(dim_in)
         complex*16,intent(in) :: dy(dim_in)
-        complex*16,intent(out) :: dx(dim_in)
+        complex*16,intent(inout) :: dx(dim_in)
         complex*16 :: xi
+        !f2py complex*16 optional,intent(in,out),depend(dim_in) :: dx(dim_in)
 
         integer :: i
 
+        !$omp parallel do schedule(static) private(xi) if(dim_in>32768)
         do i=1,dim_in
             xi=x(i)
             if(aimag(xi)>0 .and. real(xi)>0) then
@@ -88,16 +104,20 @@ module lib
                 dx(i)=dcmplx(real(dy(i)),leak*aimag(dy(i)))
             endif
         enddo
+        !$omp end parallel do
     end subroutine backward_riz
     
     subroutine forward_rc(x, y, dim_in, leak)
         implicit none
+        !f2py threadsafe
         integer,intent(in) :: dim_in
         real*4,intent(in) :: leak
         complex*8,intent(in) :: x(dim_in)
-        complex*8,intent(out) :: y(dim_in)
+        complex*8,intent(inout) :: y(dim_in)
         integer :: i
+        !f2py complex*8 optional,intent(in,out),depend(dim_in) :: y(dim_in)
         complex*8 :: xi
+        !$omp parallel do schedule(static) private(xi) if(dim_in>32768)
         do i=1,dim_in
             xi=x(i)
             if(real(xi)<0) then
@@ -107,19 +127,23 @@ module lib
             endif
             
         enddo
+        !$omp end parallel do
     end subroutine forward_rc
 
     subroutine backward_rc(dy,x,dx,dim_in,leak)
         implicit none
+        !f2py threadsafe
         integer,intent(in) :: dim_in
         real*4,intent(in) :: leak
         complex*8,intent(in) :: x(dim_in)
         complex*8,intent(in) :: dy(dim_in)
-        complex*8,intent(out) :: dx(dim_in)
+        complex*8,intent(inout) :: dx(dim_in)
         complex*8 :: xi
+        !f2py complex*8 optional,intent(in,out),depend(dim_in) :: dx(dim_in)
 
         integer :: i
 
+        !$omp parallel do schedule(static) private(xi) if(dim_in>32768)
         do i=1,dim_in
             xi=x(i)
             if(real(xi)<0) then
@@ -129,15 +153,19 @@ module lib
             endif
             
         enddo
+        !$omp end parallel do
     end subroutine backward_rc
     subroutine forward_ric(x, y, dim_in, leak)
         implicit none
+        !f2py threadsafe
         integer,intent(in) :: dim_in
         real*4,intent(in) :: leak
         complex*8,intent(in) :: x(dim_in)
-        complex*8,intent(out) :: y(dim_in)
+        complex*8,intent(inout) :: y(dim_in)
         integer :: i
+        !f2py complex*8 optional,intent(in,out),depend(dim_in) :: y(dim_in)
         complex*8 :: xi
+        !$omp parallel do schedule(static) private(xi) if(dim_in>32768)
         do i=1,dim_in
             xi=x(i)
             if(aimag(xi)>0 .and. real(xi)>0) then
@@ -150,19 +178,23 @@ module lib
                 y(i)=cmplx(real(xi),leak*aimag(xi))
             endif
         enddo
+        !$omp end parallel do
     end subroutine forward_ric
 
     subroutine backward_ric(dy,x,dx,dim_in,leak)
         implicit none
+        !f2py threadsafe
         integer,intent(in) :: dim_in
         real*4,intent(in) :: leak
         complex*8,intent(in) :: x(dim_in)
         complex*8,intent(in) :: dy(dim_in)
-        complex*8,intent(out) :: dx(dim_in)
+        complex*8,intent(inout) :: dx(dim_in)
         complex*8 :: xi
+        !f2py complex*8 optional,intent(in,out),depend(dim_in) :: dx(dim_in)
 
         integer :: i
 
+        !$omp parallel do schedule(static) private(xi) if(dim_in>32768)
         do i=1,dim_in
             xi=x(i)
             if(aimag(xi)>0 .and. real(xi)>0) then
@@ -175,16 +207,20 @@ module lib
                 dx(i)=cmplx(real(dy(i)),leak*aimag(dy(i)))
             endif
         enddo
+        !$omp end parallel do
     end subroutine backward_ric
     
     subroutine forward_rd(x, y, dim_in, leak)
         implicit none
+        !f2py threadsafe
         integer,intent(in) :: dim_in
         real*8,intent(in) :: leak
         real*8,intent(in) :: x(dim_in)
-        real*8,intent(out) :: y(dim_in)
+        real*8,intent(inout) :: y(dim_in)
         integer :: i
+        !f2py real*8 optional,intent(in,out),depend(dim_in) :: y(dim_in)
         real*8 :: xi
+        !$omp parallel do schedule(static) private(xi) if(dim_in>32768)
         do i=1,dim_in
             xi=x(i)
             if(xi<0) then
@@ -194,19 +230,23 @@ module lib
             endif
             
         enddo
+        !$omp end parallel do
     end subroutine forward_rd
 
     subroutine backward_rd(dy,x,dx,dim_in,leak)
         implicit none
+        !f2py threadsafe
         integer,intent(in) :: dim_in
         real*8,intent(in) :: leak
         real*8,intent(in) :: x(dim_in)
         real*8,intent(in) :: dy(dim_in)
-        real*8,intent(out) :: dx(dim_in)
+        real*8,intent(inout) :: dx(dim_in)
         real*8 :: xi
+        !f2py real*8 optional,intent(in,out),depend(dim_in) :: dx(dim_in)
 
         integer :: i
 
+        !$omp parallel do schedule(static) private(xi) if(dim_in>32768)
         do i=1,dim_in
             xi=x(i)
             if(xi<0) then
@@ -216,16 +256,20 @@ module lib
             endif
             
         enddo
+        !$omp end parallel do
     end subroutine backward_rd
     
     subroutine forward_rs(x, y, dim_in, leak)
         implicit none
+        !f2py threadsafe
         integer,intent(in) :: dim_in
         real*4,intent(in) :: leak
         real*4,intent(in) :: x(dim_in)
-        real*4,intent(out) :: y(dim_in)
+        real*4,intent(inout) :: y(dim_in)
         integer :: i
+        !f2py real*4 optional,intent(in,out),depend(dim_in) :: y(dim_in)
         real*4 :: xi
+        !$omp parallel do schedule(static) private(xi) if(dim_in>32768)
         do i=1,dim_in
             xi=x(i)
             if(xi<0) then
@@ -235,19 +279,23 @@ module lib
             endif
             
         enddo
+        !$omp end parallel do
     end subroutine forward_rs
 
     subroutine backward_rs(dy,x,dx,dim_in,leak)
         implicit none
+        !f2py threadsafe
         integer,intent(in) :: dim_in
         real*4,intent(in) :: leak
         real*4,intent(in) :: x(dim_in)
         real*4,intent(in) :: dy(dim_in)
-        real*4,intent(out) :: dx(dim_in)
+        real*4,intent(inout) :: dx(dim_in)
         real*4 :: xi
+        !f2py real*4 optional,intent(in,out),depend(dim_in) :: dx(dim_in)
 
         integer :: i
 
+        !$omp parallel do schedule(static) private(xi) if(dim_in>32768)
         do i=1,dim_in
             xi=x(i)
             if(xi<0) then
@@ -257,6 +305,7 @@ module lib
             endif
             
         enddo
+        !$omp end parallel do
     end subroutine backward_rs
     
     
@@ -3,15 +3,18 @@ import os
 
 template_list=['linear.template.f90', 'spconv.template.f90',\
         'pooling.template.f90','relu.template.f90', 'spsp.template.f90',\
-        'convprod.template.f90','futils.template.f90']
+        'convprod.template.f90','futils.template.f90', 'fused.template.f90']
 source_list=[tmplt[:-12]+'f90' for tmplt in template_list]
 extension_list=[source[:-4] for source in source_list]
 
 libdir='poornn/lib'
 version_dict={
         'spconv.f90':['general','contiguous'],
-        'spsp.f90':['','_conv'],
         }
+
+# build kernels with OpenMP, unless POORNN_OPENMP=0.
+use_openmp = os.environ.get('POORNN_OPENMP', '1') != '0'
+openmp_args = ['-fopenmp'] if use_openmp else []
 #libdir='.'
 def render_f90s(templates=None):
     from frender import render_f90
@@ -55,5 +58,6 @@ def configuration(parent_package='',top_path=None):
     for extension, source in zip(extension_list, source_list):
         #config.add_extension(extension, [os.path.join(libdir, source)], libraries=libraries,
         #        library_dirs=library_dirs, include_dirs=include_dirs)
-        config.add_extension(extension, [os.path.join(libdir, source)], extra_info=lapack_opt)
+        config.add_extension(extension, [os.path.join(libdir, source)], extra_info=lapack_opt,
+                extra_f90_compile_args=openmp_args, extra_link_args=openmp_args)
     return config
@@ -1,27 +1,118 @@
 !This is an f90 file automatically generated.
 !orders: conv_dim_out/in, feature_dim_out/in, batch_dim
+!loops over output pixels run in parallel if compiled with OpenMP,
+!backward passes with batch split the batch among threads.
 module lib
+    !$ use omp_lib
     contains
+    !complex matrix product c=alpha*op(a)*op(b)+beta*c, op is 'N' or 'T'.
+    !if gemm3m, it uses the 3M (Gauss) scheme, three real gemms on planar
+    !real and imaginary parts instead of four real multiplies per element,
+    !  re = ar*br - ai*bi, im = (ar+ai)*(br+bi) - ar*br - ai*bi.
+    !it saves 25% of flops, the error of the real part is the same as zgemm,
+    !the error of the imaginary part is bounded by (|ar|+|ai|)*(|br|+|bi|)
+    !instead of |a|*|b|, larger if it cancels out.
+    subroutine gemm_z(gemm3m, transa, transb, m, n, k, alpha, a, lda, b, ldb, beta, c, ldc)
+        implicit none
+        logical,intent(in) :: gemm3m
+        character,intent(in) :: transa, transb
+        integer,intent(in) :: m, n, k, lda, ldb, ldc
+        complex*16,intent(in) :: alpha, beta, a(lda,*), b(ldb,*)
+        complex*16,intent(inout) :: c(ldc,*)
+
+        real*8,allocatable :: ar(:,:), ai(:,:), br(:,:), bi(:,:), t1(:,:), t2(:,:)
+        real*8 :: p1, p2
+        integer :: ma, na, mb, nb, i, j
+        real*8,parameter :: rone=1D0, rzero=0D0
+
+        if(.not. gemm3m) then
+            call zgemm(transa, transb, m, n, k, alpha, a, lda, b, ldb, beta, c, ldc)
+            return
+        endif
+        if(m==0 .or. n==0) return
+        if(transa=='N') then
+            ma=m
+            na=k
+        else
+            ma=k
+            na=m
+        endif
+        if(transb=='N') then
+            mb=k
+            nb=n
+        else
+            mb=n
+            nb=k
+        endif
+        allocate(ar(ma,na), ai(ma,na), br(mb,nb), bi(mb,nb), t1(m,n), t2(m,n))
+        do j=1,na
+            do i=1,ma
+                ar(i,j)=real(a(i,j))
+                ai(i,j)=aimag(a(i,j))
+            enddo
+        enddo
+        do j=1,nb
+            do i=1,mb
+                br(i,j)=real(b(i,j))
+                bi(i,j)=aimag(b(i,j))
+            enddo
+        enddo
+        call dgemm(transa, transb, m, n, k, rone, ar, max(ma,1), br, max(mb,1), rzero, t1, m)
+        call dgemm(transa, transb, m, n, k, rone, ai, max(ma,1), bi, max(mb,1), rzero, t2, m)
+
+        !t1 <- real part, t2 <- -(ar*br+ai*bi), the imaginary part is accumulated on t2.
+        do j=1,n
+            do i=1,m
+                p1=t1(i,j)
+                p2=t2(i,j)
+                t1(i,j)=p1-p2
+                t2(i,j)=-p1-p2
+            enddo
+        enddo
+        ar=ar+ai
+        br=br+bi
+        call dgemm(transa, transb, m, n, k, rone, ar, max(ma,1), br, max(mb,1), rone, t2, m)
+
+        do j=1,n
+            if(beta==0) then
+                do i=1,m
+                    c(i,j)=alpha*cmplx(t1(i,j), t2(i,j), kind=8)
+                enddo
+            else
+                do i=1,m
+                    c(i,j)=alpha*cmplx(t1(i,j), t2(i,j), kind=8)+beta*c(i,j)
+                enddo
+            endif
+        enddo
+        deallocate(ar, ai, br, bi, t1, t2)
+    end subroutine gemm_z
+
     subroutine forward_generalz(x, y, bias, num_batch, csc_indptr, csc_indices, fltr_data, weight_indices,&
-            nnz, dim_in, dim_out, nfi, nfo, nd, max_nnz_row)
+            nnz, dim_in, dim_out, nfi, nfo, nd, max_nnz_row, gemm3m)
         implicit none
+        !f2py threadsafe
         integer,intent(in) :: num_batch, nnz, dim_in, dim_out, nfi, nfo, max_nnz_row, nd
+        logical,intent(in) :: gemm3m
+        !f2py logical optional,intent(in) :: gemm3m=0
         complex*16,intent(in) :: x(num_batch, nfi, dim_in), bias(nfo)
         complex*16,intent(in) :: fltr_data(nfo, nfi, nd)
         integer,intent(in) :: csc_indices(nnz), csc_indptr(dim_out+1), weight_indices(nnz)
-        complex*16,intent(out) :: y(num_batch, nfo, dim_out)
+        complex*16,intent(inout) :: y(num_batch, nfo, dim_out)
 
-        complex*16 :: x_work(num_batch, nfi, max_nnz_row), w_work(nfo, nfi, max_nnz_row)
+        complex*16,allocatable :: x_work(:,:,:), w_work(:,:,:)
         integer :: start_, end_, col, ii, nnz_row, k
         complex*16,parameter :: one=dcmplx(1D0,0D0)
         !f2py intent(in) x, csc_indices, csc_indptr, fltr_data, bias, weight_indices
         !f2py intent(in) nfi, nfo, num_batch, max_nnz_row, nnz, dim_out, nd, dim_in
-        !f2py intent(out) y
+        !f2py complex*16 optional,intent(in,out),depend(num_batch, nfo,dim_out) :: y(num_batch, nfo,dim_out)
 
         do ii=1,nfo
             y(:,ii,:)=bias(ii)
         enddo
 
+        !$omp parallel private(start_, end_, col, ii, nnz_row, k, x_work, w_work)
+        allocate(x_work(num_batch, nfi, max_nnz_row), w_work(nfo, nfi, max_nnz_row))
+        !$omp do schedule(static)
         do col=1, dim_out
             start_=csc_indptr(col)
             end_=csc_indptr(col+1)
@@ -33,32 +124,51 @@ module lib
                 x_work(:,:,ii)=x(:,:,csc_indices(start_+ii-1))
                 w_work(:,:,ii)=fltr_data(:,:,weight_indices(start_+ii-1))
             enddo
-            call zgemm('N', 'T', num_batch, nfo, k, one, x_work, num_batch,&
+            call gemm_z(gemm3m, 'N', 'T', num_batch, nfo, k, one, x_work, num_batch,&
                 w_work, nfo, one, y(:,:,col), num_batch)
             enddo
+        !$omp end do
+        deallocate(x_work, w_work)
+        !$omp end parallel
     end subroutine forward_generalz
 
     subroutine backward_generalz(dy,x,dx,dweight,dbias,csc_indptr,csc_indices,weight_indices,fltr_data,&
-            nnz,dim_in,dim_out,nfi,nfo, nd, num_batch, do_xgrad, do_wgrad, do_bgrad, max_nnz_row)
+            nnz,dim_in,dim_out,nfi,nfo, nd, num_batch, do_xgrad, do_wgrad, do_bgrad, max_nnz_row, gemm3m)
         implicit none
+        !f2py threadsafe
         integer,intent(in) :: num_batch, nnz,dim_in,dim_out,nfi,nfo,nd,max_nnz_row
-        logical,intent(in) :: do_xgrad, do_wgrad, do_bgrad
+        logical,intent(in) :: do_xgrad, do_wgrad, do_bgrad, gemm3m
+        !f2py logical optional,intent(in) :: gemm3m=0
         complex*16,intent(in) :: x(num_batch, nfi, dim_in), dy(num_batch, nfo, dim_out),&
             fltr_data(nfo,nfi,nd)
         integer,intent(in) :: csc_indices(nnz), csc_indptr(dim_out+1), weight_indices(nnz)
-        complex*16,intent(out) :: dweight(nfo, nfi, nd), dbias(nfo), dx(num_batch, nfi, dim_in)
+        complex*16,intent(inout) :: dweight(nfo, nfi, nd), dbias(nfo), dx(num_batch, nfi, dim_in)
 
-        integer :: start_, end_, k, col, ii, row, nnz_row
-        complex*16 :: x_work(num_batch, nfi, max_nnz_row), w_work(nfo, nfi, max_nnz_row)
+        integer :: start_, end_, k, col, ii, row, nnz_row, b0, b1, nbl
+        complex*16,allocatable :: x_work(:,:,:), w_work(:,:,:)
         complex*16,parameter :: one=dcmplx(1D0,0D0)
         complex*16,parameter :: zero=dcmplx(0D0,0D0)
 
         !f2py intent(in) x, dy, csc_indices, csc_indptr, weight_indices, fltr_data
         !f2py intent(in) do_xgrad, do_wgrad, do_bgrad
         !f2py intent(in) nfi, nfo, num_batch, nd, max_nnz_row, dim_in, dim_out, nnz
-        !f2py intent(out) dx, dweight, dbias
-
+        !f2py complex*16 optional,intent(in,out),depend(num_batch, nfi,dim_in) :: dx(num_batch, nfi,dim_in)
+        !f2py complex*16 optional,intent(in,out),depend(nfo,nfi,nd) :: dweight(nfo,nfi,nd)
+        !f2py complex*16 optional,intent(in,out),depend(nfo) :: dbias(nfo)
+
+        if(do_xgrad) dx=zero
+        if(do_wgrad) dweight=zero
+        !rows b0:b1 of the batch are taken by this thread.
+        !$omp parallel private(start_, end_, k, col, ii, row, nnz_row, b0, b1, nbl, x_work, w_work)&
+        !$omp reduction(+:dweight)
+        b0=1
+        b1=num_batch
+        !$ b0=omp_get_thread_num()*num_batch/omp_get_num_threads()+1
+        !$ b1=(omp_get_thread_num()+1)*num_batch/omp_get_num_threads()
+        nbl=b1-b0+1
+        allocate(x_work(max(nbl,1), nfi, max_nnz_row), w_work(nfo, nfi, max_nnz_row))
         do col=1,dim_out
+            if(nbl==0) exit
             start_=csc_indptr(col)
             end_=csc_indptr(col+1)
             nnz_row=end_-start_
@@ -67,12 +177,12 @@ module lib
             if(do_wgrad) then
                 !prepair work space by taking rows in x
                 do ii=1,nnz_row
-                    x_work(:,:,ii)=x(:,:,csc_indices(start_+ii-1))
+                    x_work(:,:,ii)=x(b0:b1,:,csc_indices(start_+ii-1))
                 enddo
 
                 !calculate dweight
-                call zgemm('T', 'N', nfo, k, num_batch, one,&
-                    dy(:,:,col), num_batch, x_work, num_batch,&
+                call gemm_z(gemm3m, 'T', 'N', nfo, k, nbl, one,&
+                    dy(b0,1,col), num_batch, x_work, max(nbl,1),&
                     zero, w_work, nfo)
 
                 !extract rows
@@ -87,15 +197,17 @@ module lib
                     w_work(:,:,ii)=fltr_data(:,:,weight_indices(start_+ii-1))
                 enddo
                 !calculate dx
-                call zgemm('N', 'N', num_batch, k, nfo, one, dy(:,:,col), num_batch,&
-                    w_work, nfo, zero, x_work, num_batch)
+                call gemm_z(gemm3m, 'N', 'N', nbl, k, nfo, one, dy(b0,1,col), num_batch,&
+                    w_work, nfo, zero, x_work, max(nbl,1))
                 !extract rows
                 do ii=1,nnz_row
                     row=csc_indices(start_+ii-1)
-                    dx(:,:,row)=dx(:,:,row)+x_work(:,:,ii)
+                    dx(b0:b1,:,row)=dx(b0:b1,:,row)+x_work(:,:,ii)
                 enddo
             endif
         enddo
+        deallocate(x_work, w_work)
+        !$omp end parallel
         if(do_bgrad) then
             !calculate dbias
             dbias=sum(sum(dy,1),2)
@@ -105,23 +217,27 @@ module lib
     subroutine forward1_generalz(x, y, bias, csc_indptr, csc_indices, fltr_data, weight_indices,&
             nnz, dim_in, dim_out, nfi, nfo, nd, max_nnz_row)
         implicit none
+        !f2py threadsafe
         integer,intent(in) :: nnz, dim_in, dim_out, nfi, nfo, max_nnz_row, nd
         complex*16,intent(in) :: x(nfi, dim_in), bias(nfo)
         complex*16,intent(in) :: fltr_data(nfo, nfi, nd)
         integer,intent(in) :: csc_indices(nnz), csc_indptr(dim_out+1), weight_indices(nnz)
-        complex*16,intent(out) :: y(nfo, dim_out)
+        complex*16,intent(inout) :: y(nfo, dim_out)
 
-        complex*16 :: x_work(nfi, max_nnz_row), w_work(nfo, nfi, max_nnz_row)
+        complex*16,allocatable :: x_work(:,:), w_work(:,:,:)
         integer :: start_, end_, col, ii, nnz_row, k
         complex*16,parameter :: one=dcmplx(1D0,0D0)
         !f2py intent(in) x, csc_indices, csc_indptr, fltr_data, bias, weight_indices
         !f2py intent(in) nfi, nfo, max_nnz_row, nnz, dim_out, nd, dim_in
-        !f2py intent(out) y
+        !f2py complex*16 optional,intent(in,out),depend(nfo,dim_out) :: y(nfo,dim_out)
 
         do ii=1,nfo
             y(ii,:)=bias(ii)
         enddo
 
+        !$omp parallel private(start_, end_, col, ii, nnz_row, k, x_work, w_work)
+        allocate(x_work(nfi, max_nnz_row), w_work(nfo, nfi, max_nnz_row))
+        !$omp do schedule(static)
         do col=1, dim_out
             start_=csc_indptr(col)
             end_=csc_indptr(col+1)
@@ -133,31 +249,40 @@ module lib
                 x_work(:,ii)=x(:,csc_indices(start_+ii-1))
                 w_work(:,:,ii)=fltr_data(:,:,weight_indices(start_+ii-1))
             enddo
-            call zgemv('N', nfo, k, one, fltr_data, nfo,&
+            call zgemv('N', nfo, k, one, w_work, nfo,&
             x_work, 1, one, y(:,col), 1)
             enddo
+        !$omp end do
+        deallocate(x_work, w_work)
+        !$omp end parallel
     end subroutine forward1_generalz
 
     subroutine backward1_generalz(dy,x,dx,dweight,dbias,csc_indptr,csc_indices,weight_indices,fltr_data,&
             nnz,dim_in,dim_out,nfi,nfo, nd, do_xgrad, do_wgrad, do_bgrad, max_nnz_row)
         implicit none
+        !f2py threadsafe
         integer,intent(in) :: nnz,dim_in,dim_out,nfi,nfo,nd,max_nnz_row
         logical,intent(in) :: do_xgrad, do_wgrad, do_bgrad
         complex*16,intent(in) :: x(nfi, dim_in), dy(nfo, dim_out),&
             fltr_data(nfo,nfi,nd)
         integer,intent(in) :: csc_indices(nnz), csc_indptr(dim_out+1), weight_indices(nnz)
-        complex*16,intent(out) :: dweight(nfo, nfi, nd), dbias(nfo), dx(nfi, dim_in)
+        complex*16,intent(inout) :: dweight(nfo, nfi, nd), dbias(nfo), dx(nfi, dim_in)
 
         integer :: start_, end_, k, col, ii, row, nnz_row
-        complex*16 :: x_work(nfi, max_nnz_row), w_work(nfo, nfi, max_nnz_row)
+        complex*16,allocatable :: x_work(:,:), w_work(:,:,:)
         complex*16,parameter :: one=dcmplx(1D0,0D0)
         complex*16,parameter :: zero=dcmplx(0D0,0D0)
 
         !f2py intent(in) x, dy, csc_indices, csc_indptr, weight_indices, fltr_data
         !f2py intent(in) do_xgrad, do_wgrad, do_bgrad
         !f2py intent(in) nfi, nfo, nd, max_nnz_row, dim_in, dim_out, nnz
-        !f2py intent(out) dx, dweight, dbias
+        !f2py complex*16 optional,intent(in,out),depend(nfi,dim_in) :: dx(nfi,dim_in)
+        !f2py complex*16 optional,intent(in,out),depend(nfo,nfi,nd) :: dweight(nfo,nfi,nd)
+        !f2py complex*16 optional,intent(in,out),depend(nfo) :: dbias(nfo)
 
+        if(do_xgrad) dx=zero
+        if(do_wgrad) dweight=zero
+        allocate(x_work(nfi, max_nnz_row), w_work(nfo, nfi, max_nnz_row))
         do col=1,dim_out
             start_=csc_indptr(col)
             end_=csc_indptr(col+1)
@@ -196,6 +321,7 @@ module lib
                 enddo
             endif
         enddo
+        deallocate(x_work, w_work)
         if(do_bgrad) then
             !calculate dbias
             dbias=sum(dy,2)
@@ -203,25 +329,31 @@ module lib
     end subroutine backward1_generalz
 
     subroutine forward_contiguousz(x, y, bias, num_batch, csc_indptr, csc_indices, fltr_data,&
-            nnz, dim_in, dim_out, nfi, nfo, nd, max_nnz_row)
+            nnz, dim_in, dim_out, nfi, nfo, nd, max_nnz_row, gemm3m)
         implicit none
+        !f2py threadsafe
         integer,intent(in) :: num_batch, nnz, dim_in, dim_out, nfi, nfo, max_nnz_row, nd
+        logical,intent(in) :: gemm3m
+        !f2py logical optional,intent(in) :: gemm3m=0
         complex*16,intent(in) :: x(num_batch, nfi, dim_in), bias(nfo)
         complex*16,intent(in) :: fltr_data(nfo, nfi, nd)
         integer,intent(in) :: csc_indices(nnz), csc_indptr(dim_out+1)
-        complex*16,intent(out) :: y(num_batch, nfo, dim_out)
+        complex*16,intent(inout) :: y(num_batch, nfo, dim_out)
 
-        complex*16 :: x_work(num_batch, nfi, max_nnz_row)
+        complex*16,allocatable :: x_work(:,:,:)
         integer :: start_, end_, col, ii, nnz_row, k
         complex*16,parameter :: one=dcmplx(1D0,0D0)
         !f2py intent(in) x, csc_indices, csc_indptr, fltr_data, bias
         !f2py intent(in) nfi, nfo, num_batch, max_nnz_row, nnz, dim_out, nd, dim_in
-        !f2py intent(out) y
+        !f2py complex*16 optional,intent(in,out),depend(num_batch, nfo,dim_out) :: y(num_batch, nfo,dim_out)
 
         do ii=1,nfo
             y(:,ii,:)=bias(ii)
         enddo
 
+        !$omp parallel private(start_, end_, col, ii, nnz_row, k, x_work)
+        allocate(x_work(num_batch, nfi, max_nnz_row))
+        !$omp do schedule(static)
         do col=1, dim_out
             start_=csc_indptr(col)
             end_=csc_indptr(col+1)
@@ -233,32 +365,51 @@ module lib
                 x_work(:,:,ii)=x(:,:,csc_indices(start_+ii-1))
                 
             enddo
-            call zgemm('N', 'T', num_batch, nfo, k, one, x_work, num_batch,&
+            call gemm_z(gemm3m, 'N', 'T', num_batch, nfo, k, one, x_work, num_batch,&
                 fltr_data, nfo, one, y(:,:,col), num_batch)
             enddo
+        !$omp end do
+        deallocate(x_work)
+        !$omp end parallel
     end subroutine forward_contiguousz
 
     subroutine backward_contiguousz(dy,x,dx,dweight,dbias,csc_indptr,csc_indices,fltr_data,&
-            nnz,dim_in,dim_out,nfi,nfo, nd, num_batch, do_xgrad, do_wgrad, do_bgrad, max_nnz_row)
+            nnz,dim_in,dim_out,nfi,nfo, nd, num_batch, do_xgrad, do_wgrad, do_bgrad, max_nnz_row, gemm3m)
         implicit none
+        !f2py threadsafe
         integer,intent(in) :: num_batch, nnz,dim_in,dim_out,nfi,nfo,nd,max_nnz_row
-        logical,intent(in) :: do_xgrad, do_wgrad, do_bgrad
+        logical,intent(in) :: do_xgrad, do_wgrad, do_bgrad, gemm3m
+        !f2py logical optional,intent(in) :: gemm3m=0
         complex*16,intent(in) :: x(num_batch, nfi, dim_in), dy(num_batch, nfo, dim_out),&
             fltr_data(nfo,nfi,nd)
         integer,intent(in) :: csc_indices(nnz), csc_indptr(dim_out+1)
-        complex*16,intent(out) :: dweight(nfo, nfi, nd), dbias(nfo), dx(num_batch, nfi, dim_in)
+        complex*16,intent(inout) :: dweight(nfo, nfi, nd), dbias(nfo), dx(num_batch, nfi, dim_in)
 
-        integer :: start_, end_, k, col, ii, row, nnz_row
-        complex*16 :: x_work(num_batch, nfi, max_nnz_row)
+        integer :: start_, end_, k, col, ii, row, nnz_row, b0, b1, nbl
+        complex*16,allocatable :: x_work(:,:,:)
         complex*16,parameter :: one=dcmplx(1D0,0D0)
         complex*16,parameter :: zero=dcmplx(0D0,0D0)
 
         !f2py intent(in) x, dy, csc_indices, csc_indptr, fltr_data
         !f2py intent(in) do_xgrad, do_wgrad, do_bgrad
         !f2py intent(in) nfi, nfo, num_batch, nd, max_nnz_row, dim_in, dim_out, nnz
-        !f2py intent(out) dx, dweight, dbias
-
+        !f2py complex*16 optional,intent(in,out),depend(num_batch, nfi,dim_in) :: dx(num_batch, nfi,dim_in)
+        !f2py complex*16 optional,intent(in,out),depend(nfo,nfi,nd) :: dweight(nfo,nfi,nd)
+        !f2py complex*16 optional,intent(in,out),depend(nfo) :: dbias(nfo)
+
+        if(do_xgrad) dx=zero
+        if(do_wgrad) dweight=zero
+        !rows b0:b1 of the batch are taken by this thread.
+        !$omp parallel private(start_, end_, k, col, ii, row, nnz_row, b0, b1, nbl, x_work)&
+        !$omp reduction(+:dweight)
+        b0=1
+        b1=num_batch
+        !$ b0=omp_get_thread_num()*num_batch/omp_get_num_threads()+1
+        !$ b1=(omp_get_thread_num()+1)*num_batch/omp_get_num_threads()
+        nbl=b1-b0+1
+        allocate(x_work(max(nbl,1), nfi, max_nnz_row))
         do col=1,dim_out
+            if(nbl==0) exit
             start_=csc_indptr(col)
             end_=csc_indptr(col+1)
             nnz_row=end_-start_
@@ -267,26 +418,28 @@ module lib
             if(do_wgrad) then
                 !prepair work space by taking rows in x
                 do ii=1,nnz_row
-                    x_work(:,:,ii)=x(:,:,csc_indices(start_+ii-1))
+                    x_work(:,:,ii)=x(b0:b1,:,csc_indices(start_+ii-1))
                 enddo
 
                 !calculate dweight
-                call zgemm('T', 'N', nfo, k, num_batch, one,&
-                    dy(:,:,col), num_batch, x_work, num_batch,&
+                call gemm_z(gemm3m, 'T', 'N', nfo, k, nbl, one,&
+                    dy(b0,1,col), num_batch, x_work, max(nbl,1),&
                     one, dweight, nfo)
 
                 endif
             if(do_xgrad) then
                 !calculate dx
-                call zgemm('N', 'N', num_batch, k, nfo, one, dy(:,:,col), num_batch,&
-                    fltr_data, nfo, zero, x_work, num_batch)
+                call gemm_z(gemm3m, 'N', 'N', nbl, k, nfo, one, dy(b0,1,col), num_batch,&
+                    fltr_data, nfo, zero, x_work, max(nbl,1))
                 !extract rows
                 do ii=1,nnz_row
                     row=csc_indices(start_+ii-1)
-                    dx(:,:,row)=dx(:,:,row)+x_work(:,:,ii)
+                    dx(b0:b1,:,row)=dx(b0:b1,:,row)+x_work(:,:,ii)
                 enddo
             endif
         enddo
+        deallocate(x_work)
+        !$omp end parallel
         if(do_bgrad) then
             !calculate dbias
             dbias=sum(sum(dy,1),2)
@@ -296,23 +449,27 @@ module lib
     subroutine forward1_contiguousz(x, y, bias, csc_indptr, csc_indices, fltr_data,&
             nnz, dim_in, dim_out, nfi, nfo, nd, max_nnz_row)
         implicit none
+        !f2py threadsafe
         integer,intent(in) :: nnz, dim_in, dim_out, nfi, nfo, max_nnz_row, nd
         complex*16,intent(in) :: x(nfi, dim_in), bias(nfo)
         complex*16,intent(in) :: fltr_data(nfo, nfi, nd)
         integer,intent(in) :: csc_indices(nnz), csc_indptr(dim_out+1)
-        complex*16,intent(out) :: y(nfo, dim_out)
+        complex*16,intent(inout) :: y(nfo, dim_out)
 
-        complex*16 :: x_work(nfi, max_nnz_row)
+        complex*16,allocatable :: x_work(:,:)
         integer :: start_, end_, col, ii, nnz_row, k
         complex*16,parameter :: one=dcmplx(1D0,0D0)
         !f2py intent(in) x, csc_indices, csc_indptr, fltr_data, bias
         !f2py intent(in) nfi, nfo, max_nnz_row, nnz, dim_out, nd, dim_in
-        !f2py intent(out) y
+        !f2py complex*16 optional,intent(in,out),depend(nfo,dim_out) :: y(nfo,dim_out)
 
         do ii=1,nfo
             y(ii,:)=bias(ii)
         enddo
 
+        !$omp parallel private(start_, end_, col, ii, nnz_row, k, x_work)
+        allocate(x_work(nfi, max_nnz_row))
+        !$omp do schedule(static)
         do col=1, dim_out
             start_=csc_indptr(col)
             end_=csc_indptr(col+1)
@@ -327,28 +484,37 @@ module lib
             call zgemv('N', nfo, k, one, fltr_data, nfo,&
             x_work, 1, one, y(:,col), 1)
             enddo
+        !$omp end do
+        deallocate(x_work)
+        !$omp end parallel
     end subroutine forward1_contiguousz
 
     subroutine backward1_contiguousz(dy,x,dx,dweight,dbias,csc_indptr,csc_indices,fltr_data,&
             nnz,dim_in,dim_out,nfi,nfo, nd, do_xgrad, do_wgrad, do_bgrad, max_nnz_row)
         implicit none
+        !f2py threadsafe
         integer,intent(in) :: nnz,dim_in,dim_out,nfi,nfo,nd,max_nnz_row
         logical,intent(in) :: do_xgrad, do_wgrad, do_bgrad
         complex*16,intent(in) :: x(nfi, dim_in), dy(nfo, dim_out),&
             fltr_data(nfo,nfi,nd)
         integer,intent(in) :: csc_indices(nnz), csc_indptr(dim_out+1)
-        complex*16,intent(out) :: dweight(nfo, nfi, nd), dbias(nfo), dx(nfi, dim_in)
+        complex*16,intent(inout) :: dweight(nfo, nfi, nd), dbias(nfo), dx(nfi, dim_in)
 
         integer :: start_, end_, k, col, ii, row, nnz_row
-        complex*16 :: x_work(nfi, max_nnz_row)
+        complex*16,allocatable :: x_work(:,:)
         complex*16,parameter :: one=dcmplx(1D0,0D0)
         complex*16,parameter :: zero=dcmplx(0D0,0D0)
 
         !f2py intent(in) x, dy, csc_indices, csc_indptr, fltr_data
         !f2py intent(in) do_xgrad, do_wgrad, do_bgrad
         !f2py intent(in) nfi, nfo, nd, max_nnz_row, dim_in, dim_out, nnz
-        !f2py intent(out) dx, dweight, dbias
+        !f2py complex*16 optional,intent(in,out),depend(nfi,dim_in) :: dx(nfi,dim_in)
+        !f2py complex*16 optional,intent(in,out),depend(nfo,nfi,nd) :: dweight(nfo,nfi,nd)
+        !f2py complex*16 optional,intent(in,out),depend(nfo) :: dbias(nfo)
 
+        if(do_xgrad) dx=zero
+        if(do_wgrad) dweight=zero
+        allocate(x_work(nfi, max_nnz_row))
         do col=1,dim_out
             start_=csc_indptr(col)
             end_=csc_indptr(col+1)
@@ -378,32 +544,256 @@ module lib
                 enddo
             endif
         enddo
+        deallocate(x_work)
         if(do_bgrad) then
             !calculate dbias
             dbias=sum(dy,2)
         endif
     end subroutine backward1_contiguousz
 
+    subroutine forward_im2colz(x, y, bias, num_batch, csc_indices, fltr_data,&
+            nnz, dim_in, dim_out, nfi, nfo, nd, block_size, gemm3m)
+        implicit none
+        !f2py threadsafe
+        integer,intent(in) :: num_batch, nnz, dim_in, dim_out, nfi, nfo, nd, block_size
+        logical,intent(in) :: gemm3m
+        !f2py logical optional,intent(in) :: gemm3m=0
+        complex*16,intent(in) :: x(num_batch, nfi, dim_in), bias(nfo)
+        complex*16,intent(in) :: fltr_data(nfo, nfi, nd)
+        integer,intent(in) :: csc_indices(nnz)
+        complex*16,intent(inout) :: y(num_batch, nfo, dim_out)
+
+        complex*16,allocatable :: x_work(:,:,:,:), y_work(:,:,:)
+        integer :: col0, nb, bmax, ldw, ii, j
+        complex*16,parameter :: one=dcmplx(1D0,0D0)
+        !f2py intent(in) x, csc_indices, fltr_data, bias
+        !f2py intent(in) nfi, nfo, num_batch, nnz, nd, dim_in, block_size
+        !f2py integer optional,intent(in),depend(nnz,nd) :: dim_out=nnz/nd
+        !f2py complex*16 optional,intent(in,out),depend(num_batch,nfo,dim_out) :: y(num_batch,nfo,dim_out)
+
+        !columns of a block of output pixels, (num_batch, block, nfi, nd),
+        !blocks are made small enough to give every thread some.
+        bmax=max(1,min(block_size,dim_out))
+        !$ bmax=max(1,min(bmax,(dim_out-1)/omp_get_max_threads()+1))
+        ldw=num_batch*bmax
+
+        !$omp parallel private(col0, nb, ii, j, x_work, y_work)
+        allocate(x_work(num_batch, bmax, nfi, nd), y_work(num_batch, bmax, nfo))
+        !$omp do schedule(static)
+        do col0=1, dim_out, bmax
+            nb=min(bmax,dim_out-col0+1)
+
+            !gather patches of input, one column per kernel offset.
+            do ii=1,nd
+                do j=1,nb
+                    x_work(:,j,:,ii)=x(:,:,csc_indices((col0+j-2)*nd+ii))
+                enddo
+            enddo
+            do ii=1,nfo
+                y_work(:,:,ii)=bias(ii)
+            enddo
+
+            call gemm_z(gemm3m, 'N', 'T', num_batch*nb, nfo, nfi*nd, one, x_work, ldw,&
+                fltr_data, nfo, one, y_work, ldw)
+
+            do j=1,nb
+                y(:,:,col0+j-1)=y_work(:,j,:)
+            enddo
+        enddo
+        !$omp end do
+        deallocate(x_work, y_work)
+        !$omp end parallel
+    end subroutine forward_im2colz
+
+    subroutine backward_im2colz(dy,x,dx,dweight,dbias,num_batch,csc_indices,fltr_data,&
+            nnz,dim_in,dim_out,nfi,nfo,nd,do_xgrad,do_wgrad,do_bgrad,block_size,gemm3m)
+        implicit none
+        !f2py threadsafe
+        integer,intent(in) :: num_batch,nnz,dim_in,dim_out,nfi,nfo,nd,block_size
+        logical,intent(in) :: gemm3m
+        !f2py logical optional,intent(in) :: gemm3m=0
+        logical,intent(in) :: do_xgrad, do_wgrad, do_bgrad
+        complex*16,intent(in) :: x(num_batch, nfi, dim_in), dy(num_batch, nfo, dim_out),&
+            fltr_data(nfo,nfi,nd)
+        integer,intent(in) :: csc_indices(nnz)
+        complex*16,intent(inout) :: dweight(nfo, nfi, nd), dbias(nfo), dx(num_batch, nfi, dim_in)
+
+        complex*16,allocatable :: x_work(:,:,:,:), dy_work(:,:,:)
+        integer :: col0, nb, bmax, ldw, ii, j, row, b0, b1, nbl
+        complex*16,parameter :: one=dcmplx(1D0,0D0)
+        complex*16,parameter :: zero=dcmplx(0D0,0D0)
+
+        !f2py intent(in) x, dy, csc_indices, fltr_data
+        !f2py intent(in) do_xgrad, do_wgrad, do_bgrad
+        !f2py intent(in) nfi, nfo, num_batch, nd, dim_in, dim_out, nnz, block_size
+        !f2py complex*16 optional,intent(in,out),depend(num_batch,nfi,dim_in) :: dx(num_batch,nfi,dim_in)
+        !f2py complex*16 optional,intent(in,out),depend(nfo,nfi,nd) :: dweight(nfo,nfi,nd)
+        !f2py complex*16 optional,intent(in,out),depend(nfo) :: dbias(nfo)
+
+        if(do_xgrad) dx=zero
+        if(do_wgrad) dweight=zero
+        if(do_xgrad .or. do_wgrad) then
+            bmax=max(1,min(block_size,dim_out))
+
+            !rows b0:b1 of the batch are taken by this thread.
+            !$omp parallel private(col0, nb, ldw, ii, j, row, b0, b1, nbl, x_work, dy_work)&
+            !$omp reduction(+:dweight)
+            b0=1
+            b1=num_batch
+            !$ b0=omp_get_thread_num()*num_batch/omp_get_num_threads()+1
+            !$ b1=(omp_get_thread_num()+1)*num_batch/omp_get_num_threads()
+            nbl=b1-b0+1
+            ldw=max(nbl,1)*bmax
+            allocate(x_work(max(nbl,1), bmax, nfi, nd), dy_work(max(nbl,1), bmax, nfo))
+
+            do col0=1, dim_out, bmax
+                if(nbl==0) exit
+                nb=min(bmax,dim_out-col0+1)
+                do j=1,nb
+                    dy_work(:,j,:)=dy(b0:b1,:,col0+j-1)
+                enddo
+
+                if(do_wgrad) then
+                    !gather patches of input
+                    do ii=1,nd
+                        do j=1,nb
+                            x_work(:,j,:,ii)=x(b0:b1,:,csc_indices((col0+j-2)*nd+ii))
+                        enddo
+                    enddo
+
+                    !calculate dweight
+                    call gemm_z(gemm3m, 'T', 'N', nfo, nfi*nd, nbl*nb, one,&
+                        dy_work, ldw, x_work, ldw, one, dweight, nfo)
+                endif
+                if(do_xgrad) then
+                    !calculate gradients of patches, and scatter them back to dx.
+                    call gemm_z(gemm3m, 'N', 'N', nbl*nb, nfi*nd, nfo, one,&
+                        dy_work, ldw, fltr_data, nfo, zero, x_work, ldw)
+                    do ii=1,nd
+                        do j=1,nb
+                            row=csc_indices((col0+j-2)*nd+ii)
+                            dx(b0:b1,:,row)=dx(b0:b1,:,row)+x_work(:,j,:,ii)
+                        enddo
+                    enddo
+                endif
+            enddo
+            deallocate(x_work, dy_work)
+            !$omp end parallel
+        endif
+        if(do_bgrad) then
+            !calculate dbias
+            dbias=sum(sum(dy,1),2)
+        endif
+    end subroutine backward_im2colz
+
+    !complex matrix product c=alpha*op(a)*op(b)+beta*c, op is 'N' or 'T'.
+    !if gemm3m, it uses the 3M (Gauss) scheme, three real gemms on planar
+    !real and imaginary parts instead of four real multiplies per element,
+    !  re = ar*br - ai*bi, im = (ar+ai)*(br+bi) - ar*br - ai*bi.
+    !it saves 25% of flops, the error of the real part is the same as zgemm,
+    !the error of the imaginary part is bounded by (|ar|+|ai|)*(|br|+|bi|)
+    !instead of |a|*|b|, larger if it cancels out.
+    subroutine gemm_c(gemm3m, transa, transb, m, n, k, alpha, a, lda, b, ldb, beta, c, ldc)
+        implicit none
+        logical,intent(in) :: gemm3m
+        character,intent(in) :: transa, transb
+        integer,intent(in) :: m, n, k, lda, ldb, ldc
+        complex*8,intent(in) :: alpha, beta, a(lda,*), b(ldb,*)
+        complex*8,intent(inout) :: c(ldc,*)
+
+        real*4,allocatable :: ar(:,:), ai(:,:), br(:,:), bi(:,:), t1(:,:), t2(:,:)
+        real*4 :: p1, p2
+        integer :: ma, na, mb, nb, i, j
+        real*4,parameter :: rone=1.0, rzero=0.0
+
+        if(.not. gemm3m) then
+            call cgemm(transa, transb, m, n, k, alpha, a, lda, b, ldb, beta, c, ldc)
+            return
+        endif
+        if(m==0 .or. n==0) return
+        if(transa=='N') then
+            ma=m
+            na=k
+        else
+            ma=k
+            na=m
+        endif
+        if(transb=='N') then
+            mb=k
+            nb=n
+        else
+            mb=n
+            nb=k
+        endif
+        allocate(ar(ma,na), ai(ma,na), br(mb,nb), bi(mb,nb), t1(m,n), t2(m,n))
+        do j=1,na
+            do i=1,ma
+                ar(i,j)=real(a(i,j))
+                ai(i,j)=aimag(a(i,j))
+            enddo
+        enddo
+        do j=1,nb
+            do i=1,mb
+                br(i,j)=real(b(i,j))
+                bi(i,j)=aimag(b(i,j))
+            enddo
+        enddo
+        call sgemm(transa, transb, m, n, k, rone, ar, max(ma,1), br, max(mb,1), rzero, t1, m)
+        call sgemm(transa, transb, m, n, k, rone, ai, max(ma,1), bi, max(mb,1), rzero, t2, m)
+
+        !t1 <- real part, t2 <- -(ar*br+ai*bi), the imaginary part is accumulated on t2.
+        do j=1,n
+            do i=1,m
+                p1=t1(i,j)
+                p2=t2(i,j)
+                t1(i,j)=p1-p2
+                t2(i,j)=-p1-p2
+            enddo
+        enddo
+        ar=ar+ai
+        br=br+bi
+        call sgemm(transa, transb, m, n, k, rone, ar, max(ma,1), br, max(mb,1), rone, t2, m)
+
+        do j=1,n
+            if(beta==0) then
+                do i=1,m
+                    c(i,j)=alpha*cmplx(t1(i,j), t2(i,j), kind=4)
+                enddo
+            else
+                do i=1,m
+                    c(i,j)=alpha*cmplx(t1(i,j), t2(i,j), kind=4)+beta*c(i,j)
+                enddo
+            endif
+        enddo
+        deallocate(ar, ai, br, bi, t1, t2)
+    end subroutine gemm_c
+
     subroutine forward_generalc(x, y, bias, num_batch, csc_indptr, csc_indices, fltr_data, weight_indices,&
-            nnz, dim_in, dim_out, nfi, nfo, nd, max_nnz_row)
+            nnz, dim_in, dim_out, nfi, nfo, nd, max_nnz_row, gemm3m)
         implicit none
+        !f2py threadsafe
         integer,intent(in) :: num_batch, nnz, dim_in, dim_out, nfi, nfo, max_nnz_row, nd
+        logical,intent(in) :: gemm3m
+        !f2py logical optional,intent(in) :: gemm3m=0
         complex*8,intent(in) :: x(num_batch, nfi, dim_in), bias(nfo)
         complex*8,intent(in) :: fltr_data(nfo, nfi, nd)
         integer,intent(in) :: csc_indices(nnz), csc_indptr(dim_out+1), weight_indices(nnz)
-        complex*8,intent(out) :: y(num_batch, nfo, dim_out)
+        complex*8,intent(inout) :: y(num_batch, nfo, dim_out)
 
-        complex*8 :: x_work(num_batch, nfi, max_nnz_row), w_work(nfo, nfi, max_nnz_row)
+        complex*8,allocatable :: x_work(:,:,:), w_work(:,:,:)
         integer :: start_, end_, col, ii, nnz_row, k
         complex*8,parameter :: one=cmplx(1.0,0.0)
         !f2py intent(in) x, csc_indices, csc_indptr, fltr_data, bias, weight_indices
         !f2py intent(in) nfi, nfo, num_batch, max_nnz_row, nnz, dim_out, nd, dim_in
-        !f2py intent(out) y
+        !f2py complex*8 optional,intent(in,out),depend(num_batch, nfo,dim_out) :: y(num_batch, nfo,dim_out)
 
         do ii=1,nfo
             y(:,ii,:)=bias(ii)
         enddo
 
+        !$omp parallel private(start_, end_, col, ii, nnz_row, k, x_work, w_work)
+        allocate(x_work(num_batch, nfi, max_nnz_row), w_work(nfo, nfi, max_nnz_row))
+        !$omp do schedule(static)
         do col=1, dim_out
             start_=csc_indptr(col)
             end_=csc_indptr(col+1)
@@ -415,32 +805,51 @@ module lib
                 x_work(:,:,ii)=x(:,:,csc_indices(start_+ii-1))
                 w_work(:,:,ii)=fltr_data(:,:,weight_indices(start_+ii-1))
             enddo
-            call cgemm('N', 'T', num_batch, nfo, k, one, x_work, num_batch,&
+            call gemm_c(gemm3m, 'N', 'T', num_batch, nfo, k, one, x_work, num_batch,&
                 w_work, nfo, one, y(:,:,col), num_batch)
             enddo
+        !$omp end do
+        deallocate(x_work, w_work)
+        !$omp end parallel
     end subroutine forward_generalc
 
     subroutine backward_generalc(dy,x,dx,dweight,dbias,csc_indptr,csc_indices,weight_indices,fltr_data,&
-            nnz,dim_in,dim_out,nfi,nfo, nd, num_batch, do_xgrad, do_wgrad, do_bgrad, max_nnz_row)
+            nnz,dim_in,dim_out,nfi,nfo, nd, num_batch, do_xgrad, do_wgrad, do_bgrad, max_nnz_row, gemm3m)
         implicit none
+        !f2py threadsafe
         integer,intent(in) :: num_batch, nnz,dim_in,dim_out,nfi,nfo,nd,max_nnz_row
-        logical,intent(in) :: do_xgrad, do_wgrad, do_bgrad
+        logical,intent(in) :: do_xgrad, do_wgrad, do_bgrad, gemm3m
+        !f2py logical optional,intent(in) :: gemm3m=0
         complex*8,intent(in) :: x(num_batch, nfi, dim_in), dy(num_batch, nfo, dim_out),&
             fltr_data(nfo,nfi,nd)
         integer,intent(in) :: csc_indices(nnz), csc_indptr(dim_out+1), weight_indices(nnz)
-        complex*8,intent(out) :: dweight(nfo, nfi, nd), dbias(nfo), dx(num_batch, nfi, dim_in)
+        complex*8,intent(inout) :: dweight(nfo, nfi, nd), dbias(nfo), dx(num_batch, nfi, dim_in)
 
-        integer :: start_, end_, k, col, ii, row, nnz_row
-        complex*8 :: x_work(num_batch, nfi, max_nnz_row), w_work(nfo, nfi, max_nnz_row)
+        integer :: start_, end_, k, col, ii, row, nnz_row, b0, b1, nbl
+        complex*8,allocatable :: x_work(:,:,:), w_work(:,:,:)
         complex*8,parameter :: one=cmplx(1.0,0.0)
         complex*8,parameter :: zero=cmplx(0.0,0.0)
 
         !f2py intent(in) x, dy, csc_indices, csc_indptr, weight_indices, fltr_data
         !f2py intent(in) do_xgrad, do_wgrad, do_bgrad
         !f2py intent(in) nfi, nfo, num_batch, nd, max_nnz_row, dim_in, dim_out, nnz
-        !f2py intent(out) dx, dweight, dbias
-
+        !f2py complex*8 optional,intent(in,out),depend(num_batch, nfi,dim_in) :: dx(num_batch, nfi,dim_in)
+        !f2py complex*8 optional,intent(in,out),depend(nfo,nfi,nd) :: dweight(nfo,nfi,nd)
+        !f2py complex*8 optional,intent(in,out),depend(nfo) :: dbias(nfo)
+
+        if(do_xgrad) dx=zero
+        if(do_wgrad) dweight=zero
+        !rows b0:b1 of the batch are taken by this thread.
+        !$omp parallel private(start_, end_, k, col, ii, row, nnz_row, b0, b1, nbl, x_work, w_work)&
+        !$omp reduction(+:dweight)
+        b0=1
+        b1=num_batch
+        !$ b0=omp_get_thread_num()*num_batch/omp_get_num_threads()+1
+        !$ b1=(omp_get_thread_num()+1)*num_batch/omp_get_num_threads()
+        nbl=b1-b0+1
+        allocate(x_work(max(nbl,1), nfi, max_nnz_row), w_work(nfo, nfi, max_nnz_row))
         do col=1,dim_out
+            if(nbl==0) exit
             start_=csc_indptr(col)
             end_=csc_indptr(col+1)
             nnz_row=end_-start_
@@ -449,12 +858,12 @@ module lib
             if(do_wgrad) then
                 !prepair work space by taking rows in x
                 do ii=1,nnz_row
-                    x_work(:,:,ii)=x(:,:,csc_indices(start_+ii-1))
+                    x_work(:,:,ii)=x(b0:b1,:,csc_indices(start_+ii-1))
                 enddo
 
                 !calculate dweight
-                call cgemm('T', 'N', nfo, k, num_batch, one,&
-                    dy(:,:,col), num_batch, x_work, num_batch,&
+                call gemm_c(gemm3m, 'T', 'N', nfo, k, nbl, one,&
+                    dy(b0,1,col), num_batch, x_work, max(nbl,1),&
                     zero, w_work, nfo)
 
                 !extract rows
@@ -469,15 +878,17 @@ module lib
                     w_work(:,:,ii)=fltr_data(:,:,weight_indices(start_+ii-1))
                 enddo
                 !calculate dx
-                call cgemm('N', 'N', num_batch, k, nfo, one, dy(:,:,col), num_batch,&
-                    w_work, nfo, zero, x_work, num_batch)
+                call gemm_c(gemm3m, 'N', 'N', nbl, k, nfo, one, dy(b0,1,col), num_batch,&
+                    w_work, nfo, zero, x_work, max(nbl,1))
                 !extract rows
                 do ii=1,nnz_row
                     row=csc_indices(start_+ii-1)
-                    dx(:,:,row)=dx(:,:,row)+x_work(:,:,ii)
+                    dx(b0:b1,:,row)=dx(b0:b1,:,row)+x_work(:,:,ii)
                 enddo
             endif
         enddo
+        deallocate(x_work, w_work)
+        !$omp end parallel
         if(do_bgrad) then
             !calculate dbias
             dbias=sum(sum(dy,1),2)
@@ -487,23 +898,27 @@ module lib
     subroutine forward1_generalc(x, y, bias, csc_indptr, csc_indices, fltr_data, weight_indices,&
             nnz, dim_in, dim_out, nfi, nfo, nd, max_nnz_row)
         implicit none
+        !f2py threadsafe
         integer,intent(in) :: nnz, dim_in, dim_out, nfi, nfo, max_nnz_row, nd
         complex*8,intent(in) :: x(nfi, dim_in), bias(nfo)
         complex*8,intent(in) :: fltr_data(nfo, nfi, nd)
         integer,intent(in) :: csc_indices(nnz), csc_indptr(dim_out+1), weight_indices(nnz)
-        complex*8,intent(out) :: y(nfo, dim_out)
+        complex*8,intent(inout) :: y(nfo, dim_out)
 
-        complex*8 :: x_work(nfi, max_nnz_row), w_work(nfo, nfi, max_nnz_row)
+        complex*8,allocatable :: x_work(:,:), w_work(:,:,:)
         integer :: start_, end_, col, ii, nnz_row, k
         complex*8,parameter :: one=cmplx(1.0,0.0)
         !f2py intent(in) x, csc_indices, csc_indptr, fltr_data, bias, weight_indices
         !f2py intent(in) nfi, nfo, max_nnz_row, nnz, dim_out, nd, dim_in
-        !f2py intent(out) y
+        !f2py complex*8 optional,intent(in,out),depend(nfo,dim_out) :: y(nfo,dim_out)
 
         do ii=1,nfo
             y(ii,:)=bias(ii)
         enddo
 
+        !$omp parallel private(start_, end_, col, ii, nnz_row, k, x_work, w_work)
+        allocate(x_work(nfi, max_nnz_row), w_work(nfo, nfi, max_nnz_row))
+        !$omp do schedule(static)
         do col=1, dim_out
             start_=csc_indptr(col)
             end_=csc_indptr(col+1)
@@ -515,31 +930,40 @@ module lib
                 x_work(:,ii)=x(:,csc_indices(start_+ii-1))
                 w_work(:,:,ii)=fltr_data(:,:,weight_indices(start_+ii-1))
             enddo
-            call cgemv('N', nfo, k, one, fltr_data, nfo,&
+            call cgemv('N', nfo, k, one, w_work, nfo,&
             x_work, 1, one, y(:,col), 1)
             enddo
+        !$omp end do
+        deallocate(x_work, w_work)
+        !$omp end parallel
     end subroutine forward1_generalc
 
     subroutine backward1_generalc(dy,x,dx,dweight,dbias,csc_indptr,csc_indices,weight_indices,fltr_data,&
             nnz,dim_in,dim_out,nfi,nfo, nd, do_xgrad, do_wgrad, do_bgrad, max_nnz_row)
         implicit none
+        !f2py threadsafe
         integer,intent(in) :: nnz,dim_in,dim_out,nfi,nfo,nd,max_nnz_row
         logical,intent(in) :: do_xgrad, do_wgrad, do_bgrad
         complex*8,intent(in) :: x(nfi, dim_in), dy(nfo, dim_out),&
             fltr_data(nfo,nfi,nd)
         integer,intent(in) :: csc_indices(nnz), csc_indptr(dim_out+1), weight_indices(nnz)
-        complex*8,intent(out) :: dweight(nfo, nfi, nd), dbias(nfo), dx(nfi, dim_in)
+        complex*8,intent(inout) :: dweight(nfo, nfi, nd), dbias(nfo), dx(nfi, dim_in)
 
         integer :: start_, end_, k, col, ii, row, nnz_row
-        complex*8 :: x_work(nfi, max_nnz_row), w_work(nfo, nfi, max_nnz_row)
+        complex*8,allocatable :: x_work(:,:), w_work(:,:,:)
         complex*8,parameter :: one=cmplx(1.0,0.0)
         complex*8,parameter :: zero=cmplx(0.0,0.0)
 
         !f2py intent(in) x, dy, csc_indices, csc_indptr, weight_indices, fltr_data
         !f2py intent(in) do_xgrad, do_wgrad, do_bgrad
         !f2py intent(in) nfi, nfo, nd, max_nnz_row, dim_in, dim_out, nnz
-        !f2py intent(out) dx, dweight, dbias
+        !f2py complex*8 optional,intent(in,out),depend(nfi,dim_in) :: dx(nfi,dim_in)
+        !f2py complex*8 optional,intent(in,out),depend(nfo,nfi,nd) :: dweight(nfo,nfi,nd)
+        !f2py complex*8 optional,intent(in,out),depend(nfo) :: dbias(nfo)
 
+        if(do_xgrad) dx=zero
+        if(do_wgrad) dweight=zero
+        allocate(x_work(nfi, max_nnz_row), w_work(nfo, nfi, max_nnz_row))
         do col=1,dim_out
             start_=csc_indptr(col)
             end_=csc_indptr(col+1)
@@ -578,6 +1002,7 @@ module lib
                 enddo
             endif
         enddo
+        deallocate(x_work, w_work)
         if(do_bgrad) then
             !calculate dbias
             dbias=sum(dy,2)
@@ -585,25 +1010,31 @@ module lib
     end subroutine backward1_generalc
 
     subroutine forward_contiguousc(x, y, bias, num_batch, csc_indptr, csc_indices, fltr_data,&
-            nnz, dim_in, dim_out, nfi, nfo, nd, max_nnz_row)
+            nnz, dim_in, dim_out, nfi, nfo, nd, max_nnz_row, gemm3m)
         implicit none
+        !f2py threadsafe
         integer,intent(in) :: num_batch, nnz, dim_in, dim_out, nfi, nfo, max_nnz_row, nd
+        logical,intent(in) :: gemm3m
+        !f2py logical optional,intent(in) :: gemm3m=0
         complex*8,intent(in) :: x(num_batch, nfi, dim_in), bias(nfo)
         complex*8,intent(in) :: fltr_data(nfo, nfi, nd)
         integer,intent(in) :: csc_indices(nnz), csc_indptr(dim_out+1)
-        complex*8,intent(out) :: y(num_batch, nfo, dim_out)
+        complex*8,intent(inout) :: y(num_batch, nfo, dim_out)
 
-        complex*8 :: x_work(num_batch, nfi, max_nnz_row)
+        complex*8,allocatable :: x_work(:,:,:)
         integer :: start_, end_, col, ii, nnz_row, k
         complex*8,parameter :: one=cmplx(1.0,0.0)
         !f2py intent(in) x, csc_indices, csc_indptr, fltr_data, bias
         !f2py intent(in) nfi, nfo, num_batch, max_nnz_row, nnz, dim_out, nd, dim_in
-        !f2py intent(out) y
+        !f2py complex*8 optional,intent(in,out),depend(num_batch, nfo,dim_out) :: y(num_batch, nfo,dim_out)
 
         do ii=1,nfo
             y(:,ii,:)=bias(ii)
         enddo
 
+        !$omp parallel private(start_, end_, col, ii, nnz_row, k, x_work)
+        allocate(x_work(num_batch, nfi, max_nnz_row))
+        !$omp do schedule(static)
         do col=1, dim_out
             start_=csc_indptr(col)
             end_=csc_indptr(col+1)
@@ -615,32 +1046,51 @@ module lib
                 x_work(:,:,ii)=x(:,:,csc_indices(start_+ii-1))
                 
             enddo
-            call cgemm('N', 'T', num_batch, nfo, k, one, x_work, num_batch,&
+            call gemm_c(gemm3m, 'N', 'T', num_batch, nfo, k, one, x_work, num_batch,&
                 fltr_data, nfo, one, y(:,:,col), num_batch)
             enddo
+        !$omp end do
+        deallocate(x_work)
+        !$omp end parallel
     end subroutine forward_contiguousc
 
     subroutine backward_contiguousc(dy,x,dx,dweight,dbias,csc_indptr,csc_indices,fltr_data,&
-            nnz,dim_in,dim_out,nfi,nfo, nd, num_batch, do_xgrad, do_wgrad, do_bgrad, max_nnz_row)
+            nnz,dim_in,dim_out,nfi,nfo, nd, num_batch, do_xgrad, do_wgrad, do_bgrad, max_nnz_row, gemm3m)
         implicit none
+        !f2py threadsafe
         integer,intent(in) :: num_batch, nnz,dim_in,dim_out,nfi,nfo,nd,max_nnz_row
-        logical,intent(in) :: do_xgrad, do_wgrad, do_bgrad
+        logical,intent(in) :: do_xgrad, do_wgrad, do_bgrad, gemm3m
+        !f2py logical optional,intent(in) :: gemm3m=0
         complex*8,intent(in) :: x(num_batch, nfi, dim_in), dy(num_batch, nfo, dim_out),&
             fltr_data(nfo,nfi,nd)
         integer,intent(in) :: csc_indices(nnz), csc_indptr(dim_out+1)
-        complex*8,intent(out) :: dweight(nfo, nfi, nd), dbias(nfo), dx(num_batch, nfi, dim_in)
+        complex*8,intent(inout) :: dweight(nfo, nfi, nd), dbias(nfo), dx(num_batch, nfi, dim_in)
 
-        integer :: start_, end_, k, col, ii, row, nnz_row
-        complex*8 :: x_work(num_batch, nfi, max_nnz_row)
+        integer :: start_, end_, k, col, ii, row, nnz_row, b0, b1, nbl
+        complex*8,allocatable :: x_work(:,:,:)
         complex*8,parameter :: one=cmplx(1.0,0.0)
         complex*8,parameter :: zero=cmplx(0.0,0.0)
 
         !f2py intent(in) x, dy, csc_indices, csc_indptr, fltr_data
         !f2py intent(in) do_xgrad, do_wgrad, do_bgrad
         !f2py intent(in) nfi, nfo, num_batch, nd, max_nnz_row, dim_in, dim_out, nnz
-        !f2py intent(out) dx, dweight, dbias
-
+        !f2py complex*8 optional,intent(in,out),depend(num_batch, nfi,dim_in) :: dx(num_batch, nfi,dim_in)
+        !f2py complex*8 optional,intent(in,out),depend(nfo,nfi,nd) :: dweight(nfo,nfi,nd)
+        !f2py complex*8 optional,intent(in,out),depend(nfo) :: dbias(nfo)
+
+        if(do_xgrad) dx=zero
+        if(do_wgrad) dweight=zero
+        !rows b0:b1 of the batch are taken by this thread.
+        !$omp parallel private(start_, end_, k, col, ii, row, nnz_row, b0, b1, nbl, x_work)&
+        !$omp reduction(+:dweight)
+        b0=1
+        b1=num_batch
+        !$ b0=omp_get_thread_num()*num_batch/omp_get_num_threads()+1
+        !$ b1=(omp_get_thread_num()+1)*num_batch/omp_get_num_threads()
+        nbl=b1-b0+1
+        allocate(x_work(max(nbl,1), nfi, max_nnz_row))
         do col=1,dim_out
+            if(nbl==0) exit
             start_=csc_indptr(col)
             end_=csc_indptr(col+1)
             nnz_row=end_-start_
@@ -649,26 +1099,28 @@ module lib
             if(do_wgrad) then
                 !prepair work space by taking rows in x
                 do ii=1,nnz_row
-                    x_work(:,:,ii)=x(:,:,csc_indices(start_+ii-1))
+                    x_work(:,:,ii)=x(b0:b1,:,csc_indices(start_+ii-1))
                 enddo
 
                 !calculate dweight
-                call cgemm('T', 'N', nfo, k, num_batch, one,&
-                    dy(:,:,col), num_batch, x_work, num_batch,&
+                call gemm_c(gemm3m, 'T', 'N', nfo, k, nbl, one,&
+                    dy(b0,1,col), num_batch, x_work, max(nbl,1),&
                     one, dweight, nfo)
 
                 endif
             if(do_xgrad) then
                 !calculate dx
-                call cgemm('N', 'N', num_batch, k, nfo, one, dy(:,:,col), num_batch,&
-                    fltr_data, nfo, zero, x_work, num_batch)
+                call gemm_c(gemm3m, 'N', 'N', nbl, k, nfo, one, dy(b0,1,col), num_batch,&
+                    fltr_data, nfo, zero, x_work, max(nbl,1))
                 !extract rows
                 do ii=1,nnz_row
                     row=csc_indices(start_+ii-1)
-                    dx(:,:,row)=dx(:,:,row)+x_work(:,:,ii)
+                    dx(b0:b1,:,row)=dx(b0:b1,:,row)+x_work(:,:,ii)
                 enddo
             endif
         enddo
+        deallocate(x_work)
+        !$omp end parallel
         if(do_bgrad) then
             !calculate dbias
             dbias=sum(sum(dy,1),2)
@@ -678,23 +1130,27 @@ module lib
     subroutine forward1_contiguousc(x, y, bias, csc_indptr, csc_indices, fltr_data,&
             nnz, dim_in, dim_out, nfi, nfo, nd, max_nnz_row)
         implicit none
+        !f2py threadsafe
         integer,intent(in) :: nnz, dim_in, dim_out, nfi, nfo, max_nnz_row, nd
         complex*8,intent(in) :: x(nfi, dim_in), bias(nfo)
         complex*8,intent(in) :: fltr_data(nfo, nfi, nd)
         integer,intent(in) :: csc_indices(nnz), csc_indptr(dim_out+1)
-        complex*8,intent(out) :: y(nfo, dim_out)
+        complex*8,intent(inout) :: y(nfo, dim_out)
 
-        complex*8 :: x_work(nfi, max_nnz_row)
+        complex*8,allocatable :: x_work(:,:)
         integer :: start_, end_, col, ii, nnz_row, k
         complex*8,parameter :: one=cmplx(1.0,0.0)
         !f2py intent(in) x, csc_indices, csc_indptr, fltr_data, bias
         !f2py intent(in) nfi, nfo, max_nnz_row, nnz, dim_out, nd, dim_in
-        !f2py intent(out) y
+        !f2py complex*8 optional,intent(in,out),depend(nfo,dim_out) :: y(nfo,dim_out)
 
         do ii=1,nfo
             y(ii,:)=bias(ii)
         enddo
 
+        !$omp parallel private(start_, end_, col, ii, nnz_row, k, x_work)
+        allocate(x_work(nfi, max_nnz_row))
+        !$omp do schedule(static)
         do col=1, dim_out
             start_=csc_indptr(col)
             end_=csc_indptr(col+1)
@@ -709,28 +1165,37 @@ module lib
             call cgemv('N', nfo, k, one, fltr_data, nfo,&
             x_work, 1, one, y(:,col), 1)
             enddo
+        !$omp end do
+        deallocate(x_work)
+        !$omp end parallel
     end subroutine forward1_contiguousc
 
     subroutine backward1_contiguousc(dy,x,dx,dweight,dbias,csc_indptr,csc_indices,fltr_data,&
             nnz,dim_in,dim_out,nfi,nfo, nd, do_xgrad, do_wgrad, do_bgrad, max_nnz_row)
         implicit none
+        !f2py threadsafe
         integer,intent(in) :: nnz,dim_in,dim_out,nfi,nfo,nd,max_nnz_row
         logical,intent(in) :: do_xgrad, do_wgrad, do_bgrad
         complex*8,intent(in) :: x(nfi, dim_in), dy(nfo, dim_out),&
             fltr_data(nfo,nfi,nd)
         integer,intent(in) :: csc_indices(nnz), csc_indptr(dim_out+1)
-        complex*8,intent(out) :: dweight(nfo, nfi, nd), dbias(nfo), dx(nfi, dim_in)
+        complex*8,intent(inout) :: dweight(nfo, nfi, nd), dbias(nfo), dx(nfi, dim_in)
 
         integer :: start_, end_, k, col, ii, row, nnz_row
-        complex*8 :: x_work(nfi, max_nnz_row)
+        complex*8,allocatable :: x_work(:,:)
         complex*8,parameter :: one=cmplx(1.0,0.0)
         complex*8,parameter :: zero=cmplx(0.0,0.0)
 
         !f2py intent(in) x, dy, csc_indices, csc_indptr, fltr_data
         !f2py intent(in) do_xgrad, do_wgrad, do_bgrad
         !f2py intent(in) nfi, nfo, nd, max_nnz_row, dim_in, dim_out, nnz
-        !f2py intent(out) dx, dweight, dbias
+        !f2py complex*8 optional,intent(in,out),depend(nfi,dim_in) :: dx(nfi,dim_in)
+        !f2py complex*8 optional,intent(in,out),depend(nfo,nfi,nd) :: dweight(nfo,nfi,nd)
+        !f2py complex*8 optional,intent(in,out),depend(nfo) :: dbias(nfo)
 
+        if(do_xgrad) dx=zero
+        if(do_wgrad) dweight=zero
+        allocate(x_work(nfi, max_nnz_row))
         do col=1,dim_out
             start_=csc_indptr(col)
             end_=csc_indptr(col+1)
@@ -760,32 +1225,172 @@ module lib
                 enddo
             endif
         enddo
+        deallocate(x_work)
         if(do_bgrad) then
             !calculate dbias
             dbias=sum(dy,2)
         endif
     end subroutine backward1_contiguousc
 
+    subroutine forward_im2colc(x, y, bias, num_batch, csc_indices, fltr_data,&
+            nnz, dim_in, dim_out, nfi, nfo, nd, block_size, gemm3m)
+        implicit none
+        !f2py threadsafe
+        integer,intent(in) :: num_batch, nnz, dim_in, dim_out, nfi, nfo, nd, block_size
+        logical,intent(in) :: gemm3m
+        !f2py logical optional,intent(in) :: gemm3m=0
+        complex*8,intent(in) :: x(num_batch, nfi, dim_in), bias(nfo)
+        complex*8,intent(in) :: fltr_data(nfo, nfi, nd)
+        integer,intent(in) :: csc_indices(nnz)
+        complex*8,intent(inout) :: y(num_batch, nfo, dim_out)
+
+        complex*8,allocatable :: x_work(:,:,:,:), y_work(:,:,:)
+        integer :: col0, nb, bmax, ldw, ii, j
+        complex*8,parameter :: one=cmplx(1.0,0.0)
+        !f2py intent(in) x, csc_indices, fltr_data, bias
+        !f2py intent(in) nfi, nfo, num_batch, nnz, nd, dim_in, block_size
+        !f2py integer optional,intent(in),depend(nnz,nd) :: dim_out=nnz/nd
+        !f2py complex*8 optional,intent(in,out),depend(num_batch,nfo,dim_out) :: y(num_batch,nfo,dim_out)
+
+        !columns of a block of output pixels, (num_batch, block, nfi, nd),
+        !blocks are made small enough to give every thread some.
+        bmax=max(1,min(block_size,dim_out))
+        !$ bmax=max(1,min(bmax,(dim_out-1)/omp_get_max_threads()+1))
+        ldw=num_batch*bmax
+
+        !$omp parallel private(col0, nb, ii, j, x_work, y_work)
+        allocate(x_work(num_batch, bmax, nfi, nd), y_work(num_batch, bmax, nfo))
+        !$omp do schedule(static)
+        do col0=1, dim_out, bmax
+            nb=min(bmax,dim_out-col0+1)
+
+            !gather patches of input, one column per kernel offset.
+            do ii=1,nd
+                do j=1,nb
+                    x_work(:,j,:,ii)=x(:,:,csc_indices((col0+j-2)*nd+ii))
+                enddo
+            enddo
+            do ii=1,nfo
+                y_work(:,:,ii)=bias(ii)
+            enddo
+
+            call gemm_c(gemm3m, 'N', 'T', num_batch*nb, nfo, nfi*nd, one, x_work, ldw,&
+                fltr_data, nfo, one, y_work, ldw)
+
+            do j=1,nb
+                y(:,:,col0+j-1)=y_work(:,j,:)
+            enddo
+        enddo
+        !$omp end do
+        deallocate(x_work, y_work)
+        !$omp end parallel
+    end subroutine forward_im2colc
+
+    subroutine backward_im2colc(dy,x,dx,dweight,dbias,num_batch,csc_indices,fltr_data,&
+            nnz,dim_in,dim_out,nfi,nfo,nd,do_xgrad,do_wgrad,do_bgrad,block_size,gemm3m)
+        implicit none
+        !f2py threadsafe
+        integer,intent(in) :: num_batch,nnz,dim_in,dim_out,nfi,nfo,nd,block_size
+        logical,intent(in) :: gemm3m
+        !f2py logical optional,intent(in) :: gemm3m=0
+        logical,intent(in) :: do_xgrad, do_wgrad, do_bgrad
+        complex*8,intent(in) :: x(num_batch, nfi, dim_in), dy(num_batch, nfo, dim_out),&
+            fltr_data(nfo,nfi,nd)
+        integer,intent(in) :: csc_indices(nnz)
+        complex*8,intent(inout) :: dweight(nfo, nfi, nd), dbias(nfo), dx(num_batch, nfi, dim_in)
+
+        complex*8,allocatable :: x_work(:,:,:,:), dy_work(:,:,:)
+        integer :: col0, nb, bmax, ldw, ii, j, row, b0, b1, nbl
+        complex*8,parameter :: one=cmplx(1.0,0.0)
+        complex*8,parameter :: zero=cmplx(0.0,0.0)
+
+        !f2py intent(in) x, dy, csc_indices, fltr_data
+        !f2py intent(in) do_xgrad, do_wgrad, do_bgrad
+        !f2py intent(in) nfi, nfo, num_batch, nd, dim_in, dim_out, nnz, block_size
+        !f2py complex*8 optional,intent(in,out),depend(num_batch,nfi,dim_in) :: dx(num_batch,nfi,dim_in)
+        !f2py complex*8 optional,intent(in,out),depend(nfo,nfi,nd) :: dweight(nfo,nfi,nd)
+        !f2py complex*8 optional,intent(in,out),depend(nfo) :: dbias(nfo)
+
+        if(do_xgrad) dx=zero
+        if(do_wgrad) dweight=zero
+        if(do_xgrad .or. do_wgrad) then
+            bmax=max(1,min(block_size,dim_out))
+
+            !rows b0:b1 of the batch are taken by this thread.
+            !$omp parallel private(col0, nb, ldw, ii, j, row, b0, b1, nbl, x_work, dy_work)&
+            !$omp reduction(+:dweight)
+            b0=1
+            b1=num_batch
+            !$ b0=omp_get_thread_num()*num_batch/omp_get_num_threads()+1
+            !$ b1=(omp_get_thread_num()+1)*num_batch/omp_get_num_threads()
+            nbl=b1-b0+1
+            ldw=max(nbl,1)*bmax
+            allocate(x_work(max(nbl,1), bmax, nfi, nd), dy_work(max(nbl,1), bmax, nfo))
+
+            do col0=1, dim_out, bmax
+                if(nbl==0) exit
+                nb=min(bmax,dim_out-col0+1)
+                do j=1,nb
+                    dy_work(:,j,:)=dy(b0:b1,:,col0+j-1)
+                enddo
+
+                if(do_wgrad) then
+                    !gather patches of input
+                    do ii=1,nd
+                        do j=1,nb
+                            x_work(:,j,:,ii)=x(b0:b1,:,csc_indices((col0+j-2)*nd+ii))
+                        enddo
+                    enddo
+
+                    !calculate dweight
+                    call gemm_c(gemm3m, 'T', 'N', nfo, nfi*nd, nbl*nb, one,&
+                        dy_work, ldw, x_work, ldw, one, dweight, nfo)
+                endif
+                if(do_xgrad) then
+                    !calculate gradients of patches, and scatter them back to dx.
+                    call gemm_c(gemm3m, 'N', 'N', nbl*nb, nfi*nd, nfo, one,&
+                        dy_work, ldw, fltr_data, nfo, zero, x_work, ldw)
+                    do ii=1,nd
+                        do j=1,nb
+                            row=csc_indices((col0+j-2)*nd+ii)
+                            dx(b0:b1,:,row)=dx(b0:b1,:,row)+x_work(:,j,:,ii)
+                        enddo
+                    enddo
+                endif
+            enddo
+            deallocate(x_work, dy_work)
+            !$omp end parallel
+        endif
+        if(do_bgrad) then
+            !calculate dbias
+            dbias=sum(sum(dy,1),2)
+        endif
+    end subroutine backward_im2colc
+
     subroutine forward_generald(x, y, bias, num_batch, csc_indptr, csc_indices, fltr_data, weight_indices,&
             nnz, dim_in, dim_out, nfi, nfo, nd, max_nnz_row)
         implicit none
+        !f2py threadsafe
         integer,intent(in) :: num_batch, nnz, dim_in, dim_out, nfi, nfo, max_nnz_row, nd
         real*8,intent(in) :: x(num_batch, nfi, dim_in), bias(nfo)
         real*8,intent(in) :: fltr_data(nfo, nfi, nd)
         integer,intent(in) :: csc_indices(nnz), csc_indptr(dim_out+1), weight_indices(nnz)
-        real*8,intent(out) :: y(num_batch, nfo, dim_out)
+        real*8,intent(inout) :: y(num_batch, nfo, dim_out)
 
-        real*8 :: x_work(num_batch, nfi, max_nnz_row), w_work(nfo, nfi, max_nnz_row)
+        real*8,allocatable :: x_work(:,:,:), w_work(:,:,:)
         integer :: start_, end_, col, ii, nnz_row, k
         real*8,parameter :: one=1D0
         !f2py intent(in) x, csc_indices, csc_indptr, fltr_data, bias, weight_indices
         !f2py intent(in) nfi, nfo, num_batch, max_nnz_row, nnz, dim_out, nd, dim_in
-        !f2py intent(out) y
+        !f2py real*8 optional,intent(in,out),depend(num_batch, nfo,dim_out) :: y(num_batch, nfo,dim_out)
 
         do ii=1,nfo
             y(:,ii,:)=bias(ii)
         enddo
 
+        !$omp parallel private(start_, end_, col, ii, nnz_row, k, x_work, w_work)
+        allocate(x_work(num_batch, nfi, max_nnz_row), w_work(nfo, nfi, max_nnz_row))
+        !$omp do schedule(static)
         do col=1, dim_out
             start_=csc_indptr(col)
             end_=csc_indptr(col+1)
@@ -800,29 +1405,47 @@ module lib
             call dgemm('N', 'T', num_batch, nfo, k, one, x_work, num_batch,&
                 w_work, nfo, one, y(:,:,col), num_batch)
             enddo
+        !$omp end do
+        deallocate(x_work, w_work)
+        !$omp end parallel
     end subroutine forward_generald
 
     subroutine backward_generald(dy,x,dx,dweight,dbias,csc_indptr,csc_indices,weight_indices,fltr_data,&
             nnz,dim_in,dim_out,nfi,nfo, nd, num_batch, do_xgrad, do_wgrad, do_bgrad, max_nnz_row)
         implicit none
+        !f2py threadsafe
         integer,intent(in) :: num_batch, nnz,dim_in,dim_out,nfi,nfo,nd,max_nnz_row
         logical,intent(in) :: do_xgrad, do_wgrad, do_bgrad
         real*8,intent(in) :: x(num_batch, nfi, dim_in), dy(num_batch, nfo, dim_out),&
             fltr_data(nfo,nfi,nd)
         integer,intent(in) :: csc_indices(nnz), csc_indptr(dim_out+1), weight_indices(nnz)
-        real*8,intent(out) :: dweight(nfo, nfi, nd), dbias(nfo), dx(num_batch, nfi, dim_in)
+        real*8,intent(inout) :: dweight(nfo, nfi, nd), dbias(nfo), dx(num_batch, nfi, dim_in)
 
-        integer :: start_, end_, k, col, ii, row, nnz_row
-        real*8 :: x_work(num_batch, nfi, max_nnz_row), w_work(nfo, nfi, max_nnz_row)
+        integer :: start_, end_, k, col, ii, row, nnz_row, b0, b1, nbl
+        real*8,allocatable :: x_work(:,:,:), w_work(:,:,:)
         real*8,parameter :: one=1D0
         real*8,parameter :: zero=0D0
 
         !f2py intent(in) x, dy, csc_indices, csc_indptr, weight_indices, fltr_data
         !f2py intent(in) do_xgrad, do_wgrad, do_bgrad
         !f2py intent(in) nfi, nfo, num_batch, nd, max_nnz_row, dim_in, dim_out, nnz
-        !f2py intent(out) dx, dweight, dbias
-
+        !f2py real*8 optional,intent(in,out),depend(num_batch, nfi,dim_in) :: dx(num_batch, nfi,dim_in)
+        !f2py real*8 optional,intent(in,out),depend(nfo,nfi,nd) :: dweight(nfo,nfi,nd)
+        !f2py real*8 optional,intent(in,out),depend(nfo) :: dbias(nfo)
+
+        if(do_xgrad) dx=zero
+        if(do_wgrad) dweight=zero
+        !rows b0:b1 of the batch are taken by this thread.
+        !$omp parallel private(start_, end_, k, col, ii, row, nnz_row, b0, b1, nbl, x_work, w_work)&
+        !$omp reduction(+:dweight)
+        b0=1
+        b1=num_batch
+        !$ b0=omp_get_thread_num()*num_batch/omp_get_num_threads()+1
+        !$ b1=(omp_get_thread_num()+1)*num_batch/omp_get_num_threads()
+        nbl=b1-b0+1
+        allocate(x_work(max(nbl,1), nfi, max_nnz_row), w_work(nfo, nfi, max_nnz_row))
         do col=1,dim_out
+            if(nbl==0) exit
             start_=csc_indptr(col)
             end_=csc_indptr(col+1)
             nnz_row=end_-start_
@@ -831,12 +1454,12 @@ module lib
             if(do_wgrad) then
                 !prepair work space by taking rows in x
                 do ii=1,nnz_row
-                    x_work(:,:,ii)=x(:,:,csc_indices(start_+ii-1))
+                    x_work(:,:,ii)=x(b0:b1,:,csc_indices(start_+ii-1))
                 enddo
 
                 !calculate dweight
-                call dgemm('T', 'N', nfo, k, num_batch, one,&
-                    dy(:,:,col), num_batch, x_work, num_batch,&
+                call dgemm('T', 'N', nfo, k, nbl, one,&
+                    dy(b0,1,col), num_batch, x_work, max(nbl,1),&
                     zero, w_work, nfo)
 
                 !extract rows
@@ -851,15 +1474,17 @@ module lib
                     w_work(:,:,ii)=fltr_data(:,:,weight_indices(start_+ii-1))
                 enddo
                 !calculate dx
-                call dgemm('N', 'N', num_batch, k, nfo, one, dy(:,:,col), num_batch,&
-                    w_work, nfo, zero, x_work, num_batch)
+                call dgemm('N', 'N', nbl, k, nfo, one, dy(b0,1,col), num_batch,&
+                    w_work, nfo, zero, x_work, max(nbl,1))
                 !extract rows
                 do ii=1,nnz_row
                     row=csc_indices(start_+ii-1)
-                    dx(:,:,row)=dx(:,:,row)+x_work(:,:,ii)
+                    dx(b0:b1,:,row)=dx(b0:b1,:,row)+x_work(:,:,ii)
                 enddo
             endif
         enddo
+        deallocate(x_work, w_work)
+        !$omp end parallel
         if(do_bgrad) then
             !calculate dbias
             dbias=sum(sum(dy,1),2)
@@ -869,23 +1494,27 @@ module lib
     subroutine forward1_generald(x, y, bias, csc_indptr, csc_indices, fltr_data, weight_indices,&
             nnz, dim_in, dim_out, nfi, nfo, nd, max_nnz_row)
         implicit none
+        !f2py threadsafe
         integer,intent(in) :: nnz, dim_in, dim_out, nfi, nfo, max_nnz_row, nd
         real*8,intent(in) :: x(nfi, dim_in), bias(nfo)
         real*8,intent(in) :: fltr_data(nfo, nfi, nd)
         integer,intent(in) :: csc_indices(nnz), csc_indptr(dim_out+1), weight_indices(nnz)
-        real*8,intent(out) :: y(nfo, dim_out)
+        real*8,intent(inout) :: y(nfo, dim_out)
 
-        real*8 :: x_work(nfi, max_nnz_row), w_work(nfo, nfi, max_nnz_row)
+        real*8,allocatable :: x_work(:,:), w_work(:,:,:)
         integer :: start_, end_, col, ii, nnz_row, k
         real*8,parameter :: one=1D0
         !f2py intent(in) x, csc_indices, csc_indptr, fltr_data, bias, weight_indices
         !f2py intent(in) nfi, nfo, max_nnz_row, nnz, dim_out, nd, dim_in
-        !f2py intent(out) y
+        !f2py real*8 optional,intent(in,out),depend(nfo,dim_out) :: y(nfo,dim_out)
 
         do ii=1,nfo
             y(ii,:)=bias(ii)
         enddo
 
+        !$omp parallel private(start_, end_, col, ii, nnz_row, k, x_work, w_work)
+        allocate(x_work(nfi, max_nnz_row), w_work(nfo, nfi, max_nnz_row))
+        !$omp do schedule(static)
         do col=1, dim_out
             start_=csc_indptr(col)
             end_=csc_indptr(col+1)
@@ -897,31 +1526,40 @@ module lib
                 x_work(:,ii)=x(:,csc_indices(start_+ii-1))
                 w_work(:,:,ii)=fltr_data(:,:,weight_indices(start_+ii-1))
             enddo
-            call dgemv('N', nfo, k, one, fltr_data, nfo,&
+            call dgemv('N', nfo, k, one, w_work, nfo,&
             x_work, 1, one, y(:,col), 1)
             enddo
+        !$omp end do
+        deallocate(x_work, w_work)
+        !$omp end parallel
     end subroutine forward1_generald
 
     subroutine backward1_generald(dy,x,dx,dweight,dbias,csc_indptr,csc_indices,weight_indices,fltr_data,&
             nnz,dim_in,dim_out,nfi,nfo, nd, do_xgrad, do_wgrad, do_bgrad, max_nnz_row)
         implicit none
+        !f2py threadsafe
         integer,intent(in) :: nnz,dim_in,dim_out,nfi,nfo,nd,max_nnz_row
         logical,intent(in) :: do_xgrad, do_wgrad, do_bgrad
         real*8,intent(in) :: x(nfi, dim_in), dy(nfo, dim_out),&
             fltr_data(nfo,nfi,nd)
         integer,intent(in) :: csc_indices(nnz), csc_indptr(dim_out+1), weight_indices(nnz)
-        real*8,intent(out) :: dweight(nfo, nfi, nd), dbias(nfo), dx(nfi, dim_in)
+        real*8,intent(inout) :: dweight(nfo, nfi, nd), dbias(nfo), dx(nfi, dim_in)
 
         integer :: start_, end_, k, col, ii, row, nnz_row
-        real*8 :: x_work(nfi, max_nnz_row), w_work(nfo, nfi, max_nnz_row)
+        real*8,allocatable :: x_work(:,:), w_work(:,:,:)
         real*8,parameter :: one=1D0
         real*8,parameter :: zero=0D0
 
         !f2py intent(in) x, dy, csc_indices, csc_indptr, weight_indices, fltr_data
         !f2py intent(in) do_xgrad, do_wgrad, do_bgrad
         !f2py intent(in) nfi, nfo, nd, max_nnz_row, dim_in, dim_out, nnz
-        !f2py intent(out) dx, dweight, dbias
+        !f2py real*8 optional,intent(in,out),depend(nfi,dim_in) :: dx(nfi,dim_in)
+        !f2py real*8 optional,intent(in,out),depend(nfo,nfi,nd) :: dweight(nfo,nfi,nd)
+        !f2py real*8 optional,intent(in,out),depend(nfo) :: dbias(nfo)
 
+        if(do_xgrad) dx=zero
+        if(do_wgrad) dweight=zero
+        allocate(x_work(nfi, max_nnz_row), w_work(nfo, nfi, max_nnz_row))
         do col=1,dim_out
             start_=csc_indptr(col)
             end_=csc_indptr(col+1)
@@ -960,6 +1598,7 @@ module lib
                 enddo
             endif
         enddo
+        deallocate(x_work, w_work)
         if(do_bgrad) then
             !calculate dbias
             dbias=sum(dy,2)
@@ -969,23 +1608,27 @@ module lib
     subroutine forward_contiguousd(x, y, bias, num_batch, csc_indptr, csc_indices, fltr_data,&
             nnz, dim_in, dim_out, nfi, nfo, nd, max_nnz_row)
         implicit none
+        !f2py threadsafe
         integer,intent(in) :: num_batch, nnz, dim_in, dim_out, nfi, nfo, max_nnz_row, nd
         real*8,intent(in) :: x(num_batch, nfi, dim_in), bias(nfo)
         real*8,intent(in) :: fltr_data(nfo, nfi, nd)
         integer,intent(in) :: csc_indices(nnz), csc_indptr(dim_out+1)
-        real*8,intent(out) :: y(num_batch, nfo, dim_out)
+        real*8,intent(inout) :: y(num_batch, nfo, dim_out)
 
-        real*8 :: x_work(num_batch, nfi, max_nnz_row)
+        real*8,allocatable :: x_work(:,:,:)
         integer :: start_, end_, col, ii, nnz_row, k
         real*8,parameter :: one=1D0
         !f2py intent(in) x, csc_indices, csc_indptr, fltr_data, bias
         !f2py intent(in) nfi, nfo, num_batch, max_nnz_row, nnz, dim_out, nd, dim_in
-        !f2py intent(out) y
+        !f2py real*8 optional,intent(in,out),depend(num_batch, nfo,dim_out) :: y(num_batch, nfo,dim_out)
 
         do ii=1,nfo
             y(:,ii,:)=bias(ii)
         enddo
 
+        !$omp parallel private(start_, end_, col, ii, nnz_row, k, x_work)
+        allocate(x_work(num_batch, nfi, max_nnz_row))
+        !$omp do schedule(static)
         do col=1, dim_out
             start_=csc_indptr(col)
             end_=csc_indptr(col+1)
@@ -1000,29 +1643,47 @@ module lib
             call dgemm('N', 'T', num_batch, nfo, k, one, x_work, num_batch,&
                 fltr_data, nfo, one, y(:,:,col), num_batch)
             enddo
+        !$omp end do
+        deallocate(x_work)
+        !$omp end parallel
     end subroutine forward_contiguousd
 
     subroutine backward_contiguousd(dy,x,dx,dweight,dbias,csc_indptr,csc_indices,fltr_data,&
             nnz,dim_in,dim_out,nfi,nfo, nd, num_batch, do_xgrad, do_wgrad, do_bgrad, max_nnz_row)
         implicit none
+        !f2py threadsafe
         integer,intent(in) :: num_batch, nnz,dim_in,dim_out,nfi,nfo,nd,max_nnz_row
         logical,intent(in) :: do_xgrad, do_wgrad, do_bgrad
         real*8,intent(in) :: x(num_batch, nfi, dim_in), dy(num_batch, nfo, dim_out),&
             fltr_data(nfo,nfi,nd)
         integer,intent(in) :: csc_indices(nnz), csc_indptr(dim_out+1)
-        real*8,intent(out) :: dweight(nfo, nfi, nd), dbias(nfo), dx(num_batch, nfi, dim_in)
+        real*8,intent(inout) :: dweight(nfo, nfi, nd), dbias(nfo), dx(num_batch, nfi, dim_in)
 
-        integer :: start_, end_, k, col, ii, row, nnz_row
-        real*8 :: x_work(num_batch, nfi, max_nnz_row)
+        integer :: start_, end_, k, col, ii, row, nnz_row, b0, b1, nbl
+        real*8,allocatable :: x_work(:,:,:)
         real*8,parameter :: one=1D0
         real*8,parameter :: zero=0D0
 
         !f2py intent(in) x, dy, csc_indices, csc_indptr, fltr_data
         !f2py intent(in) do_xgrad, do_wgrad, do_bgrad
         !f2py intent(in) nfi, nfo, num_batch, nd, max_nnz_row, dim_in, dim_out, nnz
-        !f2py intent(out) dx, dweight, dbias
-
+        !f2py real*8 optional,intent(in,out),depend(num_batch, nfi,dim_in) :: dx(num_batch, nfi,dim_in)
+        !f2py real*8 optional,intent(in,out),depend(nfo,nfi,nd) :: dweight(nfo,nfi,nd)
+        !f2py real*8 optional,intent(in,out),depend(nfo) :: dbias(nfo)
+
+        if(do_xgrad) dx=zero
+        if(do_wgrad) dweight=zero
+        !rows b0:b1 of the batch are taken by this thread.
+        !$omp parallel private(start_, end_, k, col, ii, row, nnz_row, b0, b1, nbl, x_work)&
+        !$omp reduction(+:dweight)
+        b0=1
+        b1=num_batch
+        !$ b0=omp_get_thread_num()*num_batch/omp_get_num_threads()+1
+        !$ b1=(omp_get_thread_num()+1)*num_batch/omp_get_num_threads()
+        nbl=b1-b0+1
+        allocate(x_work(max(nbl,1), nfi, max_nnz_row))
         do col=1,dim_out
+            if(nbl==0) exit
             start_=csc_indptr(col)
             end_=csc_indptr(col+1)
             nnz_row=end_-start_
@@ -1031,26 +1692,28 @@ module lib
             if(do_wgrad) then
                 !prepair work space by taking rows in x
                 do ii=1,nnz_row
-                    x_work(:,:,ii)=x(:,:,csc_indices(start_+ii-1))
+                    x_work(:,:,ii)=x(b0:b1,:,csc_indices(start_+ii-1))
                 enddo
 
                 !calculate dweight
-                call dgemm('T', 'N', nfo, k, num_batch, one,&
-                    dy(:,:,col), num_batch, x_work, num_batch,&
+                call dgemm('T', 'N', nfo, k, nbl, one,&
+                    dy(b0,1,col), num_batch, x_work, max(nbl,1),&
                     one, dweight, nfo)
 
                 endif
             if(do_xgrad) then
                 !calculate dx
-                call dgemm('N', 'N', num_batch, k, nfo, one, dy(:,:,col), num_batch,&
-                    fltr_data, nfo, zero, x_work, num_batch)
+                call dgemm('N', 'N', nbl, k, nfo, one, dy(b0,1,col), num_batch,&
+                    fltr_data, nfo, zero, x_work, max(nbl,1))
                 !extract rows
                 do ii=1,nnz_row
                     row=csc_indices(start_+ii-1)
-                    dx(:,:,row)=dx(:,:,row)+x_work(:,:,ii)
+                    dx(b0:b1,:,row)=dx(b0:b1,:,row)+x_work(:,:,ii)
                 enddo
             endif
         enddo
+        deallocate(x_work)
+        !$omp end parallel
         if(do_bgrad) then
             !calculate dbias
             dbias=sum(sum(dy,1),2)
@@ -1060,23 +1723,27 @@ module lib
     subroutine forward1_contiguousd(x, y, bias, csc_indptr, csc_indices, fltr_data,&
             nnz, dim_in, dim_out, nfi, nfo, nd, max_nnz_row)
         implicit none
+        !f2py threadsafe
         integer,intent(in) :: nnz, dim_in, dim_out, nfi, nfo, max_nnz_row, nd
         real*8,intent(in) :: x(nfi, dim_in), bias(nfo)
         real*8,intent(in) :: fltr_data(nfo, nfi, nd)
         integer,intent(in) :: csc_indices(nnz), csc_indptr(dim_out+1)
-        real*8,intent(out) :: y(nfo, dim_out)
+        real*8,intent(inout) :: y(nfo, dim_out)
 
-        real*8 :: x_work(nfi, max_nnz_row)
+        real*8,allocatable :: x_work(:,:)
         integer :: start_, end_, col, ii, nnz_row, k
         real*8,parameter :: one=1D0
         !f2py intent(in) x, csc_indices, csc_indptr, fltr_data, bias
         !f2py intent(in) nfi, nfo, max_nnz_row, nnz, dim_out, nd, dim_in
-        !f2py intent(out) y
+        !f2py real*8 optional,intent(in,out),depend(nfo,dim_out) :: y(nfo,dim_out)
 
         do ii=1,nfo
             y(ii,:)=bias(ii)
         enddo
 
+        !$omp parallel private(start_, end_, col, ii, nnz_row, k, x_work)
+        allocate(x_work(nfi, max_nnz_row))
+        !$omp do schedule(static)
         do col=1, dim_out
             start_=csc_indptr(col)
             end_=csc_indptr(col+1)
@@ -1091,28 +1758,37 @@ module lib
             call dgemv('N', nfo, k, one, fltr_data, nfo,&
             x_work, 1, one, y(:,col), 1)
             enddo
+        !$omp end do
+        deallocate(x_work)
+        !$omp end parallel
     end subroutine forward1_contiguousd
 
     subroutine backward1_contiguousd(dy,x,dx,dweight,dbias,csc_indptr,csc_indices,fltr_data,&
             nnz,dim_in,dim_out,nfi,nfo, nd, do_xgrad, do_wgrad, do_bgrad, max_nnz_row)
         implicit none
+        !f2py threadsafe
         integer,intent(in) :: nnz,dim_in,dim_out,nfi,nfo,nd,max_nnz_row
         logical,intent(in) :: do_xgrad, do_wgrad, do_bgrad
         real*8,intent(in) :: x(nfi, dim_in), dy(nfo, dim_out),&
             fltr_data(nfo,nfi,nd)
         integer,intent(in) :: csc_indices(nnz), csc_indptr(dim_out+1)
-        real*8,intent(out) :: dweight(nfo, nfi, nd), dbias(nfo), dx(nfi, dim_in)
+        real*8,intent(inout) :: dweight(nfo, nfi, nd), dbias(nfo), dx(nfi, dim_in)
 
         integer :: start_, end_, k, col, ii, row, nnz_row
-        real*8 :: x_work(nfi, max_nnz_row)
+        real*8,allocatable :: x_work(:,:)
         real*8,parameter :: one=1D0
         real*8,parameter :: zero=0D0
 
         !f2py intent(in) x, dy, csc_indices, csc_indptr, fltr_data
         !f2py intent(in) do_xgrad, do_wgrad, do_bgrad
         !f2py intent(in) nfi, nfo, nd, max_nnz_row, dim_in, dim_out, nnz
-        !f2py intent(out) dx, dweight, dbias
+        !f2py real*8 optional,intent(in,out),depend(nfi,dim_in) :: dx(nfi,dim_in)
+        !f2py real*8 optional,intent(in,out),depend(nfo,nfi,nd) :: dweight(nfo,nfi,nd)
+        !f2py real*8 optional,intent(in,out),depend(nfo) :: dbias(nfo)
 
+        if(do_xgrad) dx=zero
+        if(do_wgrad) dweight=zero
+        allocate(x_work(nfi, max_nnz_row))
         do col=1,dim_out
             start_=csc_indptr(col)
             end_=csc_indptr(col+1)
@@ -1142,32 +1818,168 @@ module lib
                 enddo
             endif
         enddo
+        deallocate(x_work)
         if(do_bgrad) then
             !calculate dbias
             dbias=sum(dy,2)
         endif
     end subroutine backward1_contiguousd
 
+    subroutine forward_im2cold(x, y, bias, num_batch, csc_indices, fltr_data,&
+            nnz, dim_in, dim_out, nfi, nfo, nd, block_size)
+        implicit none
+        !f2py threadsafe
+        integer,intent(in) :: num_batch, nnz, dim_in, dim_out, nfi, nfo, nd, block_size
+        real*8,intent(in) :: x(num_batch, nfi, dim_in), bias(nfo)
+        real*8,intent(in) :: fltr_data(nfo, nfi, nd)
+        integer,intent(in) :: csc_indices(nnz)
+        real*8,intent(inout) :: y(num_batch, nfo, dim_out)
+
+        real*8,allocatable :: x_work(:,:,:,:), y_work(:,:,:)
+        integer :: col0, nb, bmax, ldw, ii, j
+        real*8,parameter :: one=1D0
+        !f2py intent(in) x, csc_indices, fltr_data, bias
+        !f2py intent(in) nfi, nfo, num_batch, nnz, nd, dim_in, block_size
+        !f2py integer optional,intent(in),depend(nnz,nd) :: dim_out=nnz/nd
+        !f2py real*8 optional,intent(in,out),depend(num_batch,nfo,dim_out) :: y(num_batch,nfo,dim_out)
+
+        !columns of a block of output pixels, (num_batch, block, nfi, nd),
+        !blocks are made small enough to give every thread some.
+        bmax=max(1,min(block_size,dim_out))
+        !$ bmax=max(1,min(bmax,(dim_out-1)/omp_get_max_threads()+1))
+        ldw=num_batch*bmax
+
+        !$omp parallel private(col0, nb, ii, j, x_work, y_work)
+        allocate(x_work(num_batch, bmax, nfi, nd), y_work(num_batch, bmax, nfo))
+        !$omp do schedule(static)
+        do col0=1, dim_out, bmax
+            nb=min(bmax,dim_out-col0+1)
+
+            !gather patches of input, one column per kernel offset.
+            do ii=1,nd
+                do j=1,nb
+                    x_work(:,j,:,ii)=x(:,:,csc_indices((col0+j-2)*nd+ii))
+                enddo
+            enddo
+            do ii=1,nfo
+                y_work(:,:,ii)=bias(ii)
+            enddo
+
+            call dgemm('N', 'T', num_batch*nb, nfo, nfi*nd, one, x_work, ldw,&
+                fltr_data, nfo, one, y_work, ldw)
+
+            do j=1,nb
+                y(:,:,col0+j-1)=y_work(:,j,:)
+            enddo
+        enddo
+        !$omp end do
+        deallocate(x_work, y_work)
+        !$omp end parallel
+    end subroutine forward_im2cold
+
+    subroutine backward_im2cold(dy,x,dx,dweight,dbias,num_batch,csc_indices,fltr_data,&
+            nnz,dim_in,dim_out,nfi,nfo,nd,do_xgrad,do_wgrad,do_bgrad,block_size)
+        implicit none
+        !f2py threadsafe
+        integer,intent(in) :: num_batch,nnz,dim_in,dim_out,nfi,nfo,nd,block_size
+        logical,intent(in) :: do_xgrad, do_wgrad, do_bgrad
+        real*8,intent(in) :: x(num_batch, nfi, dim_in), dy(num_batch, nfo, dim_out),&
+            fltr_data(nfo,nfi,nd)
+        integer,intent(in) :: csc_indices(nnz)
+        real*8,intent(inout) :: dweight(nfo, nfi, nd), dbias(nfo), dx(num_batch, nfi, dim_in)
+
+        real*8,allocatable :: x_work(:,:,:,:), dy_work(:,:,:)
+        integer :: col0, nb, bmax, ldw, ii, j, row, b0, b1, nbl
+        real*8,parameter :: one=1D0
+        real*8,parameter :: zero=0D0
+
+        !f2py intent(in) x, dy, csc_indices, fltr_data
+        !f2py intent(in) do_xgrad, do_wgrad, do_bgrad
+        !f2py intent(in) nfi, nfo, num_batch, nd, dim_in, dim_out, nnz, block_size
+        !f2py real*8 optional,intent(in,out),depend(num_batch,nfi,dim_in) :: dx(num_batch,nfi,dim_in)
+        !f2py real*8 optional,intent(in,out),depend(nfo,nfi,nd) :: dweight(nfo,nfi,nd)
+        !f2py real*8 optional,intent(in,out),depend(nfo) :: dbias(nfo)
+
+        if(do_xgrad) dx=zero
+        if(do_wgrad) dweight=zero
+        if(do_xgrad .or. do_wgrad) then
+            bmax=max(1,min(block_size,dim_out))
+
+            !rows b0:b1 of the batch are taken by this thread.
+            !$omp parallel private(col0, nb, ldw, ii, j, row, b0, b1, nbl, x_work, dy_work)&
+            !$omp reduction(+:dweight)
+            b0=1
+            b1=num_batch
+            !$ b0=omp_get_thread_num()*num_batch/omp_get_num_threads()+1
+            !$ b1=(omp_get_thread_num()+1)*num_batch/omp_get_num_threads()
+            nbl=b1-b0+1
+            ldw=max(nbl,1)*bmax
+            allocate(x_work(max(nbl,1), bmax, nfi, nd), dy_work(max(nbl,1), bmax, nfo))
+
+            do col0=1, dim_out, bmax
+                if(nbl==0) exit
+                nb=min(bmax,dim_out-col0+1)
+                do j=1,nb
+                    dy_work(:,j,:)=dy(b0:b1,:,col0+j-1)
+                enddo
+
+                if(do_wgrad) then
+                    !gather patches of input
+                    do ii=1,nd
+                        do j=1,nb
+                            x_work(:,j,:,ii)=x(b0:b1,:,csc_indices((col0+j-2)*nd+ii))
+                        enddo
+                    enddo
+
+                    !calculate dweight
+                    call dgemm('T', 'N', nfo, nfi*nd, nbl*nb, one,&
+                        dy_work, ldw, x_work, ldw, one, dweight, nfo)
+                endif
+                if(do_xgrad) then
+                    !calculate gradients of patches, and scatter them back to dx.
+                    call dgemm('N', 'N', nbl*nb, nfi*nd, nfo, one,&
+                        dy_work, ldw, fltr_data, nfo, zero, x_work, ldw)
+                    do ii=1,nd
+                        do j=1,nb
+                            row=csc_indices((col0+j-2)*nd+ii)
+                            dx(b0:b1,:,row)=dx(b0:b1,:,row)+x_work(:,j,:,ii)
+                        enddo
+                    enddo
+                endif
+            enddo
+            deallocate(x_work, dy_work)
+            !$omp end parallel
+        endif
+        if(do_bgrad) then
+            !calculate dbias
+            dbias=sum(sum(dy,1),2)
+        endif
+    end subroutine backward_im2cold
+
     subroutine forward_generals(x, y, bias, num_batch, csc_indptr, csc_indices, fltr_data, weight_indices,&
             nnz, dim_in, dim_out, nfi, nfo, nd, max_nnz_row)
         implicit none
+        !f2py threadsafe
         integer,intent(in) :: num_batch, nnz, dim_in, dim_out, nfi, nfo, max_nnz_row, nd
         real*4,intent(in) :: x(num_batch, nfi, dim_in), bias(nfo)
         real*4,intent(in) :: fltr_data(nfo, nfi, nd)
         integer,intent(in) :: csc_indices(nnz), csc_indptr(dim_out+1), weight_indices(nnz)
-        real*4,intent(out) :: y(num_batch, nfo, dim_out)
+        real*4,intent(inout) :: y(num_batch, nfo, dim_out)
 
-        real*4 :: x_work(num_batch, nfi, max_nnz_row), w_work(nfo, nfi, max_nnz_row)
+        real*4,allocatable :: x_work(:,:,:), w_work(:,:,:)
         integer :: start_, end_, col, ii, nnz_row, k
         real*4,parameter :: one=1.0
         !f2py intent(in) x, csc_indices, csc_indptr, fltr_data, bias, weight_indices
         !f2py intent(in) nfi, nfo, num_batch, max_nnz_row, nnz, dim_out, nd, dim_in
-        !f2py intent(out) y
+        !f2py real*4 optional,intent(in,out),depend(num_batch, nfo,dim_out) :: y(num_batch, nfo,dim_out)
 
         do ii=1,nfo
             y(:,ii,:)=bias(ii)
         enddo
 
+        !$omp parallel private(start_, end_, col, ii, nnz_row, k, x_work, w_work)
+        allocate(x_work(num_batch, nfi, max_nnz_row), w_work(nfo, nfi, max_nnz_row))
+        !$omp do schedule(static)
         do col=1, dim_out
             start_=csc_indptr(col)
             end_=csc_indptr(col+1)
@@ -1182,29 +1994,47 @@ module lib
             call sgemm('N', 'T', num_batch, nfo, k, one, x_work, num_batch,&
                 w_work, nfo, one, y(:,:,col), num_batch)
             enddo
+        !$omp end do
+        deallocate(x_work, w_work)
+        !$omp end parallel
     end subroutine forward_generals
 
     subroutine backward_generals(dy,x,dx,dweight,dbias,csc_indptr,csc_indices,weight_indices,fltr_data,&
             nnz,dim_in,dim_out,nfi,nfo, nd, num_batch, do_xgrad, do_wgrad, do_bgrad, max_nnz_row)
         implicit none
+        !f2py threadsafe
         integer,intent(in) :: num_batch, nnz,dim_in,dim_out,nfi,nfo,nd,max_nnz_row
         logical,intent(in) :: do_xgrad, do_wgrad, do_bgrad
         real*4,intent(in) :: x(num_batch, nfi, dim_in), dy(num_batch, nfo, dim_out),&
             fltr_data(nfo,nfi,nd)
         integer,intent(in) :: csc_indices(nnz), csc_indptr(dim_out+1), weight_indices(nnz)
-        real*4,intent(out) :: dweight(nfo, nfi, nd), dbias(nfo), dx(num_batch, nfi, dim_in)
+        real*4,intent(inout) :: dweight(nfo, nfi, nd), dbias(nfo), dx(num_batch, nfi, dim_in)
 
-        integer :: start_, end_, k, col, ii, row, nnz_row
-        real*4 :: x_work(num_batch, nfi, max_nnz_row), w_work(nfo, nfi, max_nnz_row)
+        integer :: start_, end_, k, col, ii, row, nnz_row, b0, b1, nbl
+        real*4,allocatable :: x_work(:,:,:), w_work(:,:,:)
         real*4,parameter :: one=1.0
         real*4,parameter :: zero=0.0
 
         !f2py intent(in) x, dy, csc_indices, csc_indptr, weight_indices, fltr_data
         !f2py intent(in) do_xgrad, do_wgrad, do_bgrad
         !f2py intent(in) nfi, nfo, num_batch, nd, max_nnz_row, dim_in, dim_out, nnz
-        !f2py intent(out) dx, dweight, dbias
-
+        !f2py real*4 optional,intent(in,out),depend(num_batch, nfi,dim_in) :: dx(num_batch, nfi,dim_in)
+        !f2py real*4 optional,intent(in,out),depend(nfo,nfi,nd) :: dweight(nfo,nfi,nd)
+        !f2py real*4 optional,intent(in,out),depend(nfo) :: dbias(nfo)
+
+        if(do_xgrad) dx=zero
+        if(do_wgrad) dweight=zero
+        !rows b0:b1 of the batch are taken by this thread.
+        !$omp parallel private(start_, end_, k, col, ii, row, nnz_row, b0, b1, nbl, x_work, w_work)&
+        !$omp reduction(+:dweight)
+        b0=1
+        b1=num_batch
+        !$ b0=omp_get_thread_num()*num_batch/omp_get_num_threads()+1
+        !$ b1=(omp_get_thread_num()+1)*num_batch/omp_get_num_threads()
+        nbl=b1-b0+1
+        allocate(x_work(max(nbl,1), nfi, max_nnz_row), w_work(nfo, nfi, max_nnz_row))
         do col=1,dim_out
+            if(nbl==0) exit
             start_=csc_indptr(col)
             end_=csc_indptr(col+1)
             nnz_row=end_-start_
@@ -1213,12 +2043,12 @@ module lib
             if(do_wgrad) then
                 !prepair work space by taking rows in x
                 do ii=1,nnz_row
-                    x_work(:,:,ii)=x(:,:,csc_indices(start_+ii-1))
+                    x_work(:,:,ii)=x(b0:b1,:,csc_indices(start_+ii-1))
                 enddo
 
                 !calculate dweight
-                call sgemm('T', 'N', nfo, k, num_batch, one,&
-                    dy(:,:,col), num_batch, x_work, num_batch,&
+                call sgemm('T', 'N', nfo, k, nbl, one,&
+                    dy(b0,1,col), num_batch, x_work, max(nbl,1),&
                     zero, w_work, nfo)
 
                 !extract rows
@@ -1233,15 +2063,17 @@ module lib
                     w_work(:,:,ii)=fltr_data(:,:,weight_indices(start_+ii-1))
                 enddo
                 !calculate dx
-                call sgemm('N', 'N', num_batch, k, nfo, one, dy(:,:,col), num_batch,&
-                    w_work, nfo, zero, x_work, num_batch)
+                call sgemm('N', 'N', nbl, k, nfo, one, dy(b0,1,col), num_batch,&
+                    w_work, nfo, zero, x_work, max(nbl,1))
                 !extract rows
                 do ii=1,nnz_row
                     row=csc_indices(start_+ii-1)
-                    dx(:,:,row)=dx(:,:,row)+x_work(:,:,ii)
+                    dx(b0:b1,:,row)=dx(b0:b1,:,row)+x_work(:,:,ii)
                 enddo
             endif
         enddo
+        deallocate(x_work, w_work)
+        !$omp end parallel
         if(do_bgrad) then
             !calculate dbias
             dbias=sum(sum(dy,1),2)
@@ -1251,23 +2083,27 @@ module lib
     subroutine forward1_generals(x, y, bias, csc_indptr, csc_indices, fltr_data, weight_indices,&
             nnz, dim_in, dim_out, nfi, nfo, nd, max_nnz_row)
         implicit none
+        !f2py threadsafe
         integer,intent(in) :: nnz, dim_in, dim_out, nfi, nfo, max_nnz_row, nd
         real*4,intent(in) :: x(nfi, dim_in), bias(nfo)
         real*4,intent(in) :: fltr_data(nfo, nfi, nd)
         integer,intent(in) :: csc_indices(nnz), csc_indptr(dim_out+1), weight_indices(nnz)
-        real*4,intent(out) :: y(nfo, dim_out)
+        real*4,intent(inout) :: y(nfo, dim_out)
 
-        real*4 :: x_work(nfi, max_nnz_row), w_work(nfo, nfi, max_nnz_row)
+        real*4,allocatable :: x_work(:,:), w_work(:,:,:)
         integer :: start_, end_, col, ii, nnz_row, k
         real*4,parameter :: one=1.0
         !f2py intent(in) x, csc_indices, csc_indptr, fltr_data, bias, weight_indices
         !f2py intent(in) nfi, nfo, max_nnz_row, nnz, dim_out, nd, dim_in
-        !f2py intent(out) y
+        !f2py real*4 optional,intent(in,out),depend(nfo,dim_out) :: y(nfo,dim_out)
 
         do ii=1,nfo
             y(ii,:)=bias(ii)
         enddo
 
+        !$omp parallel private(start_, end_, col, ii, nnz_row, k, x_work, w_work)
+        allocate(x_work(nfi, max_nnz_row), w_work(nfo, nfi, max_nnz_row))
+        !$omp do schedule(static)
         do col=1, dim_out
             start_=csc_indptr(col)
             end_=csc_indptr(col+1)
@@ -1279,31 +2115,40 @@ module lib
                 x_work(:,ii)=x(:,csc_indices(start_+ii-1))
                 w_work(:,:,ii)=fltr_data(:,:,weight_indices(start_+ii-1))
             enddo
-            call sgemv('N', nfo, k, one, fltr_data, nfo,&
+            call sgemv('N', nfo, k, one, w_work, nfo,&
             x_work, 1, one, y(:,col), 1)
             enddo
+        !$omp end do
+        deallocate(x_work, w_work)
+        !$omp end parallel
     end subroutine forward1_generals
 
     subroutine backward1_generals(dy,x,dx,dweight,dbias,csc_indptr,csc_indices,weight_indices,fltr_data,&
             nnz,dim_in,dim_out,nfi,nfo, nd, do_xgrad, do_wgrad, do_bgrad, max_nnz_row)
         implicit none
+        !f2py threadsafe
         integer,intent(in) :: nnz,dim_in,dim_out,nfi,nfo,nd,max_nnz_row
         logical,intent(in) :: do_xgrad, do_wgrad, do_bgrad
         real*4,intent(in) :: x(nfi, dim_in), dy(nfo, dim_out),&
             fltr_data(nfo,nfi,nd)
         integer,intent(in) :: csc_indices(nnz), csc_indptr(dim_out+1), weight_indices(nnz)
-        real*4,intent(out) :: dweight(nfo, nfi, nd), dbias(nfo), dx(nfi, dim_in)
+        real*4,intent(inout) :: dweight(nfo, nfi, nd), dbias(nfo), dx(nfi, dim_in)
 
         integer :: start_, end_, k, col, ii, row, nnz_row
-        real*4 :: x_work(nfi, max_nnz_row), w_work(nfo, nfi, max_nnz_row)
+        real*4,allocatable :: x_work(:,:), w_work(:,:,:)
         real*4,parameter :: one=1.0
         real*4,parameter :: zero=0.0
 
         !f2py intent(in) x, dy, csc_indices, csc_indptr, weight_indices, fltr_data
         !f2py intent(in) do_xgrad, do_wgrad, do_bgrad
         !f2py intent(in) nfi, nfo, nd, max_nnz_row, dim_in, dim_out, nnz
-        !f2py intent(out) dx, dweight, dbias
+        !f2py real*4 optional,intent(in,out),depend(nfi,dim_in) :: dx(nfi,dim_in)
+        !f2py real*4 optional,intent(in,out),depend(nfo,nfi,nd) :: dweight(nfo,nfi,nd)
+        !f2py real*4 optional,intent(in,out),depend(nfo) :: dbias(nfo)
 
+        if(do_xgrad) dx=zero
+        if(do_wgrad) dweight=zero
+        allocate(x_work(nfi, max_nnz_row), w_work(nfo, nfi, max_nnz_row))
         do col=1,dim_out
             start_=csc_indptr(col)
             end_=csc_indptr(col+1)
@@ -1342,6 +2187,7 @@ module lib
                 enddo
             endif
         enddo
+        deallocate(x_work, w_work)
         if(do_bgrad) then
             !calculate dbias
             dbias=sum(dy,2)
@@ -1351,23 +2197,27 @@ module lib
     subroutine forward_contiguouss(x, y, bias, num_batch, csc_indptr, csc_indices, fltr_data,&
             nnz, dim_in, dim_out, nfi, nfo, nd, max_nnz_row)
         implicit none
+        !f2py threadsafe
         integer,intent(in) :: num_batch, nnz, dim_in, dim_out, nfi, nfo, max_nnz_row, nd
         real*4,intent(in) :: x(num_batch, nfi, dim_in), bias(nfo)
         real*4,intent(in) :: fltr_data(nfo, nfi, nd)
         integer,intent(in) :: csc_indices(nnz), csc_indptr(dim_out+1)
-        real*4,intent(out) :: y(num_batch, nfo, dim_out)
+        real*4,intent(inout) :: y(num_batch, nfo, dim_out)
 
-        real*4 :: x_work(num_batch, nfi, max_nnz_row)
+        real*4,allocatable :: x_work(:,:,:)
         integer :: start_, end_, col, ii, nnz_row, k
         real*4,parameter :: one=1.0
         !f2py intent(in) x, csc_indices, csc_indptr, fltr_data, bias
         !f2py intent(in) nfi, nfo, num_batch, max_nnz_row, nnz, dim_out, nd, dim_in
-        !f2py intent(out) y
+        !f2py real*4 optional,intent(in,out),depend(num_batch, nfo,dim_out) :: y(num_batch, nfo,dim_out)
 
         do ii=1,nfo
             y(:,ii,:)=bias(ii)
         enddo
 
+        !$omp parallel private(start_, end_, col, ii, nnz_row, k, x_work)
+        allocate(x_work(num_batch, nfi, max_nnz_row))
+        !$omp do schedule(static)
         do col=1, dim_out
             start_=csc_indptr(col)
             end_=csc_indptr(col+1)
@@ -1382,29 +2232,47 @@ module lib
             call sgemm('N', 'T', num_batch, nfo, k, one, x_work, num_batch,&
                 fltr_data, nfo, one, y(:,:,col), num_batch)
             enddo
+        !$omp end do
+        deallocate(x_work)
+        !$omp end parallel
     end subroutine forward_contiguouss
 
     subroutine backward_contiguouss(dy,x,dx,dweight,dbias,csc_indptr,csc_indices,fltr_data,&
             nnz,dim_in,dim_out,nfi,nfo, nd, num_batch, do_xgrad, do_wgrad, do_bgrad, max_nnz_row)
         implicit none
+        !f2py threadsafe
         integer,intent(in) :: num_batch, nnz,dim_in,dim_out,nfi,nfo,nd,max_nnz_row
         logical,intent(in) :: do_xgrad, do_wgrad, do_bgrad
         real*4,intent(in) :: x(num_batch, nfi, dim_in), dy(num_batch, nfo, dim_out),&
             fltr_data(nfo,nfi,nd)
         integer,intent(in) :: csc_indices(nnz), csc_indptr(dim_out+1)
-        real*4,intent(out) :: dweight(nfo, nfi, nd), dbias(nfo), dx(num_batch, nfi, dim_in)
+        real*4,intent(inout) :: dweight(nfo, nfi, nd), dbias(nfo), dx(num_batch, nfi, dim_in)
 
-        integer :: start_, end_, k, col, ii, row, nnz_row
-        real*4 :: x_work(num_batch, nfi, max_nnz_row)
+        integer :: start_, end_, k, col, ii, row, nnz_row, b0, b1, nbl
+        real*4,allocatable :: x_work(:,:,:)
         real*4,parameter :: one=1.0
         real*4,parameter :: zero=0.0
 
         !f2py intent(in) x, dy, csc_indices, csc_indptr, fltr_data
         !f2py intent(in) do_xgrad, do_wgrad, do_bgrad
         !f2py intent(in) nfi, nfo, num_batch, nd, max_nnz_row, dim_in, dim_out, nnz
-        !f2py intent(out) dx, dweight, dbias
-
+        !f2py real*4 optional,intent(in,out),depend(num_batch, nfi,dim_in) :: dx(num_batch, nfi,dim_in)
+        !f2py real*4 optional,intent(in,out),depend(nfo,nfi,nd) :: dweight(nfo,nfi,nd)
+        !f2py real*4 optional,intent(in,out),depend(nfo) :: dbias(nfo)
+
+        if(do_xgrad) dx=zero
+        if(do_wgrad) dweight=zero
+        !rows b0:b1 of the batch are taken by this thread.
+        !$omp parallel private(start_, end_, k, col, ii, row, nnz_row, b0, b1, nbl, x_work)&
+        !$omp reduction(+:dweight)
+        b0=1
+        b1=num_batch
+        !$ b0=omp_get_thread_num()*num_batch/omp_get_num_threads()+1
+        !$ b1=(omp_get_thread_num()+1)*num_batch/omp_get_num_threads()
+        nbl=b1-b0+1
+        allocate(x_work(max(nbl,1), nfi, max_nnz_row))
         do col=1,dim_out
+            if(nbl==0) exit
             start_=csc_indptr(col)
             end_=csc_indptr(col+1)
             nnz_row=end_-start_
@@ -1413,26 +2281,28 @@ module lib
             if(do_wgrad) then
                 !prepair work space by taking rows in x
                 do ii=1,nnz_row
-                    x_work(:,:,ii)=x(:,:,csc_indices(start_+ii-1))
+                    x_work(:,:,ii)=x(b0:b1,:,csc_indices(start_+ii-1))
                 enddo
 
                 !calculate dweight
-                call sgemm('T', 'N', nfo, k, num_batch, one,&
-                    dy(:,:,col), num_batch, x_work, num_batch,&
+                call sgemm('T', 'N', nfo, k, nbl, one,&
+                    dy(b0,1,col), num_batch, x_work, max(nbl,1),&
                     one, dweight, nfo)
 
                 endif
             if(do_xgrad) then
                 !calculate dx
-                call sgemm('N', 'N', num_batch, k, nfo, one, dy(:,:,col), num_batch,&
-                    fltr_data, nfo, zero, x_work, num_batch)
+                call sgemm('N', 'N', nbl, k, nfo, one, dy(b0,1,col), num_batch,&
+                    fltr_data, nfo, zero, x_work, max(nbl,1))
                 !extract rows
                 do ii=1,nnz_row
                     row=csc_indices(start_+ii-1)
-                    dx(:,:,row)=dx(:,:,row)+x_work(:,:,ii)
+                    dx(b0:b1,:,row)=dx(b0:b1,:,row)+x_work(:,:,ii)
                 enddo
             endif
         enddo
+        deallocate(x_work)
+        !$omp end parallel
         if(do_bgrad) then
             !calculate dbias
             dbias=sum(sum(dy,1),2)
@@ -1442,23 +2312,27 @@ module lib
     subroutine forward1_contiguouss(x, y, bias, csc_indptr, csc_indices, fltr_data,&
             nnz, dim_in, dim_out, nfi, nfo, nd, max_nnz_row)
         implicit none
+        !f2py threadsafe
         integer,intent(in) :: nnz, dim_in, dim_out, nfi, nfo, max_nnz_row, nd
         real*4,intent(in) :: x(nfi, dim_in), bias(nfo)
         real*4,intent(in) :: fltr_data(nfo, nfi, nd)
         integer,intent(in) :: csc_indices(nnz), csc_indptr(dim_out+1)
-        real*4,intent(out) :: y(nfo, dim_out)
+        real*4,intent(inout) :: y(nfo, dim_out)
 
-        real*4 :: x_work(nfi, max_nnz_row)
+        real*4,allocatable :: x_work(:,:)
         integer :: start_, end_, col, ii, nnz_row, k
         real*4,parameter :: one=1.0
         !f2py intent(in) x, csc_indices, csc_indptr, fltr_data, bias
         !f2py intent(in) nfi, nfo, max_nnz_row, nnz, dim_out, nd, dim_in
-        !f2py intent(out) y
+        !f2py real*4 optional,intent(in,out),depend(nfo,dim_out) :: y(nfo,dim_out)
 
         do ii=1,nfo
             y(ii,:)=bias(ii)
         enddo
 
+        !$omp parallel private(start_, end_, col, ii, nnz_row, k, x_work)
+        allocate(x_work(nfi, max_nnz_row))
+        !$omp do schedule(static)
         do col=1, dim_out
             start_=csc_indptr(col)
             end_=csc_indptr(col+1)
@@ -1473,28 +2347,37 @@ module lib
             call sgemv('N', nfo, k, one, fltr_data, nfo,&
             x_work, 1, one, y(:,col), 1)
             enddo
+        !$omp end do
+        deallocate(x_work)
+        !$omp end parallel
     end subroutine forward1_contiguouss
 
     subroutine backward1_contiguouss(dy,x,dx,dweight,dbias,csc_indptr,csc_indices,fltr_data,&
             nnz,dim_in,dim_out,nfi,nfo, nd, do_xgrad, do_wgrad, do_bgrad, max_nnz_row)
         implicit none
+        !f2py threadsafe
         integer,intent(in) :: nnz,dim_in,dim_out,nfi,nfo,nd,max_nnz_row
         logical,intent(in) :: do_xgrad, do_wgrad, do_bgrad
         real*4,intent(in) :: x(nfi, dim_in), dy(nfo, dim_out),&
             fltr_data(nfo,nfi,nd)
         integer,intent(in) :: csc_indices(nnz), csc_indptr(dim_out+1)
-        real*4,intent(out) :: dweight(nfo, nfi, nd), dbias(nfo), dx(nfi, dim_in)
+        real*4,intent(inout) :: dweight(nfo, nfi, nd), dbias(nfo), dx(nfi, dim_in)
 
         integer :: start_, end_, k, col, ii, row, nnz_row
-        real*4 :: x_work(nfi, max_nnz_row)
+        real*4,allocatable :: x_work(:,:)
         real*4,parameter :: one=1.0
         real*4,parameter :: zero=0.0
 
         !f2py intent(in) x, dy, csc_indices, csc_indptr, fltr_data
         !f2py intent(in) do_xgrad, do_wgrad, do_bgrad
         !f2py intent(in) nfi, nfo, nd, max_nnz_row, dim_in, dim_out, nnz
-        !f2py intent(out) dx, dweight, dbias
+        !f2py real*4 optional,intent(in,out),depend(nfi,dim_in) :: dx(nfi,dim_in)
+        !f2py real*4 optional,intent(in,out),depend(nfo,nfi,nd) :: dweight(nfo,nfi,nd)
+        !f2py real*4 optional,intent(in,out),depend(nfo) :: dbias(nfo)
 
+        if(do_xgrad) dx=zero
+        if(do_wgrad) dweight=zero
+        allocate(x_work(nfi, max_nnz_row))
         do col=1,dim_out
             start_=csc_indptr(col)
             end_=csc_indptr(col+1)
@@ -1524,10 +2407,142 @@ module lib
                 enddo
             endif
         enddo
+        deallocate(x_work)
         if(do_bgrad) then
             !calculate dbias
             dbias=sum(dy,2)
         endif
     end subroutine backward1_contiguouss
 
+    subroutine forward_im2cols(x, y, bias, num_batch, csc_indices, fltr_data,&
+            nnz, dim_in, dim_out, nfi, nfo, nd, block_size)
+        implicit none
+        !f2py threadsafe
+        integer,intent(in) :: num_batch, nnz, dim_in, dim_out, nfi, nfo, nd, block_size
+        real*4,intent(in) :: x(num_batch, nfi, dim_in), bias(nfo)
+        real*4,intent(in) :: fltr_data(nfo, nfi, nd)
+        integer,intent(in) :: csc_indices(nnz)
+        real*4,intent(inout) :: y(num_batch, nfo, dim_out)
+
+        real*4,allocatable :: x_work(:,:,:,:), y_work(:,:,:)
+        integer :: col0, nb, bmax, ldw, ii, j
+        real*4,parameter :: one=1.0
+        !f2py intent(in) x, csc_indices, fltr_data, bias
+        !f2py intent(in) nfi, nfo, num_batch, nnz, nd, dim_in, block_size
+        !f2py integer optional,intent(in),depend(nnz,nd) :: dim_out=nnz/nd
+        !f2py real*4 optional,intent(in,out),depend(num_batch,nfo,dim_out) :: y(num_batch,nfo,dim_out)
+
+        !columns of a block of output pixels, (num_batch, block, nfi, nd),
+        !blocks are made small enough to give every thread some.
+        bmax=max(1,min(block_size,dim_out))
+        !$ bmax=max(1,min(bmax,(dim_out-1)/omp_get_max_threads()+1))
+        ldw=num_batch*bmax
+
+        !$omp parallel private(col0, nb, ii, j, x_work, y_work)
+        allocate(x_work(num_batch, bmax, nfi, nd), y_work(num_batch, bmax, nfo))
+        !$omp do schedule(static)
+        do col0=1, dim_out, bmax
+            nb=min(bmax,dim_out-col0+1)
+
+            !gather patches of input, one column per kernel offset.
+            do ii=1,nd
+                do j=1,nb
+                    x_work(:,j,:,ii)=x(:,:,csc_indices((col0+j-2)*nd+ii))
+                enddo
+            enddo
+            do ii=1,nfo
+                y_work(:,:,ii)=bias(ii)
+            enddo
+
+            call sgemm('N', 'T', num_batch*nb, nfo, nfi*nd, one, x_work, ldw,&
+                fltr_data, nfo, one, y_work, ldw)
+
+            do j=1,nb
+                y(:,:,col0+j-1)=y_work(:,j,:)
+            enddo
+        enddo
+        !$omp end do
+        deallocate(x_work, y_work)
+        !$omp end parallel
+    end subroutine forward_im2cols
+
+    subroutine backward_im2cols(dy,x,dx,dweight,dbias,num_batch,csc_indices,fltr_data,&
+            nnz,dim_in,dim_out,nfi,nfo,nd,do_xgrad,do_wgrad,do_bgrad,block_size)
+        implicit none
+        !f2py threadsafe
+        integer,intent(in) :: num_batch,nnz,dim_in,dim_out,nfi,nfo,nd,block_size
+        logical,intent(in) :: do_xgrad, do_wgrad, do_bgrad
+        real*4,intent(in) :: x(num_batch, nfi, dim_in), dy(num_batch, nfo, dim_out),&
+            fltr_data(nfo,nfi,nd)
+        integer,intent(in) :: csc_indices(nnz)
+        real*4,intent(inout) :: dweight(nfo, nfi, nd), dbias(nfo), dx(num_batch, nfi, dim_in)
+
+        real*4,allocatable :: x_work(:,:,:,:), dy_work(:,:,:)
+        integer :: col0, nb, bmax, ldw, ii, j, row, b0, b1, nbl
+        real*4,parameter :: one=1.0
+        real*4,parameter :: zero=0.0
+
+        !f2py intent(in) x, dy, csc_indices, fltr_data
+        !f2py intent(in) do_xgrad, do_wgrad, do_bgrad
+        !f2py intent(in) nfi, nfo, num_batch, nd, dim_in, dim_out, nnz, block_size
+        !f2py real*4 optional,intent(in,out),depend(num_batch,nfi,dim_in) :: dx(num_batch,nfi,dim_in)
+        !f2py real*4 optional,intent(in,out),depend(nfo,nfi,nd) :: dweight(nfo,nfi,nd)
+        !f2py real*4 optional,intent(in,out),depend(nfo) :: dbias(nfo)
+
+        if(do_xgrad) dx=zero
+        if(do_wgrad) dweight=zero
+        if(do_xgrad .or. do_wgrad) then
+            bmax=max(1,min(block_size,dim_out))
+
+            !rows b0:b1 of the batch are taken by this thread.
+            !$omp parallel private(col0, nb, ldw, ii, j, row, b0, b1, nbl, x_work, dy_work)&
+            !$omp reduction(+:dweight)
+            b0=1
+            b1=num_batch
+            !$ b0=omp_get_thread_num()*num_batch/omp_get_num_threads()+1
+            !$ b1=(omp_get_thread_num()+1)*num_batch/omp_get_num_threads()
+            nbl=b1-b0+1
+            ldw=max(nbl,1)*bmax
+            allocate(x_work(max(nbl,1), bmax, nfi, nd), dy_work(max(nbl,1), bmax, nfo))
+
+            do col0=1, dim_out, bmax
+                if(nbl==0) exit
+                nb=min(bmax,dim_out-col0+1)
+                do j=1,nb
+                    dy_work(:,j,:)=dy(b0:b1,:,col0+j-1)
+                enddo
+
+                if(do_wgrad) then
+                    !gather patches of input
+                    do ii=1,nd
+                        do j=1,nb
+                            x_work(:,j,:,ii)=x(b0:b1,:,csc_indices((col0+j-2)*nd+ii))
+                        enddo
+                    enddo
+
+                    !calculate dweight
+                    call sgemm('T', 'N', nfo, nfi*nd, nbl*nb, one,&
+                        dy_work, ldw, x_work, ldw, one, dweight, nfo)
+                endif
+                if(do_xgrad) then
+                    !calculate gradients of patches, and scatter them back to dx.
+                    call sgemm('N', 'N', nbl*nb, nfi*nd, nfo, one,&
+                        dy_work, ldw, fltr_data, nfo, zero, x_work, ldw)
+                    do ii=1,nd
+                        do j=1,nb
+                            row=csc_indices((col0+j-2)*nd+ii)
+                            dx(b0:b1,:,row)=dx(b0:b1,:,row)+x_work(:,j,:,ii)
+                        enddo
+                    enddo
+                endif
+            enddo
+            deallocate(x_work, dy_work)
+            !$omp end parallel
+        endif
+        if(do_bgrad) then
+            !calculate dbias
+            dbias=sum(sum(dy,1),2)
+        endif
+    end subroutine backward_im2cols
+
     end module lib
\ No newline at end of file
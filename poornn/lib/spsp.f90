@@ -26,11 +26,13 @@ module lib
         complex*16,intent(out) :: dx(num_batch, dim_in)
         complex*16,intent(in) :: x(num_batch, dim_in), dy(num_batch,dim_out), csc_data(nnz)
         integer,intent(in) :: csc_indices(nnz), csc_indptr(dim_out+1)
-        complex*16,intent(out) :: dweight(nnz), dbias(dim_out)
+        complex*16,intent(inout) :: dweight(nnz), dbias(dim_out)
+        !f2py complex*16 optional,intent(in,out),depend(nnz) :: dweight(nnz)
+        !f2py complex*16 optional,intent(in,out),depend(dim_out) :: dbias(dim_out)
 
         integer :: k, col, start_, end_
 
-        dweight=0
+        if(do_wgrad) dweight=0
         do k=1,num_batch
             if(do_wgrad) then
                 !calculate dweight
@@ -38,11 +40,10 @@ module lib
                     start_=csc_indptr(col)
                     end_=csc_indptr(col+1)-1
                     dweight(start_:end_)= dweight(start_:end_)+x(k,csc_indices(start_:end_))*dy(k,col)
-                    enddo
+                enddo
             endif
             if(do_xgrad) then
                 !calculate dx
-                
                 call mkl_zcscmv('N', dim_in, dim_out, dcmplx(1D0,0D0), matdescra, csc_data, csc_indices,&
                 csc_indptr(1:dim_out), csc_indptr(2:dim_out+1), dy(k,:), dcmplx(0D0,0D0), dx(k,:))
             endif
@@ -52,45 +53,58 @@ module lib
             dbias=sum(dy,1)
         endif
     end subroutine backwardz
-    subroutine backward_convz(dy,x,dx,dweight, dbias, num_batch, csc_indptr,csc_indices, &
-            csc_data, nnz,nd, dim_in,dim_out, do_xgrad, do_wgrad, do_bgrad)
+
+    !convolution with a sparse kernel, columns are (feature_out, img_out) with feature_out the fastest,
+    !each group of nfo columns (an output pixel) takes nd entries, the i-th entry uses fltr_data(mod(i-1,nd)+1).
+    subroutine forward_convz(x, y, bias, csc_indptr, csc_indices, fltr_data, num_batch, dim_in, dim_out, nnz, nd, nfo)
         implicit none
-        integer,intent(in) :: num_batch, nnz,dim_in,nd, dim_out
+        !f2py threadsafe
+        integer,intent(in) :: num_batch, dim_in, dim_out, nnz, nd, nfo
+        complex*16,intent(in) :: x(num_batch, dim_in), fltr_data(nd), bias(nfo)
+        complex*16,intent(inout) :: y(num_batch, dim_out)
+        integer,intent(in) :: csc_indices(nnz), csc_indptr(dim_out+1)
+        !f2py complex*16 optional,intent(in,out),depend(num_batch,dim_out) :: y(num_batch,dim_out)
+
+        integer :: col, ii
+
+        do col=1,dim_out
+            y(:,col)=bias(modulo(col-1,nfo)+1)
+            do ii=csc_indptr(col),csc_indptr(col+1)-1
+                y(:,col)=y(:,col)+fltr_data(modulo(ii-1,nd)+1)*x(:,csc_indices(ii))
+            enddo
+        enddo
+    end subroutine forward_convz
+
+    subroutine backward_convz(dy, x, dx, dweight, dbias, csc_indptr, csc_indices, fltr_data,&
+            num_batch, dim_in, dim_out, nnz, nd, nfo, do_xgrad, do_wgrad, do_bgrad)
+        implicit none
+        !f2py threadsafe
+        integer,intent(in) :: num_batch, dim_in, dim_out, nnz, nd, nfo
         logical,intent(in) :: do_xgrad, do_wgrad, do_bgrad
-        complex*16,intent(out) :: dx(num_batch, dim_in)
-        complex*16,intent(in) :: x(num_batch, dim_in), dy(num_batch,dim_out), csc_data(nd)
+        complex*16,intent(in) :: x(num_batch, dim_in), dy(num_batch, dim_out), fltr_data(nd)
         integer,intent(in) :: csc_indices(nnz), csc_indptr(dim_out+1)
-        complex*16,intent(out) :: dweight(nd), dbias(dim_out)
+        complex*16,intent(inout) :: dx(num_batch, dim_in), dweight(nd), dbias(nfo)
+        !f2py complex*16 optional,intent(in,out),depend(num_batch,dim_in) :: dx(num_batch,dim_in)
+        !f2py complex*16 optional,intent(in,out),depend(nd) :: dweight(nd)
+        !f2py complex*16 optional,intent(in,out),depend(nfo) :: dbias(nfo)
 
-        integer :: k, col, start_, end_,data_start_, data_end_, ifo
+        integer :: col, ii, k, row
 
-        dweight=0
-        do k=1,num_batch
-            if(do_wgrad) then
-                !calculate dweight
-                do col=1,dim_out
-                    start_=csc_indptr(col)
-                    end_=csc_indptr(col+1)-1
-                    data_start_=modulo(start_-1, nd)+1
-                    data_end_=modulo(end_-1, nd)+1
-                    dweight(data_start_:data_end_)= dweight(data_start_:data_end_)+x(k,csc_indices(start_:end_))*dy(k,col)
-                    enddo
-            endif
-            if(do_xgrad) then
-                !calculate dx
-                do ifo=1,nnz/nd
-                    call mkl_zcscmv('N', dim_in, dim_out, dcmplx(1D0,0D0), matdescra, csc_data, csc_indices,&
-                    csc_indptr(1:dim_in), csc_indptr(2:dim_in+1), dy(k,:), dcmplx(0D0,0D0), dx(k,:))
-                enddo
-                
-                call mkl_zcscmv('N', dim_in, dim_out, dcmplx(1D0,0D0), matdescra, csc_data, csc_indices,&
-                csc_indptr(1:dim_out), csc_indptr(2:dim_out+1), dy(k,:), dcmplx(0D0,0D0), dx(k,:))
+        if(do_xgrad) dx=0
+        if(do_wgrad) dweight=0
+        if(do_bgrad) dbias=0
+        do col=1,dim_out
+            if(do_bgrad) then
+                k=modulo(col-1,nfo)+1
+                dbias(k)=dbias(k)+sum(dy(:,col))
             endif
+            do ii=csc_indptr(col),csc_indptr(col+1)-1
+                k=modulo(ii-1,nd)+1
+                row=csc_indices(ii)
+                if(do_xgrad) dx(:,row)=dx(:,row)+fltr_data(k)*dy(:,col)
+                if(do_wgrad) dweight(k)=dweight(k)+sum(x(:,row)*dy(:,col))
+            enddo
         enddo
-        if(do_bgrad) then
-            !calculate dbias
-            dbias=sum(dy,1)
-        endif
     end subroutine backward_convz
     subroutine forwardc(x, y, bias, num_batch, csc_indptr, csc_indices, csc_data, nnz, dim_in, dim_out)
         implicit none
@@ -116,11 +130,13 @@ module lib
         complex*8,intent(out) :: dx(num_batch, dim_in)
         complex*8,intent(in) :: x(num_batch, dim_in), dy(num_batch,dim_out), csc_data(nnz)
         integer,intent(in) :: csc_indices(nnz), csc_indptr(dim_out+1)
-        complex*8,intent(out) :: dweight(nnz), dbias(dim_out)
+        complex*8,intent(inout) :: dweight(nnz), dbias(dim_out)
+        !f2py complex*8 optional,intent(in,out),depend(nnz) :: dweight(nnz)
+        !f2py complex*8 optional,intent(in,out),depend(dim_out) :: dbias(dim_out)
 
         integer :: k, col, start_, end_
 
-        dweight=0
+        if(do_wgrad) dweight=0
         do k=1,num_batch
             if(do_wgrad) then
                 !calculate dweight
@@ -128,11 +144,10 @@ module lib
                     start_=csc_indptr(col)
                     end_=csc_indptr(col+1)-1
                     dweight(start_:end_)= dweight(start_:end_)+x(k,csc_indices(start_:end_))*dy(k,col)
-                    enddo
+                enddo
             endif
             if(do_xgrad) then
                 !calculate dx
-                
                 call mkl_ccscmv('N', dim_in, dim_out, cmplx(1.0,0.0), matdescra, csc_data, csc_indices,&
                 csc_indptr(1:dim_out), csc_indptr(2:dim_out+1), dy(k,:), cmplx(0.0,0.0), dx(k,:))
             endif
@@ -142,45 +157,58 @@ module lib
             dbias=sum(dy,1)
         endif
     end subroutine backwardc
-    subroutine backward_convc(dy,x,dx,dweight, dbias, num_batch, csc_indptr,csc_indices, &
-            csc_data, nnz,nd, dim_in,dim_out, do_xgrad, do_wgrad, do_bgrad)
+
+    !convolution with a sparse kernel, columns are (feature_out, img_out) with feature_out the fastest,
+    !each group of nfo columns (an output pixel) takes nd entries, the i-th entry uses fltr_data(mod(i-1,nd)+1).
+    subroutine forward_convc(x, y, bias, csc_indptr, csc_indices, fltr_data, num_batch, dim_in, dim_out, nnz, nd, nfo)
         implicit none
-        integer,intent(in) :: num_batch, nnz,dim_in,nd, dim_out
+        !f2py threadsafe
+        integer,intent(in) :: num_batch, dim_in, dim_out, nnz, nd, nfo
+        complex*8,intent(in) :: x(num_batch, dim_in), fltr_data(nd), bias(nfo)
+        complex*8,intent(inout) :: y(num_batch, dim_out)
+        integer,intent(in) :: csc_indices(nnz), csc_indptr(dim_out+1)
+        !f2py complex*8 optional,intent(in,out),depend(num_batch,dim_out) :: y(num_batch,dim_out)
+
+        integer :: col, ii
+
+        do col=1,dim_out
+            y(:,col)=bias(modulo(col-1,nfo)+1)
+            do ii=csc_indptr(col),csc_indptr(col+1)-1
+                y(:,col)=y(:,col)+fltr_data(modulo(ii-1,nd)+1)*x(:,csc_indices(ii))
+            enddo
+        enddo
+    end subroutine forward_convc
+
+    subroutine backward_convc(dy, x, dx, dweight, dbias, csc_indptr, csc_indices, fltr_data,&
+            num_batch, dim_in, dim_out, nnz, nd, nfo, do_xgrad, do_wgrad, do_bgrad)
+        implicit none
+        !f2py threadsafe
+        integer,intent(in) :: num_batch, dim_in, dim_out, nnz, nd, nfo
         logical,intent(in) :: do_xgrad, do_wgrad, do_bgrad
-        complex*8,intent(out) :: dx(num_batch, dim_in)
-        complex*8,intent(in) :: x(num_batch, dim_in), dy(num_batch,dim_out), csc_data(nd)
+        complex*8,intent(in) :: x(num_batch, dim_in), dy(num_batch, dim_out), fltr_data(nd)
         integer,intent(in) :: csc_indices(nnz), csc_indptr(dim_out+1)
-        complex*8,intent(out) :: dweight(nd), dbias(dim_out)
+        complex*8,intent(inout) :: dx(num_batch, dim_in), dweight(nd), dbias(nfo)
+        !f2py complex*8 optional,intent(in,out),depend(num_batch,dim_in) :: dx(num_batch,dim_in)
+        !f2py complex*8 optional,intent(in,out),depend(nd) :: dweight(nd)
+        !f2py complex*8 optional,intent(in,out),depend(nfo) :: dbias(nfo)
 
-        integer :: k, col, start_, end_,data_start_, data_end_, ifo
+        integer :: col, ii, k, row
 
-        dweight=0
-        do k=1,num_batch
-            if(do_wgrad) then
-                !calculate dweight
-                do col=1,dim_out
-                    start_=csc_indptr(col)
-                    end_=csc_indptr(col+1)-1
-                    data_start_=modulo(start_-1, nd)+1
-                    data_end_=modulo(end_-1, nd)+1
-                    dweight(data_start_:data_end_)= dweight(data_start_:data_end_)+x(k,csc_indices(start_:end_))*dy(k,col)
-                    enddo
-            endif
-            if(do_xgrad) then
-                !calculate dx
-                do ifo=1,nnz/nd
-                    call mkl_ccscmv('N', dim_in, dim_out, cmplx(1.0,0.0), matdescra, csc_data, csc_indices,&
-                    csc_indptr(1:dim_in), csc_indptr(2:dim_in+1), dy(k,:), cmplx(0.0,0.0), dx(k,:))
-                enddo
-                
-                call mkl_ccscmv('N', dim_in, dim_out, cmplx(1.0,0.0), matdescra, csc_data, csc_indices,&
-                csc_indptr(1:dim_out), csc_indptr(2:dim_out+1), dy(k,:), cmplx(0.0,0.0), dx(k,:))
+        if(do_xgrad) dx=0
+        if(do_wgrad) dweight=0
+        if(do_bgrad) dbias=0
+        do col=1,dim_out
+            if(do_bgrad) then
+                k=modulo(col-1,nfo)+1
+                dbias(k)=dbias(k)+sum(dy(:,col))
             endif
+            do ii=csc_indptr(col),csc_indptr(col+1)-1
+                k=modulo(ii-1,nd)+1
+                row=csc_indices(ii)
+                if(do_xgrad) dx(:,row)=dx(:,row)+fltr_data(k)*dy(:,col)
+                if(do_wgrad) dweight(k)=dweight(k)+sum(x(:,row)*dy(:,col))
+            enddo
         enddo
-        if(do_bgrad) then
-            !calculate dbias
-            dbias=sum(dy,1)
-        endif
     end subroutine backward_convc
     subroutine forwardd(x, y, bias, num_batch, csc_indptr, csc_indices, csc_data, nnz, dim_in, dim_out)
         implicit none
@@ -206,11 +234,13 @@ module lib
         real*8,intent(out) :: dx(num_batch, dim_in)
         real*8,intent(in) :: x(num_batch, dim_in), dy(num_batch,dim_out), csc_data(nnz)
         integer,intent(in) :: csc_indices(nnz), csc_indptr(dim_out+1)
-        real*8,intent(out) :: dweight(nnz), dbias(dim_out)
+        real*8,intent(inout) :: dweight(nnz), dbias(dim_out)
+        !f2py real*8 optional,intent(in,out),depend(nnz) :: dweight(nnz)
+        !f2py real*8 optional,intent(in,out),depend(dim_out) :: dbias(dim_out)
 
         integer :: k, col, start_, end_
 
-        dweight=0
+        if(do_wgrad) dweight=0
         do k=1,num_batch
             if(do_wgrad) then
                 !calculate dweight
@@ -218,11 +248,10 @@ module lib
                     start_=csc_indptr(col)
                     end_=csc_indptr(col+1)-1
                     dweight(start_:end_)= dweight(start_:end_)+x(k,csc_indices(start_:end_))*dy(k,col)
-                    enddo
+                enddo
             endif
             if(do_xgrad) then
                 !calculate dx
-                
                 call mkl_dcscmv('N', dim_in, dim_out, 1D0, matdescra, csc_data, csc_indices,&
                 csc_indptr(1:dim_out), csc_indptr(2:dim_out+1), dy(k,:), 0D0, dx(k,:))
             endif
@@ -232,45 +261,58 @@ module lib
             dbias=sum(dy,1)
         endif
     end subroutine backwardd
-    subroutine backward_convd(dy,x,dx,dweight, dbias, num_batch, csc_indptr,csc_indices, &
-            csc_data, nnz,nd, dim_in,dim_out, do_xgrad, do_wgrad, do_bgrad)
+
+    !convolution with a sparse kernel, columns are (feature_out, img_out) with feature_out the fastest,
+    !each group of nfo columns (an output pixel) takes nd entries, the i-th entry uses fltr_data(mod(i-1,nd)+1).
+    subroutine forward_convd(x, y, bias, csc_indptr, csc_indices, fltr_data, num_batch, dim_in, dim_out, nnz, nd, nfo)
         implicit none
-        integer,intent(in) :: num_batch, nnz,dim_in,nd, dim_out
+        !f2py threadsafe
+        integer,intent(in) :: num_batch, dim_in, dim_out, nnz, nd, nfo
+        real*8,intent(in) :: x(num_batch, dim_in), fltr_data(nd), bias(nfo)
+        real*8,intent(inout) :: y(num_batch, dim_out)
+        integer,intent(in) :: csc_indices(nnz), csc_indptr(dim_out+1)
+        !f2py real*8 optional,intent(in,out),depend(num_batch,dim_out) :: y(num_batch,dim_out)
+
+        integer :: col, ii
+
+        do col=1,dim_out
+            y(:,col)=bias(modulo(col-1,nfo)+1)
+            do ii=csc_indptr(col),csc_indptr(col+1)-1
+                y(:,col)=y(:,col)+fltr_data(modulo(ii-1,nd)+1)*x(:,csc_indices(ii))
+            enddo
+        enddo
+    end subroutine forward_convd
+
+    subroutine backward_convd(dy, x, dx, dweight, dbias, csc_indptr, csc_indices, fltr_data,&
+            num_batch, dim_in, dim_out, nnz, nd, nfo, do_xgrad, do_wgrad, do_bgrad)
+        implicit none
+        !f2py threadsafe
+        integer,intent(in) :: num_batch, dim_in, dim_out, nnz, nd, nfo
         logical,intent(in) :: do_xgrad, do_wgrad, do_bgrad
-        real*8,intent(out) :: dx(num_batch, dim_in)
-        real*8,intent(in) :: x(num_batch, dim_in), dy(num_batch,dim_out), csc_data(nd)
+        real*8,intent(in) :: x(num_batch, dim_in), dy(num_batch, dim_out), fltr_data(nd)
         integer,intent(in) :: csc_indices(nnz), csc_indptr(dim_out+1)
-        real*8,intent(out) :: dweight(nd), dbias(dim_out)
+        real*8,intent(inout) :: dx(num_batch, dim_in), dweight(nd), dbias(nfo)
+        !f2py real*8 optional,intent(in,out),depend(num_batch,dim_in) :: dx(num_batch,dim_in)
+        !f2py real*8 optional,intent(in,out),depend(nd) :: dweight(nd)
+        !f2py real*8 optional,intent(in,out),depend(nfo) :: dbias(nfo)
 
-        integer :: k, col, start_, end_,data_start_, data_end_, ifo
+        integer :: col, ii, k, row
 
-        dweight=0
-        do k=1,num_batch
-            if(do_wgrad) then
-                !calculate dweight
-                do col=1,dim_out
-                    start_=csc_indptr(col)
-                    end_=csc_indptr(col+1)-1
-                    data_start_=modulo(start_-1, nd)+1
-                    data_end_=modulo(end_-1, nd)+1
-                    dweight(data_start_:data_end_)= dweight(data_start_:data_end_)+x(k,csc_indices(start_:end_))*dy(k,col)
-                    enddo
-            endif
-            if(do_xgrad) then
-                !calculate dx
-                do ifo=1,nnz/nd
-                    call mkl_dcscmv('N', dim_in, dim_out, 1D0, matdescra, csc_data, csc_indices,&
-                    csc_indptr(1:dim_in), csc_indptr(2:dim_in+1), dy(k,:), 0D0, dx(k,:))
-                enddo
-                
-                call mkl_dcscmv('N', dim_in, dim_out, 1D0, matdescra, csc_data, csc_indices,&
-                csc_indptr(1:dim_out), csc_indptr(2:dim_out+1), dy(k,:), 0D0, dx(k,:))
+        if(do_xgrad) dx=0
+        if(do_wgrad) dweight=0
+        if(do_bgrad) dbias=0
+        do col=1,dim_out
+            if(do_bgrad) then
+                k=modulo(col-1,nfo)+1
+                dbias(k)=dbias(k)+sum(dy(:,col))
             endif
+            do ii=csc_indptr(col),csc_indptr(col+1)-1
+                k=modulo(ii-1,nd)+1
+                row=csc_indices(ii)
+                if(do_xgrad) dx(:,row)=dx(:,row)+fltr_data(k)*dy(:,col)
+                if(do_wgrad) dweight(k)=dweight(k)+sum(x(:,row)*dy(:,col))
+            enddo
         enddo
-        if(do_bgrad) then
-            !calculate dbias
-            dbias=sum(dy,1)
-        endif
     end subroutine backward_convd
     subroutine forwards(x, y, bias, num_batch, csc_indptr, csc_indices, csc_data, nnz, dim_in, dim_out)
         implicit none
@@ -296,11 +338,13 @@ module lib
         real*4,intent(out) :: dx(num_batch, dim_in)
         real*4,intent(in) :: x(num_batch, dim_in), dy(num_batch,dim_out), csc_data(nnz)
         integer,intent(in) :: csc_indices(nnz), csc_indptr(dim_out+1)
-        real*4,intent(out) :: dweight(nnz), dbias(dim_out)
+        real*4,intent(inout) :: dweight(nnz), dbias(dim_out)
+        !f2py real*4 optional,intent(in,out),depend(nnz) :: dweight(nnz)
+        !f2py real*4 optional,intent(in,out),depend(dim_out) :: dbias(dim_out)
 
         integer :: k, col, start_, end_
 
-        dweight=0
+        if(do_wgrad) dweight=0
         do k=1,num_batch
             if(do_wgrad) then
                 !calculate dweight
@@ -308,11 +352,10 @@ module lib
                     start_=csc_indptr(col)
                     end_=csc_indptr(col+1)-1
                     dweight(start_:end_)= dweight(start_:end_)+x(k,csc_indices(start_:end_))*dy(k,col)
-                    enddo
+                enddo
             endif
             if(do_xgrad) then
                 !calculate dx
-                
                 call mkl_scscmv('N', dim_in, dim_out, 1.0, matdescra, csc_data, csc_indices,&
                 csc_indptr(1:dim_out), csc_indptr(2:dim_out+1), dy(k,:), 0.0, dx(k,:))
             endif
@@ -322,44 +365,57 @@ module lib
             dbias=sum(dy,1)
         endif
     end subroutine backwards
-    subroutine backward_convs(dy,x,dx,dweight, dbias, num_batch, csc_indptr,csc_indices, &
-            csc_data, nnz,nd, dim_in,dim_out, do_xgrad, do_wgrad, do_bgrad)
+
+    !convolution with a sparse kernel, columns are (feature_out, img_out) with feature_out the fastest,
+    !each group of nfo columns (an output pixel) takes nd entries, the i-th entry uses fltr_data(mod(i-1,nd)+1).
+    subroutine forward_convs(x, y, bias, csc_indptr, csc_indices, fltr_data, num_batch, dim_in, dim_out, nnz, nd, nfo)
         implicit none
-        integer,intent(in) :: num_batch, nnz,dim_in,nd, dim_out
+        !f2py threadsafe
+        integer,intent(in) :: num_batch, dim_in, dim_out, nnz, nd, nfo
+        real*4,intent(in) :: x(num_batch, dim_in), fltr_data(nd), bias(nfo)
+        real*4,intent(inout) :: y(num_batch, dim_out)
+        integer,intent(in) :: csc_indices(nnz), csc_indptr(dim_out+1)
+        !f2py real*4 optional,intent(in,out),depend(num_batch,dim_out) :: y(num_batch,dim_out)
+
+        integer :: col, ii
+
+        do col=1,dim_out
+            y(:,col)=bias(modulo(col-1,nfo)+1)
+            do ii=csc_indptr(col),csc_indptr(col+1)-1
+                y(:,col)=y(:,col)+fltr_data(modulo(ii-1,nd)+1)*x(:,csc_indices(ii))
+            enddo
+        enddo
+    end subroutine forward_convs
+
+    subroutine backward_convs(dy, x, dx, dweight, dbias, csc_indptr, csc_indices, fltr_data,&
+            num_batch, dim_in, dim_out, nnz, nd, nfo, do_xgrad, do_wgrad, do_bgrad)
+        implicit none
+        !f2py threadsafe
+        integer,intent(in) :: num_batch, dim_in, dim_out, nnz, nd, nfo
         logical,intent(in) :: do_xgrad, do_wgrad, do_bgrad
-        real*4,intent(out) :: dx(num_batch, dim_in)
-        real*4,intent(in) :: x(num_batch, dim_in), dy(num_batch,dim_out), csc_data(nd)
+        real*4,intent(in) :: x(num_batch, dim_in), dy(num_batch, dim_out), fltr_data(nd)
         integer,intent(in) :: csc_indices(nnz), csc_indptr(dim_out+1)
-        real*4,intent(out) :: dweight(nd), dbias(dim_out)
+        real*4,intent(inout) :: dx(num_batch, dim_in), dweight(nd), dbias(nfo)
+        !f2py real*4 optional,intent(in,out),depend(num_batch,dim_in) :: dx(num_batch,dim_in)
+        !f2py real*4 optional,intent(in,out),depend(nd) :: dweight(nd)
+        !f2py real*4 optional,intent(in,out),depend(nfo) :: dbias(nfo)
 
-        integer :: k, col, start_, end_,data_start_, data_end_, ifo
+        integer :: col, ii, k, row
 
-        dweight=0
-        do k=1,num_batch
-            if(do_wgrad) then
-                !calculate dweight
-                do col=1,dim_out
-                    start_=csc_indptr(col)
-                    end_=csc_indptr(col+1)-1
-                    data_start_=modulo(start_-1, nd)+1
-                    data_end_=modulo(end_-1, nd)+1
-                    dweight(data_start_:data_end_)= dweight(data_start_:data_end_)+x(k,csc_indices(start_:end_))*dy(k,col)
-                    enddo
-            endif
-            if(do_xgrad) then
-                !calculate dx
-                do ifo=1,nnz/nd
-                    call mkl_scscmv('N', dim_in, dim_out, 1.0, matdescra, csc_data, csc_indices,&
-                    csc_indptr(1:dim_in), csc_indptr(2:dim_in+1), dy(k,:), 0.0, dx(k,:))
-                enddo
-                
-                call mkl_scscmv('N', dim_in, dim_out, 1.0, matdescra, csc_data, csc_indices,&
-                csc_indptr(1:dim_out), csc_indptr(2:dim_out+1), dy(k,:), 0.0, dx(k,:))
+        if(do_xgrad) dx=0
+        if(do_wgrad) dweight=0
+        if(do_bgrad) dbias=0
+        do col=1,dim_out
+            if(do_bgrad) then
+                k=modulo(col-1,nfo)+1
+                dbias(k)=dbias(k)+sum(dy(:,col))
             endif
+            do ii=csc_indptr(col),csc_indptr(col+1)-1
+                k=modulo(ii-1,nd)+1
+                row=csc_indices(ii)
+                if(do_xgrad) dx(:,row)=dx(:,row)+fltr_data(k)*dy(:,col)
+                if(do_wgrad) dweight(k)=dweight(k)+sum(x(:,row)*dy(:,col))
+            enddo
         enddo
-        if(do_bgrad) then
-            !calculate dbias
-            dbias=sum(dy,1)
-        endif
     end subroutine backward_convs
     end module lib
\ No newline at end of file
@@ -1,4 +1,5 @@
 module lib
+    !$ use omp_lib
     contains
     {%for dtype in dtype_list -%}
     {%if dtype == "complex*16"%}{%set dtype_one, dtype_zero, dtype_token, is_complex = "dcmplx(1D0,0D0)", "dcmplx(0D0,0D0)", "z", True -%}
@@ -18,6 +19,7 @@ module lib
         integer :: start_, end_, col, irow
 
         y=1
+        !$omp parallel do schedule(static) private(start_, end_, irow)
         do col=1, dim_out
             start_=csc_indptr(col)
             end_=csc_indptr(col+1)
@@ -25,6 +27,7 @@ module lib
                 y(:,col)=y(:,col)*x(:,csc_indices(start_+irow-1))**powers(irow)
             enddo
         enddo
+        !$omp end parallel do
     end subroutine forward_{{version}}{{dtype_token}}
 
     subroutine backward_{{version}}{{dtype_token}}(dy,x,y,dx,csc_indptr,csc_indices, nnz,dim_in,dim_out,nfi,powers,nd)
@@ -37,19 +40,26 @@ module lib
         integer,intent(in) :: csc_indptr(dim_out+1)
         {{dtype}},intent(out) :: dx(nfi, dim_in)
 
-        integer :: start_, end_, col, ib
+        integer :: start_, end_, col, ib, i0, i1
         integer,pointer :: rows(:)
 
         dx=0
+        !rows i0:i1 of x are taken by this thread.
+        !$omp parallel private(start_, end_, col, ib, i0, i1, rows)
+        i0=1
+        i1=nfi
+        !$ i0=omp_get_thread_num()*nfi/omp_get_num_threads()+1
+        !$ i1=(omp_get_thread_num()+1)*nfi/omp_get_num_threads()
         do col=1,dim_out
             start_=csc_indptr(col)
             end_=csc_indptr(col+1)
 
             rows=>csc_indices(start_:end_-1)
-            do ib=1,nfi
+            do ib=i0,i1
                 dx(ib,rows) = dx(ib,rows)+dy(ib,col)*y(ib,col)*powers/x(ib,rows)
             enddo
         enddo
+        !$omp end parallel
     end subroutine backward_{{version}}{{dtype_token}}
     {%endfor -%}
 end module lib
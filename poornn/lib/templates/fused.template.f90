@@ -0,0 +1,230 @@
+!orders: batch_dim, feature_dim_out/in, conv_dim_out/in
+!fused kernels, relu is the holomophic real (r) version.
+module lib
+    contains
+    {%for dtype in dtype_list -%}
+    {%if dtype == "complex*16"%}{%set rtype, dtype_one, dtype_zero, dtype_token, is_complex = "real*8", "dcmplx(1D0,0D0)", "dcmplx(0D0,0D0)", "z", True -%}
+    {%elif dtype == "complex*8"%}{%set rtype, dtype_one, dtype_zero, dtype_token, is_complex = "real*4", "cmplx(1.0,0.0)", "cmplx(0.0,0.0)", "c", True -%}
+    {%elif dtype == "real*8"%}{%set rtype, dtype_one, dtype_zero, dtype_token, is_complex = "real*8", "1D0", "0D0", "d", False -%}
+    {%elif dtype == "real*4"%}{%set rtype, dtype_one, dtype_zero, dtype_token, is_complex = "real*4", "1.0", "0.0", "s", False -%}
+    {%endif -%}
+    {%if is_complex%}{%set re, key_max, key_abs = "real", "real", "abs"-%}{%else%}{%set re, key_max, key_abs = "", "", "abs"-%}{%endif-%}
+    !linear followed by relu, computed in blocks of batch.
+    subroutine linear_relu_forward_{{dtype_token}}(x, y, weight, bias, leak, num_batch, nfi, nfo)
+        implicit none
+        !f2py threadsafe
+        integer,intent(in) :: num_batch, nfi, nfo
+        {{rtype}},intent(in) :: leak
+        {{dtype}},intent(in) :: x(num_batch, nfi), weight(nfo, nfi), bias(nfo)
+        {{dtype}},intent(inout) :: y(num_batch, nfo)
+        {{dtype}},parameter :: one={{dtype_one}}
+        integer,parameter :: block_size=64
+        integer :: i, j, i0, nb
+        !f2py {{dtype}} optional,intent(in,out),depend(num_batch,nfo) :: y(num_batch,nfo)
+
+        do i0=1,num_batch,block_size
+            nb=min(block_size,num_batch-i0+1)
+            do i=1,nfo
+                y(i0:i0+nb-1,i)=bias(i)
+            enddo
+            call {{dtype_token}}gemm('N', 'T', nb, nfo, nfi, one, x(i0,1), num_batch,&
+                weight, nfo, one, y(i0,1), num_batch)
+            do j=1,nfo
+                do i=i0,i0+nb-1
+                    if({{re}}(y(i,j))<0) y(i,j)=leak*y(i,j)
+                enddo
+            enddo
+        enddo
+    end subroutine linear_relu_forward_{{dtype_token}}
+
+    !the slope of relu is infered from output y.
+    subroutine linear_relu_backward_{{dtype_token}}(dy, x, y, weight, leak, dx, dweight, dbias,&
+            nfi, nfo, num_batch, do_xgrad, do_wgrad, do_bgrad)
+        implicit none
+        !f2py threadsafe
+        integer,intent(in) :: num_batch, nfi, nfo
+        logical,intent(in) :: do_xgrad, do_wgrad, do_bgrad
+        {{rtype}},intent(in) :: leak
+        {{dtype}},intent(in) :: x(num_batch, nfi), y(num_batch, nfo), dy(num_batch, nfo), weight(nfo, nfi)
+        {{dtype}},intent(inout) :: dweight(nfo, nfi), dbias(nfo), dx(num_batch, nfi)
+
+        {{dtype}},allocatable :: dz(:,:)
+        {{dtype}},parameter :: one={{dtype_one}}
+        {{dtype}},parameter :: zero={{dtype_zero}}
+        integer :: i, j
+
+        !f2py {{dtype}} optional,intent(in,out),depend(num_batch,nfi) :: dx(num_batch,nfi)
+        !f2py {{dtype}} optional,intent(in,out),depend(nfo,nfi) :: dweight(nfo,nfi)
+        !f2py {{dtype}} optional,intent(in,out),depend(nfo) :: dbias(nfo)
+
+        allocate(dz(num_batch, nfo))
+        do j=1,nfo
+            do i=1,num_batch
+                if({{re}}(y(i,j))<0 .or. (leak==0 .and. y(i,j)==zero)) then
+                    dz(i,j)=leak*dy(i,j)
+                else
+                    dz(i,j)=dy(i,j)
+                endif
+            enddo
+        enddo
+        if(do_wgrad) then
+            call {{dtype_token}}gemm('T', 'N', nfo, nfi, num_batch, one, dz, num_batch,&
+                x, num_batch, zero, dweight, nfo)
+        endif
+        if(do_xgrad) then
+            call {{dtype_token}}gemm('N', 'N', num_batch, nfi, nfo, one, dz, num_batch,&
+                weight, nfo, zero, dx, num_batch)
+        endif
+        if(do_bgrad) then
+            dbias=sum(dz,1)
+        endif
+        deallocate(dz)
+    end subroutine linear_relu_backward_{{dtype_token}}
+
+    !contiguous convolution followed by relu and pooling,
+    !convolution outputs are computed column by column and pooled at once.
+    !mode = 0: max real, 1: max abs, 2: min real, 3: min abs.
+    !argmax stores the selected column of convolution output,
+    !negative if relu takes the leak branch.
+    subroutine conv_relu_pool_forward_{{dtype_token}}(x, y, argmax, bias, num_batch, csc_indptr, csc_indices, fltr_data,&
+            pool_indptr, pool_indices, leak, mode, nnz, dim_in, dim_out, pool_nnz, dim_pool, nfi, nfo, nd, max_nnz_row)
+        implicit none
+        !f2py threadsafe
+        integer,intent(in) :: num_batch, nnz, dim_in, dim_out, pool_nnz, dim_pool, nfi, nfo, max_nnz_row, nd, mode
+        {{rtype}},intent(in) :: leak
+        {{dtype}},intent(in) :: x(num_batch, nfi, dim_in), bias(nfo)
+        {{dtype}},intent(in) :: fltr_data(nfo, nfi, nd)
+        integer,intent(in) :: csc_indices(nnz), csc_indptr(dim_out+1)
+        integer,intent(in) :: pool_indices(pool_nnz), pool_indptr(dim_pool+1)
+        {{dtype}},intent(inout) :: y(num_batch, nfo, dim_pool)
+        integer,intent(out) :: argmax(num_batch, nfo, dim_pool)
+
+        {{dtype}} :: x_work(num_batch, nfi, max_nnz_row), z_work(num_batch, nfo), zi
+        {{rtype}} :: key, best(num_batch, nfo)
+        integer :: start_, end_, col, pcol, jj, ii, ib, k, nnz_row, sgn
+        {{dtype}},parameter :: one={{dtype_one}}
+        !f2py intent(in) x, csc_indices, csc_indptr, fltr_data, bias, pool_indices, pool_indptr
+        !f2py intent(in) nfi, nfo, num_batch, max_nnz_row, nnz, dim_out, nd, dim_in, pool_nnz, dim_pool
+        !f2py {{dtype}} optional,intent(in,out),depend(num_batch,nfo,dim_pool) :: y(num_batch,nfo,dim_pool)
+        !f2py intent(out) argmax
+
+        do pcol=1,dim_pool
+            do jj=pool_indptr(pcol),pool_indptr(pcol+1)-1
+                col=pool_indices(jj)
+                start_=csc_indptr(col)
+                end_=csc_indptr(col+1)
+                nnz_row=end_-start_
+                k=nfi*nnz_row
+
+                !convolution output of this column.
+                do ii=1,nnz_row
+                    x_work(:,:,ii)=x(:,:,csc_indices(start_+ii-1))
+                enddo
+                do ii=1,nfo
+                    z_work(:,ii)=bias(ii)
+                enddo
+                call {{dtype_token}}gemm('N', 'T', num_batch, nfo, k, one, x_work, num_batch,&
+                    fltr_data, nfo, one, z_work, num_batch)
+
+                !relu and pooling.
+                do ii=1,nfo
+                    do ib=1,num_batch
+                        zi=z_work(ib,ii)
+                        sgn=1
+                        if({{re}}(zi)<0) then
+                            zi=leak*zi
+                            sgn=-1
+                        endif
+                        select case (mode)
+                        case (0,2)
+                            key={{key_max}}(zi)
+                        case (1,3)
+                            key={{key_abs}}(zi)
+                        case default
+                            print*,'Error: Pooling mode not supported!'
+                            stop 1
+                        endselect
+                        if(mode>=2) key=-key
+                        !the first one is taken among equals.
+                        if(jj==pool_indptr(pcol) .or. key>best(ib,ii)) then
+                            best(ib,ii)=key
+                            y(ib,ii,pcol)=zi
+                            argmax(ib,ii,pcol)=sgn*col
+                        endif
+                    enddo
+                enddo
+            enddo
+        enddo
+    end subroutine conv_relu_pool_forward_{{dtype_token}}
+
+    subroutine conv_relu_pool_backward_{{dtype_token}}(dy, x, argmax, dx, dweight, dbias, num_batch, csc_indptr, csc_indices,&
+            fltr_data, pool_indptr, pool_indices, leak, nnz, dim_in, dim_out, pool_nnz, dim_pool, nfi, nfo, nd,&
+            do_xgrad, do_wgrad, do_bgrad, max_nnz_row)
+        implicit none
+        !f2py threadsafe
+        integer,intent(in) :: num_batch, nnz, dim_in, dim_out, pool_nnz, dim_pool, nfi, nfo, nd, max_nnz_row
+        logical,intent(in) :: do_xgrad, do_wgrad, do_bgrad
+        {{rtype}},intent(in) :: leak
+        {{dtype}},intent(in) :: x(num_batch, nfi, dim_in), dy(num_batch, nfo, dim_pool), fltr_data(nfo, nfi, nd)
+        integer,intent(in) :: argmax(num_batch, nfo, dim_pool)
+        integer,intent(in) :: csc_indices(nnz), csc_indptr(dim_out+1)
+        integer,intent(in) :: pool_indices(pool_nnz), pool_indptr(dim_pool+1)
+        {{dtype}},intent(inout) :: dweight(nfo, nfi, nd), dbias(nfo), dx(num_batch, nfi, dim_in)
+
+        {{dtype}} :: x_work(num_batch, nfi, max_nnz_row), dz(num_batch, nfo)
+        integer :: start_, end_, col, pcol, jj, ii, ib, k, nnz_row, row
+        {{dtype}},parameter :: one={{dtype_one}}
+        {{dtype}},parameter :: zero={{dtype_zero}}
+
+        !f2py intent(in) x, dy, argmax, csc_indices, csc_indptr, fltr_data, pool_indices, pool_indptr
+        !f2py intent(in) do_xgrad, do_wgrad, do_bgrad
+        !f2py intent(in) nfi, nfo, num_batch, nd, max_nnz_row, dim_in, dim_out, nnz, pool_nnz, dim_pool
+        !f2py {{dtype}} optional,intent(in,out),depend(num_batch,nfi,dim_in) :: dx(num_batch,nfi,dim_in)
+        !f2py {{dtype}} optional,intent(in,out),depend(nfo,nfi,nd) :: dweight(nfo,nfi,nd)
+        !f2py {{dtype}} optional,intent(in,out),depend(nfo) :: dbias(nfo)
+
+        if(do_xgrad) dx=zero
+        if(do_wgrad) dweight=zero
+        if(do_bgrad) dbias=zero
+        do pcol=1,dim_pool
+            do jj=pool_indptr(pcol),pool_indptr(pcol+1)-1
+                col=pool_indices(jj)
+                start_=csc_indptr(col)
+                end_=csc_indptr(col+1)
+                nnz_row=end_-start_
+                k=nfi*nnz_row
+
+                !gradient on convolution output of this column.
+                do ii=1,nfo
+                    do ib=1,num_batch
+                        if(argmax(ib,ii,pcol)==col) then
+                            dz(ib,ii)=dy(ib,ii,pcol)
+                        else if(argmax(ib,ii,pcol)==-col) then
+                            dz(ib,ii)=leak*dy(ib,ii,pcol)
+                        else
+                            dz(ib,ii)=zero
+                        endif
+                    enddo
+                enddo
+
+                if(do_wgrad) then
+                    do ii=1,nnz_row
+                        x_work(:,:,ii)=x(:,:,csc_indices(start_+ii-1))
+                    enddo
+                    call {{dtype_token}}gemm('T', 'N', nfo, k, num_batch, one,&
+                        dz, num_batch, x_work, num_batch, one, dweight, nfo)
+                endif
+                if(do_xgrad) then
+                    call {{dtype_token}}gemm('N', 'N', num_batch, k, nfo, one, dz, num_batch,&
+                        fltr_data, nfo, zero, x_work, num_batch)
+                    do ii=1,nnz_row
+                        row=csc_indices(start_+ii-1)
+                        dx(:,:,row)=dx(:,:,row)+x_work(:,:,ii)
+                    enddo
+                endif
+                if(do_bgrad) dbias=dbias+sum(dz,1)
+            enddo
+        enddo
+    end subroutine conv_relu_pool_backward_{{dtype_token}}
+    {%endfor -%}
+end module lib
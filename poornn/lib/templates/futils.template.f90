@@ -23,3 +23,25 @@ subroutine fsign_{{dtype_token}}(x, nx, s)
     enddo
 end subroutine fsign_{{dtype_token}}
 {%endfor-%}
+
+subroutine set_num_threads(num_threads)
+    !$ use omp_lib
+    implicit none
+    integer,intent(in) :: num_threads
+    !$ call omp_set_num_threads(num_threads)
+end subroutine set_num_threads
+
+subroutine get_num_threads(num_threads)
+    !$ use omp_lib
+    implicit none
+    integer,intent(out) :: num_threads
+    num_threads=1
+    !$ num_threads=omp_get_max_threads()
+end subroutine get_num_threads
+
+subroutine openmp_enabled(enabled)
+    implicit none
+    logical,intent(out) :: enabled
+    enabled=.false.
+    !$ enabled=.true.
+end subroutine openmp_enabled
@@ -0,0 +1,87 @@
+{#- complex gemm with an optional 3M scheme, imported by templates calling gemm. -#}
+{%macro gemm3m(dtype, dtype_token) -%}
+    {%if dtype == "complex*16"%}{%set rtype, rtoken, rkind, rone, rzero = "real*8", "d", 8, "1D0", "0D0" -%}
+    {%else%}{%set rtype, rtoken, rkind, rone, rzero = "real*4", "s", 4, "1.0", "0.0" -%}
+    {%endif -%}
+    !complex matrix product c=alpha*op(a)*op(b)+beta*c, op is 'N' or 'T'.
+    !if gemm3m, it uses the 3M (Gauss) scheme, three real gemms on planar
+    !real and imaginary parts instead of four real multiplies per element,
+    !  re = ar*br - ai*bi, im = (ar+ai)*(br+bi) - ar*br - ai*bi.
+    !it saves 25% of flops, the error of the real part is the same as zgemm,
+    !the error of the imaginary part is bounded by (|ar|+|ai|)*(|br|+|bi|)
+    !instead of |a|*|b|, larger if it cancels out.
+    subroutine gemm_{{dtype_token}}(gemm3m, transa, transb, m, n, k, alpha, a, lda, b, ldb, beta, c, ldc)
+        implicit none
+        logical,intent(in) :: gemm3m
+        character,intent(in) :: transa, transb
+        integer,intent(in) :: m, n, k, lda, ldb, ldc
+        {{dtype}},intent(in) :: alpha, beta, a(lda,*), b(ldb,*)
+        {{dtype}},intent(inout) :: c(ldc,*)
+
+        {{rtype}},allocatable :: ar(:,:), ai(:,:), br(:,:), bi(:,:), t1(:,:), t2(:,:)
+        {{rtype}} :: p1, p2
+        integer :: ma, na, mb, nb, i, j
+        {{rtype}},parameter :: rone={{rone}}, rzero={{rzero}}
+
+        if(.not. gemm3m) then
+            call {{dtype_token}}gemm(transa, transb, m, n, k, alpha, a, lda, b, ldb, beta, c, ldc)
+            return
+        endif
+        if(m==0 .or. n==0) return
+        if(transa=='N') then
+            ma=m
+            na=k
+        else
+            ma=k
+            na=m
+        endif
+        if(transb=='N') then
+            mb=k
+            nb=n
+        else
+            mb=n
+            nb=k
+        endif
+        allocate(ar(ma,na), ai(ma,na), br(mb,nb), bi(mb,nb), t1(m,n), t2(m,n))
+        do j=1,na
+            do i=1,ma
+                ar(i,j)=real(a(i,j))
+                ai(i,j)=aimag(a(i,j))
+            enddo
+        enddo
+        do j=1,nb
+            do i=1,mb
+                br(i,j)=real(b(i,j))
+                bi(i,j)=aimag(b(i,j))
+            enddo
+        enddo
+        call {{rtoken}}gemm(transa, transb, m, n, k, rone, ar, max(ma,1), br, max(mb,1), rzero, t1, m)
+        call {{rtoken}}gemm(transa, transb, m, n, k, rone, ai, max(ma,1), bi, max(mb,1), rzero, t2, m)
+
+        !t1 <- real part, t2 <- -(ar*br+ai*bi), the imaginary part is accumulated on t2.
+        do j=1,n
+            do i=1,m
+                p1=t1(i,j)
+                p2=t2(i,j)
+                t1(i,j)=p1-p2
+                t2(i,j)=-p1-p2
+            enddo
+        enddo
+        ar=ar+ai
+        br=br+bi
+        call {{rtoken}}gemm(transa, transb, m, n, k, rone, ar, max(ma,1), br, max(mb,1), rone, t2, m)
+
+        do j=1,n
+            if(beta==0) then
+                do i=1,m
+                    c(i,j)=alpha*cmplx(t1(i,j), t2(i,j), kind={{rkind}})
+                enddo
+            else
+                do i=1,m
+                    c(i,j)=alpha*cmplx(t1(i,j), t2(i,j), kind={{rkind}})+beta*c(i,j)
+                enddo
+            endif
+        enddo
+        deallocate(ar, ai, br, bi, t1, t2)
+    end subroutine gemm_{{dtype_token}}
+{%- endmacro %}
@@ -1,139 +1,237 @@
 !orders: conv_dim_out/in, feature_dim_out/in, batch_dim
 module lib
+    !$ use omp_lib
     contains
+    !pixels of a regular tiling (strides equal to kernel_shape, open boundary),
+    !the input column of window iw at output column col is starts(col)+offsets(iw).
+    subroutine tile_offsets(img_in_shape, kernel_shape, nd, offsets, nk, starts, dim_out)
+        implicit none
+        integer,intent(in) :: nd, nk, dim_out
+        integer,intent(in) :: img_in_shape(nd), kernel_shape(nd)
+        integer,intent(out) :: offsets(nk), starts(dim_out)
+
+        integer :: i, iw, col, r, stride(nd)
+
+        stride(1)=1
+        do i=2,nd
+            stride(i)=stride(i-1)*img_in_shape(i-1)
+        enddo
+        do iw=1,nk
+            r=iw-1
+            offsets(iw)=1
+            do i=1,nd
+                offsets(iw)=offsets(iw)+mod(r,kernel_shape(i))*stride(i)
+                r=r/kernel_shape(i)
+            enddo
+        enddo
+        do col=1,dim_out
+            r=col-1
+            starts(col)=0
+            do i=1,nd
+                starts(col)=starts(col)+mod(r,img_in_shape(i)/kernel_shape(i))*kernel_shape(i)*stride(i)
+                r=r/(img_in_shape(i)/kernel_shape(i))
+            enddo
+        enddo
+    end subroutine tile_offsets
+
     {%for dtype in dtype_list -%}
-    {%if dtype == "complex*16"%}{%set dtype_one, dtype_zero, dtype_token, is_complex = "dcmplx(1D0,0D0)", "dcmplx(0D0,0D0)", "z", True -%}
-    {%elif dtype == "complex*8"%}{%set dtype_one, dtype_zero, dtype_token, is_complex ="cmplx(1.0,0.0)", "cmplx(0.0,0.0)", "c", True -%}
-    {%elif dtype == "real*8"%}{%set dtype_one, dtype_zero, dtype_token, is_complex = "1D0", "0D0", "d", False -%}
-    {%elif dtype == "real*4"%}{%set dtype_one, dtype_zero, dtype_token, is_complex = "1.0", "0.0", "s", False -%}
+    {%if dtype == "complex*16"%}{%set rtype, dtype_one, dtype_zero, dtype_token, is_complex = "real*8", "dcmplx(1D0,0D0)", "dcmplx(0D0,0D0)", "z", True -%}
+    {%elif dtype == "complex*8"%}{%set rtype, dtype_one, dtype_zero, dtype_token, is_complex = "real*4", "cmplx(1.0,0.0)", "cmplx(0.0,0.0)", "c", True -%}
+    {%elif dtype == "real*8"%}{%set rtype, dtype_one, dtype_zero, dtype_token, is_complex = "real*8", "1D0", "0D0", "d", False -%}
+    {%elif dtype == "real*4"%}{%set rtype, dtype_one, dtype_zero, dtype_token, is_complex = "real*4", "1.0", "0.0", "s", False -%}
     {%endif -%}
+    {%if is_complex%}{%set re = "real"-%}{%else%}{%set re = ""-%}{%endif-%}
     !mode = 0: max real.
     !mode = 1: max abs.
     !mode = 2: min real.
     !mode = 3: min abs.
     !mode = 4: mean pooling.
-    subroutine forward_{{version}}{{dtype_token}}(x, y, csc_indptr, csc_indices, nnz, dim_in, dim_out, nfi, mode)
+    !pooling over a regular tiling, without index arrays,
+    !rows (batch and feature) of x are contiguous, and split among threads.
+    !forward_tiled_argmax also returns the selected columns of x in argmax.
+    {%set select_modes = [(0, re, ">"), (1, "abs", ">"), (2, re, "<"), (3, "abs", "<")] -%}
+    {%macro select_rows(fkey, cmp, actions) -%}
+                if(nk<=max_nk_inner) then
+                    do ib=i0,i1
+                        jb=start_+offsets(1)
+                        best={{fkey}}(x(ib,jb))
+                        do iw=2,nk
+                            j=start_+offsets(iw)
+                            key={{fkey}}(x(ib,j))
+                            if(key{{cmp}}best) then
+                                best=key
+                                jb=j
+                            endif
+                        enddo
+                        {{actions|join("\n                        ")}}
+                    enddo
+                else
+                    jbest=start_+offsets(1)
+                    best_rows={{fkey}}(x(i0:i1,start_+offsets(1)))
+                    do iw=2,nk
+                        j=start_+offsets(iw)
+                        do ib=i0,i1
+                            key={{fkey}}(x(ib,j))
+                            if(key{{cmp}}best_rows(ib)) then
+                                best_rows(ib)=key
+                                jbest(ib)=j
+                            endif
+                        enddo
+                    enddo
+                    do ib=i0,i1
+                        jb=jbest(ib)
+                        {{actions|join("\n                        ")}}
+                    enddo
+                endif
+    {%- endmacro -%}
+    {%for with_argmax in [False, True] -%}
+    {%set name = "forward_tiled_argmax_" if with_argmax else "forward_tiled_"-%}
+    subroutine {{name}}{{version}}{{dtype_token}}(x, y, {%if with_argmax%}argmax, {%endif%}img_in_shape, kernel_shape, nfi, dim_in, dim_out, nd, mode)
         implicit none
-        integer,intent(in) :: nnz, dim_in, dim_out, nfi,mode
+        !f2py threadsafe
+        integer,intent(in) :: nfi, dim_in, dim_out, nd, mode
+        integer,intent(in) :: img_in_shape(nd), kernel_shape(nd)
         {{dtype}},intent(in) :: x(nfi, dim_in)
-        integer,intent(in),target :: csc_indices(nnz)
-        integer,intent(in) :: csc_indptr(dim_out+1)
-        {{dtype}},intent(out) :: y(nfi, dim_out)
+        {{dtype}},intent(inout) :: y(nfi, dim_out)
+        {%if with_argmax%}integer,intent(out) :: argmax(nfi, dim_out){%endif%}
 
-        integer,pointer :: rows(:)
-        integer :: start_, end_, col, ib, irow
-        !f2py intent(in) x, csc_indices, csc_indptr
-        !f2py intent(in) nfi, nnz, dim_out, dim_in
-        !f2py intent(out) y
+        integer :: col, iw, ib, j, jb, start_, i0, i1, nk
+        integer,allocatable :: offsets(:), starts(:)
+        {{rtype}} :: key, best
+        integer,allocatable :: jbest(:)
+        {{rtype}},allocatable :: best_rows(:)
+        !windows larger than this are scanned by columns, keeping x contiguous.
+        integer,parameter :: max_nk_inner=16
+        !f2py intent(in) x, img_in_shape, kernel_shape, dim_out
+        !f2py intent(in) nfi, dim_in, nd, mode
+        !f2py {{dtype}} optional,intent(in,out),depend(nfi,dim_out) :: y(nfi,dim_out)
+        {%if with_argmax%}!f2py intent(out) argmax{%endif%}
 
-        do col=1, dim_out
-            start_=csc_indptr(col)
-            end_=csc_indptr(col+1)
+        if(mode<0 .or. mode>4) then
+            print*,'Error: Pooling mode not exist!'
+            stop 1
+        endif
+        nk=product(kernel_shape)
+        allocate(offsets(nk), starts(dim_out))
+        call tile_offsets(img_in_shape, kernel_shape, nd, offsets, nk, starts, dim_out)
 
-            !prepair work space by taking rows in x.
+        !$omp parallel private(col, iw, ib, j, jb, start_, i0, i1, key, best, jbest, best_rows)
+        i0=1
+        i1=nfi
+        !$ i0=omp_get_thread_num()*nfi/omp_get_num_threads()+1
+        !$ i1=(omp_get_thread_num()+1)*nfi/omp_get_num_threads()
+        if(nk>max_nk_inner) allocate(jbest(i0:i1), best_rows(i0:i1))
+        do col=1,dim_out
+            start_=starts(col)
             select case (mode)
-            case (0)
-                {%if is_complex-%}
-                rows=>csc_indices(start_:end_-1)
-                do ib=1,nfi
-                    irow=maxloc(real(x(ib,rows)),1)
-                    y(ib,col)=x(ib,rows(irow))
-                enddo
-                {%else-%}
-                y(:,col)=maxval(x(:,csc_indices(start_:end_-1)),2)
-                {%endif-%}
-            case (1)
-                rows=>csc_indices(start_:end_-1)
-                do ib=1,nfi
-                    irow=maxloc(abs(x(ib,rows)),1)
-                    y(ib,col)=x(ib,rows(irow))
-                enddo
-            case (2)
-                {%if is_complex-%}
-                rows=>csc_indices(start_:end_-1)
-                do ib=1,nfi
-                    irow=minloc(real(x(ib,rows)),1)
-                    y(ib,col)=x(ib,rows(irow))
-                enddo
-                {%else-%}
-                y(:,col)=minval(x(:,csc_indices(start_:end_-1)),2)
-                {%endif-%}
-            case (3)
-                rows=>csc_indices(start_:end_-1)
-                do ib=1,nfi
-                    irow=minloc(abs(x(ib,rows)),1)
-                    y(ib,col)=x(ib,rows(irow))
+            {%for m, fkey, cmp in select_modes -%}
+            case ({{m}})
+                {%if not is_complex and m in (0, 2) and not with_argmax -%}
+                y(i0:i1,col)=x(i0:i1,start_+offsets(1))
+                do iw=2,nk
+                    y(i0:i1,col)={{"max" if m == 0 else "min"}}(y(i0:i1,col),x(i0:i1,start_+offsets(iw)))
                 enddo
+                {%- else -%}
+                {%set actions = ["y(ib,col)=x(ib,jb)"] + (["argmax(ib,col)=jb"] if with_argmax else []) -%}
+                {{select_rows(fkey, cmp, actions)}}
+                {%- endif %}
+            {%endfor -%}
             case (4)
-                y(:,col)=sum(x(:,csc_indices(start_:end_-1)),2)/(end_-start_)
-            case default
-                print*,'Error: Pooling mode not exist!'
-                stop 1
+                y(i0:i1,col)=x(i0:i1,start_+offsets(1))
+                do iw=2,nk
+                    y(i0:i1,col)=y(i0:i1,col)+x(i0:i1,start_+offsets(iw))
+                enddo
+                y(i0:i1,col)=y(i0:i1,col)/nk
             endselect
         enddo
-    end subroutine forward_{{version}}{{dtype_token}}
+        if(nk>max_nk_inner) deallocate(jbest, best_rows)
+        !$omp end parallel
+        deallocate(offsets, starts)
+    end subroutine {{name}}{{version}}{{dtype_token}}
 
-    subroutine backward_{{version}}{{dtype_token}}(dy,x,dx,csc_indptr,csc_indices, nnz,dim_in,dim_out,nfi,mode)
+    {%endfor -%}
+    subroutine backward_tiled_{{version}}{{dtype_token}}(dy, x, dx, img_in_shape, kernel_shape, nfi, dim_in, dim_out, nd, mode)
         implicit none
-        integer,intent(in) :: nnz,dim_in,dim_out,nfi,mode
+        !f2py threadsafe
+        integer,intent(in) :: nfi, dim_in, dim_out, nd, mode
+        integer,intent(in) :: img_in_shape(nd), kernel_shape(nd)
         {{dtype}},intent(in) :: x(nfi, dim_in)
         {{dtype}},intent(in) :: dy(nfi, dim_out)
-        integer,intent(in),target :: csc_indices(nnz)
-        integer,intent(in) :: csc_indptr(dim_out+1)
-        {{dtype}},intent(out) :: dx(nfi, dim_in)
+        {{dtype}},intent(inout) :: dx(nfi, dim_in)
 
-        integer :: start_, end_, col, irow, ib
-        integer,pointer :: rows(:)
-        {{dtype}} :: y_work(nfi)
-        {{dtype}},parameter :: one={{dtype_one}}
+        integer :: col, iw, ib, j, jb, start_, i0, i1, nk
+        integer,allocatable :: offsets(:), starts(:)
+        {{rtype}} :: key, best
+        integer,allocatable :: jbest(:)
+        {{rtype}},allocatable :: best_rows(:)
+        integer,parameter :: max_nk_inner=16
         {{dtype}},parameter :: zero={{dtype_zero}}
+        !f2py intent(in) x, dy, img_in_shape, kernel_shape
+        !f2py intent(in) nfi, dim_in, dim_out, nd, mode
+        !f2py {{dtype}} optional,intent(in,out),depend(nfi,dim_in) :: dx(nfi,dim_in)
 
-        !f2py intent(in) x, dy, csc_indices, csc_indptr
-        !f2py intent(in) nfi, dim_in, dim_out, nnz
-        !f2py intent(out) dx
-
-        if(mode==0) dx=0
+        if(mode<0 .or. mode>4) then
+            print*,'Error: Pooling mode not exist!'
+            stop 1
+        endif
+        nk=product(kernel_shape)
+        allocate(offsets(nk), starts(dim_out))
+        call tile_offsets(img_in_shape, kernel_shape, nd, offsets, nk, starts, dim_out)
+        dx=zero
 
+        !$omp parallel private(col, iw, ib, j, jb, start_, i0, i1, key, best, jbest, best_rows)
+        i0=1
+        i1=nfi
+        !$ i0=omp_get_thread_num()*nfi/omp_get_num_threads()+1
+        !$ i1=(omp_get_thread_num()+1)*nfi/omp_get_num_threads()
+        if(nk>max_nk_inner) allocate(jbest(i0:i1), best_rows(i0:i1))
         do col=1,dim_out
-            start_=csc_indptr(col)
-            end_=csc_indptr(col+1)
-
+            start_=starts(col)
             select case (mode)
-            case (0)
-                !prepair work space by taking rows in x.
-                rows=>csc_indices(start_:end_-1)
-                do ib=1,nfi
-                    irow=maxloc({%if is_complex%}real{%endif%}(x(ib,rows)),1)
-                    dx(ib,rows(irow))=dy(ib,col)
-                enddo
-            case (1)
-                rows=>csc_indices(start_:end_-1)
-                do ib=1,nfi
-                    irow=maxloc(abs(x(ib,rows)),1)
-                    dx(ib,rows(irow))=dy(ib,col)
-                enddo
-            case (2)
-                rows=>csc_indices(start_:end_-1)
-                do ib=1,nfi
-                    irow=minloc({%if is_complex%}real{%endif%}(x(ib,rows)),1)
-                    dx(ib,rows(irow))=dy(ib,col)
-                enddo
-            case (3)
-                rows=>csc_indices(start_:end_-1)
-                do ib=1,nfi
-                    irow=minloc(abs(x(ib,rows)),1)
-                    dx(ib,rows(irow))=dy(ib,col)
-                enddo
+            {%for m, fkey, cmp in select_modes -%}
+            case ({{m}})
+                {{select_rows(fkey, cmp, ["dx(ib,jb)=dy(ib,col)"])}}
+            {%endfor -%}
             case (4)
-                y_work=dy(:,col)/(end_-start_)
-                do irow=start_,end_-1
-                    dx(:,csc_indices(irow))=y_work
+                do iw=1,nk
+                    dx(i0:i1,start_+offsets(iw))=dy(i0:i1,col)/nk
                 enddo
-            case default
-                print*,'Error: Pooling mode not exist!'
-                stop 1
             endselect
         enddo
-    end subroutine backward_{{version}}{{dtype_token}}
+        if(nk>max_nk_inner) deallocate(jbest, best_rows)
+        !$omp end parallel
+        deallocate(offsets, starts)
+    end subroutine backward_tiled_{{version}}{{dtype_token}}
+
+    subroutine backward_argmax_{{version}}{{dtype_token}}(dy, argmax, dx, dim_in, dim_out, nfi)
+        implicit none
+        !f2py threadsafe
+        integer,intent(in) :: dim_in, dim_out, nfi
+        {{dtype}},intent(in) :: dy(nfi, dim_out)
+        integer,intent(in) :: argmax(nfi, dim_out)
+        {{dtype}},intent(inout) :: dx(nfi, dim_in)
+
+        integer :: col, ib, i0, i1
+        {{dtype}},parameter :: zero={{dtype_zero}}
+
+        !f2py intent(in) dy, argmax, dim_in
+        !f2py intent(in) nfi, dim_out
+        !f2py {{dtype}} optional,intent(in,out),depend(nfi,dim_in) :: dx(nfi,dim_in)
+
+        dx=zero
+
+        !rows i0:i1 of dx are written by this thread.
+        !$omp parallel private(col, ib, i0, i1)
+        i0=1
+        i1=nfi
+        !$ i0=omp_get_thread_num()*nfi/omp_get_num_threads()+1
+        !$ i1=(omp_get_thread_num()+1)*nfi/omp_get_num_threads()
+        do col=1,dim_out
+            do ib=i0,i1
+                dx(ib,argmax(ib,col))=dy(ib,col)
+            enddo
+        enddo
+        !$omp end parallel
+    end subroutine backward_argmax_{{version}}{{dtype_token}}
     {%endfor -%}
 end module lib
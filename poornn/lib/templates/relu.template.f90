@@ -1,5 +1,6 @@
 !orders: conv_dim_out/in, feature_dim_out/in, batch_dim
 !version: 1 -> real-imagine seperate, otherwise real only
+!loops run in parallel if compiled with OpenMP and longer than 32768.
 module lib
     contains
     {%for dtype in dtype_list -%}
@@ -12,12 +13,15 @@ module lib
     {%for version in version_list-%}
     subroutine forward_{{version}}{{dtype_token}}(x, y, dim_in, leak)
         implicit none
+        !f2py threadsafe
         integer,intent(in) :: dim_in
         {{rtype}},intent(in) :: leak
         {{dtype}},intent(in) :: x(dim_in)
-        {{dtype}},intent(out) :: y(dim_in)
+        {{dtype}},intent(inout) :: y(dim_in)
         integer :: i
+        !f2py {{dtype}} optional,intent(in,out),depend(dim_in) :: y(dim_in)
         {{dtype}} :: xi
+        !$omp parallel do schedule(static) private(xi) if(dim_in>32768)
         do i=1,dim_in
             xi=x(i)
             {%if version == "r"-%}
@@ -38,19 +42,23 @@ module lib
             endif
             {%-endif%}
         enddo
+        !$omp end parallel do
     end subroutine forward_{{version}}{{dtype_token}}
 
     subroutine backward_{{version}}{{dtype_token}}(dy,x,dx,dim_in,leak)
         implicit none
+        !f2py threadsafe
         integer,intent(in) :: dim_in
         {{rtype}},intent(in) :: leak
         {{dtype}},intent(in) :: x(dim_in)
         {{dtype}},intent(in) :: dy(dim_in)
-        {{dtype}},intent(out) :: dx(dim_in)
+        {{dtype}},intent(inout) :: dx(dim_in)
         {{dtype}} :: xi
+        !f2py {{dtype}} optional,intent(in,out),depend(dim_in) :: dx(dim_in)
 
         integer :: i
 
+        !$omp parallel do schedule(static) private(xi) if(dim_in>32768)
         do i=1,dim_in
             xi=x(i)
             {%if version == "r"-%}
@@ -71,6 +79,7 @@ module lib
             endif
             {%-endif%}
         enddo
+        !$omp end parallel do
     end subroutine backward_{{version}}{{dtype_token}}
     {%endfor%}
     {%endfor%}
@@ -1,37 +1,53 @@
 !orders: conv_dim_out/in, feature_dim_out/in, batch_dim
+!loops over output pixels run in parallel if compiled with OpenMP,
+!backward passes with batch split the batch among threads.
+{%from "templates/gemm3m.template.f90" import gemm3m -%}
 module lib
+    !$ use omp_lib
     contains
     {%for dtype in dtype_list -%}
     {%if dtype == "complex*16"%}{%set dtype_one, dtype_zero, dtype_token, is_complex = "dcmplx(1D0,0D0)", "dcmplx(0D0,0D0)", "z", True -%}
     {%elif dtype == "complex*8"%}{%set dtype_one, dtype_zero, dtype_token, is_complex ="cmplx(1.0,0.0)", "cmplx(0.0,0.0)", "c", True -%}
     {%elif dtype == "real*8"%}{%set dtype_one, dtype_zero, dtype_token, is_complex = "1D0", "0D0", "d", False -%}
     {%elif dtype == "real*4"%}{%set dtype_one, dtype_zero, dtype_token, is_complex = "1.0", "0.0", "s", False -%}
+    {%endif -%}
+    {%if is_complex%}{{gemm3m(dtype, dtype_token)}}
+
     {%endif -%}
     {%for version in version_list -%}
     {%for withbatch in [True, False] -%}
-    {%if withbatch%}{%set comma, num_batch, batch_token, batch_dim = ":,", "num_batch, ", "", "num_batch" -%}
-    {%else%}{%set comma, num_batch, batch_token, batch_dim = "", "", "1", "1" -%}
+    {%if withbatch%}{%set comma, num_batch, batch_token, batch_dim, bslice = ":,", "num_batch, ", "", "num_batch", "b0:b1," -%}
+    {%else%}{%set comma, num_batch, batch_token, batch_dim, bslice = "", "", "1", "1", "" -%}
     {%endif -%}
+    {%set use3m = is_complex and withbatch -%}
+    {%set gemm_call = "gemm_%s(gemm3m, " % dtype_token if use3m else "%sgemm(" % dtype_token -%}
     subroutine forward{{batch_token}}_{{version}}{{dtype_token}}(x, y, bias, {{num_batch}}csc_indptr, csc_indices, fltr_data,{%if version == "general"%} weight_indices,{%endif%}&
-            nnz, dim_in, dim_out, nfi, nfo, nd, max_nnz_row)
+            nnz, dim_in, dim_out, nfi, nfo, nd, max_nnz_row{%if use3m%}, gemm3m{%endif%})
         implicit none
+        !f2py threadsafe
         integer,intent(in) :: {{num_batch}}nnz, dim_in, dim_out, nfi, nfo, max_nnz_row, nd
+        {%if use3m%}logical,intent(in) :: gemm3m
+        !f2py logical optional,intent(in) :: gemm3m=0
+        {%endif -%}
         {{dtype}},intent(in) :: x({{num_batch}}nfi, dim_in), bias(nfo)
         {{dtype}},intent(in) :: fltr_data(nfo, nfi, nd)
         integer,intent(in) :: csc_indices(nnz), csc_indptr(dim_out+1){%if version == "general"%}, weight_indices(nnz){%endif%}
-        {{dtype}},intent(out) :: y({{num_batch}}nfo, dim_out)
+        {{dtype}},intent(inout) :: y({{num_batch}}nfo, dim_out)
 
-        {{dtype}} :: x_work({{num_batch}}nfi, max_nnz_row){%if version == "general"%}, w_work(nfo, nfi, max_nnz_row){%endif%}
+        {{dtype}},allocatable :: x_work({%if withbatch%}:,{%endif%}:,:){%if version == "general"%}, w_work(:,:,:){%endif%}
         integer :: start_, end_, col, ii, nnz_row, k
         {{dtype}},parameter :: one={{dtype_one}}
         !f2py intent(in) x, csc_indices, csc_indptr, fltr_data, bias{%if version == "general"%}, weight_indices{%endif%}
         !f2py intent(in) nfi, nfo, {{num_batch}}max_nnz_row, nnz, dim_out, nd, dim_in
-        !f2py intent(out) y
+        !f2py {{dtype}} optional,intent(in,out),depend({{num_batch}}nfo,dim_out) :: y({{num_batch}}nfo,dim_out)
 
         do ii=1,nfo
             y({{comma}}ii,:)=bias(ii)
         enddo
 
+        !$omp parallel private(start_, end_, col, ii, nnz_row, k, x_work{%if version == "general"%}, w_work{%endif%})
+        allocate(x_work({{num_batch}}nfi, max_nnz_row){%if version == "general"%}, w_work(nfo, nfi, max_nnz_row){%endif%})
+        !$omp do schedule(static)
         do col=1, dim_out
             start_=csc_indptr(col)
             end_=csc_indptr(col+1)
@@ -44,36 +60,60 @@ module lib
                 {%if version == "general"%}w_work(:,:,ii)=fltr_data(:,:,weight_indices(start_+ii-1)){%endif%}
             enddo
             {%if withbatch-%}
-            call {{dtype_token}}gemm('N', 'T', num_batch, nfo, k, one, x_work, num_batch,&
+            call {{gemm_call}}'N', 'T', num_batch, nfo, k, one, x_work, num_batch,&
                 {%if version == "contiguous"%}fltr_data{%else%}w_work{%endif%}, nfo, one, y(:,:,col), num_batch)
             {%else -%}
-            call {{dtype_token}}gemv('N', nfo, k, one, {%if version == general%}w_work{%else%}fltr_data{%endif%}, nfo,&
+            call {{dtype_token}}gemv('N', nfo, k, one, {%if version == "general"%}w_work{%else%}fltr_data{%endif%}, nfo,&
             x_work, 1, one, y(:,col), 1)
             {%endif -%}
         enddo
+        !$omp end do
+        deallocate(x_work{%if version == "general"%}, w_work{%endif%})
+        !$omp end parallel
     end subroutine forward{{batch_token}}_{{version}}{{dtype_token}}
 
     subroutine backward{{batch_token}}_{{version}}{{dtype_token}}(dy,x,dx,dweight,dbias,csc_indptr,csc_indices{%if version == "general"%},weight_indices{%endif%},fltr_data,&
-            nnz,dim_in,dim_out,nfi,nfo, nd, {{num_batch}}do_xgrad, do_wgrad, do_bgrad, max_nnz_row)
+            nnz,dim_in,dim_out,nfi,nfo, nd, {{num_batch}}do_xgrad, do_wgrad, do_bgrad, max_nnz_row{%if use3m%}, gemm3m{%endif%})
         implicit none
+        !f2py threadsafe
         integer,intent(in) :: {{num_batch}}nnz,dim_in,dim_out,nfi,nfo,nd,max_nnz_row
-        logical,intent(in) :: do_xgrad, do_wgrad, do_bgrad
+        logical,intent(in) :: do_xgrad, do_wgrad, do_bgrad{%if use3m%}, gemm3m
+        !f2py logical optional,intent(in) :: gemm3m=0{%endif%}
         {{dtype}},intent(in) :: x({{num_batch}}nfi, dim_in), dy({{num_batch}}nfo, dim_out),&
             fltr_data(nfo,nfi,nd)
         integer,intent(in) :: csc_indices(nnz), csc_indptr(dim_out+1){%if version == "general"%}, weight_indices(nnz){%endif%}
-        {{dtype}},intent(out) :: dweight(nfo, nfi, nd), dbias(nfo), dx({{num_batch}}nfi, dim_in)
+        {{dtype}},intent(inout) :: dweight(nfo, nfi, nd), dbias(nfo), dx({{num_batch}}nfi, dim_in)
 
-        integer :: start_, end_, k, col, ii, row, nnz_row
-        {{dtype}} :: x_work({{num_batch}}nfi, max_nnz_row){%if version == "general"%}, w_work(nfo, nfi, max_nnz_row){%endif%}
+        integer :: start_, end_, k, col, ii, row, nnz_row{%if withbatch%}, b0, b1, nbl{%endif%}
+        {{dtype}},allocatable :: x_work({%if withbatch%}:,{%endif%}:,:){%if version == "general"%}, w_work(:,:,:){%endif%}
         {{dtype}},parameter :: one={{dtype_one}}
         {{dtype}},parameter :: zero={{dtype_zero}}
 
         !f2py intent(in) x, dy, csc_indices, csc_indptr{%if version == "general"%}, weight_indices{%endif%}, fltr_data
         !f2py intent(in) do_xgrad, do_wgrad, do_bgrad
         !f2py intent(in) nfi, nfo, {{num_batch}}nd, max_nnz_row, dim_in, dim_out, nnz
-        !f2py intent(out) dx, dweight, dbias
+        !f2py {{dtype}} optional,intent(in,out),depend({{num_batch}}nfi,dim_in) :: dx({{num_batch}}nfi,dim_in)
+        !f2py {{dtype}} optional,intent(in,out),depend(nfo,nfi,nd) :: dweight(nfo,nfi,nd)
+        !f2py {{dtype}} optional,intent(in,out),depend(nfo) :: dbias(nfo)
 
+        if(do_xgrad) dx=zero
+        if(do_wgrad) dweight=zero
+        {%if withbatch -%}
+        !rows b0:b1 of the batch are taken by this thread.
+        !$omp parallel private(start_, end_, k, col, ii, row, nnz_row, b0, b1, nbl, x_work{%if version == "general"%}, w_work{%endif%})&
+        !$omp reduction(+:dweight)
+        b0=1
+        b1=num_batch
+        !$ b0=omp_get_thread_num()*num_batch/omp_get_num_threads()+1
+        !$ b1=(omp_get_thread_num()+1)*num_batch/omp_get_num_threads()
+        nbl=b1-b0+1
+        allocate(x_work(max(nbl,1), nfi, max_nnz_row){%if version == "general"%}, w_work(nfo, nfi, max_nnz_row){%endif%})
+        {%else -%}
+        allocate(x_work(nfi, max_nnz_row){%if version == "general"%}, w_work(nfo, nfi, max_nnz_row){%endif%})
+        {%endif -%}
         do col=1,dim_out
+            {%if withbatch%}if(nbl==0) exit
+            {%endif -%}
             start_=csc_indptr(col)
             end_=csc_indptr(col+1)
             nnz_row=end_-start_
@@ -82,12 +122,12 @@ module lib
             if(do_wgrad) then
                 !prepair work space by taking rows in x
                 do ii=1,nnz_row
-                    x_work({{comma}}:,ii)=x({{comma}}:,csc_indices(start_+ii-1))
+                    x_work({{comma}}:,ii)=x({{bslice}}:,csc_indices(start_+ii-1))
                 enddo
 
                 !calculate dweight
-                call {{dtype_token}}gemm({%if withbatch%}'T'{%else%}'N'{%endif%}, 'N', nfo, k, {{batch_dim}}, one,&
-                    dy({{comma}}:,col), {%if withbatch%}num_batch{%else%}nfo{%endif%}, x_work, {{batch_dim}},&
+                call {{gemm_call}}{%if withbatch%}'T'{%else%}'N'{%endif%}, 'N', nfo, k, {%if withbatch%}nbl{%else%}1{%endif%}, one,&
+                    {%if withbatch%}dy(b0,1,col), num_batch, x_work, max(nbl,1){%else%}dy(:,col), nfo, x_work, 1{%endif%},&
                     {%if version == "general"%}zero, w_work{%else%}one, dweight{%endif%}, nfo)
 
                 {%if version == "general" -%}
@@ -108,8 +148,8 @@ module lib
 
                 !calculate dx
                 {%if withbatch -%}
-                call {{dtype_token}}gemm('N', 'N', num_batch, k, nfo, one, dy({{comma}}:,col), num_batch,&
-                    {%if version == 'general'%}w_work{%else%}fltr_data{%endif%}, nfo, zero, x_work, num_batch)
+                call {{gemm_call}}'N', 'N', nbl, k, nfo, one, dy(b0,1,col), num_batch,&
+                    {%if version == 'general'%}w_work{%else%}fltr_data{%endif%}, nfo, zero, x_work, max(nbl,1))
                 {%else -%}
                 call {{dtype_token}}gemv('T', nfo, k, one,&
                     {%if version == "general"%}w_work{%else%}fltr_data{%endif%}, nfo, dy(:,col), 1, zero, x_work, 1)
@@ -118,10 +158,14 @@ module lib
                 !extract rows
                 do ii=1,nnz_row
                     row=csc_indices(start_+ii-1)
-                    dx({{comma}}:,row)=dx({{comma}}:,row)+x_work({{comma}}:,ii)
+                    dx({{bslice}}:,row)=dx({{bslice}}:,row)+x_work({{comma}}:,ii)
                 enddo
             endif
         enddo
+        deallocate(x_work{%if version == "general"%}, w_work{%endif%})
+        {%if withbatch -%}
+        !$omp end parallel
+        {%endif -%}
         if(do_bgrad) then
             !calculate dbias
             dbias=sum({%if withbatch%}sum(dy,1){%else%}dy{%endif%},2)
@@ -130,5 +174,144 @@ module lib
 
     {%endfor -%}
     {%endfor -%}
+    {%set gemm_call = "gemm_%s(gemm3m, " % dtype_token if is_complex else "%sgemm(" % dtype_token -%}
+
+    subroutine forward_im2col{{dtype_token}}(x, y, bias, num_batch, csc_indices, fltr_data,&
+            nnz, dim_in, dim_out, nfi, nfo, nd, block_size{%if is_complex%}, gemm3m{%endif%})
+        implicit none
+        !f2py threadsafe
+        integer,intent(in) :: num_batch, nnz, dim_in, dim_out, nfi, nfo, nd, block_size
+        {%if is_complex%}logical,intent(in) :: gemm3m
+        !f2py logical optional,intent(in) :: gemm3m=0
+        {%endif -%}
+        {{dtype}},intent(in) :: x(num_batch, nfi, dim_in), bias(nfo)
+        {{dtype}},intent(in) :: fltr_data(nfo, nfi, nd)
+        integer,intent(in) :: csc_indices(nnz)
+        {{dtype}},intent(inout) :: y(num_batch, nfo, dim_out)
+
+        {{dtype}},allocatable :: x_work(:,:,:,:), y_work(:,:,:)
+        integer :: col0, nb, bmax, ldw, ii, j
+        {{dtype}},parameter :: one={{dtype_one}}
+        !f2py intent(in) x, csc_indices, fltr_data, bias
+        !f2py intent(in) nfi, nfo, num_batch, nnz, nd, dim_in, block_size
+        !f2py integer optional,intent(in),depend(nnz,nd) :: dim_out=nnz/nd
+        !f2py {{dtype}} optional,intent(in,out),depend(num_batch,nfo,dim_out) :: y(num_batch,nfo,dim_out)
+
+        !columns of a block of output pixels, (num_batch, block, nfi, nd),
+        !blocks are made small enough to give every thread some.
+        bmax=max(1,min(block_size,dim_out))
+        !$ bmax=max(1,min(bmax,(dim_out-1)/omp_get_max_threads()+1))
+        ldw=num_batch*bmax
+
+        !$omp parallel private(col0, nb, ii, j, x_work, y_work)
+        allocate(x_work(num_batch, bmax, nfi, nd), y_work(num_batch, bmax, nfo))
+        !$omp do schedule(static)
+        do col0=1, dim_out, bmax
+            nb=min(bmax,dim_out-col0+1)
+
+            !gather patches of input, one column per kernel offset.
+            do ii=1,nd
+                do j=1,nb
+                    x_work(:,j,:,ii)=x(:,:,csc_indices((col0+j-2)*nd+ii))
+                enddo
+            enddo
+            do ii=1,nfo
+                y_work(:,:,ii)=bias(ii)
+            enddo
+
+            call {{gemm_call}}'N', 'T', num_batch*nb, nfo, nfi*nd, one, x_work, ldw,&
+                fltr_data, nfo, one, y_work, ldw)
+
+            do j=1,nb
+                y(:,:,col0+j-1)=y_work(:,j,:)
+            enddo
+        enddo
+        !$omp end do
+        deallocate(x_work, y_work)
+        !$omp end parallel
+    end subroutine forward_im2col{{dtype_token}}
+
+    subroutine backward_im2col{{dtype_token}}(dy,x,dx,dweight,dbias,num_batch,csc_indices,fltr_data,&
+            nnz,dim_in,dim_out,nfi,nfo,nd,do_xgrad,do_wgrad,do_bgrad,block_size{%if is_complex%},gemm3m{%endif%})
+        implicit none
+        !f2py threadsafe
+        integer,intent(in) :: num_batch,nnz,dim_in,dim_out,nfi,nfo,nd,block_size
+        {%if is_complex%}logical,intent(in) :: gemm3m
+        !f2py logical optional,intent(in) :: gemm3m=0
+        {%endif -%}
+        logical,intent(in) :: do_xgrad, do_wgrad, do_bgrad
+        {{dtype}},intent(in) :: x(num_batch, nfi, dim_in), dy(num_batch, nfo, dim_out),&
+            fltr_data(nfo,nfi,nd)
+        integer,intent(in) :: csc_indices(nnz)
+        {{dtype}},intent(inout) :: dweight(nfo, nfi, nd), dbias(nfo), dx(num_batch, nfi, dim_in)
+
+        {{dtype}},allocatable :: x_work(:,:,:,:), dy_work(:,:,:)
+        integer :: col0, nb, bmax, ldw, ii, j, row, b0, b1, nbl
+        {{dtype}},parameter :: one={{dtype_one}}
+        {{dtype}},parameter :: zero={{dtype_zero}}
+
+        !f2py intent(in) x, dy, csc_indices, fltr_data
+        !f2py intent(in) do_xgrad, do_wgrad, do_bgrad
+        !f2py intent(in) nfi, nfo, num_batch, nd, dim_in, dim_out, nnz, block_size
+        !f2py {{dtype}} optional,intent(in,out),depend(num_batch,nfi,dim_in) :: dx(num_batch,nfi,dim_in)
+        !f2py {{dtype}} optional,intent(in,out),depend(nfo,nfi,nd) :: dweight(nfo,nfi,nd)
+        !f2py {{dtype}} optional,intent(in,out),depend(nfo) :: dbias(nfo)
+
+        if(do_xgrad) dx=zero
+        if(do_wgrad) dweight=zero
+        if(do_xgrad .or. do_wgrad) then
+            bmax=max(1,min(block_size,dim_out))
+
+            !rows b0:b1 of the batch are taken by this thread.
+            !$omp parallel private(col0, nb, ldw, ii, j, row, b0, b1, nbl, x_work, dy_work)&
+            !$omp reduction(+:dweight)
+            b0=1
+            b1=num_batch
+            !$ b0=omp_get_thread_num()*num_batch/omp_get_num_threads()+1
+            !$ b1=(omp_get_thread_num()+1)*num_batch/omp_get_num_threads()
+            nbl=b1-b0+1
+            ldw=max(nbl,1)*bmax
+            allocate(x_work(max(nbl,1), bmax, nfi, nd), dy_work(max(nbl,1), bmax, nfo))
+
+            do col0=1, dim_out, bmax
+                if(nbl==0) exit
+                nb=min(bmax,dim_out-col0+1)
+                do j=1,nb
+                    dy_work(:,j,:)=dy(b0:b1,:,col0+j-1)
+                enddo
+
+                if(do_wgrad) then
+                    !gather patches of input
+                    do ii=1,nd
+                        do j=1,nb
+                            x_work(:,j,:,ii)=x(b0:b1,:,csc_indices((col0+j-2)*nd+ii))
+                        enddo
+                    enddo
+
+                    !calculate dweight
+                    call {{gemm_call}}'T', 'N', nfo, nfi*nd, nbl*nb, one,&
+                        dy_work, ldw, x_work, ldw, one, dweight, nfo)
+                endif
+                if(do_xgrad) then
+                    !calculate gradients of patches, and scatter them back to dx.
+                    call {{gemm_call}}'N', 'N', nbl*nb, nfi*nd, nfo, one,&
+                        dy_work, ldw, fltr_data, nfo, zero, x_work, ldw)
+                    do ii=1,nd
+                        do j=1,nb
+                            row=csc_indices((col0+j-2)*nd+ii)
+                            dx(b0:b1,:,row)=dx(b0:b1,:,row)+x_work(:,j,:,ii)
+                        enddo
+                    enddo
+                endif
+            enddo
+            deallocate(x_work, dy_work)
+            !$omp end parallel
+        endif
+        if(do_bgrad) then
+            !calculate dbias
+            dbias=sum(sum(dy,1),2)
+        endif
+    end subroutine backward_im2col{{dtype_token}}
+
     {%endfor -%}
 end module lib
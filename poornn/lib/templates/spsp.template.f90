@@ -23,46 +23,32 @@ module lib
         enddo
     end subroutine forward{{dtype_token}}
 
-    {%for version in version_list -%}
-    {%if version == "_conv"%}{%set nd_, nd = "nd, ", "nd" -%}
-    {%else%}{%set nd_, nd = "", "nnz"-%}
-    {%endif -%}
-    subroutine backward{{version}}{{dtype_token}}(dy,x,dx,dweight, dbias, num_batch, csc_indptr,csc_indices, &
-            {{data_indices}}csc_data, nnz,{{nd_}}dim_in,dim_out, do_xgrad, do_wgrad, do_bgrad)
+    subroutine backward{{dtype_token}}(dy,x,dx,dweight, dbias, num_batch, csc_indptr,csc_indices, &
+            csc_data, nnz,dim_in,dim_out, do_xgrad, do_wgrad, do_bgrad)
         implicit none
-        integer,intent(in) :: num_batch, nnz,dim_in,{{nd_}}dim_out
+        integer,intent(in) :: num_batch, nnz,dim_in,dim_out
         logical,intent(in) :: do_xgrad, do_wgrad, do_bgrad
         {{dtype}},intent(out) :: dx(num_batch, dim_in)
-        {{dtype}},intent(in) :: x(num_batch, dim_in), dy(num_batch,dim_out), csc_data({{nd}})
+        {{dtype}},intent(in) :: x(num_batch, dim_in), dy(num_batch,dim_out), csc_data(nnz)
         integer,intent(in) :: csc_indices(nnz), csc_indptr(dim_out+1)
-        {{dtype}},intent(out) :: dweight({{nd}}), dbias(dim_out)
+        {{dtype}},intent(inout) :: dweight(nnz), dbias(dim_out)
+        !f2py {{dtype}} optional,intent(in,out),depend(nnz) :: dweight(nnz)
+        !f2py {{dtype}} optional,intent(in,out),depend(dim_out) :: dbias(dim_out)
 
-        integer :: k, col, start_, end_{%if version == '_conv'%},data_start_, data_end_, ifo{%endif%}
+        integer :: k, col, start_, end_
 
-        dweight=0
+        if(do_wgrad) dweight=0
         do k=1,num_batch
             if(do_wgrad) then
                 !calculate dweight
                 do col=1,dim_out
                     start_=csc_indptr(col)
                     end_=csc_indptr(col+1)-1
-                    {%if version == "_conv" -%}
-                    data_start_=modulo(start_-1, nd)+1
-                    data_end_=modulo(end_-1, nd)+1
-                    dweight(data_start_:data_end_)= dweight(data_start_:data_end_)+x(k,csc_indices(start_:end_))*dy(k,col)
-                    {%else-%}
                     dweight(start_:end_)= dweight(start_:end_)+x(k,csc_indices(start_:end_))*dy(k,col)
-                    {%endif-%}
                 enddo
             endif
             if(do_xgrad) then
                 !calculate dx
-                {%if version == '_conv' -%}
-                do ifo=1,nnz/nd
-                    call mkl_{{dtype_token}}cscmv('N', dim_in, dim_out, {{dtype_one}}, matdescra, csc_data, csc_indices,&
-                    csc_indptr(1:dim_in), csc_indptr(2:dim_in+1), dy(k,:), {{dtype_zero}}, dx(k,:))
-                enddo
-                {%endif%}
                 call mkl_{{dtype_token}}cscmv('N', dim_in, dim_out, {{dtype_one}}, matdescra, csc_data, csc_indices,&
                 csc_indptr(1:dim_out), csc_indptr(2:dim_out+1), dy(k,:), {{dtype_zero}}, dx(k,:))
             endif
@@ -71,7 +57,59 @@ module lib
             !calculate dbias
             dbias=sum(dy,1)
         endif
-    end subroutine backward{{version}}{{dtype_token}}
-    {%endfor -%}
+    end subroutine backward{{dtype_token}}
+
+    !convolution with a sparse kernel, columns are (feature_out, img_out) with feature_out the fastest,
+    !each group of nfo columns (an output pixel) takes nd entries, the i-th entry uses fltr_data(mod(i-1,nd)+1).
+    subroutine forward_conv{{dtype_token}}(x, y, bias, csc_indptr, csc_indices, fltr_data, num_batch, dim_in, dim_out, nnz, nd, nfo)
+        implicit none
+        !f2py threadsafe
+        integer,intent(in) :: num_batch, dim_in, dim_out, nnz, nd, nfo
+        {{dtype}},intent(in) :: x(num_batch, dim_in), fltr_data(nd), bias(nfo)
+        {{dtype}},intent(inout) :: y(num_batch, dim_out)
+        integer,intent(in) :: csc_indices(nnz), csc_indptr(dim_out+1)
+        !f2py {{dtype}} optional,intent(in,out),depend(num_batch,dim_out) :: y(num_batch,dim_out)
+
+        integer :: col, ii
+
+        do col=1,dim_out
+            y(:,col)=bias(modulo(col-1,nfo)+1)
+            do ii=csc_indptr(col),csc_indptr(col+1)-1
+                y(:,col)=y(:,col)+fltr_data(modulo(ii-1,nd)+1)*x(:,csc_indices(ii))
+            enddo
+        enddo
+    end subroutine forward_conv{{dtype_token}}
+
+    subroutine backward_conv{{dtype_token}}(dy, x, dx, dweight, dbias, csc_indptr, csc_indices, fltr_data,&
+            num_batch, dim_in, dim_out, nnz, nd, nfo, do_xgrad, do_wgrad, do_bgrad)
+        implicit none
+        !f2py threadsafe
+        integer,intent(in) :: num_batch, dim_in, dim_out, nnz, nd, nfo
+        logical,intent(in) :: do_xgrad, do_wgrad, do_bgrad
+        {{dtype}},intent(in) :: x(num_batch, dim_in), dy(num_batch, dim_out), fltr_data(nd)
+        integer,intent(in) :: csc_indices(nnz), csc_indptr(dim_out+1)
+        {{dtype}},intent(inout) :: dx(num_batch, dim_in), dweight(nd), dbias(nfo)
+        !f2py {{dtype}} optional,intent(in,out),depend(num_batch,dim_in) :: dx(num_batch,dim_in)
+        !f2py {{dtype}} optional,intent(in,out),depend(nd) :: dweight(nd)
+        !f2py {{dtype}} optional,intent(in,out),depend(nfo) :: dbias(nfo)
+
+        integer :: col, ii, k, row
+
+        if(do_xgrad) dx=0
+        if(do_wgrad) dweight=0
+        if(do_bgrad) dbias=0
+        do col=1,dim_out
+            if(do_bgrad) then
+                k=modulo(col-1,nfo)+1
+                dbias(k)=dbias(k)+sum(dy(:,col))
+            endif
+            do ii=csc_indptr(col),csc_indptr(col+1)-1
+                k=modulo(ii-1,nd)+1
+                row=csc_indices(ii)
+                if(do_xgrad) dx(:,row)=dx(:,row)+fltr_data(k)*dy(:,col)
+                if(do_wgrad) dweight(k)=dweight(k)+sum(x(:,row)*dy(:,col))
+            enddo
+        enddo
+    end subroutine backward_conv{{dtype_token}}
     {%endfor -%}
 end module lib
@@ -0,0 +1,97 @@
+'''
+Static memory planning, serve data flows from a single reusable arena.
+'''
+
+import numpy as np
+
+__all__ = ['ALIGNMENT', 'assign_offsets', 'MemoryPlan']
+
+ALIGNMENT = 64
+'''Alignment of buffers in an arena, in bytes.'''
+
+
+def assign_offsets(sizes, lifetimes, alignment=ALIGNMENT):
+    '''
+    Assign offsets to buffers so that buffers alive at the same time \
+never overlap, larger buffers are placed first, each into the \
+smallest gap it fits in (best fit).
+
+    Args:
+        sizes (list<int>): sizes of buffers in bytes.
+        lifetimes (list<tuple>): closed interval (first, last) of steps \
+in which a buffer is alive.
+        alignment (int, default=:data:`ALIGNMENT`): alignment of offsets.
+
+    Returns:
+        (list<int>, int): offsets of buffers and the size of arena in bytes.
+    '''
+    offsets = [0] * len(sizes)
+    placed = []
+    total = 0
+    for i in sorted(range(len(sizes)), key=lambda i: -sizes[i]):
+        size = -(-sizes[i] // alignment) * alignment
+        first, last = lifetimes[i]
+        busy = sorted([(offsets[j], offsets[j] + size_j)
+                       for j, size_j in placed
+                       if lifetimes[j][0] <= last and lifetimes[j][1] >= first])
+
+        # find the smallest gap between busy regions.
+        best, best_gap, start = None, None, 0
+        for lo, hi in busy:
+            gap = lo - start
+            if gap >= size and (best_gap is None or gap < best_gap):
+                best, best_gap = start, gap
+            start = max(start, hi)
+        offsets[i] = start if best is None else best
+        placed.append((i, size))
+        total = max(total, offsets[i] + size)
+    return offsets, total
+
+
+class MemoryPlan(object):
+    '''
+    Buffers of a data flow with fixed shapes, all served from one arena.
+
+    Args:
+        specs (list<tuple|None>): (shape, dtype) of each tensor, \
+None if a tensor is not served by the arena.
+        lifetimes (list<tuple>): closed interval (first, last) \
+of steps in which a tensor is alive.
+
+    Attributes:
+        arena (1darray<uint8>): the memory block.
+        buffers (list<ndarray|None>): arrays in 'F' order viewing arena, \
+None for tensors not served.
+    '''
+
+    def __init__(self, specs, lifetimes):
+        served = [i for i, spec in enumerate(specs) if spec is not None]
+        sizes = [int(np.prod(specs[i][0])) * np.dtype(specs[i][1]).itemsize
+                 for i in served]
+        offsets, total = assign_offsets(
+            sizes, [lifetimes[i] for i in served])
+        self.arena = np.empty(total + ALIGNMENT, dtype='uint8')
+        # align the start of arena.
+        base = -self.arena.ctypes.data % ALIGNMENT
+
+        self.buffers = [None] * len(specs)
+        for i, offset in zip(served, offsets):
+            shape, dtype = specs[i]
+            self.buffers[i] = np.ndarray(shape, dtype=dtype, buffer=self.arena,
+                                         offset=base + offset, order='F')
+
+    def __repr__(self):
+        return '<%s>: %d buffers in %d bytes' % (
+            self.__class__.__name__, self.num_buffers, self.arena.size)
+
+    @property
+    def num_buffers(self):
+        '''int: number of tensors served.'''
+        return sum([buf is not None for buf in self.buffers])
+
+
+def _flow_spec(x, y):
+    '''(shape, dtype, shares memory with x) of a tensor y in data flow.'''
+    if isinstance(y, list) or not isinstance(y, np.ndarray):
+        return None
+    return y.shape, y.dtype.name, np.may_share_memory(x, y)
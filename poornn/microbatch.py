@@ -0,0 +1,143 @@
+'''
+Micro-batching, stream a batch through a network chunk by chunk.
+'''
+
+import numpy as np
+
+from .functions import Mean, Sum, BatchNorm
+
+__all__ = ['accumulate_gradients']
+
+
+def accumulate_gradients(net, x, chunk_size, dy=np.array(1), var_dict=None,
+                         do_xgrad=False):
+    '''
+    Forward and backward a batch in chunks of `chunk_size` samples \
+along axis 0, accumulating gradients of variables into one vector, \
+only activations of one chunk are alive at a time.
+    The result equals a forward-backward run on the whole batch,
+
+        * a last layer of :class:`Mean` or :class:`Sum` over axis 0 \
+reduces over the whole batch, outputs and gradients of chunks \
+are weighted accordingly.
+        * statistics of :class:`BatchNorm` layers over axis 0 are \
+taken over the whole batch in extra forward passes, and kept fixed \
+while chunks are streamed.
+
+    Args:
+        net (:class:`ANN`): the network.
+        x (ndarray): input in 'F' order, with samples along axis 0.
+        chunk_size (int): number of samples in a chunk.
+        dy (ndarray, default=np.array(1)): gradient of output defined as \
+:math:`\partial J/\partial y`.
+        var_dict (dict|None, default=None): runtime variables, \
+arrays with the batch size as the first dimension are split into chunks.
+        do_xgrad (bool, default=False): return the gradient of input if True.
+
+    Returns:
+        (ndarray, 1darray, ndarray|None): output, gradients of variables \
+(in :attr:`flat_gradients` if flattened) and gradient of input \
+(None if not `do_xgrad`).
+    '''
+    if var_dict is None:
+        var_dict = {}
+    num_batch = x.shape[0]
+    reduction, norms = _batch_layers(net)
+    chunks = [slice(start, min(start + chunk_size, num_batch))
+              for start in range(0, num_batch, chunk_size)]
+
+    frozen = []
+    try:
+        for k in norms:
+            _freeze_norm(net, k, x, chunks, var_dict)
+            frozen.append(k)
+        ys, y, dv, dxs = [], None, None, []
+        for chunk in chunks:
+            net.set_runtime_vars(_chunk_vars(var_dict, chunk, num_batch))
+            xc = np.asfortranarray(x[chunk])
+            cache = {}
+            yc = net.forward(xc, data_cache=cache)
+            if reduction is None:
+                ys.append(yc)
+                dyc = np.asfortranarray(dy[chunk])
+            else:
+                weight = 1. if reduction is Sum else\
+                    (chunk.stop - chunk.start) / float(num_batch)
+                y = yc * weight if y is None else y + yc * weight
+                dyc = dy * weight
+            dvc, dxc = net.backward((xc, yc), dyc, data_cache=cache)
+            if dv is None:
+                dv = np.array(dvc, copy=True)
+            else:
+                dv += dvc
+            if do_xgrad:
+                dxs.append(dxc)
+    finally:
+        for k in frozen:
+            net.layers[k].axis = 0
+        if var_dict:
+            # runtime variables of the whole batch, not of the last chunk.
+            net.set_runtime_vars(var_dict)
+
+    if reduction is None:
+        y = np.concatenate(ys, axis=0)
+    if net.flat_gradients is not None:
+        net.flat_gradients[:] = dv
+        dv = net.flat_gradients
+    dx = np.asfortranarray(np.concatenate(dxs, axis=0)) if do_xgrad else None
+    return y, dv, dx
+
+
+def _batch_layers(net):
+    '''
+    Find layers acting on the batch axis.
+
+    Returns:
+        (class|None, list<int>): the class of the last layer if it \
+reduces axis 0 (:class:`Mean` or :class:`Sum`), \
+and indices of :class:`BatchNorm` layers over axis 0.
+    '''
+    reduction, norms = None, []
+    for i, layer in enumerate(net.layers):
+        if getattr(layer, 'axis', None) != 0:
+            continue
+        if type(layer) in (Mean, Sum) and i == net.num_layers - 1:
+            reduction = type(layer)
+        elif isinstance(layer, BatchNorm):
+            norms.append(i)
+        else:
+            raise ValueError('%s mixes samples along axis 0, \
+can not be micro-batched!' % layer)
+    return reduction, norms
+
+
+def _chunk_vars(var_dict, chunk, num_batch):
+    '''runtime variables of a chunk.'''
+    return dict([(k, v[chunk] if isinstance(v, np.ndarray) and v.ndim > 0
+                  and v.shape[0] == num_batch else v)
+                 for k, v in var_dict.items()])
+
+
+def _freeze_norm(net, k, x, chunks, var_dict):
+    '''
+    Set mean and variance of :class:`BatchNorm` layer `k` to statistics \
+of the whole batch, merged from chunks, and stop updating them.
+    '''
+    num, mean, m2 = 0, 0, 0
+    for chunk in chunks:
+        net.set_runtime_vars(_chunk_vars(var_dict, chunk, x.shape[0]))
+        h = np.asfortranarray(x[chunk])
+        for layer in net.layers[:k]:
+            h = layer.forward(h)
+        n = h.shape[0]
+        mean_c = h.mean(axis=0, keepdims=True)
+        m2_c = (np.abs(h - mean_c)**2).sum(axis=0, keepdims=True)
+
+        # merge statistics of two sets (Chan et al.).
+        delta = mean_c - mean
+        mean = mean + delta * (n / float(num + n))
+        m2 = m2 + m2_c + np.abs(delta)**2 * (num * n / float(num + n))
+        num += n
+    layer = net.layers[k]
+    layer.mean, layer.variance = mean, m2 / num
+    layer.axis = None
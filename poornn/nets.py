@@ -5,23 +5,66 @@ ABC of neural network.
 import numpy as np
 import pdb
 import numbers
+import heapq
+from multiprocessing.pool import ThreadPool
 
 from .checks import check_shape_forward, check_shape_backward,\
     check_shape_match
-from .core import Container, Function
+from .core import Container, Function, Monitor
 from . import functions
 from .spconv import SPConv
 from .linears import Linear
-from .utils import _connect, dtype2token, dtype_r2c, dtype_c2r, fsign
+from .utils import _connect, dtype2token, dtype_r2c, dtype_c2r, fsign,\
+    tuple_prod
+from .memory import MemoryPlan, _flow_spec
+from .execution import ExecutionPlan
+from .fusion import fuse_chain
+from .microbatch import accumulate_gradients
+from .threads import get_num_threads, _set_kernel_threads
 
-__all__ = ['ANN', 'ParallelNN', 'JointComplex', 'KeepSignFunc']
+__all__ = ['ANN', 'Graph', 'ParallelNN', 'JointComplex', 'KeepSignFunc']
 
 
 class ANN(Container):
     '''
     Sequential Artificial Neural network.
+
+    Args:
+        plan_memory (bool, default=False): serve outputs and gradients \
+of layers from a reusable arena if True, see :meth:`forward`.
+        checkpoints (int|list|None, default=None): keep only outputs of \
+these layers (labels or indices) or of every k-th layer if an int \
+in a forward run with `data_cache`, other outputs are recomputed \
+segment by segment in :meth:`backward`.
+        auto_inplace (bool, default=True): let buffered elementwise \
+layers write into their inputs (and input gradients) when \
+no later step reads them, see :meth:`forward`.
+
+    Attributes:
+        plan_memory (bool): serve outputs and gradients \
+of layers from a reusable arena if True.
+        checkpoints (int|list|None): layers to keep outputs \
+in a forward run with `data_cache`, None to keep all.
+        auto_inplace (bool): let buffered elementwise \
+layers write into their inputs when it is safe.
     '''
 
+    def __init__(self, layers=None, labels=None, plan_memory=False,
+                 checkpoints=None, auto_inplace=True):
+        super(ANN, self).__init__(layers=layers, labels=labels)
+        self.plan_memory = plan_memory
+        self.checkpoints = checkpoints
+        self.auto_inplace = auto_inplace
+        self._memory_plans = {}
+        self._flow_records = {}
+
+    def __getstate__(self):
+        # memory plans hold arenas, they are rebuilt on demand.
+        state = dict(self.__dict__)
+        state['_memory_plans'] = {}
+        state['_flow_records'] = {}
+        return state
+
     def __graphviz__(self, g, father=None):
         node = 'cluster-%s' % id(self)
         label = '<%s<br align="left"/><font color="#225566">\
@@ -94,23 +137,103 @@ because backward need :data:`data_cache`.
             :data:`'%d-ys'%id(self)` is used as the key to store \
 run-time output of layers in this network.
             :data:`data_cache['%d-ys'%id(self)]` is a list with contents \
-outputs in each layers generate in this forward run.
+outputs in each layers generate in this forward run, \
+with `None` for outputs dropped by :attr:`checkpoints`.
+
+            If :attr:`plan_memory` is True, the first run (or the first \
+forward-backward step if :data:`data_cache` is provided) for an input \
+shape records the data flow, later runs let buffered layers \
+write into views of one arena, with buffers shared among \
+tensors whose lifetimes do not overlap. These outputs are overwritten \
+by gradients in :meth:`backward` and by the next run, \
+copy them if they are needed longer. It is not used in training \
+if :attr:`checkpoints` is set.
+
+            If :attr:`auto_inplace` is True, a buffered elementwise layer \
+(e.g. :class:`ReLU`) writes into its input if neither :meth:`backward` \
+(see :attr:`Layer.__backward_needs__`) nor :attr:`checkpoints` read it, \
+and it does not share memory with `x` or with data kept by \
+:class:`Monitor` layers. Such entries of \
+:data:`data_cache['%d-ys'%id(self)]` hold outputs of the next layer.
 
         Returns:
             list: output in each layer.
         '''
-        ys = []
-        for layer in self.layers:
+        kept = None if data_cache is None else self._kept_outputs()
+        plan, record = None, False
+        if self.plan_memory and kept is None:
+            key = self._plan_key(x, data_cache is not None)
+            plan = self._memory_plans.get(key)
+            record = plan is None and key not in self._flow_records
+        ys, specs = [], []
+        # tensors read later, which should not be overwritten.
+        needed = [x]
+        for i, layer in enumerate(self.layers):
+            if data_cache is not None and 'x' in layer.__backward_needs__:
+                needed.append(x)
+            if plan is not None and plan.buffers[i] is not None:
+                kwargs = {'out': plan.buffers[i]}
+            elif self.auto_inplace and _overwritable(layer, x, layer.otype,
+                                                     needed):
+                kwargs = {'out': x}
+            else:
+                kwargs = {}
+            # layers in a dropped segment collect datas in recomputation.
+            cache = data_cache if kept is None or i in kept else None
             if do_shape_check:
-                x = check_shape_forward(layer.forward)(
-                    layer, x, data_cache=data_cache)
+                y = check_shape_forward(layer.forward)(
+                    layer, x, data_cache=cache, **kwargs)
             else:
-                x = layer.forward(x, data_cache=data_cache)
-            ys.append(x)
-            if isinstance(x, list):
-                x = x[-1]
+                y = layer.forward(x, data_cache=cache, **kwargs)
+            if record:
+                specs.append(_flow_spec(x, y))
+            ys.append(y if kept is None or i in kept else None)
+            # monitors keep their inputs, which are also their outputs.
+            if isinstance(layer, Monitor) or data_cache is not None and (
+                    'y' in layer.__backward_needs__ or
+                    kept is not None and i in kept):
+                needed.extend(y if isinstance(y, list) else [y])
+            x = y[-1] if isinstance(y, list) else y
+        if record:
+            if data_cache is None:
+                self._memory_plans[key] = self._build_memory_plan(specs)
+            else:
+                self._flow_records[key] = specs
         if data_cache is not None:
             data_cache['%d-ys' % id(self)] = ys
+            if kept is not None:
+                # recomputation should see the same runtime variables.
+                data_cache['%d-runtimes' % id(self)] = [
+                    _runtime_vars(layer) for layer in self.layers]
+        return x
+
+    def predict(self, x):
+        '''
+        Forward run for inference, only the current activation is kept alive.
+
+            * :class:`DropOut` and :class:`Monitor` layers are skipped.
+            * buffered elementwise layers (e.g. :class:`ReLU`) write into \
+their inputs if these inputs are produced in this run.
+
+        Args:
+            x (ndarray): input in 'F' order, it is not changed.
+
+        Returns:
+            ndarray: output.
+        '''
+        x0 = x
+        for layer in self.layers:
+            if isinstance(layer, (Monitor, functions.DropOut)):
+                continue
+            if isinstance(layer, ANN):
+                y = layer.predict(x)
+            elif layer.__buffered__ and layer.__elementwise__ and\
+                    x.dtype == layer.otype and x.flags.f_contiguous and\
+                    not np.may_share_memory(x, x0):
+                y = layer.forward(x, out=x)
+            else:
+                y = layer.forward(x)
+            x = y[-1] if isinstance(y, list) else y
         return x
 
     def backward(self, xy, dy=np.array(1), data_cache=None,
@@ -136,16 +259,225 @@ outputs in each layers generate in this forward run.
             raise TypeError('Can not find cached ys! get %s' % data_cache)
         else:
             xy = [x] + data_cache[key]
+        checkpointed = any([yi is None for yi in xy])
+        plan, record = None, False
+        if self.plan_memory and not checkpointed:
+            pkey = self._plan_key(x, True)
+            plan = self._memory_plans.get(pkey)
+            record = plan is None and pkey in self._flow_records
+        num_layers, specs = len(xy) - 1, []
+        # gradients kept by monitors should not be overwritten.
+        dy0, monitored = dy, []
         for i in range(1, len(xy)):
+            if xy[-i - 1] is None:
+                self._recompute(xy, num_layers - i, data_cache,
+                                do_shape_check)
             x, y = xy[-i - 1], xy[-i]
+            if checkpointed:
+                xy[-i] = None
             layer = self.layers[-i]
+            buf = None if plan is None else plan.buffers[2 * num_layers - i]
+            if buf is not None:
+                kwargs = {'out': buf}
+            elif self.auto_inplace and _overwritable(
+                    layer, dy, layer.itype,
+                    _flatten_flow([dy0, x, y] + xy[:-i] + monitored)):
+                kwargs = {'out': dy}
+            else:
+                kwargs = {}
             if do_shape_check:
-                dv, dy = check_shape_backward(layer.backward)(
-                    layer, [x, y], dy, data_cache=data_cache)
+                dv, dx = check_shape_backward(layer.backward)(
+                    layer, [x, y], dy, data_cache=data_cache, **kwargs)
             else:
-                dv, dy = layer.backward([x, y], dy, data_cache=data_cache)
+                dv, dx = layer.backward([x, y], dy, data_cache=data_cache,
+                                        **kwargs)
+            if record:
+                specs.append(_flow_spec(dy, dx))
+            if isinstance(layer, Monitor):
+                monitored.append(dx)
             dvs.append(dv)
-        return np.concatenate(dvs[::-1]), dy
+            dy = dx
+        if record:
+            self._memory_plans[pkey] = self._build_memory_plan(
+                self._flow_records.pop(pkey), specs[::-1])
+        return self._gather_gradients(dvs[::-1]), dy
+
+    def fuse(self):
+        '''
+        Replace chains of layers by fused layers inplace, \
+see :func:`poornn.fusion.fuse_chain` for supported chains. \
+Chains with labeled layers other than the head are kept, \
+labels of heads move to fused layers.
+
+        Returns:
+            int: number of fused layers.
+        '''
+        labeled = [id(layer) for layer in self.__layer_dict__.values()]
+        layers, num_fused, i = [], 0, 0
+        while i < self.num_layers:
+            res = fuse_chain(self.layers[i:])
+            if res is not None and all([id(layer) not in labeled for layer
+                                        in self.layers[i + 1:i + res[1]]]):
+                fused, num = res
+                for label, layer in self.__layer_dict__.items():
+                    if layer is self.layers[i]:
+                        self.__layer_dict__[label] = fused
+                layers.append(fused)
+                num_fused += 1
+                i += num
+            else:
+                layers.append(self.layers[i])
+                i += 1
+        self.layers[:] = layers
+        self.clear_memory_plans()
+        return num_fused
+
+    def compile(self, input_shape, itype=None):
+        '''
+        Resolve shapes, Fortran entries and buffers for a fixed input \
+shape and data type.
+
+        Args:
+            input_shape (tuple): concrete input shape.
+            itype (str, default=:attr:`itype`): input data type.
+
+        Returns:
+            :class:`ExecutionPlan`: plan with :meth:`ExecutionPlan.run` \
+and :meth:`ExecutionPlan.grad`.
+        '''
+        if itype is None:
+            itype = self.itype
+        return ExecutionPlan(self, input_shape, itype)
+
+    def accumulate_gradients(self, x, chunk_size, dy=np.array(1),
+                             var_dict=None, do_xgrad=False):
+        '''
+        Forward and backward a batch in chunks along axis 0, \
+see :func:`poornn.microbatch.accumulate_gradients`.
+
+        Args:
+            x (ndarray): input in 'F' order, with samples along axis 0.
+            chunk_size (int): number of samples in a chunk.
+            dy (ndarray, default=np.array(1)): gradient of output.
+            var_dict (dict|None, default=None): runtime variables.
+            do_xgrad (bool, default=False): return the gradient of \
+input if True.
+
+        Returns:
+            (ndarray, 1darray, ndarray|None): output, gradients of \
+variables and gradient of input.
+        '''
+        return accumulate_gradients(self, x, chunk_size, dy=dy,
+                                    var_dict=var_dict, do_xgrad=do_xgrad)
+
+    def _kept_outputs(self):
+        '''
+        Indices of layers whose outputs are kept by :attr:`checkpoints`, \
+None if all outputs are kept.
+        '''
+        if self.checkpoints is None:
+            return None
+        num_layers = self.num_layers
+        if isinstance(self.checkpoints, numbers.Integral):
+            kept = set(range(self.checkpoints - 1, num_layers,
+                             self.checkpoints))
+        else:
+            kept = set()
+            for name in self.checkpoints:
+                layer = self[name]
+                kept.update([i for i, li in enumerate(self.layers)
+                             if li is layer])
+        # the output of this network is always kept.
+        kept.add(num_layers - 1)
+        return kept
+
+    def _recompute(self, xy, end, data_cache, do_shape_check=False):
+        '''
+        Recompute dropped outputs in the segment ended before layer `end`, \
+from the nearest kept output.
+
+        Args:
+            xy (list): input and outputs of layers, `None` for dropped ones.
+            end (int): index of the layer whose input is needed.
+            data_cache (dict): a dict with collected datas.
+            do_shape_check (bool): check shape of data flow if True.
+        '''
+        start = end
+        while xy[start] is None:
+            start -= 1
+        runtimes = data_cache['%d-runtimes' % id(self)]
+        for i in range(start, end):
+            layer, x = self.layers[i], xy[i]
+            if isinstance(x, list):
+                x = x[-1]
+            if isinstance(layer, Monitor):
+                xy[i + 1] = x
+                continue
+            current = _runtime_vars(layer)
+            changed = any([current[k] is not v
+                           for k, v in runtimes[i].items()])
+            if changed:
+                layer.set_runtime_vars(runtimes[i])
+            if do_shape_check:
+                y = check_shape_forward(layer.forward)(
+                    layer, x, data_cache=data_cache)
+            else:
+                y = layer.forward(x, data_cache=data_cache)
+            if changed:
+                layer.set_runtime_vars(current)
+            xy[i + 1] = y
+
+    def _build_memory_plan(self, fspecs, bspecs=None):
+        '''
+        Build the memory plan from recorded data flow, \
+in a training step, forward of layer i takes step i and backward of \
+layer i takes step 2n-1-i, outputs of this network live to the end.
+
+        Args:
+            fspecs (list): recorded outputs of layers.
+            bspecs (list|None, default=None): recorded input gradients \
+of layers, None if no backward follows.
+
+        Returns:
+            MemoryPlan: the plan.
+        '''
+        n = len(fspecs)
+        flows, ends = [], []
+        for i, spec in enumerate(fspecs):
+            flows.append((spec, i - 1 if i > 0 else None, i))
+            ends.append(i + 1 if bspecs is None else 2 * n - 1 - i)
+        for i, spec in enumerate(bspecs or []):
+            flows.append((spec, n + i + 1 if i < n - 1 else None,
+                          2 * n - 1 - i))
+            ends.append(2 * n - i)
+
+        # tensors sharing memory with their inputs extend \
+        # the lifetime of the tensor that owns the memory.
+        roots = [None] * len(flows)
+        specs = [None] * len(flows)
+        lifetimes = [[first, last] for (_, _, first), last in zip(flows, ends)]
+        for i in sorted(range(len(flows)), key=lambda i: flows[i][2]):
+            spec, src = flows[i][:2]
+            if spec is None:
+                continue
+            elif not spec[2]:
+                roots[i] = i
+                if self.layers[i % n].__buffered__:
+                    specs[i] = spec[:2]
+            elif src is not None and roots[src] is not None:
+                roots[i] = roots[src]
+                lifetimes[roots[i]][1] = max(lifetimes[roots[i]][1], ends[i])
+        return MemoryPlan(specs, lifetimes)
+
+    def clear_memory_plans(self):
+        '''Release arenas and recorded data flows of :attr:`plan_memory`.'''
+        self._memory_plans.clear()
+        self._flow_records.clear()
+
+    def _plan_key(self, x, cached):
+        '''key of memory plans, plans are dropped if layers change.'''
+        return (x.shape, x.dtype.name, cached,
+                tuple([id(layer) for layer in self.layers]))
 
     def add_layer(self, cls, label=None, **kwargs):
         '''
@@ -181,11 +513,57 @@ before using @add_layer.')
         obj = cls(input_shape=input_shape, itype=itype, **
                   kwargs) if not issubclass(cls, Container) else cls(**kwargs)
         self.layers.append(obj)
+        self.clear_memory_plans()
         if label is not None:
             self.__layer_dict__[label] = obj
         return obj
 
 
+def _overwritable(layer, x, dtype, needed):
+    '''
+    True if buffered elementwise `layer` can write its output of \
+`dtype` into `x`, which shares no memory with `needed` tensors.
+    '''
+    return layer.__buffered__ and layer.__elementwise__ and\
+        isinstance(x, np.ndarray) and x.dtype == dtype and\
+        x.flags.f_contiguous and x.flags.writeable and\
+        not any([np.may_share_memory(x, t) for t in needed])
+
+
+def _flatten_flow(xy):
+    '''arrays in a list of data flow, which may contain lists or None.'''
+    res = []
+    for item in xy:
+        if isinstance(item, list):
+            res.extend(item)
+        elif item is not None:
+            res.append(item)
+    return res
+
+
+def _output_shape(layer, x):
+    '''
+    Shape of output of `layer` for input `x`, the batch dimension \
+(-1) is infered from the size of `x`, None if it can not be infered.
+    '''
+    input_shape, output_shape = layer.input_shape, layer.output_shape
+    if not isinstance(x, np.ndarray) or output_shape is None or\
+            list(input_shape).count(-1) != list(output_shape).count(-1) or\
+            list(output_shape).count(-1) > 1:
+        return None
+    if -1 not in output_shape:
+        return tuple(output_shape)
+    num_batch = x.size // tuple_prod([d for d in input_shape if d != -1])
+    return tuple([num_batch if d == -1 else d for d in output_shape])
+
+
+def _runtime_vars(layer):
+    '''runtime variables of a layer, containers manage their own.'''
+    if isinstance(layer, Container):
+        return {}
+    return dict([(k, getattr(layer, k)) for k in layer.tags['runtimes']])
+
+
 class ParallelNN(Container):
     '''
     Parallel Artificial Neural network.
@@ -193,14 +571,35 @@ class ParallelNN(Container):
     Args:
         axis (int, default=0): specify the additional axis \
 on which outputs are packed.
+        num_threads (int, default=1): number of threads to run \
+branches concurrently, Fortran kernels release the GIL.
 
     Attributes:
         axis (int): specify the additional axis on which outputs are packed.
+        num_threads (int): number of threads to run branches.
     '''
 
-    def __init__(self, axis=0, layers=None, labels=None):
+    def __init__(self, axis=0, layers=None, labels=None, num_threads=1):
         super(ParallelNN, self).__init__(layers=layers, labels=labels)
         self.axis = axis
+        self.num_threads = num_threads
+        self._pool, self._pool_size = None, 0
+
+    def __getstate__(self):
+        state = dict(self.__dict__)
+        state['_pool'], state['_pool_size'] = None, 0
+        return state
+
+    def __del__(self):
+        self.close()
+
+    def close(self):
+        '''Stop the pool of threads, a new one is made when needed.'''
+        pool, self._pool = getattr(self, '_pool', None), None
+        self._pool_size = 0
+        if pool is not None:
+            pool.terminate()
+            pool.join()
 
     def __graphviz__(self, g, father=None):
         node = 'cluster-%s' % id(self)
@@ -258,29 +657,56 @@ dtype = %s</font><br align="l"/>>' % (
             la.input_shape = input_shape
             la.output_shape = output_shape
 
-    def forward(self, x, do_shape_check=False, **kwargs):
+    def forward(self, x, data_cache=None, do_shape_check=False, **kwargs):
         '''
         Feed input, it will generate a new axis,\
 and storge the outputs of layers parallel along this axis.
 
         Args:
             x (ndarray): input in 'F' order.
+            data_cache (dict|None, default=None): a dict used to collect datas.
             do_shape_check (bool): check shape of data flow if True.
 
+        Note:
+            Outputs of branches are written into slices of the output, \
+buffered layers write there directly if the slice is in 'F' order.
+
         Returns:
             ndarray: output,
         '''
-        ys = []
-        for layer in self.layers:
+        shape = _output_shape(self.layers[0], x)
+        y = None if shape is None else np.empty(
+            shape[:self.axis] + (self.num_layers,) + shape[self.axis:],
+            dtype=self.otype, order='F')
+
+        def run(i):
+            layer = self.layers[i]
+            slot = None if y is None else y[(slice(None),) * self.axis + (i,)]
+            kwargs = {}
+            if slot is not None and layer.__buffered__ and\
+                    slot.flags.f_contiguous and slot.dtype == layer.otype:
+                kwargs['out'] = slot
             if do_shape_check:
-                y = check_shape_forward(layer.forward)(layer, x)
+                yi = check_shape_forward(layer.forward)(
+                    layer, x, data_cache=data_cache, **kwargs)
             else:
-                y = layer.forward(x)
-            ys.append(y[(slice(None),) * self.axis + (None,)])
-        y = np.concatenate(ys, axis=self.axis)
+                yi = layer.forward(x, data_cache=data_cache, **kwargs)
+            if slot is not None and np.shape(yi) == slot.shape:
+                if not np.may_share_memory(yi, slot):
+                    slot[...] = yi
+                return None
+            return yi
+        ys = self._map(run)
+        if any([yi is not None for yi in ys]):
+            # shapes of outputs are not the expected ones.
+            ys = [y.take(i, axis=self.axis) if yi is None else yi
+                  for i, yi in enumerate(ys)]
+            y = np.concatenate([yi[(slice(None),) * self.axis + (None,)]
+                                for yi in ys], axis=self.axis)
         return y
 
-    def backward(self, xy, dy=np.array(1), do_shape_check=False, **kwargs):
+    def backward(self, xy, dy=np.array(1), data_cache=None,
+                 do_shape_check=False, **kwargs):
         '''
         Compute gradients.
 
@@ -288,24 +714,46 @@ and storge the outputs of layers parallel along this axis.
             xy (tuple): input and output
             dy (ndarray): gradient of output defined as \
 :math:`\partial J/\partial y`.
+            data_cache (dict|None, default=None): a dict with collected datas.
             do_shape_check (bool): check shape of data flow if True.
 
         Returns:
             list: gradients for vairables in layers.
         '''
         x, y = xy
-        dvs = []
-        dx = 0
-        for i, layer in enumerate(self.layers):
+
+        def run(i):
+            layer = self.layers[i]
             yi, dyi = y.take(i, axis=self.axis), dy.take(i, axis=self.axis)
             if do_shape_check:
-                dv, dxi = check_shape_backward(
-                    layer.backward)(layer, [x, yi], dyi)
-            else:
-                dv, dxi = layer.backward([x, yi], dyi)
-            dvs.append(dv)
-            dx += dxi
-        return np.concatenate(dvs), dx
+                return check_shape_backward(layer.backward)(
+                    layer, [x, yi], dyi, data_cache=data_cache)
+            return layer.backward([x, yi], dyi, data_cache=data_cache)
+        res = self._map(run)
+        dvs = [dv for dv, dxi in res]
+        return self._gather_gradients(dvs), _sum_flows([dxi for dv, dxi
+                                                        in res])
+
+    def _map(self, func):
+        '''
+        Apply `func` on indices of layers, with a pool of \
+:attr:`num_threads` threads if it is larger than 1.
+        '''
+        if self.num_threads <= 1 or self.num_layers < 2:
+            if self.num_threads <= 1:
+                self.close()
+            return [func(i) for i in range(self.num_layers)]
+        if self._pool is None or self._pool_size != self.num_threads:
+            self.close()
+            self._pool = ThreadPool(self.num_threads)
+            self._pool_size = self.num_threads
+        # OpenMP threads are set per thread, share those of the caller.
+        num_kernel_threads = max(1, get_num_threads() // self.num_threads)
+
+        def run(i):
+            _set_kernel_threads(num_kernel_threads)
+            return func(i)
+        return self._pool.map(run, range(self.num_layers))
 
     def add_layer(self, cls, **kwargs):
         '''
@@ -408,7 +856,11 @@ types, but get (%s, %s)' % (lr.itype, lr.otype))
         h, g = self.layers
         dvr, dxr = h.backward((x.real, y.real), dy.real, **kwargs)
         dvi, dxi = g.backward((x.imag, y.imag), dy.imag, **kwargs)
-        return np.concatenate([dvr, -dvi]), dxr + 1j * dxi
+        if self.flat_gradients is None:
+            return np.concatenate([dvr, -dvi]), dxr + 1j * dxi
+        dv = self._gather_gradients([dvr, dvi])
+        dv[h.num_variables:] *= -1
+        return dv, dxr + 1j * dxi
 
 
 class KeepSignFunc(Container):
@@ -484,5 +936,313 @@ dtype = %s)' % (l.itype, l.otype, l.dtype))
 
         dw0, dx0 = h.backward((absx, hy), sdy.real)
         # sdy.imag can be non-zeros.
-        return dw0, dx0 * sxc + hy / np.maximum(1e-15, absx)\
+        return self._gather_gradients([dw0]), dx0 * sxc + hy / np.maximum(1e-15, absx)\
             * sxc * 1j * sdy.imag
+
+
+class Graph(Container):
+    '''
+    Directed acyclic graph of layers, a layer takes the input of this \
+graph or outputs of other layers, multiple inputs are summed up. \
+The output of the last layer is the output of this graph.
+
+    Args:
+        inputs (list<list<int|str>|None>|None, default=None): \
+inputs of each layer, as indices (-1 for the input of this graph) \
+or labels of layers, None (or missing) for the previous layer.
+
+    Attributes:
+        inputs (list<list<int|str>|None>): inputs of each layer.
+
+    Note:
+        Layers are executed in topological order, only ancestors of \
+the last layer are executed, gradients of other layers are zeros. \
+Every layer needs at least one input, so that the input of this graph \
+is read by ancestors of the last layer.
+    '''
+
+    def __init__(self, layers=None, labels=None, inputs=None):
+        self.inputs = [] if inputs is None else list(inputs)
+        super(Graph, self).__init__(layers=layers, labels=labels)
+
+    def __graphviz__(self, g, father=None):
+        node = 'cluster-%s' % id(self)
+        label = '<%s<br align="left"/><font color="#225566">\
+dtype = %s</font><br align="l"/>>' % (
+            self.__class__.__name__, self.dtype)
+
+        # as a container, add contents
+        c = g.add_subgraph(name=node, shape='box', color='#CCEEAA',
+                           label=label, labeljust='l', penwidth="5pt")
+
+        order, sources = self._schedule()
+        nodes = {-1: None}
+        for i in order:
+            src = sources[i]
+            nodes[i] = self.layers[i].__graphviz__(c, father=nodes[src[0]])
+            for j in src[1:]:
+                if j >= 0:
+                    _connect(c, nodes[j], nodes[i],
+                             self.layers[j].output_shape,
+                             self.layers[j].otype)
+        _connect(g, father, c, self.input_shape, self.itype, pos='first')
+        return c
+
+    def __getitem__(self, name):
+        if isinstance(name, numbers.Number):
+            return self.layers[name]
+        elif isinstance(name, str) and name in self.__layer_dict__:
+            return self.__layer_dict__[name]
+        else:
+            raise KeyError('Get invalid key %s' % name)
+
+    @property
+    def input_shape(self):
+        layer = self._input_layer()
+        return None if layer is None else layer.input_shape
+
+    @property
+    def output_shape(self):
+        if self.num_layers == 0:
+            return None
+        return self.layers[-1].output_shape
+
+    @property
+    def itype(self):
+        layer = self._input_layer()
+        return None if layer is None else layer.itype
+
+    @property
+    def otype(self):
+        if self.num_layers == 0:
+            return None
+        return self.layers[-1].otype
+
+    def check_connections(self):
+        order, sources = self._schedule()
+        for i in order:
+            layer = self.layers[i]
+            for j in sources[i]:
+                src = self._input_layer() if j < 0 else self.layers[j]
+                shape = src.input_shape if j < 0 else src.output_shape
+                check_shape_match(layer.input_shape, shape)
+
+    def forward(self, x, data_cache=None, do_shape_check=False, **kwargs):
+        '''
+        Feed input to this graph.
+
+        Args:
+            x (ndarray): input in 'F' order.
+            data_cache (dict|None, default=None): a dict used to collect datas.
+            do_shape_check (bool): check shape of data flow if True.
+
+        Note:
+            :data:`data_cache['%d-ys'%id(self)]` and \
+:data:`data_cache['%d-xs'%id(self)]` store outputs of layers, \
+and summed inputs of layers with multiple inputs (None for others).
+
+            Without :data:`data_cache`, an output is released \
+once its last consumer is executed.
+
+        Returns:
+            ndarray: output of the last layer.
+        '''
+        order, sources = self._schedule()
+        ys, xs = [None] * self.num_layers, [None] * self.num_layers
+        refs = {}
+        for i in order:
+            for j in sources[i]:
+                refs[j] = refs.get(j, 0) + 1
+        for i in order:
+            layer = self.layers[i]
+            xi = _sum_flows([x if j < 0 else ys[j] for j in sources[i]])
+            if len(sources[i]) > 1:
+                xs[i] = xi
+            if do_shape_check:
+                ys[i] = check_shape_forward(layer.forward)(
+                    layer, xi, data_cache=data_cache)
+            else:
+                ys[i] = layer.forward(xi, data_cache=data_cache)
+            if data_cache is None:
+                for j in sources[i]:
+                    refs[j] -= 1
+                    if refs[j] == 0 and j >= 0:
+                        ys[j] = None
+        if data_cache is not None:
+            data_cache['%d-ys' % id(self)] = ys
+            data_cache['%d-xs' % id(self)] = xs
+        return ys[-1]
+
+    def backward(self, xy, dy=np.array(1), data_cache=None,
+                 do_shape_check=False):
+        '''
+        Compute gradients in reversed topological order, \
+gradients of layers with multiple consumers are accumulated inplace, \
+and released once consumed.
+
+        Args:
+            xy (tuple): input and output
+            dy (ndarray): gradient of output defined as \
+:math:`\partial J/\partial y`.
+            data_cache (dict): a dict with collected datas.
+            do_shape_check (bool): check shape of data flow if True.
+
+        Returns:
+            list: gradients for vairables in layers.
+        '''
+        x, y = xy
+        key = '%d-ys' % id(self)
+        if data_cache is None or key not in data_cache:
+            raise TypeError('Can not find cached ys! get %s' % data_cache)
+        ys, xs = data_cache[key], data_cache['%d-xs' % id(self)]
+        order, sources = self._schedule()
+        dvs = [np.zeros(layer.num_variables, dtype=layer.dtype)
+               for layer in self.layers]
+        dys, owned = {self.num_layers - 1: dy}, set()
+        for i in order[::-1]:
+            layer, src = self.layers[i], sources[i]
+            xi = xs[i] if len(src) > 1 else (x if src[0] < 0 else ys[src[0]])
+            dyi = dys.pop(i)
+            owned.discard(i)
+            if do_shape_check:
+                dvs[i], dx = check_shape_backward(layer.backward)(
+                    layer, [xi, ys[i]], dyi, data_cache=data_cache)
+            else:
+                dvs[i], dx = layer.backward([xi, ys[i]], dyi,
+                                            data_cache=data_cache)
+            for j in src:
+                _accumulate(dys, owned, j, dx)
+        return self._gather_gradients(dvs), dys[-1]
+
+    def add_layer(self, cls, label=None, inputs=None, **kwargs):
+        '''
+        Add a new layer, comparing with :meth:`self.layers.append`
+
+            * :attr:`input_shape` of new layer is infered from \
+:attr:`output_shape` of its first input.
+            * :attr:`itype` of new layer is infered from \
+:attr:`otype` of its first input.
+
+        Args:
+            cls (class): create a layer instance, take input_shape and \
+itype as first and second parameters.
+            label (str|None, default=None): label to index this layer, \
+leave `None` if indexing is not needed.
+            inputs (list<int|str>|None, default=None): indices \
+(-1 for the input of this graph) or labels of input layers, \
+None for the last layer.
+            **kwargs: keyword arguments used by :meth:`cls.__init__`, \
+excluding :attr:`input_shape` and :attr:`itype`.
+
+        Returns:
+            Layer: newly generated object.
+        '''
+        if len(self.layers) == 0:
+            raise AttributeError(
+                'Please make sure this network is non-empty \
+before using @add_layer.')
+        inputs = [self.num_layers - 1] if inputs is None else\
+            [self._index(name) for name in inputs]
+        if not inputs:
+            raise ValueError('A layer needs at least one input!')
+        if inputs[0] < 0:
+            input_shape, itype = self.input_shape, self.itype
+        else:
+            input_shape, itype = self.layers[inputs[0]].output_shape,\
+                self.layers[inputs[0]].otype
+        obj = cls(input_shape=input_shape, itype=itype, **
+                  kwargs) if not issubclass(cls, Container) else cls(**kwargs)
+        self.inputs.extend([None] * (self.num_layers - len(self.inputs)))
+        self.layers.append(obj)
+        self.inputs.append(inputs)
+        if label is not None:
+            self.__layer_dict__[label] = obj
+        return obj
+
+    def _index(self, name):
+        '''index of a layer given by index or label, -1 for the input.'''
+        if isinstance(name, numbers.Integral):
+            if name < -1 or name >= self.num_layers:
+                raise ValueError('Layer index %s out of range!' % name)
+            return name
+        layer = self[name]
+        for i, li in enumerate(self.layers):
+            if li is layer:
+                return i
+
+    def _sources(self, i):
+        '''indices of input layers of layer `i`.'''
+        if i < len(self.inputs) and self.inputs[i] is not None:
+            return [self._index(name) for name in self.inputs[i]]
+        return [i - 1]
+
+    def _input_layer(self):
+        '''the first layer taking the input of this graph.'''
+        for i in range(self.num_layers):
+            if -1 in self._sources(i):
+                return self.layers[i]
+        return None
+
+    def _schedule(self):
+        '''
+        Topological order of ancestors of the last layer.
+
+        Returns:
+            (list<int>, list<list<int>>): the order, and inputs of all layers.
+        '''
+        num_layers = self.num_layers
+        sources = [self._sources(i) for i in range(num_layers)]
+        ancestors, stack = set(), [num_layers - 1] if num_layers else []
+        while stack:
+            i = stack.pop()
+            if i >= 0 and i not in ancestors:
+                if not sources[i]:
+                    raise ValueError('Layer %s of %s has no input!' % (
+                        i, self.__class__.__name__))
+                ancestors.add(i)
+                stack.extend(sources[i])
+
+        # Kahn's algorithm, layers with smaller indices go first.
+        num_deps, consumers = {}, {}
+        for i in ancestors:
+            num_deps[i] = 0
+            for j in sources[i]:
+                if j >= 0:
+                    num_deps[i] += 1
+                    consumers.setdefault(j, []).append(i)
+        ready = [i for i in ancestors if num_deps[i] == 0]
+        heapq.heapify(ready)
+        order = []
+        while ready:
+            i = heapq.heappop(ready)
+            order.append(i)
+            for k in consumers.get(i, []):
+                num_deps[k] -= 1
+                if num_deps[k] == 0:
+                    heapq.heappush(ready, k)
+        if len(order) != len(ancestors):
+            raise ValueError('Connections of %s contain a cycle!' %
+                             self.__class__.__name__)
+        return order, sources
+
+
+def _sum_flows(xs):
+    '''sum of input tensors, the tensor itself if only one.'''
+    res = xs[0]
+    for x in xs[1:]:
+        res = res + x
+    return res
+
+
+def _accumulate(grads, owned, j, dx):
+    '''
+    Add gradient `dx` to `grads[j]`, inplace if `grads[j]` is \
+made here (listed in `owned`).
+    '''
+    if j not in grads:
+        grads[j] = dx
+    elif j in owned and np.result_type(grads[j], dx) == grads[j].dtype:
+        grads[j] += dx
+    else:
+        grads[j] = grads[j] + dx
+        owned.add(j)
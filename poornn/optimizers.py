@@ -0,0 +1,270 @@
+'''
+Optimizers updating a flat vector of variables inplace.
+
+For complex variables, gradients follow the convention of :meth:`backward`, \
+:math:`\delta J = \Re[g\cdot\delta w]` for a real cost :math:`J`, \
+so the steepest descent direction is :math:`g^*`.
+'''
+
+import numpy as np
+
+from .utils import dtype_c2r
+
+__all__ = ['Optimizer', 'SGD', 'RMSProp', 'Adam', 'LBFGS']
+
+
+class Optimizer(object):
+    '''
+    Base class of optimizers, states are stored in preallocated arrays \
+with the layout of variables.
+
+    Args:
+        variables (1darray): variables updated inplace, \
+e.g. the one returned by :meth:`Container.flatten_variables`.
+        step_rate (float): the learning rate.
+
+    Attributes:
+        variables (1darray): variables updated inplace.
+        step_rate (float): the learning rate.
+        num_steps (int): number of steps taken.
+    '''
+
+    def __init__(self, variables, step_rate):
+        self.variables = variables
+        self.step_rate = step_rate
+        self.num_steps = 0
+        self._is_complex = np.iscomplexobj(variables)
+        self._direction = np.empty_like(variables)
+        self._buffer = np.empty_like(variables)
+
+    def __repr__(self):
+        return '<%s>: step_rate = %s, %d variables' % (
+            self.__class__.__name__, self.step_rate, self.variables.size)
+
+    def step(self, gradients):
+        '''
+        Take a step.
+
+        Args:
+            gradients (1darray): :math:`\partial J/\partial w`, \
+e.g. gradients returned by :meth:`backward`.
+        '''
+        if self._is_complex:
+            np.conjugate(gradients, out=self._direction)
+        else:
+            self._direction[...] = gradients
+        self._update(self._direction)
+        self.num_steps += 1
+
+    def _update(self, direction):
+        '''
+        Update variables, given the steepest descent direction.
+
+        Args:
+            direction (1darray): the descent direction, \
+which can be used as a buffer.
+        '''
+        raise NotImplementedError()
+
+    def _squared_abs(self, x, out):
+        '''element-wise :math:`|x|^2` of real data type.'''
+        np.abs(x, out=out)
+        return np.multiply(out, out, out=out)
+
+
+class SGD(Optimizer):
+    '''
+    Stochastic gradient descent with (Nesterov) momentum.
+
+    Args:
+        momentum (float, default=0.0): the momentum.
+        nesterov (bool, default=False): use Nesterov momentum if True.
+
+    Attributes:
+        momentum (float): the momentum.
+        nesterov (bool): use Nesterov momentum if True.
+        velocity (1darray): the velocity.
+    '''
+
+    def __init__(self, variables, step_rate, momentum=0.0, nesterov=False):
+        super(SGD, self).__init__(variables, step_rate)
+        self.momentum = momentum
+        self.nesterov = nesterov
+        self.velocity = np.zeros_like(variables)
+
+    def _update(self, direction):
+        direction *= self.step_rate
+        if self.momentum == 0:
+            self.variables -= direction
+            return
+        self.velocity *= self.momentum
+        self.velocity -= direction
+        if self.nesterov:
+            np.multiply(self.velocity, self.momentum, out=self._buffer)
+            self._buffer -= direction
+            self.variables += self._buffer
+        else:
+            self.variables += self.velocity
+
+
+class RMSProp(Optimizer):
+    '''
+    RMSProp, steps are normalized by a running average of \
+squared gradients.
+
+    Args:
+        decay (float, default=0.9): decay of the running average.
+        momentum (float, default=0.0): the momentum.
+        eps (float, default=1e-8): small number to avoid division by 0.
+
+    Attributes:
+        decay (float): decay of the running average.
+        momentum (float): the momentum.
+        eps (float): small number to avoid division by 0.
+        mean_square (1darray): running average of squared gradients, \
+of real data type.
+        velocity (1darray): the velocity.
+    '''
+
+    def __init__(self, variables, step_rate, decay=0.9, momentum=0.0,
+                 eps=1e-8):
+        super(RMSProp, self).__init__(variables, step_rate)
+        self.decay = decay
+        self.momentum = momentum
+        self.eps = eps
+        rtype = dtype_c2r(variables.dtype.name) if self._is_complex\
+            else variables.dtype
+        self.mean_square = np.zeros(variables.shape, dtype=rtype)
+        self.velocity = np.zeros_like(variables)
+        self._rbuffer = np.empty_like(self.mean_square)
+
+    def _update(self, direction):
+        square = self._squared_abs(direction, self._rbuffer)
+        self.mean_square *= self.decay
+        square *= 1 - self.decay
+        self.mean_square += square
+
+        np.sqrt(self.mean_square, out=square)
+        square += self.eps
+        direction /= square
+        direction *= self.step_rate
+        if self.momentum == 0:
+            self.variables -= direction
+        else:
+            self.velocity *= self.momentum
+            self.velocity -= direction
+            self.variables += self.velocity
+
+
+class Adam(Optimizer):
+    '''
+    Adam, with bias corrected running averages of gradients \
+and squared gradients.
+
+    Args:
+        beta1 (float, default=0.9): decay of the first moment.
+        beta2 (float, default=0.999): decay of the second moment.
+        eps (float, default=1e-8): small number to avoid division by 0.
+
+    Attributes:
+        beta1 (float): decay of the first moment.
+        beta2 (float): decay of the second moment.
+        eps (float): small number to avoid division by 0.
+        first_moment (1darray): running average of descent directions.
+        second_moment (1darray): running average of squared gradients, \
+of real data type.
+    '''
+
+    def __init__(self, variables, step_rate=1e-3, beta1=0.9, beta2=0.999,
+                 eps=1e-8):
+        super(Adam, self).__init__(variables, step_rate)
+        self.beta1 = beta1
+        self.beta2 = beta2
+        self.eps = eps
+        rtype = dtype_c2r(variables.dtype.name) if self._is_complex\
+            else variables.dtype
+        self.first_moment = np.zeros_like(variables)
+        self.second_moment = np.zeros(variables.shape, dtype=rtype)
+        self._rbuffer = np.empty_like(self.second_moment)
+
+    def _update(self, direction):
+        t = self.num_steps + 1
+        square = self._squared_abs(direction, self._rbuffer)
+        self.second_moment *= self.beta2
+        square *= 1 - self.beta2
+        self.second_moment += square
+        self.first_moment *= self.beta1
+        direction *= 1 - self.beta1
+        self.first_moment += direction
+
+        # bias corrections are folded into the step rate and eps.
+        correction = np.sqrt(1 - self.beta2**t)
+        np.sqrt(self.second_moment, out=square)
+        square += self.eps * correction
+        np.divide(self.first_moment, square, out=direction)
+        direction *= self.step_rate * correction / (1 - self.beta1**t)
+        self.variables -= direction
+
+
+class LBFGS(Optimizer):
+    '''
+    Limited memory BFGS with a fixed step rate (no line search), \
+complex variables are treated as pairs of real numbers.
+
+    Args:
+        history (int, default=10): number of stored update pairs.
+        step_rate (float, default=1.0): the learning rate.
+
+    Attributes:
+        history (int): number of stored update pairs.
+        steps (2darray): (history, num_variables), recent updates of variables.
+        changes (2darray): (history, num_variables), \
+recent changes of descent directions.
+    '''
+
+    def __init__(self, variables, step_rate=1.0, history=10):
+        super(LBFGS, self).__init__(variables, step_rate)
+        self.history = history
+        self.steps = np.zeros((history,) + variables.shape,
+                              dtype=variables.dtype)
+        self.changes = np.zeros_like(self.steps)
+        self._rho = np.zeros(history)
+        self._alpha = np.zeros(history)
+        self._num_pairs = 0
+        self._head = 0
+        self._last_direction = np.zeros_like(variables)
+        self._last_step = np.zeros_like(variables)
+
+    def _update(self, direction):
+        # store the pair of last step, if curvature is positive.
+        if self.num_steps > 0:
+            change = self._buffer
+            np.subtract(direction, self._last_direction, out=change)
+            sy = np.vdot(self._last_step, change).real
+            if sy > 1e-12:
+                self.steps[self._head] = self._last_step
+                self.changes[self._head] = change
+                self._rho[self._head] = 1. / sy
+                self._head = (self._head + 1) % self.history
+                self._num_pairs = min(self._num_pairs + 1, self.history)
+        self._last_direction[...] = direction
+
+        # two loop recursion, from the newest pair to the oldest.
+        indices = [(self._head - k - 1) % self.history
+                   for k in range(self._num_pairs)]
+        q = direction
+        for i in indices:
+            self._alpha[i] = self._rho[i] * np.vdot(self.steps[i], q).real
+            np.multiply(self.changes[i], self._alpha[i], out=self._buffer)
+            q -= self._buffer
+        if self._num_pairs > 0:
+            newest = self.changes[indices[0]]
+            q *= 1. / (self._rho[indices[0]] * np.vdot(newest, newest).real)
+        for i in indices[::-1]:
+            beta = self._rho[i] * np.vdot(self.changes[i], q).real
+            np.multiply(self.steps[i], self._alpha[i] - beta,
+                        out=self._buffer)
+            q += self._buffer
+
+        np.multiply(q, -self.step_rate, out=self._last_step)
+        self.variables += self._last_step
@@ -1,7 +1,6 @@
 import numpy as np
 from numpy.polynomial import Polynomial, Chebyshev, Legendre,\
     Laguerre, Hermite, HermiteE
-from scipy.misc import factorial
 import pdb
 
 from .core import ParamFunction, EMPTY_VAR
@@ -10,6 +9,12 @@ from .utils import fsign, dtype_c2r, dtype_r2c
 __all__ = ['PReLU', 'Poly', 'Mobius', 'Georgiou1992', 'Gaussian', 'PMul']
 
 
+def _factorial(n):
+    '''scipy.misc.factorial, imported on first use.'''
+    from scipy.misc import factorial
+    return factorial(n)
+
+
 class PReLU(ParamFunction):
     '''
     Parametric ReLU,
@@ -121,15 +126,15 @@ class Poly(ParamFunction):
         return len(self.params) - 1
 
     def forward(self, x, **kwargs):
-        factor = 1. / factorial(np.arange(len(self.params))
-                                ) if self.factorial_rescale else 1
+        factor = 1. / _factorial(np.arange(len(self.params))
+                                 ) if self.factorial_rescale else 1
         p = self.kernel_dict[self.kernel](self.params * factor)
         y = p(x)
         return y
 
     def backward(self, xy, dy, **kwargs):
-        factor = 1. / factorial(np.arange(len(self.params))
-                                ) if self.factorial_rescale\
+        factor = 1. / _factorial(np.arange(len(self.params))
+                                 ) if self.factorial_rescale\
             else np.ones(len(self.params))
         x, y = xy
         p = self.kernel_dict[self.kernel](self.params * factor)
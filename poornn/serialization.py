@@ -0,0 +1,178 @@
+'''
+Binary save and load of networks, arrays are stored in a single \
+contiguous blob, which is memory-mapped on load.
+
+The file starts with a header, followed by a pickled object graph \
+(layers and their attributes), in which arrays are replaced by references \
+to the blob, e.g. `(root, offset, shape, strides, dtype)`. \
+Arrays sharing memory, like variables bound into \
+:attr:`Container.flat_variables`, are saved once and remain views \
+of each other after loading.
+'''
+
+import pickle
+import importlib
+import struct
+try:
+    import copyreg
+except ImportError:
+    import copy_reg as copyreg
+
+import numpy as np
+
+__all__ = ['save', 'load']
+
+MAGIC = b'POORNN\x00\x01'
+'''Magic bytes of a saved file, the last byte is the format version.'''
+
+ALIGNMENT = 64
+'''Alignment of the blob and arrays in it, in bytes.'''
+
+_HEADER = struct.Struct('<8sQQ')
+_LIB_MODULES = ['convprod', 'fused', 'linear', 'pooling', 'relu', 'spconv',
+                'spsp']
+
+
+def save(obj, filename):
+    '''
+    Save an object (e.g. a :class:`Layer` or :class:`Container`) to file.
+
+    Args:
+        obj (object): the object, arrays in it are stored in the blob.
+        filename (str): name of file.
+    '''
+    with open(filename, 'wb') as f:
+        pickler = _Pickler(f)
+        f.write(_HEADER.pack(MAGIC, 0, 0))
+        pickler.dump(obj)
+        blob_offset = _align(f.tell())
+        for root in pickler.roots:
+            f.seek(blob_offset + pickler.offsets[id(root)])
+            f.write(_raw_bytes(root))
+        f.truncate(blob_offset + pickler.blob_size)
+        f.seek(0)
+        f.write(_HEADER.pack(MAGIC, blob_offset, pickler.blob_size))
+
+
+def load(filename, mmap_mode='c'):
+    '''
+    Load an object saved by :func:`save`.
+
+    Args:
+        filename (str): name of file.
+        mmap_mode ('c'|'r'|'r+'|None, default='c'): mode of memory-mapping \
+the blob, see `numpy.memmap`, data are read into memory if None.
+            * 'c', copy-on-write, processes share pages until they are \
+written, the file is not changed.
+            * 'r', read-only, arrays can not be updated.
+            * 'r+', updates of arrays are written back to the file.
+
+    Returns:
+        object: the object, arrays in it are views of the blob.
+    '''
+    with open(filename, 'rb') as f:
+        magic, blob_offset, blob_size = _HEADER.unpack(
+            f.read(_HEADER.size))
+        if magic != MAGIC:
+            raise ValueError('%s is not a saved poornn object!' % filename)
+        if blob_size == 0:
+            blob = np.zeros(0, dtype='uint8')
+        elif mmap_mode is None:
+            f.seek(blob_offset)
+            blob = np.frombuffer(bytearray(f.read(blob_size)), dtype='uint8')
+        else:
+            blob = np.memmap(filename, dtype='uint8', mode=mmap_mode,
+                             offset=blob_offset, shape=(blob_size,))
+        f.seek(_HEADER.size)
+        unpickler = _Unpickler(f, blob)
+        return unpickler.load()
+
+
+class _Pickler(pickle.Pickler):
+    '''pickler placing numeric arrays in the blob.'''
+
+    def __init__(self, f):
+        pickle.Pickler.__init__(self, f, 2)
+        self.roots = []
+        self.offsets = {}
+        self.blob_size = 0
+
+    def persistent_id(self, obj):
+        if not isinstance(obj, np.ndarray) or obj.dtype.hasobject:
+            return None
+        root = _root(obj)
+        if root is None:
+            root = obj = np.asfortranarray(obj)
+        if id(root) not in self.offsets:
+            self.roots.append(root)
+            self.offsets[id(root)] = self.blob_size
+            self.blob_size = _align(self.blob_size + root.nbytes)
+        offset = self.offsets[id(root)] + _address(obj) - _address(root)
+        return ('array', offset, obj.shape, obj.strides, obj.dtype.str)
+
+
+class _Unpickler(pickle.Unpickler):
+    '''unpickler turning array references into views of the blob.'''
+
+    def __init__(self, f, blob):
+        pickle.Unpickler.__init__(self, f)
+        self.blob = blob
+
+    def persistent_load(self, pid):
+        kind, offset, shape, strides, dtype = pid
+        if kind != 'array':
+            raise pickle.UnpicklingError('Unknown reference %s' % kind)
+        return np.ndarray(shape, dtype=dtype, buffer=self.blob,
+                          offset=offset, strides=strides)
+
+
+def _root(arr):
+    '''
+    the outermost array owning the memory of `arr`, \
+None if it is not contiguous.
+    '''
+    while isinstance(arr.base, np.ndarray):
+        arr = arr.base
+    if arr.flags.c_contiguous or arr.flags.f_contiguous:
+        return arr
+    return None
+
+
+def _address(arr):
+    return arr.__array_interface__['data'][0]
+
+
+def _raw_bytes(arr):
+    '''memory of a contiguous array as bytes.'''
+    return arr.reshape(-1, order='A').view('uint8').tobytes()\
+        if arr.size > 0 else b''
+
+
+def _align(n):
+    return -(-n // ALIGNMENT) * ALIGNMENT
+
+
+def _fortran_path(func):
+    '''find the module and name of an f2py routine in poornn.lib.'''
+    for modname in _LIB_MODULES:
+        for name, value in _fortran_lib(modname).__dict__.items():
+            if value is func:
+                return modname, name
+    raise pickle.PicklingError('Can not find fortran routine %s' % func)
+
+
+def _fortran_lib(modname):
+    return importlib.import_module('.lib.%s' % modname, 'poornn').lib
+
+
+def _fortran_routine(modname, name):
+    return getattr(_fortran_lib(modname), name)
+
+
+def _reduce_fortran(func):
+    return _fortran_routine, _fortran_path(func)
+
+
+# each f2py extension defines its own type of routines.
+for _modname in _LIB_MODULES:
+    copyreg.pickle(type(_fortran_lib(_modname)), _reduce_fortran)
@@ -6,15 +6,23 @@ from __future__ import division
 import numpy as np
 import pdb
 import time
-from scipy import sparse as sps
+from functools import partial
 
-from .lib.spconv import lib as fspconv
-from .lib.spsp import lib as fspsp
+from .kernels import get_kernel
 from .utils import scan2csc, tuple_prod, spscan2csc,\
-    masked_concatenate, dtype2token, typed_randn
+    dtype2token, typed_randn, _issparse
 from .linears import LinearBase
 
-__all__ = ['SPConv']
+__all__ = ['SPConv', 'SPSP', 'IM2COL_BUFFER_SIZE', 'FFT_COST_FACTOR']
+
+IM2COL_BUFFER_SIZE = 2**16
+'''Default number of elements in the column buffer of \
+:class:`SPConv` with strategy 'im2col', it bounds the block size.'''
+
+FFT_COST_FACTOR = 4.
+'''Cost of FFT per element and per `log2(image size)`, relative to \
+a multiply-add of direct convolution, :class:`SPConv` with strategy 'auto' \
+uses FFT if it is estimated to be cheaper.'''
 
 
 class SPConv(LinearBase):
@@ -33,6 +41,24 @@ class SPConv(LinearBase):
                 here, unitary is defined in the map `U: img_in -> feature_out`.
         var_mask (tuple<bool>, len=2, default=(True,True)):\
                 variable mask for weight and bias.
+        strategy ('auto'|'pixel'|'im2col'|'fft'|'tune', default='auto'): \
+execution strategy,
+            * 'pixel', one small matrix product per output pixel.
+            * 'im2col', gather patches of a block of output pixels into \
+a column buffer, one large matrix product per block, \
+faster for batched inputs, `w_contiguous` is ignored.
+            * 'fft', circular convolution by FFT, periodic boundary only, \
+cheaper for large kernels, `w_contiguous` is ignored.
+            * 'auto', 'fft' if the boundary is periodic and FFT is \
+estimated to be cheaper (see :data:`FFT_COST_FACTOR`), 'pixel' otherwise.
+            * 'tune', benchmark strategies on first use, \
+see :meth:`autotune`.
+        block_size (int|None, default=None): number of output pixels \
+in a block for strategy 'im2col', if None, as many as the column buffer \
+of :data:`IM2COL_BUFFER_SIZE` elements holds.
+        gemm3m (bool, default=False): compute complex matrix products \
+of batched inputs with three real matrix products (3M scheme), \
+see :class:`poornn.linears.Linear`, strategy 'fft' is not affected.
 
     Attributes:
         weight (ndarray): dimensions are aranged as (feature_out,\
@@ -45,6 +71,11 @@ class SPConv(LinearBase):
         is_unitary (bool): keep unitary if True, here, unitary is defined\
                 in the map `U: img_in -> feature_out`.
         var_mask (tuple<bool>, len=2): variable mask for weight and bias.
+        strategy ('pixel'|'im2col'|'fft'|'tune'): execution strategy, \
+'tune' before first use.
+        block_size (int|None): number of output pixels in a block \
+for strategy 'im2col'.
+        gemm3m (bool): use the 3M scheme for complex matrix products.
 
         (Derived):
         csc_indptr (1darray): column pointers for convolution matrix.
@@ -53,12 +84,16 @@ class SPConv(LinearBase):
                 (if not contiguous).
     '''
     __display_attrs__ = ['strides', 'boundary',
-                         'kernel_shape', 'is_unitary', 'var_mask']
+                         'kernel_shape', 'is_unitary', 'var_mask', 'strategy',
+                         'gemm3m']
+    __buffered__ = True
+    __backward_needs__ = 'x'
 
     def __init__(self, input_shape, itype, weight, bias,
                  strides=None, boundary="P",
                  w_contiguous=True, var_mask=(1, 1),
-                 is_unitary=False, **kwargs):
+                 is_unitary=False, strategy='auto', block_size=None,
+                 gemm3m=False, **kwargs):
         if isinstance(weight, tuple):
             weight = 0.1 * typed_randn(kwargs.get('dtype', itype), weight)
         super(SPConv, self).__init__(input_shape, itype=itype,
@@ -72,41 +107,14 @@ class SPConv(LinearBase):
         self.boundary = boundary
         self.w_contiguous = w_contiguous
         self.is_unitary = is_unitary
+        self.gemm3m = gemm3m
 
         kernel_shape = self.weight.shape[2:]
         self.csc_indptr, self.csc_indices, self.img_out_shape = scan2csc(
             kernel_shape, input_shape[-img_nd:], strides, boundary)
         self.output_shape = input_shape[:-img_nd - 1] + \
             (self.num_feature_out,) + self.img_out_shape
-
-        # use the correct fortran subroutine.
-        dtype_token = dtype2token(
-            np.find_common_type((self.itype, self.dtype), ()))
-
-        if not w_contiguous:
-            self.weight_indices = np.asarray(np.tile(np.arange(tuple_prod(
-                kernel_shape), dtype='int32'), tuple_prod(img_out_shape)),
-                order='F') + 1  # pointer to filter data
-            func_f = eval('fspconv.forward_general%s' % dtype_token)
-            func_b = eval('fspconv.backward_general%s' % dtype_token)
-            func1_f = eval('fspconv.forward1_general%s' % dtype_token)
-            func1_b = eval('fspconv.backward1_general%s' % dtype_token)
-            self._fforward = lambda *args, **kwargs: func_f(
-                *args, weight_indices=self.weight_indices, **kwargs)
-            self._fbackward = lambda *args, **kwargs: func_b(
-                *args, weight_indices=self.weight_indices, **kwargs)
-            self._fforward1 = lambda *args, **kwargs: func1_f(
-                *args, weight_indices=self.weight_indices, **kwargs)
-            self._fbackward1 = lambda *args, **kwargs: func1_b(
-                *args, weight_indices=self.weight_indices, **kwargs)
-        else:
-            self._fforward = eval('fspconv.forward_contiguous%s' % dtype_token)
-            self._fforward1 = eval(
-                'fspconv.forward1_contiguous%s' % dtype_token)
-            self._fbackward = eval(
-                'fspconv.backward_contiguous%s' % dtype_token)
-            self._fbackward1 = eval(
-                'fspconv.backward1_contiguous%s' % dtype_token)
+        self.set_strategy(strategy, block_size=block_size)
 
         # make it unitary
         self.is_unitary = is_unitary
@@ -133,6 +141,218 @@ class SPConv(LinearBase):
     def kernel_shape(self):
         return self.weight.shape[2:]
 
+    def set_strategy(self, strategy, w_contiguous=None, block_size=None):
+        '''
+        Set the execution strategy, and resolve kernels for it.
+
+        Args:
+            strategy ('auto'|'pixel'|'im2col'|'fft'|'tune'): \
+execution strategy, for 'tune', the fastest one is selected \
+by :meth:`autotune` on first use.
+            w_contiguous (bool|None, default=None): use contiguous \
+weight for strategy 'pixel', if None, keep the current one.
+            block_size (int|None, default=None): number of output pixels \
+in a block for strategy 'im2col'.
+        '''
+        if strategy not in ('auto', 'pixel', 'im2col', 'fft', 'tune'):
+            raise ValueError('Strategy %s not supported!' % strategy)
+        if strategy == 'fft' and self.boundary != 'P':
+            raise ValueError('Strategy fft needs periodic boundary!')
+        if w_contiguous is not None:
+            self.w_contiguous = w_contiguous
+        self.block_size = block_size
+        kernel_shape = self.kernel_shape
+        img_in_shape = self.input_shape[-self.img_nd:]
+        if strategy == 'auto':
+            strategy = 'fft' if self.boundary == 'P' and _fft_cheaper(
+                self.weight.shape, img_in_shape, self.img_out_shape)\
+                else 'pixel'
+        self.strategy = strategy
+
+        # use the correct fortran subroutine.
+        dtype_token = dtype2token(
+            np.find_common_type((self.itype, self.dtype), ()))
+
+        self._fftn = self._ifftn = None
+        kernels = [None] * 4
+        if strategy == 'fft':
+            # positions of kernel offsets in the (periodic) input image.
+            self._fft_offsets = np.ravel_multi_index(np.unravel_index(
+                np.arange(tuple_prod(kernel_shape)), kernel_shape, order='F'),
+                img_in_shape, mode='wrap', order='F')
+            # real inputs and weights use real FFT, frequencies are halved.
+            if dtype_token in 'sd':
+                self._fft_shape = img_in_shape[:-1] + \
+                    (img_in_shape[-1] // 2 + 1,)
+                self._fftn = get_kernel('fft', 'rfftn')
+                self._ifftn = partial(get_kernel('fft', 'irfftn'),
+                                      s=img_in_shape)
+            else:
+                self._fft_shape = img_in_shape
+                self._fftn = get_kernel('fft', 'fftn')
+                self._ifftn = get_kernel('fft', 'ifftn')
+        elif strategy == 'im2col':
+            kernels = [get_kernel('spconv.%s' % op, 'im2col', dtype_token)
+                       for op in ['forward', 'backward']] * 2
+        elif strategy == 'pixel':
+            kernels = [get_kernel('spconv.%s' % op, 'contiguous'
+                                  if self.w_contiguous else 'general',
+                                  dtype_token)
+                       for op in ['forward', 'backward',
+                                  'forward1', 'backward1']]
+        if self.gemm3m and dtype_token in 'zc' and\
+                strategy in ('pixel', 'im2col'):
+            # single sample kernels of strategy 'pixel' are matrix-vector.
+            num_3m = 4 if strategy == 'im2col' else 2
+            kernels = [partial(func, gemm3m=True) for func in
+                       kernels[:num_3m]] + kernels[num_3m:]
+        if not self.w_contiguous and strategy == 'pixel':
+            self.weight_indices = np.asarray(np.tile(np.arange(tuple_prod(
+                kernel_shape), dtype='int32'), tuple_prod(self.img_out_shape)),
+                order='F') + 1  # pointer to filter data
+            kernels = [partial(func, weight_indices=self.weight_indices)
+                       for func in kernels]
+        self._fforward, self._fbackward, self._fforward1, self._fbackward1 =\
+            kernels
+
+    def autotune(self, num_batch, **kwargs):
+        '''
+        Select the fastest execution strategy for a batch size, \
+see :func:`poornn.autotune.tune_spconv`.
+
+        Args:
+            num_batch (int|None): batch size, None for single samples.
+            \*\*kwargs: keyword arguments of \
+:func:`poornn.autotune.tune_spconv`.
+
+        Returns:
+            dict: the selected configuration, \
+keyword arguments of :meth:`set_strategy`.
+        '''
+        from .autotune import tune_spconv
+        config = tune_spconv(self, num_batch, **kwargs)
+        self.set_strategy(**config)
+        return config
+
+    def get_block_size(self, num_batch):
+        '''
+        Number of output pixels in a block for strategy 'im2col'.
+
+        Args:
+            num_batch (int): batch size.
+
+        Returns:
+            int: block size.
+        '''
+        if self.block_size is not None:
+            return self.block_size
+        return max(1, IM2COL_BUFFER_SIZE // (num_batch * self.weight[0].size))
+
+    def _fft_kernel(self):
+        '''weight folded into the periodic input image, \
+(nfo, nfi, img_in_dims).'''
+        img_in_shape = self.input_shape[-self.img_nd:]
+        weight = self.weight.reshape(self.weight.shape[:2] + (-1,),
+                                     order='F')
+        kernel = np.zeros(weight.shape[:2] + (tuple_prod(img_in_shape),),
+                          dtype=weight.dtype, order='F')
+        if len(np.unique(self._fft_offsets)) == len(self._fft_offsets):
+            kernel[:, :, self._fft_offsets] = weight
+        else:  # kernel larger than image, offsets overlap.
+            np.add.at(kernel, (slice(None), slice(None), self._fft_offsets),
+                      weight)
+        return kernel.reshape(weight.shape[:2] + img_in_shape, order='F')
+
+    def _fft_transform(self, arr, reverse=False):
+        '''
+        FFT over image dimensions, flattened to (d0, d1, num_frequency), \
+FFT of `arr(-r)` if reverse.
+        '''
+        axes = tuple(range(2, arr.ndim))
+        if reverse:
+            arr = self._fftn(arr.conj(), axes=axes).conj()
+        else:
+            arr = self._fftn(arr, axes=axes)
+        return arr.reshape(arr.shape[:2] + (-1,), order='F')
+
+    def _fft_restore(self, arr):
+        '''inverse of :meth:`_fft_transform`.'''
+        arr = arr.reshape(arr.shape[:2] + self._fft_shape, order='F')
+        return self._ifftn(arr, axes=tuple(range(2, arr.ndim)))
+
+    def _fft_forward(self, x, out):
+        '''forward of strategy 'fft'.'''
+        img_nd = self.img_nd
+        dtype = np.result_type(x.dtype, self.weight.dtype)
+        img_in_shape = self.input_shape[-img_nd:]
+        x = x.reshape((-1, self.num_feature_in) + img_in_shape, order='F')
+
+        # cross-correlation of x and the kernel.
+        xf = self._fft_transform(x)
+        wf = self._fft_transform(self._fft_kernel(), reverse=True)
+        zf = np.matmul(xf.transpose(2, 0, 1), wf.transpose(2, 1, 0))
+        z = self._fft_restore(zf.transpose(1, 2, 0))
+        y = z[(Ellipsis,) + tuple(slice(None, None, s) for s in self.strides)]
+        if dtype.kind != 'c':
+            y = y.real
+        y = y + self.bias.reshape((-1,) + (1,) * img_nd)
+        if out is not None:
+            out.reshape(y.shape, order='F')[...] = y
+            y = out
+        return np.asarray(y, dtype=dtype, order='F').reshape(
+            self.output_shape, order='F')
+
+    def _fft_backward(self, x, dy, out):
+        '''backward of strategy 'fft'.'''
+        img_nd = self.img_nd
+        mask = self.var_mask
+        dtype = np.result_type(x.dtype, dy.dtype, self.weight.dtype)
+        img_in_shape = self.input_shape[-img_nd:]
+        x = x.reshape((-1, self.num_feature_in) + img_in_shape, order='F')
+        dy = dy.reshape((-1, self.num_feature_out) + self.img_out_shape,
+                        order='F')
+        dweight, dbias = self._gradient_slots(self.weight.shape)
+
+        # scatter dy to all pixels of the input image.
+        dz = np.zeros((dy.shape[0], self.num_feature_out) + img_in_shape,
+                      dtype=dy.dtype, order='F')
+        dz[(Ellipsis,) + tuple(slice(None, None, s)
+                               for s in self.strides)] = dy
+
+        # convolution with the kernel.
+        dzf = self._fft_transform(dz)
+        wf = self._fft_transform(self._fft_kernel())
+        dxf = np.matmul(dzf.transpose(2, 0, 1), wf.transpose(2, 0, 1))
+        dx = self._fft_restore(dxf.transpose(1, 2, 0))
+
+        if mask[0]:
+            # cross-correlation of dy and x, at kernel offsets.
+            af = self._fft_transform(dz, reverse=True)
+            xf = self._fft_transform(x)
+            gf = np.matmul(af.transpose(2, 1, 0), xf.transpose(2, 0, 1))
+            g = self._fft_restore(gf.transpose(1, 2, 0))
+            g = g.reshape(g.shape[:2] + (-1,), order='F')[
+                :, :, self._fft_offsets].reshape(self.weight.shape,
+                                                 order='F')
+            if dweight is None:
+                dweight = np.empty(self.weight.shape, dtype=dtype, order='F')
+            dweight[...] = g if dtype.kind == 'c' else g.real
+        elif dweight is None:
+            dweight = np.empty(0, dtype=dtype)
+        if mask[1]:
+            if dbias is None:
+                dbias = np.empty(self.num_feature_out, dtype=dtype)
+            dbias[...] = dy.sum(axis=(0,) + tuple(range(2, dy.ndim)))
+
+        if dtype.kind != 'c':
+            dx = dx.real
+        if out is not None:
+            out.reshape(dx.shape, order='F')[...] = dx
+            dx = out
+        return self._pack_gradients(dweight, dbias),\
+            np.asarray(dx, dtype=dtype, order='F').reshape(
+                self.input_shape, order='F')
+
     def be_unitary(self):
         weight = self.weight.reshape(self.weight.shape[:2] + (-1,), order='F')
         self.weight = np.asarray(
@@ -160,7 +380,7 @@ class SPConv(LinearBase):
     def set_variables(self, variables):
         nw = self.weight.size if self.var_mask[0] else 0
         var1, var2 = variables[:nw], variables[nw:]
-        weight_data = self.weight.data if sps.issparse(
+        weight_data = self.weight.data if _issparse(
             self.weight) else self.weight.ravel(order='F')
         if self.is_unitary and self.var_mask[0]:
             W = self.weight.reshape(self.weight.shape[:2] + (-1,), order='F')
@@ -180,36 +400,51 @@ class SPConv(LinearBase):
         if self.var_mask[1]:
             self.bias[:] = var2
 
-    def forward(self, x, **kwargs):
+    def forward(self, x, out=None, **kwargs):
         '''
         Args:
             x (ndarray): (num_batch, nfi, img_in_dims), input in 'F' order.
+            out (ndarray|None, default=None): (num_batch, nfo, img_out_dims), preallocated output in 'F' order.
         Returns:
             ndarray, (num_batch, nfo, img_out_dims), output in 'F' order.
         '''
+        if self.strategy == 'tune':
+            self.autotune(x.shape[0] if x.ndim > self.img_nd + 1 else None)
+        if self.strategy == 'fft':
+            return self._fft_forward(x, out)
         x_nd, img_nd = x.ndim, self.img_nd
 
         # flatten inputs/outputs
         x = x.reshape(x.shape[:x_nd - img_nd] + (-1,), order='F')
         _fltr_flatten = self.weight.reshape(
             self.weight.shape[:2] + (-1,), order='F')
-
-        if x_nd == img_nd + 1:  # single batch wise
+        if out is not None:
+            out = out.reshape(out.shape[:x_nd - img_nd] + (-1,), order='F')
+
+        if self.strategy == 'im2col':
+            x = x.reshape((-1,) + x.shape[-2:], order='F')
+            if out is not None:
+                out = out.reshape((-1,) + out.shape[-2:], order='F')
+            y = self._fforward(x, csc_indices=self.csc_indices,
+                               fltr_data=_fltr_flatten, bias=self.bias,
+                               block_size=self.get_block_size(x.shape[0]),
+                               y=out)
+        elif x_nd == img_nd + 1:  # single batch wise
             y = self._fforward1(x, csc_indptr=self.csc_indptr,
                                 csc_indices=self.csc_indices,
                                 fltr_data=_fltr_flatten,
                                 bias=self.bias,
-                                max_nnz_row=_fltr_flatten.shape[-1])
+                                max_nnz_row=_fltr_flatten.shape[-1], y=out)
         else:
             y = self._fforward(x, csc_indptr=self.csc_indptr,
                                csc_indices=self.csc_indices,
                                fltr_data=_fltr_flatten,
                                bias=self.bias,
-                               max_nnz_row=_fltr_flatten.shape[-1])
+                               max_nnz_row=_fltr_flatten.shape[-1], y=out)
         y = y.reshape(self.output_shape, order='F')
         return y
 
-    def backward(self, xy, dy, **kwargs):
+    def backward(self, xy, dy, out=None, **kwargs):
         '''
         Args:
             xy ((ndarray, ndarray)):
@@ -217,12 +452,17 @@ class SPConv(LinearBase):
                 * y -> (num_batch, nfo, img_out_dims), output in 'F' order.
             dy (ndarray): (num_batch, nfo, img_out_dims),\
                     gradient of output in 'F' order.
-            mask (booleans): (do_xgrad, do_wgrad, do_bgrad).
+            out (ndarray|None, default=None): (num_batch, nfi, \
+img_in_dims), preallocated gradient of input in 'F' order.
 
         Returns:
             tuple(1darray, ndarray): dw, dx
         '''
         x, y = xy
+        if self.strategy == 'tune':
+            self.autotune(x.shape[0] if x.ndim > self.img_nd + 1 else None)
+        if self.strategy == 'fft':
+            return self._fft_backward(x, dy, out)
         x_nd, img_nd = x.ndim, self.img_nd
         xpre = x.shape[:x_nd - img_nd]
         ypre = xpre[:-1] + (self.num_feature_out,)
@@ -234,8 +474,24 @@ class SPConv(LinearBase):
         dy = dy.reshape(ypre + (-1,), order='F')
         _fltr_flatten = self.weight.reshape(
             self.weight.shape[:2] + (-1,), order='F')
-
-        if x_nd == img_nd + 1:  # single batch wise
+        if out is not None:
+            out = out.reshape(x.shape, order='F')
+        dweight, dbias = self._gradient_slots(_fltr_flatten.shape)
+
+        if self.strategy == 'im2col':
+            x = x.reshape((-1,) + x.shape[-2:], order='F')
+            dy = dy.reshape((-1,) + dy.shape[-2:], order='F')
+            if out is not None:
+                out = out.reshape(x.shape, order='F')
+            dx, dweight, dbias =\
+                self._fbackward(dy, x, csc_indices=self.csc_indices,
+                                fltr_data=_fltr_flatten,
+                                do_xgrad=do_xgrad,
+                                do_wgrad=mask[0],
+                                do_bgrad=mask[1],
+                                block_size=self.get_block_size(x.shape[0]),
+                                dx=out, dweight=dweight, dbias=dbias)
+        elif x_nd == img_nd + 1:  # single batch wise
             dx, dweight, dbias =\
                 self._fbackward1(dy, x, self.csc_indptr,
                                  self.csc_indices,
@@ -243,7 +499,8 @@ class SPConv(LinearBase):
                                  do_xgrad=do_xgrad,
                                  do_wgrad=mask[0],
                                  do_bgrad=mask[1],
-                                 max_nnz_row=_fltr_flatten.shape[-1])
+                                 max_nnz_row=_fltr_flatten.shape[-1], dx=out,
+                                 dweight=dweight, dbias=dbias)
         else:
             dx, dweight, dbias =\
                 self._fbackward(dy,
@@ -252,71 +509,82 @@ class SPConv(LinearBase):
                                 do_xgrad=do_xgrad,
                                 do_wgrad=mask[0],
                                 do_bgrad=mask[1],
-                                max_nnz_row=_fltr_flatten.shape[-1])
-        return masked_concatenate([dweight.ravel(order='F'), dbias], mask),\
+                                max_nnz_row=_fltr_flatten.shape[-1], dx=out,
+                                dweight=dweight, dbias=dbias)
+        return self._pack_gradients(dweight, dbias),\
             dx.reshape(self.input_shape, order='F')
 
 
-class SPSP(SPConv):
+def _fft_cheaper(weight_shape, img_in_shape, img_out_shape):
+    '''
+    FFT convolution is estimated to be cheaper than direct convolution, \
+with kernels transformed for each sample.
     '''
+    nfo, nfi = weight_shape[:2]
+    size = tuple_prod(img_in_shape)
+    direct = nfo * nfi * tuple_prod(weight_shape[2:]) * tuple_prod(
+        img_out_shape)
+    fft = FFT_COST_FACTOR * (nfi + nfo + nfi * nfo) * size * \
+        np.log2(max(size, 2)) + nfi * nfo * size
+    return fft < direct
+
+
+class SPSP(LinearBase):
+    '''
+    Convolution layer with a sparse kernel, for sparse and irregular \
+couplings, boundary condition is periodic.
+
+    Args:
+        weight (csr_matrix): (feature_out, feature_in * img_in_dims), \
+couplings of the output pixel at the origin, columns are input offsets \
+(feature_in, img_x, img_y, ...) in 'F' order, \
+they are translated by `strides` for other output pixels.
+        bias (1darray|None): length of num_feature_out, zeros if None.
+        strides (tuple, default=(1,1,...)): displace for convolutions.
+        var_mask (tuple<bool>, len=2, default=(True,True)):\
+                variable mask for weight (nonzeros of kernel) and bias.
+
     Attributes:
-        input_shape ((batch, feature_in, img_x, img_y, ...),\
-                or (feature_in, img_x, img_y): ...)
-        cscmat (csc_matrix): with row indices (feature_in, img_x, img_y, ...),\
-                and column indices (feature_out, img_x', img_y', ...)
-        bias (1darray): (feature_out), in fortran order.
+        weight (csr_matrix): (feature_out, feature_in * img_in_dims), \
+the sparse kernel.
+        bias (1darray): length of num_feature_out.
         strides (tuple): displace for convolutions.
+        var_mask (tuple<bool>, len=2): variable mask for weight and bias.
 
-    Attributes (Derived):
+        (Derived):
         csc_indptr (1darray): column pointers for convolution matrix.
         csc_indices (1darray): row indicator for input array.
-        weight_indices (1darray): row indicator for filter array\
-                (if not contiguous).
     '''
-
-    def __init__(self, input_shape, itype, cscmat, bias, strides=None,
-                 var_mask=(1, 1)):
-        self.cscmat = cscmat
-        self.bias = bias
-        self.var_mask = var_mask
-
-        self.strides = tuple(strides)
-        img_nd = len(self.strides)
+    __display_attrs__ = ['strides', 'var_mask']
+    __buffered__ = True
+    __backward_needs__ = 'x'
+
+    def __init__(self, input_shape, itype, weight, bias, strides=None,
+                 var_mask=(1, 1), **kwargs):
+        super(SPSP, self).__init__(input_shape, itype=itype,
+                                   weight=weight, bias=bias,
+                                   var_mask=var_mask)
+        img_nd = len(input_shape) - 2
         if strides is None:
             strides = (1,) * img_nd
+        self.strides = tuple(strides)
         self.boundary = 'P'
 
-        if tuple_prod(input_shape[1:]) != cscmat.shape[0]:
-            raise ValueError('csc matrix input shape mismatch!\
-                    %s get, but %s desired.' % (
-                cscmat.shape[1], tuple_prod(input_shape[1:])))
-
-        # self.csc_indptr, self.csc_indices,
-        # self.csc_data = scan2csc_sp(input_shape[1:], strides)
-        img_in_shape = input_shape[2:]
+        img_in_shape = input_shape[-img_nd:]
+        if self.weight.shape[1] % tuple_prod(img_in_shape) != 0:
+            raise ValueError('kernel input shape mismatch! \
+%s get, but a multiple of %s desired.' % (
+                self.weight.shape[1], tuple_prod(img_in_shape)))
         self.csc_indptr, self.csc_indices, self.img_out_shape = spscan2csc(
-            kernel_shape, input_shape[-img_nd:], strides, boundary)
-        self.img_out_shape = tuple(
-            [img_is // stride for img_is, stride in zip(
-                img_in_shape, strides)])
-        output_shape = input_shape[:1] + \
+            self.weight, img_in_shape, self.strides)
+        self.output_shape = input_shape[:-img_nd - 1] + \
             (self.num_feature_out,) + self.img_out_shape
-        super(SPSP, self).__init__(input_shape, output_shape, itype=itype)
-
-        if self.num_feature_out * tuple_prod(self.img_out_shape
-                                             ) != cscmat.shape[1]:
-            raise ValueError('csc matrix output shape mismatch! \
-%s get, but %s desired.' % (
-                cscmat.shape[1], self.num_feature_out * i,
-                tuple_prod(self.img_out_shape)))
 
         # use the correct fortran subroutine.
         dtype_token = dtype2token(
             np.find_common_type((self.itype, self.dtype), ()))
-
-        # select function
-        self._fforward = eval('fspsp.forward_conv%s' % dtype_token)
-        self._fbackward = eval('fspsp.backward_conv%s' % dtype_token)
+        self._fforward = get_kernel('spsp.forward', '', dtype_token)
+        self._fbackward = get_kernel('spsp.backward', '', dtype_token)
 
     @property
     def img_nd(self):
@@ -326,37 +594,60 @@ class SPSP(SPConv):
     @property
     def num_feature_in(self):
         '''Dimension of input feature.'''
-        return self.input.shape[1]
+        return self.input_shape[-self.img_nd - 1]
 
     @property
     def num_feature_out(self):
-        '''Dimension of input feature.'''
-        return self.bias.shape[0]
+        '''Dimension of output feature.'''
+        return self.weight.shape[0]
 
-    def forward(self, x, **kwargs):
-        x = x.reshape(xpre + (-1,), order='F')
+    def forward(self, x, out=None, **kwargs):
+        '''
+        Args:
+            x (ndarray): (num_batch, nfi, img_in_dims), input in 'F' order.
+            out (ndarray|None, default=None): (num_batch, nfo, \
+img_out_dims), preallocated output in 'F' order.
+
+        Returns:
+            ndarray, (num_batch, nfo, img_out_dims), output in 'F' order.
+        '''
+        num_batch = tuple_prod(x.shape[:x.ndim - self.img_nd - 1])
+        x = x.reshape((num_batch, -1), order='F')
+        if out is not None:
+            out = out.reshape((num_batch, -1), order='F')
         y = self._fforward(x, csc_indptr=self.csc_indptr,
                            csc_indices=self.csc_indices,
-                           fltr_data=_fltr_flatten,
-                           bias=self.bias, max_nnz_row=_fltr_flatten.shape[-1])
-        y = y.reshape(self.output_shape, order='F')
-        return y
+                           fltr_data=self.weight.data, bias=self.bias, y=out)
+        return y.reshape(self.output_shape, order='F')
 
-    def backward(self, xy, dy, **kwargs):
-        x = x.reshape(xpre + (-1,), order='F')
-        dy = dy.reshape(ypre + (-1,), order='F')
-        mask = self.var_mask
+    def backward(self, xy, dy, out=None, **kwargs):
+        '''
+        Args:
+            xy ((ndarray, ndarray)):
+                * x -> (num_batch, nfi, img_in_dims), input in 'F' order.
+                * y -> (num_batch, nfo, img_out_dims), output in 'F' order.
+            dy (ndarray): (num_batch, nfo, img_out_dims),\
+                    gradient of output in 'F' order.
+            out (ndarray|None, default=None): (num_batch, nfi, \
+img_in_dims), preallocated gradient of input in 'F' order.
 
-        dx, dweight, dbias =\
-            self._fbackward(dy, x,
-                            self.csc_indptr, self.csc_indices,
-                            fltr_data=_fltr_flatten,
-                            do_xgrad=True,
-                            do_wgrad=mask[0],
-                            do_bgrad=mask[1],
-                            max_nnz_row=_fltr_flatten.shape[-1])
-        return masked_concatenate([dweight.ravel(order='F'),
-                                   dbias], mask),\
+        Returns:
+            tuple(1darray, ndarray): dw, dx
+        '''
+        x = xy[0]
+        num_batch = tuple_prod(x.shape[:x.ndim - self.img_nd - 1])
+        x = x.reshape((num_batch, -1), order='F')
+        dy = dy.reshape((num_batch, -1), order='F')
+        if out is not None:
+            out = out.reshape(x.shape, order='F')
+        mask = self.var_mask
+        dweight, dbias = self._gradient_slots(self.weight.data.shape)
+        dx, dweight, dbias = self._fbackward(
+            dy, x, self.csc_indptr, self.csc_indices,
+            fltr_data=self.weight.data, do_xgrad=True, do_wgrad=mask[0],
+            do_bgrad=mask[1], nfo=self.num_feature_out, dx=out,
+            dweight=dweight, dbias=dbias)
+        return self._pack_gradients(dweight, dbias),\
             dx.reshape(self.input_shape, order='F')
 
 
@@ -389,8 +680,8 @@ class SPConvProd(LinearBase):
             np.find_common_type((self.itype, self.dtype), ()))
 
         # use the correct function
-        self._fforward = eval('fspconvprod.forward_%s' % dtype_token)
-        self._fbackward = eval('fspconvprod.backward_%s' % dtype_token)
+        self._fforward = get_kernel('spconvprod.forward', '', dtype_token)
+        self._fbackward = get_kernel('spconvprod.backward', '', dtype_token)
 
     @property
     def img_nd(self):
@@ -0,0 +1,86 @@
+'''
+Tests for the autotuner and its persistent tuning cache.
+'''
+from numpy import *
+from numpy.testing import dec, assert_, assert_raises,\
+    assert_almost_equal, assert_allclose
+import os
+import json
+import shutil
+import tempfile
+import pdb
+
+from .. import autotune
+from ..autotune import tune_spconv, load_tune_cache, clear_tune_cache,\
+    spconv_candidates, cpu_model
+from ..spconv import SPConv
+from ..utils import typed_randn
+
+random.seed(2)
+
+
+def test_tune_spconv():
+    tmpdir = tempfile.mkdtemp()
+    filename = os.path.join(tmpdir, 'cache', 'tune_cache.json')
+    default_file = autotune.TUNE_CACHE_FILE
+    autotune.TUNE_CACHE_FILE = filename
+    try:
+        assert_(isinstance(cpu_model(), str))
+        dtype = 'complex128'
+        input_shape = (-1, 2, 6, 6)
+        weight = typed_randn(dtype, (3, 2, 3, 3))
+        bias = typed_randn(dtype, [3])
+        layer = SPConv(input_shape, dtype, weight, bias)
+        ref = SPConv(input_shape, dtype, weight, bias, strategy='pixel')
+        candidates = spconv_candidates(layer)
+        assert_(dict(strategy='fft') in candidates)
+
+        config = tune_spconv(layer, 4, num_test=1, filename=filename)
+        assert_(config in candidates)
+        assert_(os.path.isfile(filename))
+        with open(filename) as f:
+            content = json.load(f)
+        assert_(len(content) == 1)
+        result = list(content.values())[0]
+        assert_(result['config'] == config)
+        assert_(len(result['timings']) == len(candidates))
+
+        # cached results are reused, also after reloading the file.
+        assert_(tune_spconv(layer, 4, candidates=[], filename=filename)
+                == config)
+        autotune._CACHES.clear()
+        assert_(tune_spconv(layer, 4, candidates=[], filename=filename)
+                == config)
+        tune_spconv(layer, None, num_test=1, filename=filename)
+        assert_(len(load_tune_cache(filename)) == 2)
+
+        # layers with strategy 'tune' select a strategy on first use.
+        tuned = SPConv(input_shape, dtype, weight, bias, strategy='tune')
+        assert_(tuned.strategy == 'tune')
+        x = asfortranarray(typed_randn(dtype, (4, 2, 6, 6)))
+        y = tuned.forward(x)
+        assert_(tuned.strategy == config['strategy'])
+        assert_allclose(y, ref.forward(x), atol=1e-10)
+        dy = asfortranarray(typed_randn(dtype, y.shape))
+        for a, b in zip(tuned.backward((x, y), dy), ref.backward((x, y), dy)):
+            assert_allclose(a, b, atol=1e-10)
+        clear_tune_cache(filename)
+        assert_(not os.path.isfile(filename))
+
+        # settings left out by candidates are restored.
+        layer = SPConv(input_shape, dtype, weight, bias, strategy='pixel')
+        candidates = [dict(strategy='pixel', w_contiguous=False),
+                      dict(strategy='im2col', block_size=7)]
+        config = layer.autotune(4, candidates=candidates, num_test=1,
+                                filename=filename)
+        assert_(layer.strategy == config['strategy'])
+        assert_(layer.w_contiguous)
+        assert_(layer.block_size == config.get('block_size'))
+    finally:
+        autotune.TUNE_CACHE_FILE = default_file
+        clear_tune_cache(filename)
+        shutil.rmtree(tmpdir)
+
+
+if __name__ == '__main__':
+    test_tune_spconv()
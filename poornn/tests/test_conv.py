@@ -7,7 +7,6 @@ from numpy.testing import dec, assert_, assert_raises,\
 from scipy import sparse as sps
 import pdb
 import time
-import pytest
 
 from ..spconv import SPConv, SPSP
 from ..checks import check_numdiff
@@ -287,85 +286,259 @@ def test_conv2d_complex():
     assert_(all(check_numdiff(sv2, num_check=100)))
 
 
-@pytest.mark.skip
-def test_spsp_complex():
-    num_batch = 1
-    dim_x = 10
-    dim_y = 20
-    K1 = 3
-    K2 = 4
-    nfin = 4
-    nfout = 6
-    dtype = 'complex128'
-    nsite = dim_x * dim_y
-    xin_np = asfortranarray(typed_randn(
-        dtype, [num_batch, nfin, dim_x, dim_y]))
-    weight = asfortranarray(typed_randn(dtype, [nfout, nfin, K1, K2]))
+def sparse_kernel(weight, img_in_shape, density):
+    '''sparse kernel of SPSP equivalent to a SPConv weight.'''
+    nfout, nfin = weight.shape[:2]
+    mask = random.random(weight.shape) < density
+    weight = weight * mask
+    kernel = zeros((nfout, nfin) + img_in_shape, dtype=weight.dtype)
+    kernel[(slice(None), slice(None)) +
+           tuple(slice(0, k) for k in weight.shape[2:])] = weight
+    return asfortranarray(weight), sps.csr_matrix(
+        kernel.reshape((nfout, -1), order='F'))
+
+
+def test_spsp():
+    num_batch, nfin, nfout = 3, 4, 6
+    for dtype, img_in_shape, kernel_shape, strides in [
+            ('complex128', (10, 8), (3, 4), (1, 1)),
+            ('float64', (12,), (5,), (2,)),
+            ('float32', (6, 4, 4), (2, 3, 3), (2, 1, 2))]:
+        weight, kernel = sparse_kernel(
+            typed_randn(dtype, (nfout, nfin) + kernel_shape),
+            img_in_shape, 0.5)
+        bias = typed_randn(dtype, [nfout])
+        input_shape = (-1, nfin) + img_in_shape
+        sv = SPConv(input_shape, dtype, weight, bias, strides=strides,
+                    boundary='P')
+        sv2 = SPSP(input_shape, dtype, kernel, bias, strides=strides)
+        print("Testing %s against %s" % (sv2, sv))
+        assert_(sv2.output_shape == sv.output_shape)
+        x = asfortranarray(typed_randn(dtype, (num_batch,) + input_shape[1:]))
+        y = sv.forward(x)
+        y2 = sv2.forward(x)
+        atol = 1e-4 if dtype == 'float32' else 1e-8
+        assert_allclose(y2, y, atol=atol)
+
+        dy = asfortranarray(typed_randn(dtype, y.shape))
+        dwb, dx = sv.backward([x, y], dy)
+        dwb2, dx2 = sv2.backward([x, y2], dy)
+        assert_allclose(dx2, dx, atol=atol)
+        assert_allclose(dwb2[-nfout:], dwb[-nfout:], atol=atol)
+        # gradients of nonzeros in the kernel.
+        ijk = unravel_index(kernel.indices, (nfin,) + img_in_shape,
+                            order='F')
+        fo = repeat(arange(nfout), diff(kernel.indptr))
+        dweight = dwb[:weight.size].reshape(weight.shape, order='F')
+        assert_allclose(dwb2[:kernel.nnz], dweight[(fo,) + ijk], atol=atol)
+        if dtype != 'float32':
+            assert_(all(check_numdiff(sv2, x, num_check=50)))
+
+
+def test_spsp_benchmark():
+    dtype, nfin, nfout = 'float64', 4, 4
+    img_in_shape, kernel_shape = (64, 64), (9, 9)
+    weight, kernel = sparse_kernel(
+        typed_randn(dtype, (nfout, nfin) + kernel_shape), img_in_shape, 0.1)
     bias = typed_randn(dtype, [nfout])
-    sv = SPConv((-1, nfin, dim_x, dim_y), dtype, weight, bias,
-                strides=(1, 1), boundary='P', w_contiguous=True)
-
-    # the corresponding SPSP matrix
-    dmat = zeros((nfin, dim_x, dim_y, nsite * nfout), dtype=dtype)
-
-    fltr_ = transpose(weight, (1, 2, 3, 0))
-    for i in range(dim_x):
-        for j in range(dim_y):
-            k = i * dim_y + j
-            ox = max(0, i + K1 - dim_x + 1)
-            oy = max(0, j + K2 - dim_y + 1)
-            dmat[:, i:i + K1 - ox, j:j + K2 - oy, k *
-                 nfout:(k + 1) * nfout] = fltr_[:, :K1 - ox, :K2 - oy]
-            dmat[:, :ox, :oy, k * nfout:(k + 1) *
-                 nfout] = fltr_[:, K1 - ox:, K2 - oy:]
-    cscmat = sps.csc_matrix(dmat.reshape(nfin * nsite, nfout * nsite))
-    sv2 = SPSP((-1, nfin, dim_x, dim_y), dtype, cscmat, bias, strides=(1, 1))
-    print("Testing forward for %s" % sv)
-    xin_np1 = xin_np[0]
-    ntest = 5
-    t1 = time.time()
-    for i in range(ntest):
-        y2 = sv.forward(xin_np)
-    t2 = time.time()
-    for i in range(ntest):
-        y3 = sv2.forward(xin_np1)
-    t3 = time.time()
-    print("Elapse new = %s, new-sp = %s" % (t2 - t1, t3 - t2))
-    res2 = y2
-    res3 = y3[newaxis]
-    assert_allclose(res2, res2, atol=1e-4)
-
-    print("Testing backward")
-    dy_np = typed_randn(dtype, y2.shape)
-    dy_np1 = dy_np[0]
-
+    input_shape = (-1, nfin) + img_in_shape
+    t0 = time.time()
+    sv = SPConv(input_shape, dtype, weight, bias, boundary='P')
     t1 = time.time()
-    for i in range(ntest):
-        dwb, dx = sv.backward([xin_np, y2], dy_np)
+    sv2 = SPSP(input_shape, dtype, kernel, bias)
     t2 = time.time()
-    for i in range(ntest):
-        dwb1, dx1 = sv2.backward([xin_np1, y3], dy_np1)
-    t3 = time.time()
-    print("Elapse new = %s, new-sp = %s" %
-          ((t2 - t1) / ntest, (t3 - t2) / ntest))
-
-    # reshape back
-    dx1 = dx1[newaxis]
-
-    dweight, dbias = dwb[:sv.weight.size], dwb[sv.weight.size:]
-    dweight1, dbias1 = dwb1[:sv2.weight.size], dwb1[sv.weight.size:]
-    dweight1 = reshape(dweight1, dweight.shape, order='F')
-
-    assert_allclose(dbias, dbias1, atol=1e-3)
-    assert_allclose(dx, dx1, atol=1e-3)
-    assert_allclose(dweight1, dweight, atol=1e-3)
-
-    assert_(all(check_numdiff(sv, num_check=100)))
-    assert_(all(check_numdiff(sv2, num_check=100)))
+    print("Construct dense = %s, sparse = %s" % (t1 - t0, t2 - t1))
+    x = asfortranarray(typed_randn(dtype, (10,) + input_shape[1:]))
+    ntest = 3
+    for layer in [sv, sv2]:
+        t0 = time.time()
+        for i in range(ntest):
+            y = layer.forward(x)
+        t1 = time.time()
+        for i in range(ntest):
+            layer.backward([x, y], y)
+        t2 = time.time()
+        print("%s: forward = %s, backward = %s" % (
+            layer.__class__.__name__, (t1 - t0) / ntest, (t2 - t1) / ntest))
+    assert_allclose(sv2.forward(x), sv.forward(x), atol=1e-8)
+
+
+def test_im2col():
+    num_batch, nfin, nfout = 3, 4, 6
+    for dtype, img_in_shape, kernel_shape, strides, boundary, block_size in [
+            ('complex128', (10, 8), (3, 4), (1, 1), 'P', None),
+            ('complex64', (10, 8), (3, 4), (1, 2), 'O', 7),
+            ('float64', (12,), (5,), (2,), 'P', 1),
+            ('float32', (6, 4, 4), (2, 3, 3), (2, 1, 2), 'P', 5)]:
+        weight = typed_randn(dtype, (nfout, nfin) + kernel_shape)
+        bias = typed_randn(dtype, [nfout])
+        input_shape = (-1, nfin) + img_in_shape
+        sv = SPConv(input_shape, dtype, weight, bias, strides=strides,
+                    boundary=boundary)
+        sv2 = SPConv(input_shape, dtype, weight, bias, strides=strides,
+                     boundary=boundary, strategy='im2col',
+                     block_size=block_size)
+        print("Testing %s against %s" % (sv2, sv))
+        atol = 1e-4 if dtype in ['float32', 'complex64'] else 1e-8
+        for shape in [(num_batch,) + input_shape[1:], input_shape[1:]]:
+            x = asfortranarray(typed_randn(dtype, shape))
+            y = sv.forward(x)
+            y2 = sv2.forward(x)
+            assert_allclose(y2, y, atol=atol)
+            dy = asfortranarray(typed_randn(dtype, y.shape))
+            dwb, dx = sv.backward([x, y], dy)
+            dwb2, dx2 = sv2.backward([x, y2], dy)
+            assert_allclose(dx2, dx, atol=atol)
+            assert_allclose(dwb2, dwb, atol=atol)
+        if atol < 1e-5:
+            assert_(all(check_numdiff(sv2, x, num_check=50)))
+    assert_raises(ValueError, SPConv, input_shape, dtype, weight, bias,
+                  strategy='gemm')
+
+
+def test_im2col_benchmark():
+    dtype, nfin, nfout, num_batch = 'float64', 2, 4, 8
+    input_shape = (-1, nfin, 32, 32)
+    weight = typed_randn(dtype, (nfout, nfin, 3, 3))
+    bias = typed_randn(dtype, [nfout])
+    x = asfortranarray(typed_randn(dtype, (num_batch,) + input_shape[1:]))
+    ntest = 3
+    for strategy in ['pixel', 'im2col']:
+        layer = SPConv(input_shape, dtype, weight, bias, strategy=strategy)
+        t0 = time.time()
+        for i in range(ntest):
+            y = layer.forward(x)
+        t1 = time.time()
+        for i in range(ntest):
+            layer.backward([x, y], y)
+        t2 = time.time()
+        print("%s: forward = %s, backward = %s" % (
+            strategy, (t1 - t0) / ntest, (t2 - t1) / ntest))
+
+
+def test_fft():
+    num_batch, nfin, nfout = 3, 2, 3
+    for dtype, img_in_shape, kernel_shape, strides, var_mask in [
+            ('complex128', (10, 8), (3, 4), (1, 1), (1, 1)),
+            ('complex128', (6, 4), (8, 5), (2, 2), (1, 0)),
+            ('float64', (12,), (12,), (3,), (1, 1)),
+            ('float64', (7, 5), (7, 5), (1, 1), (0, 1)),
+            ('float32', (6, 4, 4), (2, 3, 3), (2, 1, 2), (1, 1))]:
+        weight = typed_randn(dtype, (nfout, nfin) + kernel_shape)
+        bias = typed_randn(dtype, [nfout])
+        input_shape = (-1, nfin) + img_in_shape
+        sv = SPConv(input_shape, dtype, weight, bias, strides=strides,
+                    strategy='pixel', var_mask=var_mask)
+        sv2 = SPConv(input_shape, dtype, weight, bias, strides=strides,
+                     strategy='fft', var_mask=var_mask)
+        print("Testing %s against %s" % (sv2, sv))
+        atol = 1e-4 if dtype == 'float32' else 1e-8
+        for shape in [(num_batch,) + input_shape[1:], input_shape[1:]]:
+            x = asfortranarray(typed_randn(dtype, shape))
+            y = sv.forward(x)
+            out = empty_like(y, order='F')
+            y2 = sv2.forward(x, out=out)
+            assert_(y2.dtype == y.dtype and may_share_memory(y2, out))
+            assert_allclose(y2, y, atol=atol)
+            dy = asfortranarray(typed_randn(dtype, y.shape))
+            dwb, dx = sv.backward([x, y], dy)
+            dwb2, dx2 = sv2.backward([x, y2], dy)
+            assert_(dx2.dtype == dx.dtype and dwb2.dtype == dwb.dtype)
+            assert_allclose(dx2, dx, atol=atol)
+            assert_allclose(dwb2, dwb, atol=atol)
+        if dtype != 'float32':
+            assert_(all(check_numdiff(sv2, x, num_check=50)))
+    assert_raises(ValueError, SPConv, input_shape, dtype, weight, bias,
+                  boundary='O', strategy='fft')
+
+    # large periodic kernels select FFT.
+    weight = typed_randn('complex128', (2, 2, 16, 16))
+    sv = SPConv((-1, 2, 16, 16), 'complex128', weight, None)
+    assert_(sv.strategy == 'fft')
+    sv = SPConv((-1, 2, 16, 16), 'complex128', weight[:, :, :3, :3], None)
+    assert_(sv.strategy == 'pixel')
+    sv = SPConv((-1, 2, 16, 16), 'complex128', weight, None, boundary='O')
+    assert_(sv.strategy == 'pixel')
+
+
+def test_fft_benchmark():
+    dtype, nfin, nfout, num_batch = 'complex128', 2, 2, 10
+    input_shape = (-1, nfin, 16, 16)
+    weight = typed_randn(dtype, (nfout, nfin, 16, 16))
+    bias = typed_randn(dtype, [nfout])
+    x = asfortranarray(typed_randn(dtype, (num_batch,) + input_shape[1:]))
+    ntest = 3
+    for strategy in ['pixel', 'fft']:
+        layer = SPConv(input_shape, dtype, weight, bias, strategy=strategy)
+        t0 = time.time()
+        for i in range(ntest):
+            y = layer.forward(x)
+        t1 = time.time()
+        for i in range(ntest):
+            layer.backward([x, y], y)
+        t2 = time.time()
+        print("%s: forward = %s, backward = %s" % (
+            strategy, (t1 - t0) / ntest, (t2 - t1) / ntest))
+
+
+def test_gemm3m():
+    num_batch, nfin, nfout = 3, 4, 6
+    for dtype, strategy, w_contiguous in [
+            ('complex128', 'pixel', True), ('complex128', 'pixel', False),
+            ('complex64', 'im2col', True), ('complex128', 'fft', True),
+            ('float64', 'pixel', True)]:
+        weight = typed_randn(dtype, (nfout, nfin, 3, 2))
+        bias = typed_randn(dtype, [nfout])
+        input_shape = (-1, nfin, 6, 5)
+        sv = SPConv(input_shape, dtype, weight, bias, strategy='pixel')
+        sv2 = SPConv(input_shape, dtype, weight, bias, strategy=strategy,
+                     w_contiguous=w_contiguous, gemm3m=True)
+        print("Testing %s against %s" % (sv2, sv))
+        atol = 1e-4 if dtype == 'complex64' else 1e-10
+        for shape in [(num_batch,) + input_shape[1:], input_shape[1:]]:
+            x = asfortranarray(typed_randn(dtype, shape))
+            y = sv.forward(x)
+            y2 = sv2.forward(x)
+            assert_allclose(y2, y, atol=atol)
+            dy = asfortranarray(typed_randn(dtype, y.shape))
+            dwb, dx = sv.backward([x, y], dy)
+            dwb2, dx2 = sv2.backward([x, y2], dy)
+            assert_allclose(dx2, dx, atol=atol)
+            assert_allclose(dwb2, dwb, atol=atol)
+        if dtype == 'complex128':
+            assert_(all(check_numdiff(sv2, x, num_check=50)))
+
+
+def test_gemm3m_benchmark():
+    dtype, nfin, nfout, num_batch = 'complex128', 16, 32, 32
+    input_shape = (-1, nfin, 16, 16)
+    weight = typed_randn(dtype, (nfout, nfin, 3, 3))
+    bias = typed_randn(dtype, [nfout])
+    x = asfortranarray(typed_randn(dtype, (num_batch,) + input_shape[1:]))
+    ntest = 3
+    for gemm3m in [False, True]:
+        layer = SPConv(input_shape, dtype, weight, bias, strategy='im2col',
+                       gemm3m=gemm3m)
+        t0 = time.time()
+        for i in range(ntest):
+            y = layer.forward(x)
+        t1 = time.time()
+        for i in range(ntest):
+            layer.backward([x, y], y)
+        t2 = time.time()
+        print("gemm3m = %s: forward = %s, backward = %s" % (
+            gemm3m, (t1 - t0) / ntest, (t2 - t1) / ntest))
 
 
 def run_all():
-    # test_spsp_complex()
+    test_fft()
+    test_fft_benchmark()
+    test_im2col()
+    test_im2col_benchmark()
+    test_gemm3m()
+    test_gemm3m_benchmark()
+    test_spsp()
+    test_spsp_benchmark()
     test_conv2d_complex()
     test_conv2d()
     test_conv2d_per()
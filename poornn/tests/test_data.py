@@ -0,0 +1,75 @@
+'''
+Tests for datasets.
+'''
+from numpy import *
+from numpy.testing import dec, assert_, assert_raises,\
+    assert_almost_equal, assert_allclose
+import os
+import gzip
+import struct
+import shutil
+import tempfile
+import pdb
+
+from ..data import load_idx, load_array, MiniBatches
+
+random.seed(2)
+
+
+def write_idx(filename, arr):
+    opener = gzip.open if filename.endswith('.gz') else open
+    with opener(filename, 'wb') as f:
+        f.write(struct.pack('>HBB', 0, 0x08, arr.ndim))
+        f.write(struct.pack('>' + 'I' * arr.ndim, *arr.shape))
+        f.write(arr.astype('uint8').tobytes())
+
+
+def test_load():
+    folder = tempfile.mkdtemp()
+    try:
+        images = random.randint(0, 256, (7, 4, 3)).astype('uint8')
+        for name in ['images.idx', 'images.idx.gz']:
+            filename = os.path.join(folder, name)
+            write_idx(filename, images)
+            assert_allclose(load_array(filename), images)
+        assert_(isinstance(load_idx(os.path.join(folder, 'images.idx')),
+                           memmap))
+        filename = os.path.join(folder, 'images.npy')
+        save(filename, images)
+        assert_(isinstance(load_array(filename), memmap))
+        assert_allclose(load_array(filename), images)
+    finally:
+        shutil.rmtree(folder)
+
+
+def test_minibatches():
+    num_samples = 53
+    # sample i is filled with i, labeled with i % 10.
+    x = (arange(num_samples)[:, None, None] * ones((1, 4, 3)))
+    y = arange(num_samples) % 10
+    batches = MiniBatches(x, y, batch_size=8, input_shape=(-1, 1, 4, 3),
+                          num_classes=10, scale=0.5, seed=3)
+    assert_(len(batches) == 6)
+    for epoch in range(2):
+        visited = []
+        for xb, var_dict in batches:
+            assert_(xb.shape == (8, 1, 4, 3) and xb.flags.f_contiguous)
+            yb = var_dict['y_true']
+            assert_(yb.shape == (8, 10) and yb.flags.f_contiguous)
+            indices = xb[:, 0, 0, 0] * 2
+            assert_allclose(xb * 2, indices[:, None, None, None] *
+                            ones((1, 1, 4, 3)))
+            assert_allclose(argmax(yb, axis=1), indices % 10)
+            visited.extend(indices)
+        assert_(len(set(visited)) == 48)
+
+    # stop in the middle of an epoch.
+    for k, (xb, var_dict) in enumerate(batches):
+        if k == 1:
+            break
+    assert_raises(ValueError, MiniBatches, x, y[:5])
+
+
+if __name__ == '__main__':
+    test_load()
+    test_minibatches()
@@ -0,0 +1,116 @@
+'''
+Tests for data parallel training.
+'''
+from numpy import *
+from numpy.testing import dec, assert_, assert_raises,\
+    assert_almost_equal, assert_allclose
+import multiprocessing
+import signal
+import os
+import pdb
+
+from ..nets import ANN
+from ..linears import Linear
+from ..dataparallel import DataParallel
+from ..utils import typed_randn
+from .. import functions
+
+random.seed(2)
+
+
+def build_net(dtype, reduction=True):
+    ann = ANN()
+    ann.layers.append(Linear((-1, 8), dtype, weight=(6, 8),
+                             bias=0.1 * ones(6, dtype=dtype)))
+    ann.add_layer(functions.ReLU)
+    ann.add_layer(functions.DropOut, keep_rate=0.5, axis=1)
+    ann.add_layer(Linear, weight=(3, 6), bias=None)
+    ann.add_layer(functions.SoftMaxCrossEntropy, axis=1)
+    if reduction:
+        ann.add_layer(functions.Mean, axis=0)
+    return ann
+
+
+def test_data_parallel():
+    num_batch = 10
+    var_dict = {'y_true': eye(3)[random.randint(0, 3, num_batch)],
+                'seed': 2}
+    for dtype in ['float64', 'complex128']:
+        for reduction in [True, False]:
+            ann = build_net(dtype, reduction)
+            ann2 = build_net(dtype, reduction)
+            ann2.set_variables(ann.get_variables())
+            x = asfortranarray(typed_randn(dtype, (num_batch, 8)))
+            dy = array(1.) if reduction else random.random(num_batch)
+            with DataParallel(ann2, num_workers=3) as trainer:
+                for step in range(3):
+                    ann.set_runtime_vars(var_dict)
+                    cache = {}
+                    y = ann.forward(x, data_cache=cache)
+                    dv, dx = ann.backward((x, y), dy, data_cache=cache)
+
+                    y2, dv2 = trainer.compute_gradients(x, dy, var_dict)
+                    assert_allclose(y2, y)
+                    assert_allclose(dv2, dv)
+
+                    # shared variables are updated inplace.
+                    ann.set_variables(ann.get_variables() - 0.1 * dv)
+                    trainer.variables -= 0.1 * dv2
+                assert_allclose(ann2.get_variables(), ann.get_variables())
+
+                # a new batch size forks new workers.
+                var_dict4 = {'y_true': var_dict['y_true'][:4], 'seed': 2}
+                y2, dv2 = trainer.compute_gradients(
+                    x[:4], dy if reduction else dy[:4], var_dict4)
+                ann.set_runtime_vars(var_dict4)
+                assert_allclose(y2, ann.forward(x[:4]))
+
+
+def test_start_method():
+    # workers are forked even if the default start method is spawn.
+    if not hasattr(multiprocessing, 'get_context'):
+        return
+    num_batch, dtype = 6, 'float64'
+    var_dict = {'y_true': eye(3)[random.randint(0, 3, num_batch)],
+                'seed': 2}
+    ann, ann2 = build_net(dtype), build_net(dtype)
+    ann2.set_variables(ann.get_variables())
+    x = asfortranarray(typed_randn(dtype, (num_batch, 8)))
+    ann.set_runtime_vars(var_dict)
+    cache = {}
+    y = ann.forward(x, data_cache=cache)
+    dv, dx = ann.backward((x, y), data_cache=cache)
+    method = multiprocessing.get_start_method()
+    multiprocessing.set_start_method('spawn', force=True)
+    try:
+        with DataParallel(ann2, num_workers=2) as trainer:
+            y2, dv2 = trainer.compute_gradients(x, var_dict=var_dict)
+    finally:
+        multiprocessing.set_start_method(method, force=True)
+    assert_allclose(y2, y)
+    assert_allclose(dv2, dv)
+
+
+def test_dead_worker():
+    num_batch, dtype = 6, 'float64'
+    var_dict = {'y_true': eye(3)[random.randint(0, 3, num_batch)],
+                'seed': 2}
+    ann = build_net(dtype)
+    x = asfortranarray(typed_randn(dtype, (num_batch, 8)))
+    with DataParallel(ann, num_workers=2) as trainer:
+        y, dv = trainer.compute_gradients(x, var_dict=var_dict)
+        # a worker killed by a signal does not hang the parent.
+        worker = trainer._workers[1]
+        os.kill(worker.pid, signal.SIGKILL)
+        worker.join()
+        assert_raises(RuntimeError, trainer.compute_gradients, x,
+                      var_dict=var_dict)
+        assert_(trainer._workers == [])
+        y2, dv2 = trainer.compute_gradients(x, var_dict=var_dict)
+        assert_allclose(y2, y)
+
+
+if __name__ == '__main__':
+    test_data_parallel()
+    test_start_method()
+    test_dead_worker()
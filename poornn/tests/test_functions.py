@@ -97,6 +97,103 @@ def test_pooling_per():
         assert_(all(check_numdiff(func, eta_x=1e-3)))
 
 
+def test_pooling_argmax():
+    for dtype in ['complex128', 'float32']:
+        for mode in ['max', 'max-abs', 'min', 'min-abs', 'mean']:
+            func = Pooling(input_shape=(-1, 3, 6, 4), itype=dtype,
+                           kernel_shape=(2, 2), mode=mode)
+            assert_(func.__backward_needs__ == '')
+            x = asfortranarray(typed_randn(dtype, (5, 3, 6, 4)))
+            cache = {}
+            y = func.forward(x, data_cache=cache)
+            assert_allclose(y, func.forward(x))
+            dy = asfortranarray(typed_randn(dtype, y.shape))
+            dx = func.backward([x, y], dy)[1]
+            if mode != 'mean':
+                argmax = cache['%d-argmax' % id(func)]
+                assert_(argmax.dtype == int32 and argmax.size == y.size)
+            # backward with cached positions does not read x.
+            dx2 = func.backward([zeros_like(x), y], dy, data_cache=cache)[1]
+            assert_allclose(dx2, dx)
+        func = Pooling(input_shape=(-1, 3, 6, 4), itype=dtype,
+                       kernel_shape=(2, 2), mode='max', cache_argmax=False)
+        assert_(func.__backward_needs__ == 'x')
+        cache = {}
+        func.forward(x, data_cache=cache)
+        assert_(len(cache) == 0)
+
+
+def csc_pooling(x, dy, indptr, indices, mode):
+    '''reference pooling over windows of a csc matrix, mode = 0-4.'''
+    dim_out = len(indptr) - 1
+    y = zeros((x.shape[0], dim_out), dtype=x.dtype)
+    dx = zeros_like(x)
+    for col in range(dim_out):
+        rows = indices[indptr[col] - 1:indptr[col + 1] - 1] - 1
+        win = x[:, rows]
+        if mode == 4:
+            y[:, col] = win.mean(axis=1)
+            dx[:, rows] += dy[:, col:col + 1] / len(rows)
+            continue
+        key = abs(win) if mode in (1, 3) else win.real
+        sel = key.argmax(axis=1) if mode < 2 else key.argmin(axis=1)
+        ib = arange(x.shape[0])
+        y[:, col] = win[ib, sel]
+        dx[ib, rows[sel]] += dy[:, col]
+    return y, dx
+
+
+def test_pooling_tiled():
+    from ..kernels import get_kernel
+    from ..utils import scan2csc, dtype2token
+    for dtype in ['complex128', 'float32']:
+        token = dtype2token(dtype)
+        for img_in_shape, kernel_shape in [((6, 4), (2, 2)), ((6, 4), (3, 1)),
+                                           ((4, 6, 2), (2, 3, 2)), ((8,), (8,)),
+                                           ((4, 6), (4, 6))]:
+            indptr, indices, img_out_shape = scan2csc(
+                kernel_shape, img_in_shape, kernel_shape, 'O')
+            dim_out = len(indptr) - 1
+            x = asfortranarray(typed_randn(dtype, (7, len(indices) // dim_out
+                                                   * dim_out)))
+            # ties, the first one in a window is selected.
+            x[:3] = x[:3].real.round()
+            dy = asfortranarray(typed_randn(dtype, (7, dim_out)))
+            for mode in range(5):
+                y0, dx0 = csc_pooling(x, dy, indptr, indices, mode)
+                for backend in ['fortran', 'numpy']:
+                    kwargs = dict(img_in_shape=img_in_shape,
+                                  kernel_shape=kernel_shape, mode=mode)
+                    y = get_kernel('pooling.forward_tiled', '', token,
+                                   backend=backend)(x, dim_out=dim_out,
+                                                    **kwargs)
+                    assert_allclose(y, y0, rtol=1e-5)
+                    dx = get_kernel('pooling.backward_tiled', '', token,
+                                    backend=backend)(dy, x, **kwargs)
+                    assert_allclose(dx, dx0, rtol=1e-5)
+                    if mode == 4:
+                        continue
+                    y, argmax = get_kernel('pooling.forward_tiled_argmax',
+                                           '', token, backend=backend)(
+                        x, dim_out=dim_out, **kwargs)
+                    assert_allclose(y, y0, rtol=1e-5)
+                    dx = get_kernel('pooling.backward_argmax', '', token,
+                                    backend=backend)(dy, argmax,
+                                                     dim_in=x.shape[1])
+                    assert_allclose(dx, dx0, rtol=1e-5)
+
+
+def test_global_pooling():
+    for mode in ['max', 'mean', 'min-abs']:
+        func = GlobalPooling((-1, 3, 4, 6), 'complex128', mode=mode)
+        x = asfortranarray(typed_randn('complex128', (5, 3, 4, 6)))
+        y = func.forward(x)
+        assert_(y.shape == (5, 3) and func.output_shape == (-1, 3))
+        ref = Pooling((-1, 3, 4, 6), 'complex128', (4, 6), mode=mode)
+        assert_allclose(y, ref.forward(x)[:, :, 0, 0])
+        assert_(all(check_numdiff(func, x, eta_x=1e-4)))
+
+
 def test_exp():
     oldshape = (3, 4, 2)
     itype = 'complex128'
@@ -435,6 +532,9 @@ def run_all():
     test_log()
     test_convprod()
     test_pooling_per()
+    test_pooling_argmax()
+    test_pooling_tiled()
+    test_global_pooling()
     test_square_loss()
     test_mul()
     test_power()
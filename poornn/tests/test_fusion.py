@@ -0,0 +1,107 @@
+'''
+Tests for fused layers.
+'''
+from numpy import *
+from numpy.testing import dec, assert_, assert_raises,\
+    assert_almost_equal, assert_allclose
+import pdb
+
+from ..fusion import LinearReLU, SPConvReLUPooling
+from ..nets import ANN
+from ..spconv import SPConv
+from ..linears import Linear
+from ..utils import typed_randn
+from .. import functions
+
+random.seed(2)
+
+
+def test_linear_relu():
+    for dtype in ['float64', 'complex128']:
+        for leak in [0, 0.1]:
+            linear = Linear((-1, 10), dtype, weight=(6, 10),
+                            bias=typed_randn(dtype, (6,)))
+            relu = functions.ReLU(linear.output_shape, dtype, leak=leak,
+                                  mode='r')
+            ann = ANN([linear, relu])
+            func = LinearReLU((-1, 10), dtype, linear.weight, linear.bias,
+                              leak=leak)
+            print('Test %s against unfused layers.' % func)
+            x = asfortranarray(typed_randn(dtype, (70, 10)))
+            dy = asfortranarray(typed_randn(dtype, (70, 6)))
+            cache = {}
+            y = ann.forward(x, data_cache=cache)
+            y2 = func.forward(x)
+            assert_allclose(y, y2)
+            dv, dx = ann.backward((x, y), dy.copy(order='F'),
+                                  data_cache=cache)
+            dv2, dx2 = func.backward((x, y2), dy)
+            assert_allclose(dv, dv2)
+            assert_allclose(dx, dx2)
+
+
+def test_conv_relu_pool():
+    for dtype in ['float64', 'complex128']:
+        for mode in ['max', 'min-abs']:
+            conv = SPConv((-1, 2, 6, 6), dtype, weight=(3, 2, 3, 3),
+                          bias=typed_randn(dtype, (3,)))
+            relu = functions.ReLU(conv.output_shape, dtype, leak=0.1,
+                                  mode='r')
+            pool = functions.Pooling(relu.output_shape, dtype,
+                                     kernel_shape=(2, 2), mode=mode)
+            ann = ANN([conv, relu, pool])
+            func = SPConvReLUPooling((-1, 2, 6, 6), dtype, conv.weight,
+                                     conv.bias, pool_shape=(2, 2),
+                                     mode=mode, leak=0.1)
+            print('Test %s against unfused layers.' % func)
+            for shape in [(4, 2, 6, 6), (2, 6, 6)]:
+                x = asfortranarray(typed_randn(dtype, shape))
+                dy = asfortranarray(typed_randn(dtype, shape[:-3] +
+                                                (3, 3, 3)))
+                cache, cache2 = {}, {}
+                y = ann.forward(x, data_cache=cache)
+                y2 = func.forward(x, data_cache=cache2)
+                assert_allclose(y, y2)
+                dv, dx = ann.backward((x, y), dy.copy(order='F'),
+                                      data_cache=cache)
+                dv2, dx2 = func.backward((x, y2), dy, data_cache=cache2)
+                assert_allclose(dv, dv2)
+                assert_allclose(dx, dx2)
+
+
+def test_fuse():
+    for dtype in ['float64', 'complex128']:
+        ann = ANN()
+        ann.layers.append(SPConv((-1, 1, 8, 8), dtype, weight=(4, 1, 3, 3),
+                                 bias=None, boundary='P'))
+        ann.add_layer(functions.ReLU, mode='r')
+        ann.add_layer(functions.Pooling, kernel_shape=(2, 2), mode='max')
+        ann.add_layer(functions.Reshape, output_shape=(-1, 64))
+        ann.add_layer(Linear, weight=(10, 64), bias=None, label='fc')
+        ann.add_layer(functions.ReLU, mode='r')
+        ann.add_layer(Linear, weight=(3, 10), bias=None)
+        ann.add_layer(functions.ReLU, mode='r', label='out')
+        ann.add_layer(functions.Sum, axis=1)
+        x = asfortranarray(typed_randn(dtype, (5, 1, 8, 8)))
+        cache = {}
+        y = ann.forward(x, data_cache=cache)
+        dv, dx = ann.backward((x, y), dy=ones(5, dtype=dtype),
+                              data_cache=cache)
+
+        # the last chain is kept, the relu is labeled.
+        assert_(ann.fuse() == 2)
+        assert_(ann.num_layers == 6)
+        assert_(isinstance(ann['fc'], LinearReLU))
+        cache = {}
+        y2 = ann.forward(x, data_cache=cache)
+        dv2, dx2 = ann.backward((x, y2), dy=ones(5, dtype=dtype),
+                                data_cache=cache)
+        assert_allclose(y, y2)
+        assert_allclose(dv, dv2)
+        assert_allclose(dx, dx2)
+
+
+if __name__ == '__main__':
+    test_linear_relu()
+    test_conv_relu_pool()
+    test_fuse()
@@ -0,0 +1,57 @@
+'''
+Benchmark of import time, heavy dependencies are only imported on use.
+'''
+from numpy.testing import dec, assert_, assert_raises
+import sys
+import subprocess
+import pdb
+
+HEAVY_MODULES = ['poornn.lib.spconv', 'poornn.lib.spsp', 'poornn.lib.linear',
+                 'poornn.lib.pooling', 'poornn.lib.relu',
+                 'poornn.lib.convprod', 'poornn.lib.fused',
+                 'poornn.lib.futils', 'scipy.sparse', 'scipy.fftpack']
+
+
+def run_script(script):
+    '''
+    run `script` in a fresh interpreter, returns (seconds, loaded modules).
+    '''
+    code = '''
+import sys, time
+t0 = time.time()
+%s
+t = time.time() - t0
+print(t)
+print(' '.join(sys.modules))
+''' % script
+    out = subprocess.check_output([sys.executable, '-c', code])
+    lines = out.decode().strip().split('\n')
+    return float(lines[-2]), set(lines[-1].split())
+
+
+def test_import_lazy():
+    for script, expect in [
+            ('import poornn', []),
+            ('import poornn.nets', []),
+            ('from poornn import Linear, functions\n'
+             'Linear((-1, 4), "float64", weight=(3, 4), bias=None)\n'
+             'functions.ReLU((-1, 3), "float64")',
+             ['poornn.lib.linear', 'poornn.lib.relu']),
+    ]:
+        t, modules = run_script(script)
+        print('%s: %.4f s' % (script.replace('\n', '; '), t))
+        loaded = sorted(set(HEAVY_MODULES) & modules)
+        assert_(loaded == expect, '%s loaded %s' % (script, loaded))
+
+
+def test_lazy_attrs():
+    import poornn
+    from poornn.nets import ANN
+    assert_(poornn.ANN is ANN)
+    assert_('SPConv' in dir(poornn))
+    assert_raises(AttributeError, getattr, poornn, 'NotALayer')
+
+
+if __name__ == '__main__':
+    test_import_lazy()
+    test_lazy_attrs()
@@ -0,0 +1,126 @@
+'''
+Tests for the kernel registry.
+'''
+from numpy import *
+from numpy.testing import dec, assert_, assert_raises,\
+    assert_almost_equal, assert_allclose
+import warnings
+import pdb
+
+from ..kernels import get_kernel, register_kernel, register_backend,\
+    set_backends, kernel_backend, BACKENDS, FORTRAN_KERNELS
+from ..nets import ANN
+from ..spconv import SPConv
+from ..linears import Linear
+from ..utils import typed_randn
+from .. import functions
+
+random.seed(2)
+
+
+def test_default_backends():
+    layer = SPConv((-1, 1, 8), 'complex128', weight=(2, 1, 3), bias=None,
+                   w_contiguous=False)
+    assert_(layer.get_backends() == dict(
+        [(key, 'fortran') for key in ['_fforward', '_fbackward',
+                                      '_fforward1', '_fbackward1']]))
+    fft = functions.FFT((-1, 8), 'complex128', axis=1)
+    assert_(fft.get_backends() == {'_fforward': 'scipy'})
+    assert_(get_kernel('linear.forward', '', 'd') is
+            get_kernel('linear.forward', '', 'd'))
+    assert_raises(NotImplementedError, get_kernel, 'linear.forward', 'x', 'd')
+    assert_raises(ValueError, functions.FFT, (-1, 8), 'complex128', axis=1,
+                  kernel='not_a_kernel')
+
+
+def test_numpy_backend():
+    for dtype in ['float32', 'float64', 'complex128']:
+        x = asfortranarray(typed_randn(dtype, (7, 10)))
+        dy = asfortranarray(typed_randn(dtype, (7, 6)))
+        nets = []
+        for backends in [['fortran'], ['numpy', 'fortran']]:
+            previous = set_backends(backends)
+            try:
+                linear = Linear((-1, 10), dtype, weight=(6, 10),
+                                bias=0.1 * ones(6, dtype=dtype))
+                relu = functions.ReLU(linear.output_shape, dtype, leak=0.1,
+                                      mode='r')
+                nets.append(ANN([linear, relu]))
+            finally:
+                set_backends(previous)
+        ann, ann2 = nets
+        print('Test numpy backend for %s' % ann2)
+        assert_(ann2.get_backends() ==
+                [{'_fforward': 'numpy', '_fbackward': 'numpy'}] * 2)
+        ann2.set_variables(ann.get_variables())
+        cache, cache2 = {}, {}
+        y = ann.forward(x, data_cache=cache)
+        y2 = ann2.forward(x, data_cache=cache2)
+        assert_(y2.dtype == y.dtype)
+        assert_allclose(y, y2, rtol=1e-5)
+        dv, dx = ann.backward((x, y), dy.copy(order='F'), data_cache=cache)
+        dv2, dx2 = ann2.backward((x, y2), dy.copy(order='F'),
+                                 data_cache=cache2)
+        assert_allclose(dv, dv2, rtol=1e-5, atol=1e-6)
+        assert_allclose(dx, dx2, rtol=1e-5, atol=1e-6)
+
+
+def test_register_backend():
+    calls = []
+
+    def resolver(operation, variant, dtype):
+        calls.append((operation, variant, dtype))
+        if operation == 'relu.forward':
+            return lambda x, leak, y=None: abs(x)
+
+    previous = list(BACKENDS)
+    register_backend('custom', resolver, priority=0)
+    try:
+        for i in range(2):
+            relu = functions.ReLU((-1, 3), 'float64')
+        assert_(calls == [('relu.forward', 'r', 'd'),
+                          ('relu.backward', 'r', 'd'),
+                          ('relu.backward', 'r', None)])
+        assert_(relu.get_backends() == {'_fforward': 'custom',
+                                        '_fbackward': 'fortran'})
+        assert_allclose(relu.forward(array([[-1., 2, -3]])), [[1, 2, 3]])
+
+        func = lambda x: x
+        register_kernel('identity', '', None, func, backend='custom')
+        assert_(get_kernel('identity', dtype='z') is func)
+        assert_(kernel_backend(func) == 'custom')
+    finally:
+        set_backends(previous)
+    assert_(relu.get_backends()['_fforward'] == 'custom')
+    assert_(functions.ReLU((-1, 3), 'float64').get_backends() ==
+            {'_fforward': 'fortran', '_fbackward': 'fortran'})
+
+
+def test_missing_extension():
+    FORTRAN_KERNELS['missing.forward'] = ('not_built', 'forward_{dtype}')
+    FORTRAN_KERNELS['missing.backward'] = ('not_built', 'backward_{dtype}')
+    try:
+        with warnings.catch_warnings(record=True) as records:
+            warnings.simplefilter('always')
+            for operation in ['missing.forward', 'missing.backward']:
+                assert_raises(NotImplementedError, get_kernel, operation,
+                              '', 'd', backend='fortran')
+        # a broken build is reported once, naming the extension.
+        assert_(len(records) == 1)
+        assert_('poornn.lib.not_built' in str(records[0].message))
+        # a routine missing from a built extension is not reported.
+        with warnings.catch_warnings(record=True) as records:
+            warnings.simplefilter('always')
+            assert_raises(NotImplementedError, get_kernel, 'linear.forward',
+                          '', 'x', backend='fortran')
+        assert_(records == [])
+    finally:
+        del FORTRAN_KERNELS['missing.forward']
+        del FORTRAN_KERNELS['missing.backward']
+
+
+if __name__ == '__main__':
+    test_default_backends()
+    test_numpy_backend()
+    test_register_backend()
+    test_missing_extension()
@@ -11,6 +11,7 @@ import pdb
 import time
 
 from ..linears import *
+from ..kernels import set_backends
 from ..checks import check_numdiff
 from ..utils import typed_randn
 
@@ -108,6 +109,33 @@ def test_linear_complex():
     assert_allclose(sv.get_variables(), zeros(0))
 
 
+def test_linear_gemm3m():
+    num_batch, dim_in, dim_out = 7, 30, 20
+    for dtype, atol in [('complex128', 1e-12), ('complex64', 1e-4),
+                        ('float64', 1e-12)]:
+        x = asfortranarray(typed_randn(dtype, [num_batch, dim_in]))
+        weight = asfortranarray(typed_randn(dtype, [dim_out, dim_in]))
+        bias = typed_randn(dtype, [dim_out])
+        sv = Linear((-1, dim_in), dtype, weight, bias)
+        y = sv.forward(x)
+        dy = asfortranarray(typed_randn(dtype, y.shape))
+        dwb, dx = sv.backward((x, y), dy)
+        for backends in [['fortran'], ['numpy']]:
+            previous = set_backends(backends)
+            try:
+                sv2 = Linear((-1, dim_in), dtype, weight, bias, gemm3m=True)
+            finally:
+                set_backends(previous)
+            print("Testing %s against %s" % (sv2, sv))
+            y2 = sv2.forward(x)
+            assert_allclose(y2, y, atol=atol)
+            dwb2, dx2 = sv2.backward((x, y2), dy)
+            assert_allclose(dx2, dx, atol=atol)
+            assert_allclose(dwb2, dwb, atol=atol)
+        if dtype == 'complex128':
+            assert_(all(check_numdiff(sv2, x, num_check=50)))
+
+
 def test_splinear():
     num_batch = 2
     dim_in = 30
@@ -150,6 +178,15 @@ def test_splinear():
     print("Testing numdiff for %s" % sv)
     assert_(all(check_numdiff(sv2, num_check=100)))
 
+    # gradients are written into bound storage.
+    dwb1, dx1 = sv2.backward([x, y1], dy)
+    gradients = zeros(sv2.num_variables, dtype=dtype)
+    sv2.bind_variables(sv2.get_variables(), gradients)
+    dwb2, dx2 = sv2.backward([x, y1], dy)
+    assert_(dwb2 is gradients)
+    assert_allclose(dwb2, dwb1)
+    assert_allclose(dx2, dx1)
+
 
 def test_linear1():
     try:
@@ -222,11 +259,23 @@ def test_apdot_complex():
     print("Testing numdiff for %s" % sv)
     assert_(all(check_numdiff(sv, num_check=100)))
 
+    # gradients are written into bound storage.
+    y = sv.forward(xin_np)
+    dy = typed_randn('complex128', y.shape)
+    dwb, dx = sv.backward([xin_np, y], dy)
+    gradients = zeros(sv.num_variables, dtype='complex128')
+    sv.bind_variables(sv.get_variables(), gradients)
+    dwb2, dx2 = sv.backward([xin_np, y], dy)
+    assert_(dwb2 is gradients)
+    assert_allclose(dwb2, dwb)
+    assert_allclose(dx2, dx)
+
 
 def run_all():
     test_splinear()
     test_apdot_complex()
     test_linear_complex()
+    test_linear_gemm3m()
     test_linear()
     test_linear1()
 
@@ -0,0 +1,112 @@
+'''
+Tests for memory planning.
+'''
+from numpy import *
+from numpy.testing import dec, assert_, assert_raises,\
+    assert_almost_equal, assert_allclose
+import pdb
+
+from ..nets import ANN
+from ..memory import assign_offsets, MemoryPlan
+from ..spconv import SPConv
+from ..linears import Linear
+from ..utils import typed_randn
+from .. import functions
+
+random.seed(2)
+
+
+def build_net(dtype, **kwargs):
+    random.seed(3)
+    ann = ANN(**kwargs)
+    ann.layers.append(SPConv((-1, 1, 8, 8), dtype, weight=(4, 1, 3, 3),
+                             bias=None, boundary='P'))
+    ann.add_layer(functions.ReLU)
+    ann.add_layer(functions.Pooling, kernel_shape=(2, 2), mode='max')
+    ann.add_layer(functions.Reshape, output_shape=(-1, 64))
+    ann.add_layer(Linear, weight=(10, 64), bias=None)
+    ann.add_layer(functions.ReLU)
+    ann.add_layer(Linear, weight=(3, 10), bias=None)
+    ann.add_layer(functions.SoftMaxCrossEntropy, axis=1)
+    ann.add_layer(functions.Mean, axis=0)
+    ann.set_runtime_vars({'y_true': eye(3)[[0, 1, 2, 0, 1]]})
+    return ann
+
+
+def test_assign_offsets():
+    sizes = [64, 128, 64, 192]
+    lifetimes = [(0, 1), (1, 2), (2, 3), (3, 4)]
+    offsets, total = assign_offsets(sizes, lifetimes)
+    for i in range(4):
+        for j in range(i):
+            if lifetimes[i][0] <= lifetimes[j][1] and\
+                    lifetimes[j][0] <= lifetimes[i][1]:
+                assert_(offsets[i] >= offsets[j] + sizes[j] or
+                        offsets[j] >= offsets[i] + sizes[i])
+    assert_(total < sum(sizes))
+
+    plan = MemoryPlan([((3, 4), 'complex128'), None, ((5,), 'float32')],
+                      [(0, 1), (0, 1), (2, 3)])
+    assert_(plan.num_buffers == 2)
+    assert_(plan.buffers[0].flags.f_contiguous)
+    assert_(plan.buffers[0].ctypes.data % 64 == 0)
+    assert_(plan.buffers[0].ctypes.data == plan.buffers[2].ctypes.data)
+
+
+def test_plan_memory():
+    for dtype in ['float64', 'complex128']:
+        ann = build_net(dtype)
+        ann2 = build_net(dtype, plan_memory=True)
+        x = asfortranarray(typed_randn(dtype, (5, 1, 8, 8)))
+        for step in range(3):
+            cache, cache2 = {}, {}
+            y = ann.forward(x, data_cache=cache)
+            y2 = ann2.forward(x, data_cache=cache2)
+            for ya, yb in zip(cache['%d-ys' % id(ann)],
+                              cache2['%d-ys' % id(ann2)]):
+                assert_allclose(ya, yb)
+            dv, dx = ann.backward((x, y), data_cache=cache)
+            dv2, dx2 = ann2.backward((x, y2), data_cache=cache2)
+            assert_allclose(dv, dv2)
+            assert_allclose(dx, dx2)
+        plan = ann2._memory_plans[ann2._plan_key(x, True)]
+        assert_(plan.num_buffers > 0)
+
+        # forward only flow uses a seperate plan.
+        y = ann.forward(x)
+        for i in range(2):
+            assert_allclose(ann2.forward(x), y)
+        assert_(len(ann2._memory_plans) == 2)
+        ann2.clear_memory_plans()
+        assert_(len(ann2._memory_plans) == 0)
+
+
+def test_plan_memory_layers():
+    dtype = 'float64'
+    x = asfortranarray(typed_randn(dtype, (5, 8)))
+    ann = ANN(plan_memory=True)
+    ann.layers.append(Linear((-1, 8), dtype, weight=(6, 8), bias=None))
+    ann.add_layer(functions.ReLU)
+    for i in range(2):
+        ann.forward(x)
+    assert_(len(ann._memory_plans) == 1)
+
+    # plans are dropped if layers change.
+    linear = ann.add_layer(Linear, weight=(3, 6), bias=None)
+    assert_(len(ann._memory_plans) == 0)
+    for i in range(2):
+        y = ann.forward(x)
+        assert_(y.shape == (5, 3))
+    ann.layers.pop()
+    for i in range(2):
+        y = ann.forward(x)
+        assert_(y.shape == (5, 6))
+    ann.layers.append(linear)
+    assert_allclose(ann.forward(x), linear.forward(ann.layers[1].forward(
+        ann.layers[0].forward(x))))
+
+
+if __name__ == '__main__':
+    test_assign_offsets()
+    test_plan_memory()
+    test_plan_memory_layers()
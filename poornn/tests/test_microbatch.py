@@ -0,0 +1,72 @@
+'''
+Tests for micro-batching.
+'''
+from numpy import *
+from numpy.testing import dec, assert_, assert_raises,\
+    assert_almost_equal, assert_allclose
+import pdb
+
+from ..nets import ANN
+from ..linears import Linear
+from ..utils import typed_randn
+from .. import functions
+
+random.seed(2)
+
+
+def build_net(dtype, reduction=True):
+    ann = ANN()
+    ann.layers.append(Linear((-1, 8), dtype, weight=(6, 8),
+                             bias=0.1 * ones(6, dtype=dtype)))
+    ann.add_layer(functions.BatchNorm, axis=0)
+    ann.add_layer(functions.ReLU)
+    ann.add_layer(functions.DropOut, keep_rate=0.5, axis=1)
+    ann.add_layer(Linear, weight=(3, 6), bias=None)
+    ann.add_layer(functions.BatchNorm, axis=0)
+    ann.add_layer(functions.SoftMaxCrossEntropy, axis=1)
+    if reduction:
+        ann.add_layer(functions.Mean, axis=0)
+    return ann
+
+
+def test_accumulate():
+    num_batch = 10
+    var_dict = {'y_true': eye(3)[random.randint(0, 3, num_batch)],
+                'seed': 2}
+    for dtype in ['float64', 'complex128']:
+        for reduction in [True, False]:
+            ann = build_net(dtype, reduction)
+            x = asfortranarray(typed_randn(dtype, (num_batch, 8)))
+            dy = array(1.) if reduction else random.random(num_batch)
+            ann.set_runtime_vars(var_dict)
+            cache = {}
+            y = ann.forward(x, data_cache=cache)
+            dv, dx = ann.backward((x, y), dy, data_cache=cache)
+
+            for chunk_size in [3, 10]:
+                y2, dv2, dx2 = ann.accumulate_gradients(
+                    x, chunk_size, dy=dy, var_dict=var_dict, do_xgrad=True)
+                assert_allclose(y2, y)
+                assert_allclose(dv2, dv)
+                assert_allclose(dx2, dx)
+                assert_(ann.layers[1].axis == 0)
+                # runtime variables of the caller are restored.
+                assert_(ann.layers[6].y_true is var_dict['y_true'])
+                assert_allclose(ann.forward(x), y)
+
+            # gradients are accumulated into flat storage.
+            v = ann.flatten_variables()
+            assert_(v is ann.flat_variables)
+            y2, dv2, dx2 = ann.accumulate_gradients(x, 4, dy=dy,
+                                                    var_dict=var_dict)
+            assert_(dv2 is ann.flat_gradients and dx2 is None)
+            assert_allclose(dv2, dv)
+
+    ann = build_net('float64')
+    ann.layers[3].axis = 0
+    assert_raises(ValueError, ann.accumulate_gradients,
+                  ones((10, 8)), 3)
+
+
+if __name__ == '__main__':
+    test_accumulate()
@@ -0,0 +1,258 @@
+'''
+Tests for containers.
+'''
+from numpy import *
+from numpy.testing import dec, assert_, assert_raises,\
+    assert_almost_equal, assert_allclose
+import pdb
+
+from ..nets import ANN, Graph, JointComplex
+from ..spconv import SPConv
+from ..linears import Linear
+from ..utils import typed_randn
+from ..checks import check_numdiff
+from .. import functions, pfunctions, monitors
+
+random.seed(2)
+
+
+def build_net(dtype, strategy='auto', **kwargs):
+    ann = ANN(**kwargs)
+    ann.layers.append(SPConv((-1, 1, 8, 8), dtype, weight=(4, 1, 3, 3),
+                             bias=None, boundary='P', strategy=strategy))
+    ann.add_layer(functions.ReLU)
+    ann.add_layer(functions.Pooling, kernel_shape=(2, 2), mode='max')
+    ann.add_layer(functions.Reshape, output_shape=(-1, 64))
+    ann.add_layer(Linear, weight=(10, 64), bias=None, var_mask=(1, 0))
+    if dtype == 'float64':
+        ann.add_layer(pfunctions.PReLU, leak=0.2)
+    else:
+        ann.add_layer(functions.ReLU)
+    ann.add_layer(functions.DropOut, keep_rate=0.5, axis=1, label='drop')
+    ann.add_layer(Linear, weight=(3, 10), bias=0.1 * ones(3, dtype=dtype))
+    ann.add_layer(functions.SoftMaxCrossEntropy, axis=1)
+    ann.add_layer(functions.Mean, axis=0)
+    ann.set_runtime_vars({'y_true': eye(3)[[0, 1, 2, 0, 1]], 'seed': 2})
+    return ann
+
+
+def test_flatten_variables():
+    for dtype in ['float64', 'complex128']:
+        ann, ann2 = build_net(dtype), build_net(dtype)
+        ann2.set_variables(ann.get_variables())
+        v = ann2.flatten_variables()
+        assert_allclose(v, ann.get_variables())
+        assert_(ann2.get_variables() is v)
+        assert_(ann2.layers[0].weight.flags.f_contiguous)
+        assert_(may_share_memory(ann2.layers[0].weight, v))
+        assert_(may_share_memory(ann2.layers[4].weight, v))
+
+        x = asfortranarray(typed_randn(dtype, (5, 1, 8, 8)))
+        for step in range(2):
+            cache, cache2 = {}, {}
+            y = ann.forward(x, data_cache=cache)
+            y2 = ann2.forward(x, data_cache=cache2)
+            assert_allclose(y, y2)
+            dv, dx = ann.backward((x, y), data_cache=cache)
+            dv2, dx2 = ann2.backward((x, y2), data_cache=cache2)
+            assert_(dv2 is ann2.flat_gradients)
+            assert_allclose(dv, dv2)
+            assert_allclose(dx, dx2)
+
+            # inplace update takes effect without set_variables.
+            ann.set_variables(ann.get_variables() - 0.1 * dv)
+            v -= 0.1 * dv2
+            ann2.set_variables(v)
+
+        ann2.set_variables(zeros_like(v))
+        assert_allclose(ann2.layers[0].weight, 0)
+
+
+def test_flatten_jc():
+    input_shape = (6, 8)
+    h = Linear(input_shape, 'float64', weight=(8, 8), bias=None)
+    g = Linear(input_shape, 'float64', weight=(8, 8), bias=None)
+    jc, jc2 = JointComplex(h, g), JointComplex(h, g)
+    x = typed_randn('complex128', input_shape)
+    y = jc.forward(x)
+    dy = typed_randn('complex128', input_shape)
+    dv, dx = jc.backward((x, y), dy)
+    jc2.flatten_variables()
+    dv2, dx2 = jc2.backward((x, y), dy)
+    assert_allclose(dv, dv2)
+    assert_(dv2 is jc2.flat_gradients)
+
+    # shared layers can not be bound twice.
+    assert_raises(ValueError, JointComplex(h, h).flatten_variables)
+
+
+def test_checkpoints():
+    for checkpoints in [3, ['drop', 1]]:
+        ann = build_net('float64')
+        ann2 = build_net('float64', checkpoints=checkpoints)
+        ann2.set_variables(ann.get_variables())
+        x = asfortranarray(typed_randn('float64', (5, 1, 8, 8)))
+        cache, cache2 = {}, {}
+        y = ann.forward(x, data_cache=cache)
+        y2 = ann2.forward(x, data_cache=cache2)
+        assert_allclose(y, y2)
+        assert_(sum([yi is None for yi in cache2['%d-ys' % id(ann2)]]) > 3)
+
+        # recomputation uses runtime variables of the forward run.
+        for net in [ann, ann2]:
+            net.set_runtime_vars({'y_true': eye(3)[[1, 1, 2, 0, 0]],
+                                  'seed': 5})
+        dv, dx = ann.backward((x, y), data_cache=cache)
+        dv2, dx2 = ann2.backward((x, y2), data_cache=cache2)
+        assert_allclose(dv, dv2)
+        assert_allclose(dx, dx2)
+        assert_(ann2['drop'].seed == 5)
+
+
+def test_predict():
+    for dtype in ['float64', 'complex128']:
+        ann = build_net(dtype)
+        ann.layers.insert(0, monitors.Print(ann.input_shape, dtype))
+        ann.layers[2].tags['is_inplace'] = True
+        x = asfortranarray(typed_randn(dtype, (5, 1, 8, 8)))
+        x0 = x.copy(order='F')
+        y = ann.predict(x)
+        assert_allclose(x, x0)
+
+        # reference without DropOut.
+        for layer in ann.layers:
+            if not isinstance(layer, (functions.DropOut, monitors.Print)):
+                x0 = layer.forward(x0)
+        assert_allclose(y, x0)
+
+
+def test_compile():
+    for dtype, strategy in [('float64', 'pixel'), ('complex128', 'pixel'),
+                            ('float64', 'im2col'), ('complex128', 'fft')]:
+        ann = build_net(dtype, strategy=strategy)
+        x = asfortranarray(typed_randn(dtype, (5, 1, 8, 8)))
+        plan = ann.compile(x.shape)
+        assert_(plan.shapes[-1] == ())
+        for step in range(3):
+            cache = {}
+            y = ann.forward(x, data_cache=cache)
+            dv, dx = ann.backward((x, y), data_cache=cache)
+            assert_allclose(plan.run(x), y)
+            dv2, dx2 = plan.grad(x)
+            assert_allclose(dv, dv2)
+            assert_allclose(dx, dx2)
+            ann.set_variables(ann.get_variables() - 0.1 * dv)
+
+
+def test_auto_inplace():
+    for dtype in ['float64', 'complex128']:
+        for plan_memory in [False, True]:
+            ann = build_net(dtype, auto_inplace=False)
+            ann2 = build_net(dtype, plan_memory=plan_memory)
+            ann2.set_variables(ann.get_variables())
+            x = asfortranarray(typed_randn(dtype, (5, 1, 8, 8)))
+            x0 = x.copy(order='F')
+            for step in range(3):
+                cache, cache2 = {}, {}
+                y = ann.forward(x, data_cache=cache)
+                y2 = ann2.forward(x, data_cache=cache2)
+                assert_allclose(y, y2)
+                dv, dx = ann.backward((x, y), data_cache=cache)
+                dv2, dx2 = ann2.backward((x, y2), data_cache=cache2)
+                assert_allclose(dv, dv2)
+                assert_allclose(dx, dx2)
+                assert_allclose(x, x0)
+            ys = cache2['%d-ys' % id(ann2)]
+            # outputs read by backward are kept.
+            assert_(not may_share_memory(ys[0], ys[1]))
+            if dtype == 'complex128':
+                # DropOut overwrites the output of ReLU.
+                assert_(may_share_memory(ys[5], ys[6]))
+            assert_allclose(ann2.forward(x), y)
+
+
+def test_auto_inplace_monitor():
+    ann = ANN()
+    ann.layers.append(Linear((-1, 10), 'float64', weight=typed_randn(
+        'float64', (10, 10)), bias=typed_randn('float64', (10,))))
+    cache = ann.add_layer(monitors.Cache)
+    ann.add_layer(functions.ReLU)
+    ann.add_layer(functions.Sigmoid)
+    x = typed_randn('float64', (3, 10))
+    ann.forward(x)
+    y0 = ann.layers[0].forward(x)
+    # data kept by monitors are not overwritten by ReLU.
+    assert_(y0.min() < 0)
+    assert_allclose(cache.forward_list[0], y0)
+
+    ann = ANN()
+    ann.layers.append(Linear((-1, 10), 'float64', weight=typed_randn(
+        'float64', (10, 10)), bias=typed_randn('float64', (10,))))
+    ann.add_layer(functions.ReLU)
+    cache = ann.add_layer(monitors.Cache)
+    ann.add_layer(functions.DropOut, keep_rate=0.5, axis=1)
+    ann.set_runtime_vars({'seed': 2})
+    data_cache = {}
+    y = ann.forward(x, data_cache=data_cache)
+    dy = ones_like(y)
+    ann.backward((x, y), dy=dy, data_cache=data_cache)
+    # nor are gradients kept by monitors overwritten by ReLU.
+    assert_allclose(cache.backward_list[0],
+                    ann.layers[3].mask / 0.5 * dy)
+
+
+def test_graph():
+    g = Graph()
+    g.layers.append(Linear((-1, 10), 'float64', weight=(10, 10),
+                           bias=0.1 * ones(10)))
+    g.add_layer(functions.Sigmoid)
+    g.add_layer(Linear, weight=(10, 10), bias=0.1 * ones(10))
+    # residual connection and two heads sharing a trunk.
+    g.add_layer(functions.Sigmoid, inputs=[2, -1], label='res')
+    g.add_layer(Linear, weight=(3, 10), bias=None, inputs=['res'])
+    g.add_layer(Linear, weight=(3, 10), bias=None, inputs=[1])
+    g.add_layer(Linear, weight=(3, 10), bias=None, inputs=[1])
+    g.add_layer(functions.Sum, axis=1, inputs=[4, 5])
+    print(g)
+    x = asfortranarray(typed_randn('float64', (5, 10)))
+    assert_(all(check_numdiff(g, x)))
+
+    # an unused head gets zero gradients.
+    cache = {}
+    y = g.forward(x, data_cache=cache)
+    assert_(cache['%d-ys' % id(g)][6] is None)
+    assert_allclose(g.forward(x), y)
+    dv, dx = g.backward((x, y), ones(5), data_cache=cache)
+    start = sum([layer.num_variables for layer in g.layers[:6]])
+    assert_allclose(dv[start:start + 30], 0)
+
+    # sequential graph equals ANN.
+    ann = build_net('float64')
+    g = Graph(layers=list(ann.layers))
+    x = asfortranarray(typed_randn('float64', (5, 1, 8, 8)))
+    cache, cache2 = {}, {}
+    y = ann.forward(x, data_cache=cache)
+    y2 = g.forward(x, data_cache=cache2)
+    assert_allclose(y, y2)
+    dv, dx = ann.backward((x, y), data_cache=cache)
+    dv2, dx2 = g.backward((x, y2), data_cache=cache2)
+    assert_allclose(dv, dv2)
+    assert_allclose(dx, dx2)
+
+    relu = functions.ReLU((-1, 10), 'float64')
+    assert_raises(ValueError, Graph, [relu, relu], inputs=[[-1, 1], [0]])
+    # every layer needs an input.
+    assert_raises(ValueError, Graph, [relu, relu], inputs=[None, []])
+    g = Graph(layers=[relu])
+    assert_raises(ValueError, g.add_layer, functions.ReLU, inputs=[])
+
+
+if __name__ == '__main__':
+    test_flatten_variables()
+    test_flatten_jc()
+    test_checkpoints()
+    test_predict()
+    test_compile()
+    test_auto_inplace()
+    test_auto_inplace_monitor()
+    test_graph()
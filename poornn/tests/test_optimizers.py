@@ -0,0 +1,97 @@
+'''
+Tests for optimizers.
+'''
+from numpy import *
+from numpy.testing import dec, assert_, assert_raises,\
+    assert_almost_equal, assert_allclose
+import pdb
+
+from ..nets import ANN
+from ..linears import Linear
+from ..optimizers import SGD, RMSProp, Adam, LBFGS
+from ..utils import typed_randn
+from .. import functions
+
+random.seed(2)
+
+
+def test_quadratic():
+    # J = sum(a*|w-w0|^2), with gradient 2*a*conj(w-w0).
+    for dtype in ['float64', 'complex128']:
+        a = linspace(0.5, 2, 20)
+        w0 = typed_randn(dtype, (20,))
+        for cls, kwargs, num_steps in [
+                (SGD, dict(step_rate=0.1), 100),
+                (SGD, dict(step_rate=0.1, momentum=0.5, nesterov=True), 100),
+                (RMSProp, dict(step_rate=0.01, momentum=0.5), 500),
+                (Adam, dict(step_rate=0.05), 500),
+                (LBFGS, dict(step_rate=0.5, history=5), 30)]:
+            w = zeros(20, dtype=dtype)
+            optimizer = cls(w, **kwargs)
+            print('Test %s' % optimizer)
+            for step in range(num_steps):
+                optimizer.step(2 * a * (w - w0).conj())
+            assert_(optimizer.variables is w)
+            assert_allclose(w, w0, atol=1e-2)
+
+
+def test_lbfgs_rejection():
+    # J = sum(cos(w)) is not convex, some curvature pairs are rejected.
+    def lbfgs_step(dw, pairs, step_rate):
+        q = dw.copy()
+        alphas = []
+        for s, y in pairs[::-1]:
+            alphas.append(vdot(s, q).real / vdot(s, y).real)
+            q -= alphas[-1] * y
+        if pairs:
+            s, y = pairs[-1]
+            q *= vdot(s, y).real / vdot(y, y).real
+        for (s, y), alpha in zip(pairs, alphas[::-1]):
+            q += (alpha - vdot(y, q).real / vdot(s, y).real) * s
+        return -step_rate * q
+
+    w = 2 * random.RandomState(1).randn(20)
+    optimizer = LBFGS(w, step_rate=0.5, history=3)
+    pairs, num_rejected = [], 0
+    for step in range(30):
+        dw = -sin(w)
+        if step > 0:
+            s, y = w - last_w, dw - last_dw
+            if vdot(s, y).real > 1e-12:
+                pairs = (pairs + [(s, y)])[-3:]
+            elif len(pairs) == 3:
+                num_rejected += 1
+        last_w, last_dw = w.copy(), dw
+        optimizer.step(dw.copy())
+        assert_allclose(w, last_w + lbfgs_step(dw, pairs, 0.5))
+    assert_(num_rejected > 0)
+
+
+def test_net():
+    dtype = 'complex128'
+    ann = ANN()
+    ann.layers.append(Linear((-1, 4), dtype, weight=(2, 4), bias=None))
+    ann.add_layer(functions.SquareLoss)
+    ann.add_layer(functions.Sum, axis=1)
+    ann.add_layer(functions.Mean, axis=0)
+    weight = typed_randn(dtype, (2, 4))
+    x = asfortranarray(typed_randn(dtype, (30, 4)))
+    ann.set_runtime_vars({'y_true': x.dot(weight.T)})
+
+    v = ann.flatten_variables()
+    optimizer = Adam(v, step_rate=0.05)
+    losses = []
+    for step in range(300):
+        cache = {}
+        y = ann.forward(x, data_cache=cache)
+        dv, dx = ann.backward((x, y), data_cache=cache)
+        optimizer.step(dv)
+        losses.append(y)
+    assert_(losses[-1] < 1e-3 * losses[0])
+    assert_allclose(ann.layers[0].weight, weight, atol=1e-2)
+
+
+if __name__ == '__main__':
+    test_quadratic()
+    test_lbfgs_rejection()
+    test_net()
@@ -7,11 +7,12 @@ from numpy.testing import dec, assert_, assert_raises,\
 from scipy import sparse as sps
 import pdb
 import time
+import threading
 
 from ..checks import check_numdiff
 from ..utils import typed_randn
 from ..linears import Linear
-from ..nets import ParallelNN
+from ..nets import ParallelNN, ANN
 from .. import functions
 
 random.seed(2)
@@ -41,5 +42,51 @@ def test_pa():
     assert_(all(check_numdiff(pnet, num_check=100)))
 
 
+def test_threads():
+    dtype = 'float64'
+    x = asfortranarray(typed_randn(dtype, [20, 30]))
+    dy = typed_randn(dtype, [20, 10, 4])
+    for axis in [1, 2]:
+        pnet = ParallelNN(axis=axis, num_threads=4)
+        for i in range(3):
+            pnet.layers.append(Linear((-1, 30), dtype, weight=(10, 30),
+                                      bias=typed_randn(dtype, [10])))
+        ann = ANN()
+        ann.layers.append(Linear((-1, 30), dtype, weight=(10, 30),
+                                 bias=None))
+        ann.add_layer(functions.ReLU)
+        pnet.layers.append(ann)
+        cache = {}
+        y = pnet.forward(x, data_cache=cache)
+        dv, dx = pnet.backward((x, y), dy.swapaxes(1, 3 - axis),
+                               data_cache=cache)
+
+        # compare with serial execution.
+        pnet.num_threads = 1
+        cache = {}
+        y2 = pnet.forward(x, data_cache=cache)
+        dv2, dx2 = pnet.backward((x, y2), dy.swapaxes(1, 3 - axis),
+                                 data_cache=cache)
+        assert_allclose(y, y2)
+        assert_allclose(dv, dv2)
+        assert_allclose(dx, dx2)
+        for i, layer in enumerate(pnet.layers):
+            assert_allclose(y.take(i, axis=axis), layer.forward(x))
+
+    # pools are stopped if replaced, or closed.
+    num_active = threading.active_count()
+    for num_threads in [2, 3, 1, 2]:
+        pnet.num_threads = num_threads
+        pnet.forward(x)
+    assert_(threading.active_count() > num_active)
+    pnet.close()
+    assert_(pnet._pool is None)
+    assert_(threading.active_count() == num_active)
+    pnet.forward(x)
+    del pnet
+    assert_(threading.active_count() == num_active)
+
+
 if __name__ == '__main__':
     test_pa()
+    test_threads()
@@ -0,0 +1,99 @@
+'''
+Tests for saving and loading networks.
+'''
+from numpy import *
+from numpy.testing import dec, assert_, assert_raises,\
+    assert_almost_equal, assert_allclose
+import os
+import pickle
+import tempfile
+import pdb
+
+from ..nets import ANN, ParallelNN
+from ..spconv import SPConv
+from ..linears import Linear
+from ..utils import typed_randn
+from ..serialization import save, load
+from .. import functions
+
+random.seed(2)
+
+
+def build_net(dtype, w_contiguous):
+    ann = ANN()
+    ann.layers.append(SPConv((-1, 1, 8, 8), dtype, weight=(4, 1, 3, 3),
+                             bias=0.1 * ones(4, dtype=dtype), boundary='P',
+                             w_contiguous=w_contiguous))
+    ann.add_layer(functions.ReLU)
+    ann.add_layer(functions.Pooling, kernel_shape=(2, 2), mode='max')
+    ann.add_layer(functions.Reshape, output_shape=(-1, 64))
+    ann.add_layer(Linear, weight=(10, 64), bias=None, var_mask=(1, 0))
+    branches = ParallelNN(axis=1, num_threads=2)
+    branches.layers.append(functions.Exp((-1, 10), dtype))
+    branches.layers.append(functions.Mul((-1, 10), dtype, alpha=2.))
+    ann.layers.append(branches)
+    ann.add_layer(functions.Mean, axis=0)
+    return ann
+
+
+def test_save_load():
+    x = asfortranarray(typed_randn('float64', (5, 1, 8, 8)))
+    filename = os.path.join(tempfile.mkdtemp(), 'ann.pnn')
+    for w_contiguous in [True, False]:
+        for flatten in [False, True]:
+            ann = build_net('float64', w_contiguous)
+            if flatten:
+                ann.flatten_variables()
+            save(ann, filename)
+            ann2 = load(filename)
+            print('Test save and load %s' % ann2)
+            assert_(ann2.layers[0].w_contiguous == w_contiguous)
+            assert_allclose(ann2.get_variables(), ann.get_variables())
+            assert_(isinstance(ann2.layers[4].weight.base, memmap))
+
+            cache, cache2 = {}, {}
+            y = ann.forward(x, data_cache=cache)
+            y2 = ann2.forward(x, data_cache=cache2)
+            assert_allclose(y, y2)
+            dy = asfortranarray(typed_randn('float64', y.shape))
+            dv, dx = ann.backward((x, y), dy.copy(order='F'),
+                                  data_cache=cache)
+            dv2, dx2 = ann2.backward((x, y2), dy, data_cache=cache2)
+            assert_allclose(dv, dv2)
+            assert_allclose(dx, dx2)
+
+            if flatten:
+                # variables remain views of the flat vector.
+                v = ann2.get_variables()
+                assert_(v is ann2.flat_variables)
+                v[:] = 0
+                assert_allclose(ann2.layers[4].weight, 0)
+                # copy-on-write, the file is not changed.
+                assert_allclose(load(filename).get_variables(),
+                                ann.get_variables())
+
+
+def test_load_readonly():
+    filename = os.path.join(tempfile.mkdtemp(), 'ann.pnn')
+    ann = build_net('complex128', False)
+    save(ann, filename)
+    ann2 = load(filename, mmap_mode='r')
+    assert_(not ann2.layers[0].weight.flags.writeable)
+    ann3 = load(filename, mmap_mode=None)
+    assert_(not isinstance(ann3.layers[0].weight.base, memmap))
+    x = asfortranarray(typed_randn('complex128', (3, 1, 8, 8)))
+    assert_allclose(ann2.forward(x), ann.forward(x))
+    assert_allclose(ann3.forward(x), ann.forward(x))
+
+    # plain pickle works as well.
+    ann4 = pickle.loads(pickle.dumps(ann))
+    assert_allclose(ann4.forward(x), ann.forward(x))
+
+    with open(filename, 'wb') as f:
+        f.write(b'not a network')
+    assert_raises(Exception, load, filename)
+
+
+if __name__ == '__main__':
+    test_save_load()
+    test_load_readonly()
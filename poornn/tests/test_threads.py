@@ -0,0 +1,92 @@
+'''
+Tests for thread control, kernels give the same results on any number \
+of threads.
+'''
+from numpy import *
+from numpy.testing import dec, assert_, assert_raises,\
+    assert_almost_equal, assert_allclose
+import pdb
+
+from ..threads import set_num_threads, get_num_threads, _has_openmp
+from ..nets import ParallelNN
+from ..spconv import SPConv
+from ..functions import Pooling, ConvProd, ReLU
+from ..utils import typed_randn
+
+random.seed(2)
+
+
+def run_layers(dtype):
+    '''forward and backward results of layers with parallel kernels.'''
+    input_shape = (-1, 3, 12, 8)
+    weight = typed_randn(dtype, (4, 3, 3, 3))
+    bias = typed_randn(dtype, [4])
+    layers = [SPConv(input_shape, dtype, weight, bias, boundary='O'),
+              SPConv(input_shape, dtype, weight, bias, strides=(2, 2),
+                     strategy='im2col', block_size=5),
+              Pooling(input_shape, dtype, kernel_shape=(2, 2), mode='max'),
+              Pooling(input_shape, dtype, kernel_shape=(3, 2), mode='mean'),
+              ConvProd(input_shape, dtype, powers=[[1, 2], [0, 1]]),
+              ReLU((-1, 50000), dtype, leak=0.1)]
+    res = []
+    for layer in layers:
+        for num_batch in [5, None]:
+            shape = layer.input_shape[1:]
+            if num_batch is not None:
+                shape = (num_batch,) + shape
+            x = asfortranarray(typed_randn(dtype, shape))
+            if isinstance(layer, ConvProd):
+                x = abs(x) + 0.5
+            y = layer.forward(x)
+            dy = asfortranarray(typed_randn(dtype, y.shape))
+            res.append((y,) + tuple(layer.backward((x, y), dy)))
+    return res
+
+
+def test_threads():
+    previous = set_num_threads(1)
+    try:
+        assert_(get_num_threads() == 1)
+        assert_(set_num_threads(3) == 1)
+        print('Kernels run on %d threads.' % get_num_threads())
+        assert_(get_num_threads() == (3 if _has_openmp() else 1))
+        assert_raises(ValueError, set_num_threads, 0)
+        for dtype in ['complex128', 'float32']:
+            rtol = 1e-4 if dtype == 'float32' else 1e-10
+            res = []
+            for num_threads in [1, 3]:
+                set_num_threads(num_threads)
+                random.seed(2)
+                res.append(run_layers(dtype))
+            for res1, res3 in zip(*res):
+                for arr1, arr3 in zip(res1, res3):
+                    assert_allclose(arr3, arr1, rtol=rtol, atol=rtol)
+    finally:
+        set_num_threads(previous)
+
+
+def test_worker_threads():
+    pnn = ParallelNN(num_threads=2)
+    for i in range(2):
+        pnn.layers.append(ReLU((-1, 3), 'float64'))
+    previous = set_num_threads(4)
+    try:
+        # branches share threads of the caller.
+        num_threads = pnn._map(lambda i: get_num_threads())
+        assert_(num_threads == [2, 2] if _has_openmp() else [1, 1])
+        set_num_threads(1)
+        assert_(pnn._map(lambda i: get_num_threads()) == [1, 1])
+    finally:
+        set_num_threads(previous)
+
+
+def test_api():
+    import poornn
+    assert_(poornn.set_num_threads is set_num_threads)
+    assert_(poornn.get_num_threads is get_num_threads)
+
+
+if __name__ == '__main__':
+    test_threads()
+    test_worker_threads()
+    test_api()
@@ -11,6 +11,7 @@ import pdb
 import time
 
 from ..utils import *
+from ..utils import _scan2csc
 
 
 def test_fsign():
@@ -30,8 +31,50 @@ def test_fsign():
             assert_allclose(s1, s2)
 
 
+def scan2csc_loop(kernel_shape, img_in_shape, strides, boundary):
+    img_out_shape = _scan2csc(kernel_shape, img_in_shape, strides,
+                              boundary)[2]
+    csc_indices = []
+    for ind_out in range(tuple_prod(img_out_shape)):
+        ijk_out = unravel_index(ind_out, img_out_shape, order='F')
+        ijk_in0 = asarray(ijk_out) * strides
+        for ind_offset in range(tuple_prod(kernel_shape)):
+            ijk_in = ijk_in0 + unravel_index(ind_offset, kernel_shape,
+                                             order='F')
+            ind_in = ravel_multi_index(ijk_in, img_in_shape,
+                                       mode='wrap' if boundary == 'P'
+                                       else 'raise', order='F')
+            csc_indices.append(ind_in + 1)
+    return int32(csc_indices)
+
+
+def test_scan2csc():
+    for args in [((3,), (10,), (1,), 'P'), ((2, 2), (6, 8), (2, 2), 'O'),
+                 ((3, 2), (6, 8), (1, 2), 'P'), ((2, 3, 1), (4, 6, 5),
+                                                 (2, 1, 1), 'O')]:
+        print('Testing scan2csc%s' % (args,))
+        indptr, indices, img_out_shape = scan2csc(*args)
+        assert_(indices.dtype == int32 and indptr.dtype == int32)
+        assert_allclose(indices, scan2csc_loop(*args))
+        assert_allclose(indptr, arange(1, indices.size + 2,
+                                       tuple_prod(args[0])))
+        # cached and read-only.
+        assert_(scan2csc(*args)[1] is indices)
+        assert_(not indices.flags.writeable)
+    assert_raises(ValueError, scan2csc, (2, 2), (5, 5), (2, 2), 'P')
+
+    t0 = time.time()
+    _scan2csc((5, 5), (256, 256), (1, 1), 'P')
+    t1 = time.time()
+    scan2csc_loop((5, 5), (32, 32), (1, 1), 'P')
+    t2 = time.time()
+    print('Elapse vectorized (256x256) = %s, loop (32x32) = %s' %
+          (t1 - t0, t2 - t1))
+
+
 def run_all():
     test_fsign()
+    test_scan2csc()
 
 
 if __name__ == '__main__':
@@ -0,0 +1,82 @@
+'''
+Threads of compiled kernels and BLAS.
+
+Kernels in :mod:`poornn.lib` built with OpenMP run their loops over pixels \
+(or batches) in parallel, BLAS called inside these loops runs single \
+threaded. :func:`set_num_threads` sets the number of threads of kernels \
+and of BLAS together, so that neither oversubscribes the cores.
+
+The number of OpenMP threads is a setting of each thread, threads \
+running kernels concurrently (branches of :class:`ParallelNN`) share \
+the number of threads of the caller, workers of :class:`DataParallel` \
+run kernels single threaded.
+'''
+
+import os
+
+from .lib import LazyLib
+
+__all__ = ['THREAD_ENVIRONS', 'set_num_threads', 'get_num_threads']
+
+THREAD_ENVIRONS = ['OMP_NUM_THREADS', 'MKL_NUM_THREADS',
+                   'OPENBLAS_NUM_THREADS']
+'''Environment variables read by OpenMP and BLAS libraries when loaded.'''
+
+_futils = LazyLib('futils')
+
+
+def set_num_threads(num_threads):
+    '''
+    Set the number of threads of compiled kernels and BLAS.
+
+    Args:
+        num_threads (int): number of threads.
+
+    Returns:
+        int: the previous number of threads of compiled kernels.
+
+    Note:
+        Libraries loaded afterwards read :data:`THREAD_ENVIRONS`, \
+BLAS libraries already loaded (e.g. by numpy) are limited with \
+`threadpoolctl` if installed. The number of OpenMP threads is a setting \
+of the calling thread, threads of :class:`ParallelNN` and workers of \
+:class:`DataParallel` set their own.
+    '''
+    num_threads = int(num_threads)
+    if num_threads < 1:
+        raise ValueError('number of threads should be positive, got %s!'
+                         % num_threads)
+    previous = get_num_threads()
+    for key in THREAD_ENVIRONS:
+        os.environ[key] = str(num_threads)
+    _set_kernel_threads(num_threads)
+    try:
+        from threadpoolctl import threadpool_limits
+    except ImportError:
+        pass
+    else:
+        threadpool_limits(num_threads, user_api='blas')
+    return previous
+
+
+def get_num_threads():
+    '''
+    Get the number of threads of compiled kernels.
+
+    Returns:
+        int: number of threads, 1 if kernels are built without OpenMP.
+    '''
+    return int(_futils.get_num_threads())
+
+
+def _set_kernel_threads(num_threads):
+    '''
+    Set the number of OpenMP threads of compiled kernels \
+called from the current thread.
+    '''
+    _futils.set_num_threads(num_threads)
+
+
+def _has_openmp():
+    '''True if compiled kernels are built with OpenMP.'''
+    return bool(_futils.openmp_enabled())
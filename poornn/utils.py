@@ -1,8 +1,11 @@
 from __future__ import division
+import sys
+import threading
+from collections import OrderedDict
 import numpy as np
 import pdb
 
-from .lib import futils
+from .kernels import get_kernel
 
 __all__ = ['take_slice', 'scan2csc', 'typed_random', 'typed_randn',
            'typed_uniform', 'tuple_prod',
@@ -25,6 +28,13 @@ def take_slice(arr, sls, axis):
     return arr[(slice(None),) * axis + (sls,)]
 
 
+SCAN_CACHE_SIZE = 64
+'''Number of index maps kept by :func:`scan2csc`.'''
+
+_SCAN_CACHE = OrderedDict()
+_SCAN_LOCK = threading.Lock()
+
+
 def scan2csc(kernel_shape, img_in_shape, strides, boundary):
     '''
     Scan target shape with filter, and transform it into csc_matrix.
@@ -38,7 +48,31 @@ def scan2csc(kernel_shape, img_in_shape, strides, boundary):
     Returns:
         (1darray, 1darray, tuple): indptr for csc maitrx, \
                 indices of csc matrix, output image shape.
+
+    Note:
+        The recent :data:`SCAN_CACHE_SIZE` results are cached, \
+layers of the same geometry share the (read-only) index arrays.
     '''
+    key = (tuple(int(n) for n in kernel_shape),
+           tuple(int(n) for n in img_in_shape),
+           tuple(int(n) for n in strides), boundary)
+    with _SCAN_LOCK:
+        res = _SCAN_CACHE.pop(key, None)
+        if res is not None:
+            _SCAN_CACHE[key] = res
+            return res
+    res = _scan2csc(*key)
+    for arr in res[:2]:
+        arr.flags.writeable = False
+    with _SCAN_LOCK:
+        _SCAN_CACHE[key] = res
+        while len(_SCAN_CACHE) > SCAN_CACHE_SIZE:
+            _SCAN_CACHE.popitem(last=False)
+    return res
+
+
+def _scan2csc(kernel_shape, img_in_shape, strides, boundary):
+    '''uncached :func:`scan2csc`.'''
     if len(img_in_shape) != len(strides) or len(kernel_shape) != len(strides):
         raise ValueError("Dimension Error! (%d, %d, %d)" %
                          (len(strides), len(img_in_shape), len(kernel_shape)))
@@ -66,35 +100,41 @@ def scan2csc(kernel_shape, img_in_shape, strides, boundary):
     # used in fortran and start from 1!.
     csc_indptr = np.arange(1, dim_kernel * dim_out + 2,
                            dim_kernel, dtype='int32')
-    csc_indices = []  # pointer to rows in x
-    for ind_out in range(dim_out):
-        ijk_out = np.unravel_index(ind_out, img_out_shape, order='F')
-        ijk_in0 = np.asarray(ijk_out) * strides
-        for ind_offset in range(tuple_prod(kernel_shape)):
-            ijk_in = ijk_in0 + \
-                np.unravel_index(ind_offset, kernel_shape, order='F')
-            ind_in = np.ravel_multi_index(
-                ijk_in, img_in_shape, mode='wrap' if boundary == 'P'
-                else 'raise', order='F')
-            csc_indices.append(ind_in + 1)
-
-    csc_indices = np.int32(csc_indices)
+
+    # pointer to rows in x, output pixels (rows) by kernel offsets (columns).
+    ijk_out = np.unravel_index(np.arange(dim_out), img_out_shape, order='F')
+    ijk_offset = np.unravel_index(np.arange(dim_kernel), kernel_shape,
+                                  order='F')
+    ijk_in = tuple(i_out[:, None] * stride + i_offset[None, :]
+                   for i_out, i_offset, stride in
+                   zip(ijk_out, ijk_offset, strides))
+    ind_in = np.ravel_multi_index(ijk_in, img_in_shape,
+                                  mode='wrap' if boundary == 'P'
+                                  else 'raise', order='F')
+    csc_indices = np.int32(ind_in.ravel() + 1)
     return csc_indptr, csc_indices, img_out_shape
 
 
-def spscan2csc(cscmat, strides):
+def spscan2csc(kernel, img_in_shape, strides):
     '''
-    Scan target shape with csc matrix, and transform it into \
-            a larger csc matrix,
-    boundary condition must be periodic.
+    Scan target shape with a sparse kernel, and transform it into \
+a larger csc matrix, boundary condition must be periodic.
 
     Args:
-        cscmat (scipy.sparse.csc_maitrx): the kernel matrix.
+        kernel (scipy.sparse.spmatrix): (feature_out, feature_in * \
+img_in_dims), couplings of the output pixel at the origin, \
+columns are input offsets (feature_in, img_x, img_y, ...) in 'F' order.
+        img_in_shape (tuple): shape of image dimension.
         strides (tuple): strides for image dimensions.
 
     Returns:
         (1darray, 1darray, tuple): indptr for csc maitrx, \
                 indices of csc matrix, output image shape.
+
+    Note:
+        Columns of the csc matrix are (feature_out, img_out_dims) \
+in 'F' order, entries of each output pixel are those of \
+`kernel.tocsr()` (in the order of its data).
     '''
     if len(img_in_shape) != len(strides):
         raise ValueError("Dimension Error! (%d, %d)" %
@@ -112,24 +152,29 @@ def spscan2csc(cscmat, strides):
     img_out_shape = tuple(img_out_shape)
     dim_out = tuple_prod(img_out_shape)
 
+    kernel = kernel.tocsr()
+    num_feature_in, res = divmod(kernel.shape[1], tuple_prod(img_in_shape))
+    if res != 0:
+        raise ValueError("Kernel of shape %s does not match image %s!" %
+                         (kernel.shape, img_in_shape))
+
     # create a sparse csc_matrix(dim_in, dim_out),
     # used in fortran and start from 1!.
-    csc_indptr = np.arange(1, cscmat.nnz * dim_out + 2,
-                           cscmat.nnz, dtype='int32')
-    csc_indices = []  # pointer to rows in x
-    for ind_out in range(dim_out):
-        ijk_out = np.unravel_index(ind_out, img_out_shape, order='F')
-        ijk_in0 = np.asarray(ijk_out) * strides
-        for ind_offset in range(tuple_prod(kernel_shape)):
-            ijk_in = ijk_in0 + \
-                np.unravel_index(ind_offset, kernel_shape, order='F')
-            ind_in = np.ravel_multi_index(
-                ijk_in, img_in_shape, mode='wrap' if boundary == 'P'
-                else 'raise', order='F')
-            csc_indices.append(ind_in + 1)
-
-    csc_indices = np.int32(csc_indices)
-    return csc_indptr, csc_indices, img_out_shape
+    nnz = kernel.indptr[-1]
+    csc_indptr = np.append((np.arange(dim_out)[:, None] * nnz +
+                            kernel.indptr[:-1]).ravel(), dim_out * nnz) + 1
+
+    # shift input offsets of entries to each output pixel, periodically.
+    ijk_kernel = np.unravel_index(kernel.indices[:nnz], (num_feature_in,) +
+                                  tuple(img_in_shape), order='F')
+    ijk_out = np.unravel_index(np.arange(dim_out), img_out_shape, order='F')
+    ijk_in = (np.broadcast_to(ijk_kernel[0], (dim_out, nnz)),) + tuple(
+        i_kernel[None, :] + i_out[:, None] * stride
+        for i_kernel, i_out, stride in zip(ijk_kernel[1:], ijk_out, strides))
+    csc_indices = np.ravel_multi_index(ijk_in, (num_feature_in,) +
+                                       tuple(img_in_shape), mode='wrap',
+                                       order='F').ravel() + 1
+    return np.int32(csc_indptr), np.int32(csc_indices), img_out_shape
 
 
 def typed_random(dtype, shape):
@@ -238,6 +283,15 @@ def masked_concatenate(vl, mask):
     return dvar
 
 
+def _issparse(x):
+    '''
+    check if x is a scipy sparse matrix, \
+without importing scipy.sparse if it is not loaded yet.
+    '''
+    sps = sys.modules.get('scipy.sparse')
+    return sps is not None and sps.issparse(x)
+
+
 def _connect(g, start, end, arr_shape, dtype, pos='mid'):
     '''utility for Connecting graphviz nodes'''
     if start is None or end is None:
@@ -383,8 +437,8 @@ def fsign(x):
         if x is 0, return 0.
     '''
     order = 'F' if np.isfortran(x) else 'C'
-    return eval('futils.fsign_%s' % dtype2token(x.dtype.name)
-                )(x.ravel(order=order)).reshape(x.shape, order=order)
+    return get_kernel('sign', '', dtype2token(x.dtype.name))(
+        x.ravel(order=order)).reshape(x.shape, order=order)
 
 
 if __name__ == '__main__':